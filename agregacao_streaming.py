@@ -0,0 +1,436 @@
+import copy
+import importlib.util
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from leitura_tabelas import (ENGINE_PYARROW_DISPONIVEL, EsquemaTabela, compactar_tipos, converter_datas,
+                             detectar_formato_data, esquema_do_arquivo, inferir_esquema)
+from sketches import FrequentesMisraGries, HyperLogLog, ParametrosErro, SketchQuantisKLL
+from telemetria import etapa
+
+# --- Agregação em Blocos para Arquivos Maiores que a Memória ---
+# head()/tail()/describe() exigem o DataFrame inteiro em memória. Aqui o arquivo é lido em blocos e cada bloco
+# alimenta acumuladores que podem ser combinados (contagem, média e variância de Welford/Chan, mínimo, máximo e
+# os sketches de sketches.py para quantis, distintos e mais frequentes), além de buffers exatos com as
+# primeiras e as últimas linhas. A memória depende só do tamanho do bloco e dos buffers, nunca do arquivo.
+# O ResumoStreaming responde a shape/head/tail/describe como um DataFrame, então as seções do prompt o usam
+# sem mudanças. Os tipos são fixados uma vez por arquivo (EsquemaBlocos): cada bloco é convertido para eles em
+# vez de reinferidos, para que o mesmo arquivo não tenha datas lidas como dd/mm num bloco e mm/dd em outro.
+
+LINHAS_POR_BLOCO = int(os.getenv("LLM_LINHAS_POR_BLOCO", "200000"))
+LINHAS_BUFFER = 1000
+QUANTIS_DESCRIBE = (0.25, 0.5, 0.75)
+EXTENSOES_EM_BLOCOS = ('.csv', '.parquet')
+PARQUET_DISPONIVEL = ENGINE_PYARROW_DISPONIVEL and importlib.util.find_spec("pyarrow.parquet") is not None
+
+
+class AcumuladorNumerico:
+    """
+    count, mean, std, min, max e quantis de uma coluna numérica (ou de datas, como inteiros em ns).
+    Média e variância são combinadas pela fórmula de Chan, estável para blocos de qualquer tamanho;
+    os quantis vêm de um sketch KLL.
+    """
+
+    def __init__(self, datas: bool = False, parametros: ParametrosErro | None = None):
+        parametros = parametros or ParametrosErro.para_erro()
+        self.datas = datas
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.quantis = SketchQuantisKLL(parametros.k_quantis)
+
+    def _combinar(self, n: int, media: float, m2: float, minimo: float, maximo: float):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = media - self.media
+        self.media += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.minimo = min(self.minimo, minimo)
+        self.maximo = max(self.maximo, maximo)
+
+    def atualizar(self, serie: pd.Series):
+        serie = serie.dropna()
+        if self.datas:
+            valores = serie.to_numpy("datetime64[ns]").astype(np.int64).astype(np.float64)
+        else:
+            valores = serie.to_numpy(np.float64)
+        if not len(valores):
+            return
+        media = float(valores.mean())
+        self._combinar(len(valores), media, float(((valores - media) ** 2).sum()),
+                       float(valores.min()), float(valores.max()))
+        self.quantis.atualizar(valores)
+
+    def mesclar(self, outro: "AcumuladorNumerico"):
+        self._combinar(outro.n, outro.media, outro.m2, outro.minimo, outro.maximo)
+        self.quantis.mesclar(outro.quantis)
+
+    @property
+    def exato(self) -> bool:
+        return self.quantis.exato
+
+    def estatisticas(self) -> dict:
+        if self.n == 0:
+            return {"count": 0}
+        quantis = self.quantis.quantis(QUANTIS_DESCRIBE)
+        if self.datas:
+            data = lambda valor: pd.Timestamp(int(round(valor)))
+            return {"count": self.n, "mean": data(self.media), "min": data(self.minimo),
+                    **{f"{q:.0%}": data(v) for q, v in zip(QUANTIS_DESCRIBE, quantis)}, "max": data(self.maximo)}
+        std = float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+        return {"count": self.n, "mean": self.media, "std": std, "min": self.minimo,
+                **{f"{q:.0%}": v for q, v in zip(QUANTIS_DESCRIBE, quantis)}, "max": self.maximo}
+
+
+class AcumuladorCategorico:
+    """
+    count, unique, top e freq de uma coluna de texto/categoria/booleana. 'top' e 'freq' vêm do Misra-Gries;
+    'unique' é exato enquanto os contadores comportam todos os valores e, depois disso, vem do HyperLogLog
+    (alimentado só com os valores distintos de cada bloco).
+    """
+
+    def __init__(self, parametros: ParametrosErro | None = None):
+        parametros = parametros or ParametrosErro.para_erro()
+        self.frequentes = FrequentesMisraGries(parametros.capacidade_frequentes)
+        self.distintos = HyperLogLog(parametros.precisao_hll)
+
+    @property
+    def n(self) -> int:
+        return self.frequentes.n
+
+    @property
+    def exato(self) -> bool:
+        return self.frequentes.exato
+
+    def atualizar(self, serie: pd.Series):
+        frequencias = serie.value_counts(dropna=True, sort=False)
+        frequencias = frequencias[frequencias > 0]
+        self.frequentes.atualizar_contagens(dict(zip(frequencias.index.tolist(), frequencias.tolist())))
+        self.distintos.atualizar(frequencias.index)
+
+    def mesclar(self, outro: "AcumuladorCategorico"):
+        self.frequentes.mesclar(outro.frequentes)
+        self.distintos.mesclar(outro.distintos)
+
+    def estatisticas(self) -> dict:
+        contagens = self.frequentes.contagens
+        if not contagens:
+            return {"count": self.n, "unique": 0}
+        top = max(contagens, key=contagens.get)
+        unique = len(contagens) if self.exato else max(self.distintos.estimativa(), len(contagens))
+        return {"count": self.n, "unique": unique, "top": top, "freq": contagens[top]}
+
+
+def _eh_numerica(serie: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie)
+
+
+def criar_acumulador(serie: pd.Series, parametros: ParametrosErro | None = None):
+    if not (_eh_numerica(serie) or pd.api.types.is_datetime64_any_dtype(serie)):
+        return AcumuladorCategorico(parametros)
+    return AcumuladorNumerico(pd.api.types.is_datetime64_any_dtype(serie), parametros)
+
+
+def _avisar_descartados(original: pd.Series, convertida: pd.Series, destino: str):
+    descartados = original.notna() & convertida.isna()
+    if descartados.any():
+        exemplos = ", ".join(repr(valor) for valor in original[descartados].head(3))
+        print(f"  ⚠️ {int(descartados.sum())} valor(es) de '{original.name}' não são {destino} como no início do "
+              f"arquivo e ficaram de fora das estatísticas ({exemplos}).")
+
+
+def ajustar_ao_acumulador(serie: pd.Series, acumulador) -> pd.Series:
+    """
+    Converte a coluna do bloco para o tipo do acumulador criado nos blocos anteriores: um acumulador numérico
+    que recebe texto (ex.: coluna vazia no primeiro bloco e preenchida depois) não pode abortar o arquivo.
+    """
+    if not isinstance(acumulador, AcumuladorNumerico):
+        return serie
+    if acumulador.datas:
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return serie
+        convertida = pd.to_datetime(serie.astype(object), errors="coerce", format="ISO8601")
+        _avisar_descartados(serie, convertida, "datas")
+        return convertida
+    if _eh_numerica(serie):
+        return serie
+    convertida = pd.to_numeric(serie.astype(object), errors="coerce")
+    _avisar_descartados(serie, convertida, "números")
+    return convertida
+
+
+class EsquemaBlocos:
+    """
+    Tipos de um arquivo lido em blocos, fixados no primeiro bloco em que cada coluna tem valores: o formato das
+    colunas de data (ver leitura_tabelas.detectar_formato_data) e se as demais são numéricas ou texto. Os blocos
+    seguintes são convertidos para esses tipos; valores que não se encaixam são avisados.
+    """
+
+    def __init__(self, esquema: EsquemaTabela | None = None):
+        self.esquema = esquema
+        self.formatos_data: dict[str, str] = {}
+        self.numericas: dict[str, bool] = {}
+
+    def aplicar(self, bloco: pd.DataFrame) -> pd.DataFrame:
+        esquema = inferir_esquema(bloco.columns, self.esquema)
+        for coluna in bloco.columns:
+            nome, serie = str(coluna), bloco[coluna]
+            if not serie.notna().any():
+                continue  # tipo ainda desconhecido: decidido no primeiro bloco com valores
+            if nome in esquema.datas:
+                if pd.api.types.is_datetime64_any_dtype(serie):
+                    continue
+                formato = self.formatos_data.setdefault(nome, detectar_formato_data(serie))
+                bloco[coluna] = converter_datas(serie, formato, nome)
+                continue
+            numerica = self.numericas.setdefault(nome, _eh_numerica(serie))
+            if numerica and not _eh_numerica(serie):
+                convertida = pd.to_numeric(serie.astype(object), errors="coerce")
+                _avisar_descartados(serie, convertida, "números")
+                bloco[coluna] = convertida
+            elif not numerica and _eh_numerica(serie):
+                bloco[coluna] = serie.astype(object).where(serie.notna()).map(
+                    lambda valor: valor if pd.isna(valor) else str(valor))
+        # As datas já convertidas não são reinferidas por compactar_tipos
+        return compactar_tipos(bloco, self.esquema)
+
+
+class ResumoStreaming:
+    """
+    Resumo de um arquivo lido em blocos: primeiras e últimas 'linhas_buffer' linhas (exatas) e um acumulador
+    por coluna. Responde a shape, head(), tail(), describe() e to_string() como um DataFrame.
+    'parametros' fixa o erro máximo dos sketches (padrão: LLM_ERRO_ESTATISTICAS).
+    """
+
+    def __init__(self, linhas_buffer: int = LINHAS_BUFFER, parametros: ParametrosErro | None = None):
+        self.linhas_buffer = linhas_buffer
+        self.parametros = parametros or ParametrosErro.para_erro()
+        self.num_linhas = 0
+        self.columns = pd.Index([])
+        self.dtypes = pd.Series(dtype=object)
+        self.acumuladores: dict = {}
+        self._inicio = pd.DataFrame()
+        self._fim = pd.DataFrame()
+
+    def atualizar(self, bloco: pd.DataFrame):
+        """
+        Acrescenta um bloco de linhas (na ordem do arquivo). O acumulador de cada coluna nasce no primeiro bloco em
+        que ela tem valores; blocos seguintes de outro tipo são convertidos para o dele (ver ajustar_ao_acumulador).
+        """
+        if not len(self.columns):
+            self.columns, self.dtypes = bloco.columns, bloco.dtypes.copy()
+        for coluna in bloco.columns:
+            serie = bloco[coluna]
+            if coluna not in self.acumuladores:
+                if not serie.notna().any():
+                    continue
+                self.acumuladores[coluna] = criar_acumulador(serie, self.parametros)
+                self.dtypes[coluna] = serie.dtype
+            self.acumuladores[coluna].atualizar(ajustar_ao_acumulador(serie, self.acumuladores[coluna]))
+        if len(self._inicio) < self.linhas_buffer:
+            self._inicio = pd.concat([self._inicio, bloco.head(self.linhas_buffer - len(self._inicio))])
+        self._fim = pd.concat([self._fim, bloco.tail(self.linhas_buffer)]).tail(self.linhas_buffer)
+        self.num_linhas += len(bloco)
+
+    def mesclar(self, outro: "ResumoStreaming"):
+        """Junta o resumo das linhas que vêm depois destas (ex.: outra partição do mesmo arquivo)."""
+        if not len(self.columns):
+            self.columns, self.dtypes = outro.columns, outro.dtypes
+        for coluna, acumulador in outro.acumuladores.items():
+            if coluna not in self.acumuladores:
+                self.acumuladores[coluna] = acumulador
+            elif type(self.acumuladores[coluna]) is type(acumulador) and \
+                    getattr(self.acumuladores[coluna], "datas", False) == getattr(acumulador, "datas", False):
+                self.acumuladores[coluna].mesclar(acumulador)
+            else:
+                print(f"  ⚠️ Coluna '{coluna}' com tipos diferentes nas partes do arquivo; "
+                      f"estatísticas da parte seguinte ignoradas.")
+        self._inicio = pd.concat([self._inicio, outro._inicio]).head(self.linhas_buffer)
+        self._fim = pd.concat([self._fim, outro._fim]).tail(self.linhas_buffer)
+        self.num_linhas += outro.num_linhas
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (self.num_linhas, len(self.columns))
+
+    @property
+    def empty(self) -> bool:
+        return self.num_linhas == 0 or not len(self.columns)
+
+    @property
+    def completo(self) -> bool:
+        """True se todas as linhas do arquivo cabem no buffer inicial."""
+        return self.num_linhas <= len(self._inicio)
+
+    def __len__(self) -> int:
+        return self.num_linhas
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self._inicio.head(n)
+
+    def tail(self, n: int = 5) -> pd.DataFrame:
+        return self._fim.tail(n) if n > 0 else self._fim.iloc[0:0]
+
+    @property
+    def aproximado(self) -> bool:
+        """True se algum sketch já deixou de ser exato (quantis compactados ou contadores podados)."""
+        return any(not acumulador.exato for acumulador in self.acumuladores.values())
+
+    def describe(self, include=None) -> pd.DataFrame:
+        """
+        Estatísticas de describe(include='all'), calculadas em uma passada. Se algum valor for aproximado,
+        o limite de erro vai em attrs['nota_aproximacao'].
+        """
+        estatisticas = {coluna: self.acumuladores[coluna].estatisticas() if coluna in self.acumuladores
+                        else {"count": 0} for coluna in self.columns}
+        ordem = ["count", "unique", "top", "freq", "mean", "std", "min",
+                 *(f"{q:.0%}" for q in QUANTIS_DESCRIBE), "max"]
+        linhas = [linha for linha in ordem if any(linha in e for e in estatisticas.values())]
+        describe = pd.DataFrame({coluna: [e.get(linha, np.nan) for linha in linhas]
+                                 for coluna, e in estatisticas.items()}, index=linhas, dtype=object)
+        if self.aproximado:
+            describe.attrs["nota_aproximacao"] = f"Estatísticas aproximadas: {self.parametros.descricao()}."
+        return describe
+
+    def to_string(self, *args, **kwargs) -> str:
+        """Todas as linhas, se couberem no buffer; senão, início e fim separados por '...' (como o pandas trunca)."""
+        if self.completo:
+            return self._inicio.to_string(*args, **kwargs)
+        return (self._inicio.to_string(*args, **kwargs) + "\n...\n"
+                + self._fim.to_string(*args, **{**kwargs, "header": False}))
+
+    def __repr__(self) -> str:
+        return f"<ResumoStreaming {self.num_linhas} linhas x {len(self.columns)} colunas>"
+
+
+def ler_em_blocos(caminho, linhas_por_bloco: int = LINHAS_POR_BLOCO) -> Iterator[pd.DataFrame]:
+    """
+    Lê um CSV (read_csv com chunksize) ou Parquet (iter_batches do pyarrow) em blocos com os tipos compactados
+    e iguais em todos os blocos (ver EsquemaBlocos). Arquivos .z (pickle do joblib) não podem ser lidos em partes:
+    levanta ValueError.
+    """
+    caminho = Path(caminho)
+    esquema = EsquemaBlocos(esquema_do_arquivo(caminho))
+    if caminho.suffix == '.csv':
+        with pd.read_csv(caminho, chunksize=linhas_por_bloco) as leitor:
+            for bloco in leitor:
+                yield esquema.aplicar(bloco)
+    elif caminho.suffix == '.parquet':
+        if not PARQUET_DISPONIVEL:
+            raise ValueError(f"Leitura de Parquet em blocos requer o pyarrow: '{caminho}'")
+        import pyarrow.parquet as pq
+        inicio = 0
+        for lote in pq.ParquetFile(caminho).iter_batches(batch_size=linhas_por_bloco):
+            bloco = lote.to_pandas()
+            bloco.index = pd.RangeIndex(inicio, inicio + len(bloco))
+            inicio += len(bloco)
+            yield esquema.aplicar(bloco)
+    else:
+        raise ValueError(f"Formato não suportado para leitura em blocos: '{caminho}'")
+
+
+def resumir_arquivo_em_blocos(caminho, linhas_por_bloco: int = LINHAS_POR_BLOCO,
+                              linhas_buffer: int = LINHAS_BUFFER,
+                              parametros: ParametrosErro | None = None) -> ResumoStreaming:
+    """Lê o arquivo inteiro em blocos, com memória limitada, e devolve o ResumoStreaming."""
+    resumo = ResumoStreaming(linhas_buffer, parametros)
+    with etapa("carregar_em_blocos", arquivo=Path(caminho).name) as detalhes:
+        for bloco in ler_em_blocos(caminho, linhas_por_bloco):
+            resumo.atualizar(bloco)
+        detalhes["linhas"] = resumo.num_linhas
+    return resumo
+
+
+### Testes ###
+
+class TestResumoStreaming(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        linhas = 30_000
+        self.df = pd.DataFrame({
+            "valor": rng.lognormal(3, 1, linhas),
+            "quantidade": rng.integers(-5, 50, linhas),
+            "categoria": rng.choice(["a", "b", "c", "d"], linhas, p=[0.4, 0.3, 0.2, 0.1]),
+            "data": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, linhas), unit="D"),
+        })
+        self.parametros = ParametrosErro.para_erro(0.01)
+
+    def _resumo(self, df: pd.DataFrame) -> ResumoStreaming:
+        resumo = ResumoStreaming(linhas_buffer=5, parametros=self.parametros)
+        for bloco in np.array_split(np.arange(len(df)), 4):
+            resumo.atualizar(df.iloc[bloco])
+        return resumo
+
+    def _mesclados(self) -> tuple[ResumoStreaming, ResumoStreaming]:
+        partes = [self._resumo(self.df.iloc[inicio:inicio + 10_000]) for inicio in (0, 10_000, 20_000)]
+        esquerda = copy.deepcopy(partes[0])
+        esquerda.mesclar(copy.deepcopy(partes[1]))
+        esquerda.mesclar(copy.deepcopy(partes[2]))
+        direita = copy.deepcopy(partes[1])
+        direita.mesclar(copy.deepcopy(partes[2]))
+        primeiro = copy.deepcopy(partes[0])
+        primeiro.mesclar(direita)
+        return esquerda, primeiro
+
+    def test_mesclar_associativo_igual_ao_exato(self):
+        exato = self.df.describe(include="all")
+        for mesclado in self._mesclados():
+            self.assertEqual(mesclado.shape, self.df.shape)
+            describe = mesclado.describe()
+            for coluna in ("valor", "quantidade"):
+                for estatistica in ("count", "mean", "std", "min", "max"):
+                    self.assertAlmostEqual(float(describe.loc[estatistica, coluna]),
+                                           float(exato.loc[estatistica, coluna]), places=6,
+                                           msg=f"{estatistica} de {coluna}")
+            for estatistica in ("count", "unique", "top", "freq"):
+                self.assertEqual(describe.loc[estatistica, "categoria"], exato.loc[estatistica, "categoria"])
+            self.assertEqual(describe.loc["min", "data"], self.df["data"].min())
+            self.assertEqual(describe.loc["max", "data"], self.df["data"].max())
+            pd.testing.assert_frame_equal(mesclado.head(), self.df.head())
+            pd.testing.assert_frame_equal(mesclado.tail(), self.df.tail())
+
+    def test_quantis_mesclados_dentro_do_erro(self):
+        ordenados = np.sort(self.df["valor"].to_numpy())
+        for mesclado in self._mesclados():
+            describe = mesclado.describe()
+            for q in QUANTIS_DESCRIBE:
+                posto = np.searchsorted(ordenados, describe.loc[f"{q:.0%}", "valor"], side="right") / len(ordenados)
+                self.assertLessEqual(abs(posto - q), self.parametros.erro)
+
+    def test_csv_em_blocos_igual_ao_arquivo_inteiro(self):
+        with tempfile.TemporaryDirectory() as temporario:
+            caminho = Path(temporario) / "movimento.csv"
+            self.df.to_csv(caminho, index=False)
+            resumo = resumir_arquivo_em_blocos(caminho, linhas_por_bloco=7_000, linhas_buffer=5,
+                                               parametros=self.parametros)
+            with self.assertRaises(ValueError):
+                next(ler_em_blocos(Path(temporario) / "movimento.z"))
+        self.assertEqual(resumo.shape, self.df.shape)
+        self.assertFalse(resumo.completo)
+        describe = resumo.describe()
+        self.assertAlmostEqual(float(describe.loc["mean", "valor"]), self.df["valor"].mean(), places=6)
+        self.assertEqual(describe.loc["max", "data"], self.df["data"].max())
+        self.assertEqual(resumo.tail(2)["quantidade"].tolist(), self.df.tail(2)["quantidade"].tolist())
+        self.assertIn("\n...\n", resumo.to_string())
+
+    def test_tipo_fixado_no_primeiro_bloco_com_valores(self):
+        resumo = ResumoStreaming(linhas_buffer=10, parametros=self.parametros)
+        resumo.atualizar(pd.DataFrame({"valor": [np.nan, np.nan], "conta": ["a", "b"]}))
+        resumo.atualizar(pd.DataFrame({"valor": [1.0, 3.0], "conta": ["a", "c"]}))
+        resumo.atualizar(pd.DataFrame({"valor": ["5", "n/d"], "conta": ["a", "a"]}))  # texto depois de números
+        describe = resumo.describe()
+        self.assertEqual(describe.loc["count", "valor"], 3)
+        self.assertEqual(describe.loc["max", "valor"], 5.0)
+        self.assertEqual((describe.loc["top", "conta"], describe.loc["freq", "conta"]), ("a", 4))
+        self.assertTrue(resumo.completo)
+        self.assertEqual(len(resumo), 6)
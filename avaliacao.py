@@ -0,0 +1,465 @@
+import argparse
+import json
+import math
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from indicadores import calcular_indicadores
+from lote import MAX_WORKERS_PADRAO, TarefaPrompt, executar_lote, limitador_compartilhado
+from resiliencia import executar_com_retentativas
+from servidor_mock_openai import ConfiguracaoMock, ServidorMockOpenAI
+from telemetria import etapa, telemetria
+
+# --- Avaliação Estatística dos Prompts ---
+# Roda cada variante (prompt1, prompt2 e o fluxo híbrido) K vezes por conjunto de dados e compara as
+# distribuições das métricas, em vez de um único resumo julgado só pela ausência de erro. As K amostras
+# saem de UMA requisição com o parâmetro 'n' da API (o prompt é processado uma vez e a cobrança do prompt
+# também é única); no híbrido, cada uma das K bases do prompt1 é refinada pelo prompt2. Os conjuntos de
+# dados rodam em paralelo (lote.py, com limite de RPM/TPM). Métricas por amostra, calculadas de forma
+# vetorizada sobre todas as respostas:
+#   - fidelidade numérica: fração dos números citados que batem com algum valor dos indicadores
+#     pré-calculados sobre a base completa (indicadores.py), na precisão em que foram escritos;
+#   - fidelidade ao acaso: a mesma fração para valores inventados perto dos citados (entre metade e o dobro,
+#     na mesma precisão). Com centenas de referências, parte das coincidências é sorte: a fidelidade só diz
+#     algo quando fica claramente acima dessa linha de base;
+#   - cobertura de seções: fração das seções pedidas pela instrução que aparecem na resposta;
+#   - tamanho (caracteres, palavras, tokens), latência e custo estimado em USD.
+#
+#   python avaliacao.py --data-dir dados/jan --data-dir dados/fev --amostras 10 --out avaliacao
+#   python avaliacao.py --data-dir dados/jan --servidor-simulado   # sem custo, contra servidor_mock_openai
+
+AMOSTRAS_PADRAO = int(os.getenv("LLM_AVALIACAO_AMOSTRAS", "5"))
+TOLERANCIA_RELATIVA_PADRAO = float(os.getenv("LLM_AVALIACAO_TOLERANCIA", "0.01"))
+MAX_AMOSTRAS_POR_CHAMADA = 128  # limite do parâmetro 'n' na API
+VALOR_MINIMO_CITADO = 10  # inteiros menores (numeração de seções, "3 riscos") não contam como números citados
+Z_95 = 1.96
+SORTEIOS_ACASO = 200  # valores inventados por número citado, para a linha de base da fidelidade
+FATOR_ACASO = 2.0  # os valores inventados ficam entre citado / FATOR_ACASO e citado * FATOR_ACASO
+# Preço em USD por milhão de tokens (prompt, prompt servido do cache de prefixo, resposta).
+# Atualize conforme a tabela de preços da OpenAI.
+PRECOS_USD_POR_MILHAO = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+METRICAS = ["fidelidade_numerica", "fidelidade_acaso", "numeros_citados", "cobertura_secoes", "caracteres", "palavras",
+            "tokens_resposta", "tokens_prompt_cache", "latencia_s", "custo_usd"]
+# Seções esperadas de cada variante: as da instrução que define o formato final da resposta
+INSTRUCAO_DAS_SECOES = {"prompt1": "prompt1", "prompt2": "prompt2", "hibrido": "prompt2"}
+
+PADRAO_NUMERO = (r"(?P<numero>\d+(?:[.,]\d+)*)\s*"
+                 r"(?P<escala>bilh(?:ões|oes|ão|ao)|milh(?:ões|oes|ão|ao)|mil\b|bi\b|mi\b|k\b)?")
+ESCALAS = {"mil": 1e3, "k": 1e3, "mi": 1e6, "milh": 1e6, "bi": 1e9, "bilh": 1e9}
+PADRAO_SECAO = re.compile(r"^\s*\d+\.\s+([^:–\-\n(]+)", re.MULTILINE)
+
+
+# --- Referências ---
+
+def secoes_esperadas(instrucao: str) -> list[str]:
+    """Títulos das seções numeradas da instrução ('1. Fluxo de Caixa Operacional' -> 'Fluxo de Caixa Operacional')."""
+    return [titulo.strip() for titulo in PADRAO_SECAO.findall(instrucao) if titulo.strip()]
+
+
+def valores_referencia(indicadores: dict) -> np.ndarray:
+    """
+    Valores absolutos que uma resposta fiel pode citar: todas as células numéricas das tabelas de indicadores,
+    os totais de cada coluna e os valores dos resumos (percentuais, prazos, HHI...).
+    """
+    partes = []
+    for valor in indicadores.values():
+        if isinstance(valor, pd.DataFrame):
+            numericas = valor.select_dtypes('number')
+            partes += [numericas.to_numpy(dtype=np.float64).ravel(), numericas.sum().to_numpy(dtype=np.float64)]
+        else:
+            partes.append(np.array([v for v in valor.values() if isinstance(v, (int, float))], dtype=np.float64))
+    valores = np.abs(np.concatenate(partes)) if partes else np.empty(0)
+    return np.unique(valores[np.isfinite(valores)])
+
+
+def _normalizar_textos(textos: pd.Series) -> pd.Series:
+    return (textos.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.lower()
+            .str.replace(r'[^a-z0-9]+', ' ', regex=True))
+
+
+# --- Métricas ---
+
+def extrair_numeros(textos: pd.Series) -> pd.DataFrame:
+    """
+    Números citados em cada texto, com separadores brasileiros ou americanos e escalas por extenso
+    ("R$ 1,2 milhão"). Retorna um DataFrame indexado pelo índice de 'textos' com o valor absoluto e a
+    'unidade' da última casa escrita (1,2 milhão -> 100000), usada como precisão da citação.
+    Anos e inteiros pequenos sem casas decimais são descartados.
+    """
+    achados = textos.str.extractall(PADRAO_NUMERO)
+    if achados.empty:
+        return pd.DataFrame({"valor": pd.Series(dtype=np.float64), "unidade": pd.Series(dtype=np.float64)})
+    numero = achados["numero"]
+    virgulas, pontos = numero.str.count(","), numero.str.count(r"\.")
+    ultima_virgula, ultimo_ponto = numero.str.rfind(","), numero.str.rfind(".")
+    # Uma única vírgula depois de qualquer ponto é decimal (1.234,56 / 12,5); um único ponto depois de qualquer
+    # vírgula também (1,234.56 / 3.5), exceto no milhar brasileiro sem decimais (1.234)
+    decimal_virgula = (virgulas == 1) & (ultima_virgula > ultimo_ponto)
+    decimal_ponto = (pontos == 1) & (ultimo_ponto > ultima_virgula) & \
+        ~((virgulas == 0) & numero.str.fullmatch(r"\d{1,3}\.\d{3}"))
+    texto = np.select(
+        [decimal_virgula, decimal_ponto],
+        [numero.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+         numero.str.replace(",", "", regex=False)],
+        numero.str.replace(r"[.,]", "", regex=True))
+    posicao_decimal = np.select([decimal_virgula, decimal_ponto], [ultima_virgula, ultimo_ponto], -1)
+    casas = np.where(posicao_decimal >= 0, numero.str.len() - 1 - posicao_decimal, 0)
+    escala = achados["escala"].str.lower().str[:4].map(ESCALAS).fillna(1.0).to_numpy()
+    valor = pd.to_numeric(pd.Series(texto, index=numero.index)).to_numpy(dtype=np.float64)
+    irrelevante = (casas == 0) & (escala == 1.0) & ((valor < VALOR_MINIMO_CITADO) | ((valor >= 1900) & (valor <= 2100)))
+    numeros = pd.DataFrame({"valor": valor * escala, "unidade": 10.0 ** -casas * escala}, index=numero.index)
+    return numeros[~irrelevante].droplevel("match")
+
+
+def _coincide(valores: np.ndarray, unidades: np.ndarray, referencias: np.ndarray, tolerancia: float) -> np.ndarray:
+    """Para cada valor, se a referência mais próxima está dentro do limite (ver fidelidade_numerica)."""
+    if not len(referencias):
+        return np.zeros(valores.shape, dtype=bool)
+    referencias = np.sort(referencias)
+    posicao = np.searchsorted(referencias, valores)
+    abaixo = referencias[np.clip(posicao - 1, 0, len(referencias) - 1)]
+    acima = referencias[np.clip(posicao, 0, len(referencias) - 1)]
+    distancia = np.minimum(np.abs(valores - abaixo), np.abs(acima - valores))
+    return distancia <= np.maximum(tolerancia * valores, unidades / 2)
+
+
+def fidelidade_numerica(textos: pd.Series, referencias: np.ndarray,
+                        tolerancia: float = TOLERANCIA_RELATIVA_PADRAO, semente: int = 0) -> pd.DataFrame:
+    """
+    Por texto: quantos números foram citados e a fração deles que coincide com alguma referência. Uma citação
+    coincide se a distância até a referência for no máximo a maior entre 'tolerancia' (relativa) e meia
+    unidade da última casa escrita, ou seja, se for a referência arredondada na precisão da citação.
+    'fidelidade_acaso' é a fração esperada para números inventados: cada citação é trocada por SORTEIOS_ACASO
+    valores sorteados (log-uniforme entre citado / FATOR_ACASO e citado * FATOR_ACASO, arredondados na mesma
+    precisão) e conta a fração deles que coincide com alguma referência.
+    """
+    numeros = extrair_numeros(textos)
+    resultado = pd.DataFrame({"numeros_citados": 0, "fidelidade_numerica": np.nan, "fidelidade_acaso": np.nan},
+                             index=textos.index)
+    if numeros.empty:
+        return resultado
+    citados, unidades = numeros["valor"].to_numpy(), numeros["unidade"].to_numpy()
+    corretos = _coincide(citados, unidades, referencias, tolerancia)
+    fatores = np.exp(np.random.default_rng(semente).uniform(
+        -np.log(FATOR_ACASO), np.log(FATOR_ACASO), (len(citados), SORTEIOS_ACASO)))
+    inventados = np.round(citados[:, None] * fatores / unidades[:, None]) * unidades[:, None]
+    acaso = _coincide(inventados, unidades[:, None], referencias, tolerancia).mean(axis=1)
+    contagem = pd.DataFrame({"citados": 1, "corretos": corretos, "acaso": acaso},
+                            index=numeros.index).groupby(level=0).sum()
+    resultado.loc[contagem.index, "numeros_citados"] = contagem["citados"]
+    resultado.loc[contagem.index, "fidelidade_numerica"] = contagem["corretos"] / contagem["citados"]
+    resultado.loc[contagem.index, "fidelidade_acaso"] = contagem["acaso"] / contagem["citados"]
+    return resultado
+
+
+def cobertura_secoes(textos: pd.Series, secoes: list[str]) -> pd.Series:
+    """Fração das seções presentes em cada texto (todas as palavras de 4+ letras do título, sem acentos)."""
+    if not secoes:
+        return pd.Series(np.nan, index=textos.index)
+    normalizados = _normalizar_textos(textos)
+    presentes = []
+    for secao in secoes:
+        palavras = [p for p in _normalizar_textos(pd.Series([secao]))[0].split() if len(p) >= 4]
+        presente = pd.Series(True, index=textos.index)
+        for palavra in palavras:
+            presente &= normalizados.str.contains(rf"\b{palavra}", regex=True)
+        presentes.append(presente)
+    return pd.concat(presentes, axis=1).mean(axis=1)
+
+
+def custo_usd(modelo: str, tokens_prompt, tokens_resposta, tokens_prompt_cache=0):
+    """Custo estimado; 'tokens_prompt_cache' (parte de 'tokens_prompt') é cobrado pelo preço com desconto."""
+    precos = PRECOS_USD_POR_MILHAO.get(modelo)
+    tokens_prompt = np.asarray(tokens_prompt, dtype=np.float64)
+    if precos is None:
+        return np.nan * tokens_prompt
+    em_cache = np.asarray(tokens_prompt_cache, dtype=np.float64)
+    return ((tokens_prompt - em_cache) * precos[0] + em_cache * precos[1]
+            + np.asarray(tokens_resposta, dtype=np.float64) * precos[2]) / 1e6
+
+
+def calcular_metricas(amostras: pd.DataFrame, referencias: dict[str, np.ndarray], secoes: dict[str, list[str]],
+                      contador, tolerancia: float = TOLERANCIA_RELATIVA_PADRAO) -> pd.DataFrame:
+    """
+    Acrescenta as métricas às amostras (colunas conjunto, variante, resposta, latencia_s, custo_usd).
+    A fidelidade é calculada por conjunto (cada um tem seus indicadores) e a cobertura por variante.
+    """
+    metricas = amostras.copy()
+    textos = metricas["resposta"].fillna("")
+    fidelidade = [fidelidade_numerica(textos[grupo.index], referencias.get(conjunto, np.empty(0)), tolerancia)
+                  for conjunto, grupo in metricas.groupby("conjunto")]
+    metricas = metricas.join(pd.concat(fidelidade))
+    metricas["cobertura_secoes"] = pd.concat([cobertura_secoes(textos[grupo.index], secoes.get(variante, []))
+                                              for variante, grupo in metricas.groupby("variante")])
+    metricas["caracteres"] = textos.str.len()
+    metricas["palavras"] = textos.str.count(r"\S+")
+    metricas["tokens_resposta"] = textos.map(contador)
+    return metricas
+
+
+def _estatisticas(grupos) -> pd.DataFrame:
+    agregado = grupos[METRICAS].agg(["mean", "std", "count"])
+    media, desvio, n = (agregado.xs(estatistica, axis=1, level=1) for estatistica in ("mean", "std", "count"))
+    ic95 = Z_95 * desvio / np.sqrt(n)
+    return pd.concat({"media": media, "desvio": desvio, "ic95": ic95, "n": n}, axis=1)
+
+
+def agregar_metricas(metricas: pd.DataFrame, variante_base: str) -> dict[str, pd.DataFrame]:
+    """
+    Médias, desvios e intervalos de 95% por variante e por (conjunto, variante), e a diferença de cada variante
+    para 'variante_base' com o intervalo de Welch. 'significativa' indica que o intervalo não contém zero.
+    """
+    por_variante = _estatisticas(metricas.groupby("variante"))
+    por_conjunto = _estatisticas(metricas.groupby(["conjunto", "variante"]))
+    comparacao = {}
+    if variante_base in por_variante.index:
+        base = por_variante.loc[variante_base]
+        for variante in por_variante.index.drop(variante_base):
+            linha = por_variante.loc[variante]
+            diferenca = linha["media"] - base["media"]
+            ic95 = Z_95 * np.sqrt(linha["desvio"] ** 2 / linha["n"] + base["desvio"] ** 2 / base["n"])
+            comparacao[variante] = pd.DataFrame({"diferenca": diferenca, "ic95": ic95,
+                                                 "significativa": diferenca.abs() > ic95})
+    return {"por_variante": por_variante, "por_conjunto": por_conjunto,
+            "comparacao": pd.concat(comparacao, names=["variante", "metrica"]) if comparacao else pd.DataFrame()}
+
+
+def tabela_media_ic(estatisticas: pd.DataFrame) -> pd.DataFrame:
+    """'média ± ic95' de cada métrica, para exibição."""
+    casas = {"fidelidade_numerica": 3, "fidelidade_acaso": 3, "cobertura_secoes": 3, "latencia_s": 2, "custo_usd": 6}
+    return pd.DataFrame({
+        metrica: [f"{m:.{casas.get(metrica, 1)}f} ± {ic:.{casas.get(metrica, 1)}f}" if not math.isnan(m) else "-"
+                  for m, ic in zip(estatisticas["media"][metrica], estatisticas["ic95"][metrica].fillna(0.0))]
+        for metrica in METRICAS
+    }, index=estatisticas.index)
+
+
+# --- Execução ---
+
+def amostrar_respostas(prompts, prompt: str, n: int, model_id: str, max_tokens: int) -> dict:
+    """
+    K respostas para o mesmo prompt com o parâmetro 'n' (em requisições de até MAX_AMOSTRAS_POR_CHAMADA),
+    com as retentativas e o disjuntor do prompts.py. O cache de respostas não é usado: cada amostra é nova.
+    Retorna {'respostas', 'tokens_prompt', 'tokens_prompt_cache', 'tokens_resposta', 'latencia_s'}.
+    """
+    resultado = {"respostas": [], "tokens_prompt": 0, "tokens_prompt_cache": 0, "tokens_resposta": 0, "latencia_s": 0.0}
+    while len(resultado["respostas"]) < n:
+        params = {**prompts.montar_parametros_chat(prompt, model_id, max_tokens),
+                  "n": min(MAX_AMOSTRAS_POR_CHAMADA, n - len(resultado["respostas"]))}
+        inicio = time.perf_counter()
+        try:
+            resposta, retentativas = executar_com_retentativas(
+                lambda: prompts.obter_cliente().chat.completions.create(**params),
+                prompts.POLITICA_RETENTATIVA, prompts.disjuntores.obter(model_id))
+        except Exception as e:
+            telemetria.registrar_chamada_llm(model_id, time.perf_counter() - inicio, status="erro",
+                                             retentativas=getattr(e, 'retentativas', 0), erro=type(e).__name__,
+                                             amostras=params["n"])
+            raise
+        duracao = time.perf_counter() - inicio
+        uso = resposta.usage
+        telemetria.registrar_chamada_llm(model_id, duracao, tokens_prompt=getattr(uso, 'prompt_tokens', None),
+                                         tokens_resposta=getattr(uso, 'completion_tokens', None),
+                                         tokens_prompt_cache=prompts.tokens_em_cache(uso),
+                                         retentativas=retentativas, amostras=params["n"])
+        resultado["respostas"] += [(escolha.message.content or "").strip()
+                                   for escolha in sorted(resposta.choices, key=lambda escolha: escolha.index)]
+        resultado["tokens_prompt"] += getattr(uso, 'prompt_tokens', 0) or 0
+        resultado["tokens_prompt_cache"] += prompts.tokens_em_cache(uso) or 0
+        resultado["tokens_resposta"] += getattr(uso, 'completion_tokens', 0) or 0
+        resultado["latencia_s"] += duracao
+    return resultado
+
+
+def _linhas_amostras(conjunto: str, variante: str, lote: dict, model_id: str, contador) -> list[dict]:
+    """
+    Uma linha por resposta do lote. O custo do prompt é dividido igualmente entre as amostras (um prefill só)
+    e o da resposta, pela proporção de tokens de cada amostra. A latência é a da requisição.
+    """
+    respostas = lote["respostas"]
+    tokens = np.array([contador(resposta) for resposta in respostas], dtype=np.float64)
+    proporcao = tokens / tokens.sum() if tokens.sum() else np.full(len(respostas), 1 / max(1, len(respostas)))
+    custos = custo_usd(model_id, lote["tokens_prompt"] / len(respostas), lote["tokens_resposta"] * proporcao,
+                       lote["tokens_prompt_cache"] / len(respostas))
+    return [{"conjunto": conjunto, "variante": variante, "amostra": i, "resposta": resposta,
+             "latencia_s": lote["latencia_s"], "custo_usd": float(custo),
+             "tokens_prompt_cache": lote["tokens_prompt_cache"] / len(respostas)}
+            for i, (resposta, custo) in enumerate(zip(respostas, custos))]
+
+
+def executar_avaliacao(diretorios_dados: list[Path], variantes: list[str], amostras: int = AMOSTRAS_PADRAO,
+                       max_workers: int = MAX_WORKERS_PADRAO,
+                       model_id: str | None = None) -> tuple[pd.DataFrame, list[dict], dict]:
+    """
+    Gera 'amostras' respostas por (conjunto de dados × variante). Retorna (amostras com resposta, latência e
+    custo; falhas; {conjunto: valores de referência dos indicadores}).
+    """
+    import prompts  # importado só aqui: OPENAI_BASE_URL pode ter sido apontada para o servidor simulado
+    model_id = model_id or prompts.MODELO_ID_FIXO
+    _, contador = prompts.obter_contador(model_id)
+    orcamento = prompts.calcular_orcamento_tokens_dados(model_id)
+    conjuntos = prompts.carregar_conjuntos_dados(diretorios_dados, orcamento)
+
+    referencias = {}
+    for nome, (diretorio, _) in conjuntos.items():
+        with etapa("referencias_avaliacao", conjunto=nome):
+            tabelas = {arquivo.name: prompts.cache_dados.carregar(arquivo)
+                       for arquivo in prompts.listar_arquivos_dados(diretorio)}
+            referencias[nome] = valores_referencia(calcular_indicadores(tabelas)[0])
+
+    limitador = limitador_compartilhado(model_id)
+    falhas = []
+
+    def enviar(prompt: str, n: int) -> dict:
+        return amostrar_respostas(prompts, prompt, n, model_id, prompts.MAX_TOKENS_RESPOSTA)
+
+    def reservar(prompt: str, n: int) -> int:
+        return prompts.estimar_tokens(prompt) + prompts.MAX_TOKENS_RESPOSTA * n
+
+    def executar(tarefas: list[TarefaPrompt]) -> dict:
+        lotes = {}
+        for tarefa, resultado in zip(tarefas, executar_lote(tarefas, enviar, max_workers, limitador)):
+            if resultado.status == "ok":
+                lotes[tarefa.identificador] = resultado.resposta
+            else:
+                print(f"❌ {tarefa.identificador}: {resultado.erro}")
+                falhas.append({"tarefa": tarefa.identificador, "erro": resultado.erro})
+        return lotes
+
+    # 1) Prompts de uma etapa; o híbrido usa as amostras do prompt1 como bases
+    unicos = list(dict.fromkeys(v for variante in variantes for v in (['prompt1'] if variante == 'hibrido' else [variante])))
+    tarefas = [TarefaPrompt(prompt=prompts.montar_prompt_unico(variante, dados),
+                            tokens_estimados=reservar(prompts.montar_prompt_unico(variante, dados), amostras),
+                            identificador=f"{nome}::{variante}", kwargs={"n": amostras})
+               for nome, (_, dados) in conjuntos.items() for variante in unicos]
+    print(f"\n🧪 Avaliação: {len(conjuntos)} conjunto(s) × {len(unicos)} prompt(s) × {amostras} amostra(s) (n={amostras})")
+    lotes = executar(tarefas)
+
+    linhas = []
+    for identificador, lote in lotes.items():
+        nome, variante = identificador.split("::")
+        if variante in variantes:
+            linhas += _linhas_amostras(nome, variante, lote, model_id, contador)
+
+    # 2) Híbrido: cada base refinada pelo prompt2 (uma amostra por base)
+    if 'hibrido' in variantes:
+        tarefas = []
+        for nome, (_, dados) in conjuntos.items():
+            for i, base in enumerate(lotes.get(f"{nome}::prompt1", {}).get("respostas", [])):
+                prompt = prompts.montar_prompt_refinador("prompt2", base, dados)
+                tarefas.append(TarefaPrompt(prompt=prompt, tokens_estimados=reservar(prompt, 1),
+                                            identificador=f"{nome}::hibrido::{i}", kwargs={"n": 1}))
+        refinados = executar(tarefas)
+        for identificador, lote in refinados.items():
+            nome, _, i = identificador.split("::")
+            base = lotes[f"{nome}::prompt1"]
+            linha, = _linhas_amostras(nome, "hibrido", lote, model_id, contador)
+            # A base custou uma fração da requisição com n amostras e fez o refinador esperar por ela
+            custo_base = custo_usd(model_id, base["tokens_prompt"] / amostras, base["tokens_resposta"] / amostras,
+                                   base["tokens_prompt_cache"] / amostras)
+            linhas.append({**linha, "amostra": int(i), "latencia_s": base["latencia_s"] + linha["latencia_s"],
+                           "custo_usd": linha["custo_usd"] + float(custo_base),
+                           "tokens_prompt_cache": linha["tokens_prompt_cache"] + base["tokens_prompt_cache"] / amostras})
+
+    colunas = ["conjunto", "variante", "amostra", "resposta", "latencia_s", "custo_usd", "tokens_prompt_cache"]
+    return pd.DataFrame(linhas, columns=colunas), falhas, referencias
+
+
+def gravar_relatorio(diretorio: Path, metricas: pd.DataFrame, agregado: dict, falhas: list[dict],
+                     metadados: dict) -> Path:
+    """Grava amostras.csv (respostas e métricas) e relatorio.json (metadados, agregados e falhas)."""
+    diretorio.mkdir(parents=True, exist_ok=True)
+    metricas.to_csv(diretorio / "amostras.csv", index=False)
+
+    def registros(tabela: pd.DataFrame) -> list[dict]:
+        if tabela.empty:
+            return []
+        tabela = tabela.copy()
+        tabela.columns = ["_".join(map(str, coluna)) if isinstance(coluna, tuple) else coluna for coluna in tabela.columns]
+        return json.loads(tabela.reset_index().to_json(orient="records", force_ascii=False))
+
+    caminho = diretorio / "relatorio.json"
+    caminho.write_text(json.dumps({"metadados": metadados, "falhas": falhas,
+                                   **{nome: registros(tabela) for nome, tabela in agregado.items()}},
+                                  indent=2, ensure_ascii=False), encoding="utf-8")
+    return caminho
+
+
+def imprimir_relatorio(agregado: dict, variante_base: str):
+    with pd.option_context('display.width', 250, 'display.max_columns', None):
+        print("\n--- Avaliação por Variante (média ± IC 95%) ---")
+        print(tabela_media_ic(agregado["por_variante"]).to_string())
+        print("\n--- Por Conjunto de Dados ---")
+        print(tabela_media_ic(agregado["por_conjunto"]).to_string())
+        if not agregado["comparacao"].empty:
+            print(f"\n--- Diferença para '{variante_base}' (Welch, IC 95%) ---")
+            print(agregado["comparacao"].round(6).to_string())
+
+
+def main(argumentos: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Avaliação estatística das variantes de prompt.")
+    parser.add_argument("--data-dir", type=Path, action="append", dest="diretorios", required=True,
+                        help="diretório com os arquivos .z (pode repetir)")
+    parser.add_argument("--variants", "--variantes", dest="variantes", default="prompt1,prompt2,hibrido",
+                        help="variantes separadas por vírgula: prompt1, prompt2, hybrid (ou hibrido)")
+    parser.add_argument("--amostras", type=int, default=AMOSTRAS_PADRAO, help="respostas por conjunto e variante (K)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS_PADRAO, help="requisições em paralelo")
+    parser.add_argument("--modelo", help="modelo avaliado (padrão: o do prompts.py)")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_RELATIVA_PADRAO,
+                        help="erro relativo aceito na fidelidade numérica (padrão 0.01)")
+    parser.add_argument("--base", default="prompt1", help="variante de referência na comparação")
+    parser.add_argument("--out", type=Path, default=Path("avaliacao_resultados"), help="pasta do relatório")
+    parser.add_argument("--servidor-simulado", action="store_true",
+                        help="usa o servidor_mock_openai local em vez da API (testa o fluxo sem custo)")
+    args = parser.parse_args(argumentos)
+    if args.amostras < 1:
+        parser.error("--amostras deve ser pelo menos 1")
+    aliases = {'hybrid': 'hibrido'}
+    variantes = list(dict.fromkeys(aliases.get(v.strip(), v.strip()) for v in args.variantes.split(",") if v.strip()))
+    invalidas = [variante for variante in variantes if variante not in INSTRUCAO_DAS_SECOES]
+    if invalidas:
+        parser.error(f"variante(s) desconhecida(s): {', '.join(invalidas)}")
+
+    servidor = None
+    if args.servidor_simulado:
+        servidor = ServidorMockOpenAI(ConfiguracaoMock(semente=42)).iniciar()
+        os.environ["OPENAI_BASE_URL"] = servidor.url
+        os.environ.setdefault("OPENAI_API_KEY", "avaliacao")
+    try:
+        amostras, falhas, referencias = executar_avaliacao(args.diretorios, variantes, args.amostras,
+                                                            max(1, args.workers), args.modelo)
+    finally:
+        if servidor is not None:
+            servidor.parar()
+    if amostras.empty:
+        print("❌ Nenhuma amostra gerada.")
+        return
+
+    import prompts
+    model_id = args.modelo or prompts.MODELO_ID_FIXO
+    secoes = {variante: secoes_esperadas(prompts.prompts_comparativos[instrucao])
+              for variante, instrucao in INSTRUCAO_DAS_SECOES.items()}
+    metricas = calcular_metricas(amostras, referencias, secoes, prompts.obter_contador(model_id)[1], args.tolerancia)
+    agregado = agregar_metricas(metricas, args.base)
+    imprimir_relatorio(agregado, args.base)
+    caminho = gravar_relatorio(args.out, metricas, agregado, falhas, {
+        "data": datetime.now().isoformat(timespec="seconds"), "modelo": model_id, "amostras": args.amostras,
+        "tolerancia": args.tolerancia, "variantes": variantes, "conjuntos": [str(d) for d in args.diretorios],
+        "servidor_simulado": args.servidor_simulado, "secoes_esperadas": secoes,
+        "referencias_por_conjunto": {nome: len(valores) for nome, valores in referencias.items()},
+    })
+    print(f"\n💾 Relatório salvo em '{caminho}' (respostas em '{args.out / 'amostras.csv'}').")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from servidor_mock_openai import ConfiguracaoMock, ServidorMockOpenAI
+
+# --- Suíte de Benchmarks ---
+# Gera bases contábeis sintéticas (1k, 100k ou 10M linhas nas tabelas de movimento), sobe o servidor
+# simulado da OpenAI e cronometra as etapas do projeto de ponta a ponta: carregamento dos CSVs,
+# conversão para texto, montagem do bloco de dados (com cache frio e quente), prompt único e fluxo híbrido.
+# O resultado vai para um JSON; com --comparar, as etapas mais lentas que a referência são apontadas.
+#
+#   python benchmark.py --tamanhos 1k,100k --saida benchmark.json
+#   python benchmark.py --tamanhos 1k,100k --comparar benchmark.json
+
+TAMANHOS = {"1k": 1_000, "100k": 100_000, "10m": 10_000_000}
+TAMANHOS_PADRAO = "1k,100k"  # 10m exige alguns GB de RAM e disco; inclua-o explicitamente
+LIMIAR_REGRESSAO_PADRAO = 0.20
+NUM_CATEGORIAS = 30
+NUM_PRODUTOS = 500
+NUM_NATUREZAS = 20
+NUM_PARCEIROS = 2_000
+
+
+def _datas(rng: np.random.Generator, n: int, inicio: str = "2023-01-01", dias: int = 730) -> pd.Series:
+    return pd.Series(pd.Timestamp(inicio) + pd.to_timedelta(rng.integers(0, dias, n), unit="D"))
+
+
+def _titulos(rng: np.random.Generator, n: int, coluna_parceiro: str) -> pd.DataFrame:
+    emissao = _datas(rng, n)
+    vencimento = emissao + pd.to_timedelta(rng.integers(15, 90, n), unit="D")
+    pago = rng.random(n) < 0.7
+    pagamento = (vencimento + pd.to_timedelta(rng.integers(-10, 40, n), unit="D")).where(pago)
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        coluna_parceiro: rng.integers(1, NUM_PARCEIROS + 1, n),
+        "natureza_id": rng.integers(1, NUM_NATUREZAS + 1, n),
+        "data_emissao": emissao,
+        "data_vencimento": vencimento,
+        "data_pagamento": pagamento,
+        "valor": rng.gamma(2.0, 800.0, n).round(2),
+        "status": pd.Categorical(np.where(pago, "pago", "aberto")),
+    })
+
+
+def gerar_dados_sinteticos(linhas: int, semente: int = 42) -> dict[str, pd.DataFrame]:
+    """
+    Gera as tabelas contábeis sintéticas. As tabelas de movimento (contas a pagar/receber, movimento financeiro
+    e vendas) têm 'linhas' linhas; as de cadastro (categorias, produtos, naturezas) têm tamanho fixo.
+    """
+    rng = np.random.default_rng(semente)
+    categorias = pd.DataFrame({"id": np.arange(1, NUM_CATEGORIAS + 1),
+                               "nome": [f"Categoria {i}" for i in range(1, NUM_CATEGORIAS + 1)]})
+    produtos = pd.DataFrame({
+        "id": np.arange(1, NUM_PRODUTOS + 1),
+        "nome": [f"Produto {i}" for i in range(1, NUM_PRODUTOS + 1)],
+        "categoria_id": rng.integers(1, NUM_CATEGORIAS + 1, NUM_PRODUTOS),
+        "preco": rng.uniform(5, 500, NUM_PRODUTOS).round(2),
+    })
+    produtos["custo"] = (produtos["preco"] * rng.uniform(0.4, 0.8, NUM_PRODUTOS)).round(2)
+    naturezas = pd.DataFrame({
+        "id": np.arange(1, NUM_NATUREZAS + 1),
+        "nome": [f"Natureza {i}" for i in range(1, NUM_NATUREZAS + 1)],
+        "tipo": np.where(np.arange(NUM_NATUREZAS) < 5, "receita", "despesa"),
+    })
+
+    produto_vendido = rng.integers(1, NUM_PRODUTOS + 1, linhas)
+    quantidade = rng.integers(1, 20, linhas)
+    preco = produtos["preco"].to_numpy()[produto_vendido - 1]
+    vendas = pd.DataFrame({
+        "id": np.arange(1, linhas + 1),
+        "data": _datas(rng, linhas),
+        "produto_id": produto_vendido,
+        "quantidade": quantidade,
+        "preco_unitario": preco,
+        "valor_total": (quantidade * preco).round(2),
+    })
+    movimento = pd.DataFrame({
+        "id": np.arange(1, linhas + 1),
+        "data": _datas(rng, linhas),
+        "tipo": pd.Categorical(np.where(rng.random(linhas) < 0.55, "entrada", "saida")),
+        "natureza_id": rng.integers(1, NUM_NATUREZAS + 1, linhas),
+        "valor": rng.gamma(2.0, 500.0, linhas).round(2),
+    })
+    return {
+        "categorias": categorias,
+        "produtos": produtos,
+        "naturezas-financeiras": naturezas,
+        "vendas": vendas,
+        "movimento-financeiro": movimento,
+        "contas-a-pagar": _titulos(rng, linhas, "fornecedor_id"),
+        "contas-a-receber": _titulos(rng, linhas, "cliente_id"),
+    }
+
+
+def gravar_dados_sinteticos(tabelas: dict[str, pd.DataFrame], diretorio: Path):
+    """Grava cada tabela como .z (joblib, usado por prompts.py) e .csv (usado por llm_openai.py)."""
+    diretorio.mkdir(parents=True, exist_ok=True)
+    for nome, df in tabelas.items():
+        joblib.dump(df, diretorio / f"{nome}.z")
+        df.to_csv(diretorio / f"{nome}.csv", index=False)
+
+
+def pico_memoria_mb() -> float:
+    """Pico de memória residente do processo até agora (MB)."""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def medir(funcao, repeticoes: int = 1, preparar=None) -> tuple[dict, object]:
+    """
+    Executa 'funcao' 'repeticoes' vezes (chamando 'preparar' antes de cada uma, fora da medição).
+    Retorna (estatísticas em segundos, resultado da última execução).
+    """
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        if preparar is not None:
+            preparar()
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return {
+        "repeticoes": repeticoes,
+        "min_s": min(tempos),
+        "mediana_s": statistics.median(tempos),
+        "max_s": max(tempos),
+        "pico_memoria_mb": round(pico_memoria_mb(), 1),
+    }, resultado
+
+
+def _versao_git() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def executar_benchmarks(tamanhos: list[str], config_mock: ConfiguracaoMock, repeticoes: int = 3,
+                        diretorio_trabalho: Path | None = None) -> dict:
+    """
+    Roda a suíte para cada tamanho e devolve o relatório (metadados + resultados por etapa).
+    O cliente do prompts.py é apontado para o servidor simulado, e os caches vão para um diretório temporário.
+    """
+    temporario = diretorio_trabalho is None
+    diretorio_trabalho = Path(diretorio_trabalho or tempfile.mkdtemp(prefix="benchmark_llm_"))
+    resultados = []
+
+    with ServidorMockOpenAI(config_mock) as servidor:
+        os.environ["OPENAI_BASE_URL"] = servidor.url
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        import llm_openai
+        import prompts
+        from cache_dados import CacheDadosZ
+        from cache_respostas import CacheRespostasLLM
+        from montagem_prompt import CacheSecoes
+        prompts.CACHE_DESATIVADO = True  # toda chamada ao LLM vai ao servidor simulado
+
+        def caches_novos(diretorio: Path):
+            shutil.rmtree(diretorio, ignore_errors=True)
+            prompts.cache_respostas = CacheRespostasLLM(diretorio / "respostas.sqlite")
+            prompts.cache_dados = CacheDadosZ(diretorio / "dados_z")
+            prompts.cache_secoes = CacheSecoes(diretorio / "secoes")
+
+        for rotulo in tamanhos:
+            linhas = TAMANHOS[rotulo]
+            print(f"\n📏 Tamanho {rotulo} ({linhas} linhas nas tabelas de movimento)")
+            diretorio_dados = diretorio_trabalho / rotulo
+            inicio = time.perf_counter()
+            tabelas = gerar_dados_sinteticos(linhas)
+            gravar_dados_sinteticos(tabelas, diretorio_dados)
+            del tabelas
+            print(f"  🧪 Dados sintéticos gerados em {time.perf_counter() - inicio:.1f}s: {diretorio_dados}")
+
+            def registrar(etapa: str, estatisticas: dict, **extras):
+                resultados.append({"tamanho": rotulo, "linhas": linhas, "etapa": etapa, **estatisticas, **extras})
+                print(f"  ⏱️ {etapa}: mediana {estatisticas['mediana_s']:.3f}s "
+                      f"(min {estatisticas['min_s']:.3f}s, {estatisticas['repeticoes']}x)")
+
+            arquivos_csv = {f"{nome}.csv": f"df_{nome.replace('-', '_')}" for nome in
+                            sorted(p.stem for p in diretorio_dados.glob("*.csv"))}
+            estatisticas, dataframes = medir(
+                lambda: llm_openai.carregar_dataframes(arquivos_csv, pasta_arquivos=diretorio_dados), repeticoes)
+            registrar("carregar_dataframes", estatisticas, dataframes=len(dataframes))
+
+            estatisticas, texto = medir(lambda: llm_openai.converter_dfs_para_texto(dataframes), repeticoes)
+            registrar("converter_dfs_para_texto", estatisticas, caracteres=len(texto))
+            del dataframes
+
+            diretorio_cache = diretorio_trabalho / f"cache_{rotulo}"
+            orcamento = prompts.calcular_orcamento_tokens_dados()
+
+            def processar():
+                return prompts.carregar_e_processar_dados_para_llm(diretorio_dados, orcamento_tokens=orcamento,
+                                                                   usar_indicadores=True)
+
+            estatisticas, _ = medir(processar, repeticoes, preparar=lambda: caches_novos(diretorio_cache))
+            registrar("carregar_e_processar_dados_para_llm (cache frio)", estatisticas)
+            estatisticas, conteudo = medir(processar, repeticoes)
+            registrar("carregar_e_processar_dados_para_llm (cache quente)", estatisticas,
+                      caracteres=len(conteudo))
+
+            prompt_unico = prompts.montar_prompt_unico('prompt1', conteudo)
+            estatisticas, _ = medir(lambda: prompts.enviar_prompt_para_llm(prompt_unico), repeticoes)
+            registrar("prompt único (prompt1)", estatisticas)
+
+            metricas = []
+            estatisticas, _ = medir(lambda: prompts.enviar_prompt_para_llm(
+                prompt_unico, ao_receber=lambda delta: None, ao_concluir=metricas.append), repeticoes)
+            registrar("prompt único em streaming (prompt1)", estatisticas,
+                      ttft_mediano_s=statistics.median(m.ttft_s or 0.0 for m in metricas),
+                      tokens_por_segundo_mediano=statistics.median(m.tokens_por_segundo for m in metricas))
+
+            estatisticas, _ = medir(
+                lambda: prompts.gerar_resumo_contabil_hibrido(conteudo, "prompt1", "prompt2"), repeticoes)
+            registrar("gerar_resumo_contabil_hibrido", estatisticas)
+
+        requisicoes, erros = servidor.requisicoes, servidor.erros_injetados
+
+    if temporario:
+        shutil.rmtree(diretorio_trabalho, ignore_errors=True)
+
+    return {
+        "metadados": {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "commit": _versao_git(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "servidor_simulado": {**config_mock.__dict__, "requisicoes": requisicoes, "erros_injetados": erros},
+        },
+        "resultados": resultados,
+    }
+
+
+def comparar_relatorios(atual: dict, referencia: dict, limiar: float = LIMIAR_REGRESSAO_PADRAO) -> list[dict]:
+    """
+    Compara a mediana de cada etapa com a do relatório de referência.
+    Retorna as etapas que ficaram mais de 'limiar' (fração) mais lentas.
+    """
+    base = {(r["tamanho"], r["etapa"]): r for r in referencia.get("resultados", [])}
+    regressoes = []
+    for resultado in atual["resultados"]:
+        anterior = base.get((resultado["tamanho"], resultado["etapa"]))
+        if not anterior or anterior["mediana_s"] <= 0:
+            continue
+        variacao = resultado["mediana_s"] / anterior["mediana_s"] - 1
+        if variacao > limiar:
+            regressoes.append({"tamanho": resultado["tamanho"], "etapa": resultado["etapa"],
+                               "referencia_s": anterior["mediana_s"], "atual_s": resultado["mediana_s"],
+                               "variacao_%": round(variacao * 100, 1)})
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do projeto contra um servidor simulado da OpenAI.")
+    parser.add_argument("--tamanhos", default=TAMANHOS_PADRAO, help=f"lista separada por vírgula entre {list(TAMANHOS)}")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--saida", type=Path, default=Path("benchmark_resultados.json"))
+    parser.add_argument("--comparar", type=Path, help="relatório JSON de referência para detectar regressões")
+    parser.add_argument("--limiar", type=float, default=LIMIAR_REGRESSAO_PADRAO,
+                        help="fração de piora tolerada antes de apontar regressão (padrão 0.20)")
+    parser.add_argument("--diretorio-trabalho", type=Path, help="onde gravar os dados sintéticos (padrão: temporário)")
+    parser.add_argument("--latencia", type=float, default=0.2, help="latência até o primeiro token do servidor simulado")
+    parser.add_argument("--tokens-por-segundo", type=float, default=100.0)
+    parser.add_argument("--tokens-resposta", type=int, default=200)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    parser.add_argument("--status-erro", type=int, default=500, choices=[429, 500, 503])
+    args = parser.parse_args()
+
+    tamanhos = [t.strip().lower() for t in args.tamanhos.split(",") if t.strip()]
+    invalidos = [t for t in tamanhos if t not in TAMANHOS]
+    if invalidos:
+        parser.error(f"tamanho(s) inválido(s): {', '.join(invalidos)}")
+
+    referencia = json.loads(args.comparar.read_text(encoding="utf-8")) if args.comparar else None
+    config_mock = ConfiguracaoMock(latencia_s=args.latencia, tokens_por_segundo=args.tokens_por_segundo,
+                                   tokens_resposta=args.tokens_resposta, taxa_erro=args.taxa_erro,
+                                   status_erro=args.status_erro, semente=42)
+    relatorio = executar_benchmarks(tamanhos, config_mock, args.repeticoes, args.diretorio_trabalho)
+    args.saida.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\n💾 Resultados salvos em '{args.saida}'.")
+
+    if referencia is not None:
+        regressoes = comparar_relatorios(relatorio, referencia, args.limiar)
+        if not regressoes:
+            print(f"✅ Nenhuma etapa ficou mais de {args.limiar:.0%} mais lenta que a referência.")
+            return
+        print(f"⚠️ {len(regressoes)} etapa(s) mais lenta(s) que a referência:")
+        for r in regressoes:
+            print(f"  - [{r['tamanho']}] {r['etapa']}: {r['referencia_s']:.3f}s → {r['atual_s']:.3f}s (+{r['variacao_%']}%)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unittest
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from agregacao_streaming import EXTENSOES_EM_BLOCOS, resumir_arquivo_em_blocos
+from telemetria import etapa
+
+# --- Cache de Carregamento dos Arquivos .z ---
+# Os arquivos .z são comprimidos e precisam ser descompactados e "despicklados" a cada joblib.load.
+# Este módulo guarda uma cópia colunar não comprimida (arrays numpy) de cada DataFrame, que é aberta
+# com joblib mmap_mode='r' nas próximas execuções, e só reconverte arquivos cuja impressão digital mudou.
+
+TAMANHO_BLOCO_HASH = 1024 * 1024
+# Quantos objetos já carregados ficam em memória no processo (os menos usados recentemente saem primeiro)
+MAX_OBJETOS_EM_MEMORIA = int(os.getenv("LLM_CACHE_DADOS_OBJETOS", "64"))
+# Hash do arquivo de origem gravado em attrs dos DataFrames carregados: (hash, linhas, colunas)
+ATTR_HASH_ARQUIVO = "hash_arquivo"
+
+
+@dataclass(frozen=True)
+class ImpressaoDigital:
+    """
+    Identifica o conteúdo de um arquivo de dados: caminho, tamanho, mtime e hash SHA-256.
+    """
+    caminho: str
+    tamanho: int
+    mtime_ns: int
+    hash: str
+
+
+def calcular_hash_arquivo(arquivo: Path) -> str:
+    """Calcula o SHA-256 de um arquivo lendo-o em blocos."""
+    sha = hashlib.sha256()
+    with open(arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_HASH), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def gravar_atomico(destino: Path, gravar):
+    """
+    Chama gravar(caminho_temporario) com um nome temporário único no diretório de 'destino' e o move para
+    'destino' de forma atômica, para que processos ou threads gravando a mesma chave não se atropelem.
+    """
+    descritor, nome_temporario = tempfile.mkstemp(dir=destino.parent, prefix=f"{destino.stem}.", suffix=".tmp")
+    os.close(descritor)
+    temporario = Path(nome_temporario)
+    try:
+        gravar(temporario)
+        temporario.replace(destino)
+    except BaseException:
+        temporario.unlink(missing_ok=True)
+        raise
+
+
+def _para_formato_colunar(df: pd.DataFrame) -> dict:
+    """
+    Converte um DataFrame em um dicionário de colunas. Colunas com dtype numpy nativo
+    (números, booleanos, datas) viram arrays numpy, que o joblib consegue mapear em memória;
+    colunas de texto viram códigos + valores únicos e as demais (categorias, extensões) são guardadas como estão.
+    """
+    valores = []
+    for i in range(df.shape[1]):
+        coluna = df.iloc[:, i]
+        if isinstance(coluna.dtype, np.dtype) and coluna.dtype.kind in 'biufcmM':
+            valores.append(coluna.to_numpy())
+        elif pd.api.types.is_object_dtype(coluna.dtype) or pd.api.types.is_string_dtype(coluna.dtype):
+            # Texto é codificado por dicionário: os códigos (int) são mapeáveis, só os valores únicos são "picklados"
+            codigos, unicos = pd.factorize(coluna)
+            valores.append({'codigos': codigos, 'unicos': unicos.array, 'dtype': coluna.dtype})
+        else:
+            valores.append(coluna.array)
+    return {'colunas': list(df.columns), 'valores': valores, 'index': df.index, 'attrs': dict(df.attrs)}
+
+
+def _de_formato_colunar(dados: dict) -> pd.DataFrame:
+    valores = [
+        pd.Series(v['unicos'].take(v['codigos'], allow_fill=True), index=dados['index'], copy=False).astype(v['dtype'])
+        if isinstance(v, dict) else v
+        for v in dados['valores']
+    ]
+    df = pd.DataFrame(dict(enumerate(valores)), index=dados['index'], copy=False)
+    df.columns = dados['colunas']
+    df.attrs.update(dados['attrs'])
+    return df
+
+
+class CacheDadosZ:
+    """
+    Camada de carregamento dos arquivos .z com impressão digital e cópia colunar mapeada em memória.
+    O manifesto (manifesto.json) guarda tamanho, mtime e hash de cada arquivo: se tamanho e mtime
+    não mudaram, o hash não é recalculado e o arquivo original nem é aberto.
+    Em memória ficam no máximo 'max_objetos' objetos carregados, descartando os menos usados recentemente.
+    """
+
+    def __init__(self, diretorio_cache: Path, max_objetos: int = MAX_OBJETOS_EM_MEMORIA):
+        self.diretorio = Path(diretorio_cache)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.caminho_manifesto = self.diretorio / 'manifesto.json'
+        self.max_objetos = max_objetos
+        self._lock = threading.Lock()
+        self._locks_chave = {}  # hash -> Lock: um único carregamento/conversão por arquivo de cada vez
+        self._memoria = OrderedDict()  # hash -> objeto já carregado neste processo (LRU)
+        try:
+            self._manifesto = json.loads(self.caminho_manifesto.read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._manifesto = {}
+
+    def _salvar_manifesto(self):
+        conteudo = json.dumps(self._manifesto, indent=2)
+        gravar_atomico(self.caminho_manifesto, lambda temporario: temporario.write_text(conteudo, encoding='utf-8'))
+
+    def _lock_da_chave(self, hash_arquivo: str) -> threading.Lock:
+        with self._lock:
+            return self._locks_chave.setdefault(hash_arquivo, threading.Lock())
+
+    def _obter_da_memoria(self, hash_arquivo: str):
+        with self._lock:
+            objeto = self._memoria.get(hash_arquivo)
+            if objeto is not None:
+                self._memoria.move_to_end(hash_arquivo)
+            return objeto
+
+    def _guardar_na_memoria(self, hash_arquivo: str, objeto):
+        with self._lock:
+            self._memoria[hash_arquivo] = objeto
+            self._memoria.move_to_end(hash_arquivo)
+            while len(self._memoria) > self.max_objetos:
+                self._memoria.popitem(last=False)
+
+    def _caminho_convertido(self, hash_arquivo: str) -> Path:
+        return self.diretorio / f"{hash_arquivo}.joblib"
+
+    def impressao_digital(self, arquivo: Path) -> ImpressaoDigital:
+        """
+        Retorna a impressão digital do arquivo. O hash só é recalculado quando tamanho ou mtime mudaram.
+        """
+        arquivo = Path(arquivo).resolve()
+        stat = arquivo.stat()
+        chave = str(arquivo)
+        with self._lock:
+            registro = self._manifesto.get(chave)
+            if registro and registro['tamanho'] == stat.st_size and registro['mtime_ns'] == stat.st_mtime_ns:
+                return ImpressaoDigital(chave, stat.st_size, stat.st_mtime_ns, registro['hash'])
+
+        hash_arquivo = calcular_hash_arquivo(arquivo)
+        with self._lock:
+            anterior = self._manifesto.get(chave)
+            self._manifesto[chave] = {'tamanho': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': hash_arquivo}
+            if anterior and anterior['hash'] != hash_arquivo:
+                self._remover_convertido_orfao(anterior['hash'])
+            self._salvar_manifesto()
+        return ImpressaoDigital(chave, stat.st_size, stat.st_mtime_ns, hash_arquivo)
+
+    def _remover_convertido_orfao(self, hash_antigo: str):
+        if any(r['hash'] == hash_antigo for r in self._manifesto.values()):
+            return
+        self._memoria.pop(hash_antigo, None)
+        self._locks_chave.pop(hash_antigo, None)
+        self._caminho_convertido(hash_antigo).unlink(missing_ok=True)
+
+    def carregar(self, arquivo: Path, impressao: ImpressaoDigital | None = None):
+        """
+        Carrega o conteúdo de um arquivo .z. Usa, nesta ordem: o objeto já carregado neste processo,
+        a cópia colunar em disco (mmap) ou, na primeira vez, o joblib.load do arquivo original,
+        gravando a cópia colunar para as próximas execuções. Exports CSV/Parquet são lidos em blocos
+        e devolvidos como ResumoStreaming (ver agregacao_streaming).
+        """
+        impressao = impressao or self.impressao_digital(arquivo)
+        objeto = self._obter_da_memoria(impressao.hash)
+        if objeto is not None:
+            return objeto
+
+        with self._lock_da_chave(impressao.hash):
+            # Outra thread pode ter carregado o mesmo arquivo enquanto esta esperava
+            objeto = self._obter_da_memoria(impressao.hash)
+            if objeto is not None:
+                return objeto
+            with etapa("carregar", arquivo=Path(arquivo).name) as detalhes:
+                objeto = self._carregar_do_disco(arquivo, impressao, detalhes)
+            if isinstance(objeto, pd.DataFrame):
+                # Os sketches do describe aproximado reconhecem o conteúdo por este hash, sem reler todas as linhas
+                objeto.attrs[ATTR_HASH_ARQUIVO] = (impressao.hash, *objeto.shape)
+            self._guardar_na_memoria(impressao.hash, objeto)
+        return objeto
+
+    def _carregar_do_disco(self, arquivo: Path, impressao: ImpressaoDigital, detalhes: dict):
+        if Path(arquivo).suffix in EXTENSOES_EM_BLOCOS:
+            # Exports CSV/Parquet podem não caber na memória: viram um ResumoStreaming (head/tail/describe)
+            detalhes["origem"] = "em_blocos"
+            return resumir_arquivo_em_blocos(arquivo)
+        convertido = self._caminho_convertido(impressao.hash)
+        objeto = None
+        if convertido.exists():
+            try:
+                armazenado = joblib.load(convertido, mmap_mode='r')
+                objeto = _de_formato_colunar(armazenado['dados']) if armazenado['colunar'] else armazenado['dados']
+                detalhes["origem"] = "copia_colunar"
+            except Exception as e:
+                print(f"    ⚠️ Cópia em cache inválida para {Path(arquivo).name}, recarregando o original: {e}")
+                convertido.unlink(missing_ok=True)
+
+        if objeto is None:
+            detalhes["origem"] = "original"
+            objeto = joblib.load(arquivo)
+            colunar = isinstance(objeto, pd.DataFrame)
+            armazenado = {'colunar': colunar, 'dados': _para_formato_colunar(objeto) if colunar else objeto}
+            gravar_atomico(convertido, lambda temporario: joblib.dump(armazenado, temporario, compress=0))
+            if colunar:
+                # Reabre a cópia recém-gravada para que o processo use a versão mapeada em memória
+                objeto = _de_formato_colunar(joblib.load(convertido, mmap_mode='r')['dados'])
+        return objeto
+
+
+def carregar_arquivos_z(data_dir: Path, cache: CacheDadosZ) -> dict:
+    """
+    Carrega todos os arquivos .z de 'data_dir' através do cache, retornando {nome_arquivo: objeto}.
+    Arquivos com erro de leitura são informados e ignorados.
+    """
+    dados = {}
+    for arquivo in sorted(Path(data_dir).glob('*.z')):
+        try:
+            dados[arquivo.name] = cache.carregar(arquivo)
+        except Exception as e:
+            print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
+    return dados
+
+
+### Testes ###
+
+class TestCacheDadosZ(unittest.TestCase):
+    def setUp(self):
+        self._temporario = tempfile.TemporaryDirectory()
+        self.diretorio = Path(self._temporario.name)
+        self.arquivos = []
+        for i in range(3):
+            arquivo = self.diretorio / f"tabela{i}.z"
+            joblib.dump(pd.DataFrame({"conta": [f"c{j}" for j in range(100)], "valor": np.arange(100.0) * i}), arquivo)
+            self.arquivos.append(arquivo)
+
+    def tearDown(self):
+        self._temporario.cleanup()
+
+    def test_memoria_limitada_descarta_menos_usado(self):
+        cache = CacheDadosZ(self.diretorio / "cache", max_objetos=2)
+        primeiro = cache.carregar(self.arquivos[0])
+        cache.carregar(self.arquivos[1])
+        self.assertIs(cache.carregar(self.arquivos[0]), primeiro)  # uso recente: tabela1 passa a ser a mais antiga
+        cache.carregar(self.arquivos[2])
+        hashes = [cache.impressao_digital(arquivo).hash for arquivo in self.arquivos]
+        self.assertEqual(list(cache._memoria), [hashes[0], hashes[2]])
+
+    def test_carregamentos_concorrentes_convertem_uma_vez(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+
+        cache = CacheDadosZ(self.diretorio / "cache")
+        with mock.patch(f"{__name__}.joblib.dump", wraps=joblib.dump) as dump:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                objetos = list(executor.map(lambda _: cache.carregar(self.arquivos[0]), range(16)))
+        self.assertEqual(dump.call_count, 1)
+        self.assertTrue(all(objeto is objetos[0] for objeto in objetos))
+        self.assertEqual(list((self.diretorio / "cache").glob("*.tmp")), [])
+
+    def test_copia_colunar_reaberta_por_nova_instancia(self):
+        CacheDadosZ(self.diretorio / "cache").carregar(self.arquivos[1])
+        df = CacheDadosZ(self.diretorio / "cache").carregar(self.arquivos[1])
+        original = joblib.load(self.arquivos[1])
+        self.assertEqual(df.to_dict("list"), original.to_dict("list"))
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+# --- Cache Persistente de Respostas do LLM ---
+# Limites padrão: 200 MB em disco e entradas com até 30 dias.
+TAMANHO_MAXIMO_CACHE_BYTES = 200 * 1024 * 1024
+IDADE_MAXIMA_CACHE_S = 30 * 24 * 3600
+
+
+def chave_cache(params: dict) -> str:
+    """
+    Gera a chave (SHA-256) de uma chamada ao LLM a partir do modelo, das mensagens
+    (system e user), temperature, top_p e max_tokens. Um 'provedor' em params (modelos locais, ver roteamento.py)
+    também entra na chave, para a resposta de um servidor local nunca valer pela do mesmo modelo em outro lugar.
+    """
+    conteudo = {
+        "model": params.get("model"),
+        "messages": params.get("messages"),
+        "temperature": params.get("temperature"),
+        "top_p": params.get("top_p"),
+        "max_tokens": params.get("max_tokens"),
+    }
+    if params.get("provedor"):
+        conteudo["provedor"] = params["provedor"]
+    serializado = json.dumps(conteudo, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+
+class CacheRespostasLLM:
+    """
+    Cache em disco (SQLite) de respostas do LLM, endereçado pelo conteúdo da requisição.
+    Remove entradas mais antigas que 'idade_maxima_s' e, se o total passar de 'tamanho_maximo_bytes',
+    remove as menos usadas recentemente (LRU). Mantém contadores de acertos e falhas.
+    """
+
+    def __init__(self, caminho: Path, tamanho_maximo_bytes: int = TAMANHO_MAXIMO_CACHE_BYTES,
+                 idade_maxima_s: float = IDADE_MAXIMA_CACHE_S):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self.tamanho_maximo_bytes = tamanho_maximo_bytes
+        self.idade_maxima_s = idade_maxima_s
+        self.acertos = 0
+        self.falhas = 0
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+        self._conexao.execute(
+            """CREATE TABLE IF NOT EXISTS respostas (
+                   chave TEXT PRIMARY KEY,
+                   modelo TEXT,
+                   resposta TEXT NOT NULL,
+                   tamanho INTEGER NOT NULL,
+                   criado_em REAL NOT NULL,
+                   ultimo_acesso REAL NOT NULL
+               )"""
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acesso ON respostas (ultimo_acesso)")
+        self._conexao.commit()
+
+    def obter(self, chave: str) -> str | None:
+        """Retorna a resposta em cache (atualizando o último acesso) ou None se ausente/expirada."""
+        agora = time.time()
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT resposta, criado_em FROM respostas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None or agora - linha[1] > self.idade_maxima_s:
+                if linha is not None:
+                    self._conexao.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+                    self._conexao.commit()
+                self.falhas += 1
+                return None
+            self._conexao.execute("UPDATE respostas SET ultimo_acesso = ? WHERE chave = ?", (agora, chave))
+            self._conexao.commit()
+            self.acertos += 1
+            return linha[0]
+
+    def guardar(self, chave: str, resposta: str, modelo: str = ""):
+        """Armazena uma resposta e aplica a política de remoção."""
+        agora = time.time()
+        tamanho = len(resposta.encode("utf-8"))
+        with self._lock:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO respostas (chave, modelo, resposta, tamanho, criado_em, ultimo_acesso) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, modelo, resposta, tamanho, agora, agora),
+            )
+            self._remover_excedentes(agora)
+            self._conexao.commit()
+
+    def _remover_excedentes(self, agora: float):
+        self._conexao.execute("DELETE FROM respostas WHERE criado_em < ?", (agora - self.idade_maxima_s,))
+        total = self._conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+        if total <= self.tamanho_maximo_bytes:
+            return
+        excesso = total - self.tamanho_maximo_bytes
+        chaves_removidas = []
+        for chave, tamanho in self._conexao.execute(
+            "SELECT chave, tamanho FROM respostas ORDER BY ultimo_acesso ASC"
+        ):
+            if excesso <= 0:
+                break
+            chaves_removidas.append((chave,))
+            excesso -= tamanho
+        self._conexao.executemany("DELETE FROM respostas WHERE chave = ?", chaves_removidas)
+
+    def limpar(self):
+        """Remove todas as entradas e zera os contadores."""
+        with self._lock:
+            self._conexao.execute("DELETE FROM respostas")
+            self._conexao.commit()
+            self.acertos = 0
+            self.falhas = 0
+
+    def estatisticas(self) -> dict:
+        """Retorna acertos, falhas, taxa de acerto, número de entradas e tamanho total em bytes."""
+        with self._lock:
+            entradas, total = self._conexao.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM respostas"
+            ).fetchone()
+        consultas = self.acertos + self.falhas
+        return {
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "taxa_acerto": (self.acertos / consultas) if consultas else 0.0,
+            "entradas": entradas,
+            "tamanho_bytes": total,
+        }
+
+
+### Testes ###
+
+class TestCacheRespostasLLM(unittest.TestCase):
+    def setUp(self):
+        from unittest import mock
+
+        self._temporario = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temporario.cleanup)
+        self.agora = 1_000_000.0
+        patcher = mock.patch(f"{__name__}.time.time", lambda: self.agora)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cache(self, **kwargs) -> CacheRespostasLLM:
+        cache = CacheRespostasLLM(Path(self._temporario.name) / "respostas.sqlite", **kwargs)
+        self.addCleanup(cache._conexao.close)
+        return cache
+
+    def test_chave_depende_dos_parametros_da_chamada(self):
+        params = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "oi"}], "temperature": 0.5}
+        self.assertEqual(chave_cache(params), chave_cache(dict(reversed(params.items()))))
+        self.assertNotEqual(chave_cache(params), chave_cache({**params, "temperature": 0.7}))
+        self.assertNotEqual(chave_cache(params), chave_cache({**params, "provedor": "local:mistral"}))
+        self.assertEqual(chave_cache(params), chave_cache({**params, "stream": True}))
+
+    def test_remove_menos_usadas_acima_do_tamanho(self):
+        cache = self._cache(tamanho_maximo_bytes=250)
+        for chave in ("a", "b"):
+            cache.guardar(chave, "x" * 100)
+            self.agora += 1
+        self.assertIsNotNone(cache.obter("a"))  # "a" passa a ser a mais recente
+        self.agora += 1
+        cache.guardar("c", "x" * 100)
+        self.assertIsNone(cache.obter("b"))
+        self.assertIsNotNone(cache.obter("a"))
+        self.assertIsNotNone(cache.obter("c"))
+        self.assertEqual(cache.estatisticas()["tamanho_bytes"], 200)
+
+    def test_remove_entradas_vencidas(self):
+        cache = self._cache(idade_maxima_s=60)
+        cache.guardar("antiga", "resposta")
+        self.agora += 30
+        cache.guardar("nova", "resposta")
+        self.assertEqual(cache.obter("antiga"), "resposta")  # o uso não renova a idade
+        self.agora += 31
+        self.assertIsNone(cache.obter("antiga"))
+        self.assertEqual(cache.obter("nova"), "resposta")
+        estatisticas = cache.estatisticas()
+        self.assertEqual((estatisticas["acertos"], estatisticas["falhas"], estatisticas["entradas"]), (2, 1, 1))
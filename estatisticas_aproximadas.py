@@ -0,0 +1,186 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import joblib
+import pandas as pd
+
+from agregacao_streaming import LINHAS_POR_BLOCO, ResumoStreaming
+from cache_dados import ATTR_HASH_ARQUIVO
+from sketches import ParametrosErro
+from telemetria import etapa
+
+# --- describe() Aproximado para Tabelas Enormes ---
+# Em DataFrames muito grandes, o describe(include='all') exato custa mais que a própria chamada ao LLM: ordena
+# cada coluna numérica para os quantis e conta os distintos de cada coluna de texto. Acima de
+# LIMITE_LINHAS_DESCRIBE_EXATO linhas, as mesmas estatísticas saem dos sketches (KLL, HyperLogLog, Misra-Gries)
+# dentro do erro configurado, e o texto do prompt informa esse limite. Os sketches ficam guardados por arquivo:
+# se o conteúdo é o mesmo (hash completo), são reaproveitados; se o arquivo só ganhou linhas no final (hash das
+# linhas já resumidas igual), apenas as linhas novas são acrescentadas. Montar os sketches do zero custa mais
+# que o describe exato, então o ganho está só nas execuções seguintes: sem cache de sketches, o describe é exato.
+
+LIMITE_LINHAS_DESCRIBE_EXATO = int(os.getenv("LLM_LIMITE_DESCRIBE_EXATO", "1000000"))
+LINHAS_IDENTIFICACAO = 1000  # primeiras linhas usadas para reconhecer o mesmo arquivo em versões diferentes
+
+
+def hash_linhas(df: pd.DataFrame, num_linhas: int | None = None) -> str:
+    """Hash do conteúdo das primeiras 'num_linhas' linhas (todas, se None), independente do índice."""
+    trecho = df if num_linhas is None else df.iloc[:num_linhas]
+    return hashlib.sha256(pd.util.hash_pandas_object(trecho, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def hash_arquivo(df: pd.DataFrame) -> str | None:
+    """
+    Hash do arquivo de onde o DataFrame foi carregado (ver cache_dados), se ele ainda tem o formato carregado;
+    evita recalcular o hash de todas as linhas. None para DataFrames sem essa marca.
+    """
+    marca = df.attrs.get(ATTR_HASH_ARQUIVO)
+    if isinstance(marca, (tuple, list)) and len(marca) == 3 and tuple(marca[1:]) == df.shape:
+        return marca[0]
+    return None
+
+
+def acumular_dataframe(df: pd.DataFrame, resumo: ResumoStreaming | None = None,
+                       parametros: ParametrosErro | None = None,
+                       linhas_por_bloco: int = LINHAS_POR_BLOCO) -> ResumoStreaming:
+    """Alimenta (ou cria) um ResumoStreaming com as linhas do DataFrame, bloco a bloco."""
+    resumo = resumo or ResumoStreaming(linhas_buffer=0, parametros=parametros)
+    for inicio in range(0, len(df), linhas_por_bloco):
+        resumo.atualizar(df.iloc[inicio:inicio + linhas_por_bloco])
+    return resumo
+
+
+class CacheEstatisticas:
+    """
+    Sketches por arquivo, gravados em disco (joblib). A chave junta o nome, as colunas, o erro configurado e o
+    hash das primeiras linhas; o registro guarda quantas linhas foram resumidas, o hash de todas elas e o hash do
+    arquivo de origem, para saber se a versão atual é a mesma, uma extensão (linhas acrescentadas) ou outra tabela.
+    Qualquer valor alterado no trecho já resumido muda o hash e refaz os sketches.
+    """
+
+    def __init__(self, diretorio: Path, parametros: ParametrosErro | None = None):
+        self.diretorio = Path(diretorio)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.parametros = parametros or ParametrosErro.para_erro()
+        self._lock = threading.Lock()
+
+    def _caminho(self, nome: str, df: pd.DataFrame) -> Path:
+        chave = hashlib.sha256("\x1f".join([
+            nome, repr(list(df.columns)), repr(self.parametros), hash_linhas(df, LINHAS_IDENTIFICACAO),
+        ]).encode('utf-8')).hexdigest()[:24]
+        return self.diretorio / f"{chave}.joblib"
+
+    def _ler(self, caminho: Path) -> dict | None:
+        try:
+            return joblib.load(caminho)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"    ⚠️ Sketches inválidos em {caminho.name}, recalculando: {e}")
+            return None
+
+    def resumo(self, nome: str, df: pd.DataFrame) -> ResumoStreaming:
+        """ResumoStreaming do DataFrame, reaproveitando (e estendendo) os sketches salvos quando possível."""
+        caminho = self._caminho(nome, df)
+        with self._lock:
+            registro = self._ler(caminho)
+        origem = hash_arquivo(df)
+        if registro is not None and registro["linhas"] == len(df):
+            # Mesmo arquivo de origem (hash já calculado pelo cache de dados) ou, sem ele, mesmas linhas
+            mesmo_conteudo = origem == registro.get("hash_arquivo") if origem is not None else \
+                hash_linhas(df) == registro.get("hash_linhas")
+            if mesmo_conteudo:
+                print(f"    ♻️ Sketches reaproveitados (arquivo inalterado): {nome}")
+                return registro["resumo"]
+        linhas = registro["linhas"] if registro is not None else 0
+        extensao = registro is not None and 0 < linhas < len(df) and hash_linhas(df, linhas) == registro.get("hash_linhas")
+        with etapa("sketches", arquivo=nome, linhas=len(df)) as detalhes:
+            if extensao:
+                print(f"    ➕ Sketches de {nome} atualizados com {len(df) - linhas} linha(s) nova(s).")
+                resumo = acumular_dataframe(df.iloc[linhas:], registro["resumo"])
+                detalhes["linhas_novas"] = len(df) - linhas
+            else:
+                resumo = acumular_dataframe(df, parametros=self.parametros)
+        temporario = caminho.with_suffix('.tmp')
+        with self._lock:
+            joblib.dump({"linhas": len(df), "hash_linhas": hash_linhas(df), "hash_arquivo": origem,
+                         "resumo": resumo}, temporario)
+            temporario.replace(caminho)
+        return resumo
+
+
+cache_estatisticas: CacheEstatisticas | None = None
+
+
+def configurar_estatisticas(diretorio: Path | None, erro: float | None = None) -> CacheEstatisticas | None:
+    """Ativa a gravação dos sketches em 'diretorio' (None desativa) com o erro máximo informado."""
+    global cache_estatisticas
+    parametros = ParametrosErro.para_erro(erro) if erro is not None else None
+    cache_estatisticas = CacheEstatisticas(diretorio, parametros) if diretorio is not None else None
+    return cache_estatisticas
+
+
+def chave_estatisticas() -> str:
+    """Configuração que altera o texto do describe(), para compor as chaves de cache das seções."""
+    if cache_estatisticas is None:
+        return f"{LIMITE_LINHAS_DESCRIBE_EXATO}:exato"
+    return f"{LIMITE_LINHAS_DESCRIBE_EXATO}:{cache_estatisticas.parametros!r}"
+
+
+def descrever(nome: str, df_content) -> pd.DataFrame:
+    """
+    describe(include='all') do conteúdo: exato até LIMITE_LINHAS_DESCRIBE_EXATO linhas, por sketches guardados
+    no cache acima disso. Quando aproximado, attrs['nota_aproximacao'] traz o limite de erro para o texto do prompt.
+    Sem cache de sketches o describe é exato: sketches montados só para uma chamada sairiam mais caros.
+    """
+    if not isinstance(df_content, pd.DataFrame) or len(df_content) <= LIMITE_LINHAS_DESCRIBE_EXATO \
+            or cache_estatisticas is None:
+        return df_content.describe(include='all')
+    return cache_estatisticas.resumo(nome, df_content).describe()
+
+
+### Testes ###
+
+class TestCacheEstatisticas(unittest.TestCase):
+    def setUp(self):
+        self._temporario = tempfile.TemporaryDirectory()
+        self.cache = CacheEstatisticas(Path(self._temporario.name))
+        self.df = pd.DataFrame({"valor": [float(i % 997) for i in range(50_000)],
+                                "categoria": [f"c{i % 13}" for i in range(50_000)]})
+
+    def tearDown(self):
+        self._temporario.cleanup()
+
+    def _linhas_resumidas(self, df: pd.DataFrame) -> int | None:
+        """Linhas passadas aos sketches nesta chamada (None se o resumo salvo foi reaproveitado)."""
+        with patch(f"{__name__}.acumular_dataframe", side_effect=acumular_dataframe) as acumular:
+            resumo = self.cache.resumo("tabela", df)
+        self.assertEqual(resumo.num_linhas, len(df))
+        return len(acumular.call_args.args[0]) if acumular.called else None
+
+    def test_reaproveita_e_estende(self):
+        self.assertEqual(self._linhas_resumidas(self.df), len(self.df))
+        self.assertIsNone(self._linhas_resumidas(self.df.copy()))
+        acrescido = pd.concat([self.df, self.df.head(10)], ignore_index=True)
+        self.assertEqual(self._linhas_resumidas(acrescido), 10)
+
+    def test_edicao_refaz_os_sketches(self):
+        self._linhas_resumidas(self.df)
+        editado = self.df.copy()
+        editado.loc[12_345, "valor"] = 1e9
+        self.assertEqual(self._linhas_resumidas(editado), len(editado))
+        self.assertEqual(self.cache.resumo("tabela", editado).describe().loc["max", "valor"], 1e9)
+        acrescido = pd.concat([self.df, self.df.head(10)], ignore_index=True)  # volta ao original + 10 linhas
+        self.assertEqual(self._linhas_resumidas(acrescido), len(acrescido))
+
+    def test_hash_do_arquivo_de_origem(self):
+        marcado = self.df.copy()
+        marcado.attrs[ATTR_HASH_ARQUIVO] = ("abc", *marcado.shape)
+        self.assertEqual(hash_arquivo(marcado), "abc")
+        self.assertIsNone(hash_arquivo(marcado.iloc[:10]))  # formato diferente do carregado
+        self._linhas_resumidas(marcado)
+        self.assertIsNone(self._linhas_resumidas(marcado))
@@ -0,0 +1,490 @@
+import json
+import re
+import unicodedata
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cache_dados import CacheDadosZ
+from montagem_prompt import CacheSecoes
+from telemetria import etapa
+
+# --- Indicadores Contábeis Pré-calculados ---
+# Calcula, sobre a base COMPLETA e de forma vetorizada (pandas/NumPy), os números que os prompts pedem ao
+# modelo: fluxo de caixa mensal, vendas por categoria, aging de contas a receber/pagar (inadimplência e
+# prazos médios) e principais naturezas de custo. As tabelas compactas resultantes substituem no prompt as
+# linhas brutas das tabelas de lançamentos que elas resumem (movimento, vendas, contas a pagar/receber); os
+# cadastros (produtos, categorias, naturezas) continuam indo inteiros ou reduzidos, pois os prompts pedem
+# detalhes por produto que os indicadores não trazem. Os nomes de colunas variam entre exportações, por isso
+# cada coluna é procurada em uma lista de nomes candidatos; indicadores sem as colunas necessárias são omitidos.
+
+CABECALHO_INDICADORES = "### INDICADORES PRÉ-CALCULADOS SOBRE A BASE COMPLETA ###\n\n"
+
+COLUNAS_DATA = ['data', 'data_movimento', 'dt_movimento', 'data_lancamento', 'data_pagamento', 'data_emissao', 'dt']
+COLUNAS_VALOR = ['valor', 'valor_movimento', 'valor_total', 'vl_total', 'total', 'valor_liquido', 'vl']
+COLUNAS_TIPO_MOVIMENTO = ['tipo', 'tipo_movimento', 'entrada_saida', 'operacao', 'debito_credito', 'natureza_movimento']
+COLUNAS_ID = ['id', 'codigo', 'cod']
+COLUNAS_ID_PRODUTO = ['produto_id', 'id_produto', 'cod_produto', 'codigo_produto', 'produto']
+COLUNAS_ID_CATEGORIA = ['categoria_id', 'id_categoria', 'cod_categoria', 'codigo_categoria', 'categoria']
+COLUNAS_ID_NATUREZA = ['natureza_id', 'id_natureza', 'natureza_financeira_id', 'cod_natureza', 'natureza']
+COLUNAS_NOME = ['nome', 'descricao', 'nome_categoria', 'nome_produto', 'nome_natureza']
+COLUNAS_QUANTIDADE = ['quantidade', 'qtd', 'qtde', 'quant']
+COLUNAS_PRECO = ['preco_unitario', 'valor_unitario', 'preco_venda', 'preco']
+COLUNAS_CUSTO = ['custo', 'preco_custo', 'custo_unitario', 'valor_custo']
+COLUNAS_VENCIMENTO = ['data_vencimento', 'vencimento', 'dt_vencimento']
+COLUNAS_EMISSAO = ['data_emissao', 'emissao', 'dt_emissao', 'data_documento', 'data']
+COLUNAS_BAIXA = ['data_pagamento', 'data_recebimento', 'data_baixa', 'dt_pagamento', 'dt_recebimento']
+COLUNAS_STATUS = ['status', 'situacao']
+STATUS_QUITADO = ('pago', 'paga', 'recebido', 'recebida', 'quitado', 'quitada', 'liquidado', 'baixado', 'baixada')
+# Palavras (inteiras, já normalizadas) que definem o sentido do movimento; E/S e C/D são os códigos usuais.
+TIPOS_ENTRADA = ('entrada', 'entradas', 'credito', 'creditos', 'receita', 'receitas', 'recebimento',
+                 'recebimentos', 'recebido', 'e', 'c')
+TIPOS_SAIDA = ('saida', 'saidas', 'debito', 'debitos', 'despesa', 'despesas', 'pagamento', 'pagamentos', 'pago',
+               'compra', 'compras', 'custo', 'custos', 's', 'd')
+PADRAO_DIA_MES = r'^\s*\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}'
+FAIXAS_AGING = [-np.inf, 0, 30, 60, 90, np.inf]
+ROTULOS_AGING = ['a vencer', '1-30 dias', '31-60 dias', '61-90 dias', '> 90 dias']
+TOP_NATUREZAS = 10
+TOP_CATEGORIAS = 30  # categorias além deste limite são somadas em "demais categorias"
+VERSAO_INDICADORES = "5"  # incremente ao mudar os cálculos, para invalidar blocos em cache
+
+
+def _normalizar(texto) -> str:
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
+
+
+def encontrar_coluna(df: pd.DataFrame, candidatos: list[str], aproximada: bool = True,
+                     ignorar: tuple = ()) -> str | None:
+    """
+    Procura a primeira coluna de 'df' cujo nome (sem acentos, minúsculo) coincide com um dos candidatos;
+    se nenhuma coincidir exatamente e 'aproximada' for True, aceita a primeira que tenha um candidato
+    como parte do nome (ex.: 'valor' em 'valor_pago'). Colunas em 'ignorar' não são consideradas.
+    """
+    normalizadas = {_normalizar(coluna): coluna for coluna in df.columns if coluna not in ignorar}
+    for candidato in candidatos:
+        if candidato in normalizadas:
+            return normalizadas[candidato]
+    if not aproximada:
+        return None
+    for candidato in candidatos:
+        for normalizada, coluna in normalizadas.items():
+            if candidato in normalizada.split('_'):
+                return coluna
+    return None
+
+
+def _chaves_texto(serie: pd.Series) -> pd.Series:
+    """
+    Chaves de junção como texto: valores numéricos inteiros (1, 1.0, "1", "1.0") viram "1"; os demais ficam
+    como o texto sem espaços nas pontas. Evita que um id float de um arquivo nunca case com o id inteiro de outro.
+    """
+    texto = serie.astype(str).str.strip()
+    numeros = pd.to_numeric(texto, errors='coerce')
+    inteiros = (numeros.notna() & (numeros == np.floor(numeros)) & (numeros.abs() < 2 ** 53)).to_numpy()
+    if inteiros.any():
+        texto = texto.copy()
+        texto[inteiros] = numeros[inteiros].astype('int64').astype(str)
+    return texto
+
+
+def _posicoes(chaves_tabela: pd.Series, chaves_busca: pd.Series) -> np.ndarray:
+    """
+    Posição de cada chave de 'chaves_busca' em 'chaves_tabela' (-1 se ausente), via índice hash.
+    As chaves são comparadas como texto normalizado (ver _chaves_texto) para tolerar exportações com tipos
+    diferentes (ex.: 7, 7.0 e "7").
+    """
+    chaves = _chaves_texto(chaves_tabela)
+    primeiras = ~chaves.duplicated(keep='first').to_numpy()
+    posicoes_originais = np.flatnonzero(primeiras)
+    posicoes = pd.Index(chaves.to_numpy()[primeiras]).get_indexer(_chaves_texto(chaves_busca))
+    return np.where(posicoes >= 0, posicoes_originais[posicoes], -1)
+
+
+def _marcar_valores(serie: pd.Series, condicao) -> np.ndarray:
+    """
+    Aplica 'condicao' (sobre o texto normalizado) apenas aos valores distintos da coluna e espalha o
+    resultado para todas as linhas: custo proporcional ao número de valores distintos, não de linhas.
+    """
+    codigos, unicos = pd.factorize(serie)
+    marcados = np.array([bool(condicao(_normalizar(valor))) for valor in unicos] + [False])
+    return marcados[codigos]  # código -1 (nulo) cai na última posição (False)
+
+
+def sentido_movimento(tipo_normalizado: str) -> int:
+    """+1 (entrada), -1 (saída) ou 0 (desconhecido/ambíguo) pelas palavras inteiras do tipo normalizado."""
+    palavras = set(tipo_normalizado.split('_'))
+    entrada, saida = bool(palavras & set(TIPOS_ENTRADA)), bool(palavras & set(TIPOS_SAIDA))
+    return 0 if entrada == saida else (1 if entrada else -1)
+
+
+def localizar_tabela(dados: dict, trecho: str):
+    """Retorna (nome, DataFrame) da tabela cujo nome contém 'trecho' (ex.: 'contas_a_pagar'), ou (None, None)."""
+    for nome, df in dados.items():
+        if isinstance(df, pd.DataFrame) and trecho in _normalizar(nome):
+            return nome, df
+    return None, None
+
+
+def _datas(serie: pd.Series) -> pd.Series:
+    """
+    Datas da coluna: textos ISO (2024-01-05) são lidos como ano-mês-dia e só os que começam como dd/mm/aaaa
+    (exportações brasileiras, com '/', '.' ou '-') são lidos com o dia primeiro.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    datas = pd.to_datetime(serie, errors='coerce', format='ISO8601')
+    dia_primeiro = serie.astype(str).str.match(PADRAO_DIA_MES).to_numpy()
+    if dia_primeiro.any():
+        datas = datas.copy()
+        datas[dia_primeiro] = pd.to_datetime(serie[dia_primeiro], errors='coerce', format='mixed', dayfirst=True)
+    return datas
+
+
+def _numeros(serie: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype('float64')
+    texto = serie.astype(str).str.replace(r'[^\d,.\-]', '', regex=True)
+    # Formato brasileiro (1.234,56): remove o separador de milhar e troca a vírgula decimal
+    brasileiro = texto.str.contains(',', regex=False)
+    texto = texto.where(~brasileiro, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(texto, errors='coerce')
+
+
+def fluxo_caixa_mensal(df_mov: pd.DataFrame) -> pd.DataFrame | None:
+    """
+    Entradas, saídas, saldo do mês e saldo acumulado do movimento financeiro.
+    O sinal vem da coluna de tipo (TIPOS_ENTRADA = +, TIPOS_SAIDA = −); sem essa coluna, ou para tipos que não
+    estão em nenhuma das listas, vale o sinal do próprio valor.
+    """
+    col_data = encontrar_coluna(df_mov, COLUNAS_DATA)
+    col_valor = encontrar_coluna(df_mov, COLUNAS_VALOR)
+    if col_data is None or col_valor is None:
+        return None
+    valores = _numeros(df_mov[col_valor])
+    col_tipo = encontrar_coluna(df_mov, COLUNAS_TIPO_MOVIMENTO)
+    if col_tipo is not None:
+        codigos, unicos = pd.factorize(df_mov[col_tipo])
+        sentidos = np.array([sentido_movimento(_normalizar(tipo)) for tipo in unicos] + [0])[codigos]
+        valores = pd.Series(np.where(sentidos > 0, valores.abs(), np.where(sentidos < 0, -valores.abs(), valores)),
+                            index=df_mov.index)
+    meses = _datas(df_mov[col_data]).dt.to_period('M')
+    base = pd.DataFrame({'mes': meses, 'entradas': valores.clip(lower=0), 'saidas': -valores.clip(upper=0)})
+    tabela = base.dropna(subset=['mes']).groupby('mes', sort=True)[['entradas', 'saidas']].sum()
+    tabela['saldo_mes'] = tabela['entradas'] - tabela['saidas']
+    tabela['saldo_acumulado'] = tabela['saldo_mes'].cumsum()
+    return tabela
+
+
+def vendas_por_categoria(df_vendas: pd.DataFrame, df_produtos: pd.DataFrame | None,
+                         df_categorias: pd.DataFrame | None) -> pd.DataFrame | None:
+    """
+    Receita, quantidade, participação e (quando há custo no cadastro de produtos) margem por categoria,
+    cruzando vendas → produtos → categorias por índice (get_indexer), sem merges linha a linha.
+    """
+    col_produto = encontrar_coluna(df_vendas, COLUNAS_ID_PRODUTO)
+    col_quantidade = encontrar_coluna(df_vendas, COLUNAS_QUANTIDADE)
+    col_preco = encontrar_coluna(df_vendas, COLUNAS_PRECO, aproximada=False)
+    col_valor = encontrar_coluna(df_vendas, ['valor_total', 'total', 'valor_venda', 'valor'], aproximada=False)
+    quantidade = _numeros(df_vendas[col_quantidade]) if col_quantidade else pd.Series(1.0, index=df_vendas.index)
+    if col_valor is not None:
+        receita = _numeros(df_vendas[col_valor])
+    elif col_preco is not None:
+        receita = quantidade * _numeros(df_vendas[col_preco])
+    else:
+        col_valor = encontrar_coluna(df_vendas, COLUNAS_VALOR)
+        if col_valor is None:
+            return None
+        receita = _numeros(df_vendas[col_valor])
+
+    categoria = pd.Series('sem categoria', index=df_vendas.index, dtype=object)
+    custo = None
+    if col_produto is not None and df_produtos is not None:
+        col_id_prod = encontrar_coluna(df_produtos, COLUNAS_ID + COLUNAS_ID_PRODUTO, aproximada=False)
+        col_cat_prod = encontrar_coluna(df_produtos, COLUNAS_ID_CATEGORIA)
+        if col_id_prod is not None:
+            posicoes = _posicoes(df_produtos[col_id_prod], df_vendas[col_produto])
+            encontrado = posicoes >= 0
+            posicoes_validas = np.where(encontrado, posicoes, 0)
+            if col_cat_prod is not None:
+                cat_ids = _chaves_texto(df_produtos[col_cat_prod]).to_numpy()[posicoes_validas]
+                categoria = pd.Series(np.where(encontrado, cat_ids, 'sem categoria'), index=df_vendas.index, dtype=object)
+                if df_categorias is not None:
+                    col_id_cat = encontrar_coluna(df_categorias, COLUNAS_ID + COLUNAS_ID_CATEGORIA, aproximada=False)
+                    col_nome_cat = encontrar_coluna(df_categorias, COLUNAS_NOME)
+                    if col_id_cat is not None and col_nome_cat is not None:
+                        pos_cat = _posicoes(df_categorias[col_id_cat], categoria)
+                        nomes = df_categorias[col_nome_cat].astype(str).to_numpy()[np.where(pos_cat >= 0, pos_cat, 0)]
+                        categoria = pd.Series(np.where(pos_cat >= 0, nomes, categoria), index=df_vendas.index, dtype=object)
+            col_custo = encontrar_coluna(df_produtos, COLUNAS_CUSTO)
+            if col_custo is not None:
+                custos = _numeros(df_produtos[col_custo]).to_numpy()[posicoes_validas]
+                custo = pd.Series(np.where(encontrado, custos, np.nan), index=df_vendas.index) * quantidade
+
+    base = pd.DataFrame({'categoria': categoria.astype(str), 'receita': receita, 'quantidade': quantidade})
+    if custo is not None:
+        base['custo'] = custo
+    tabela = base.groupby('categoria', sort=False).sum(min_count=1)
+    tabela['participacao_%'] = 100 * tabela['receita'] / tabela['receita'].sum()
+    tabela = tabela.sort_values('receita', ascending=False)
+    if len(tabela) > TOP_CATEGORIAS:
+        demais = tabela.iloc[TOP_CATEGORIAS:].sum().to_frame('demais categorias').T
+        tabela = pd.concat([tabela.iloc[:TOP_CATEGORIAS], demais])
+    if custo is not None:
+        tabela['margem_%'] = 100 * (tabela['receita'] - tabela['custo']) / tabela['receita']
+    return tabela
+
+
+def aging_titulos(df: pd.DataFrame, data_referencia: pd.Timestamp) -> tuple[pd.DataFrame, dict] | None:
+    """
+    Aging dos títulos em aberto (a vencer, 1-30, 31-60, 61-90, > 90 dias de atraso) e resumo com total em aberto,
+    percentual vencido (inadimplência) e prazo médio (vencimento − emissão, ponderado por valor).
+    Um título está em aberto quando não tem data de baixa e seu status não indica quitação.
+    """
+    col_venc = encontrar_coluna(df, COLUNAS_VENCIMENTO)
+    col_valor = encontrar_coluna(df, COLUNAS_VALOR)
+    if col_venc is None or col_valor is None:
+        return None
+    valores = _numeros(df[col_valor]).fillna(0.0)
+    vencimento = _datas(df[col_venc])
+    aberto = pd.Series(True, index=df.index)
+    col_baixa = encontrar_coluna(df, COLUNAS_BAIXA)
+    if col_baixa is not None:
+        aberto &= _datas(df[col_baixa]).isna()
+    col_status = encontrar_coluna(df, COLUNAS_STATUS)
+    if col_status is not None:
+        aberto &= ~_marcar_valores(df[col_status], lambda status: status in STATUS_QUITADO)
+
+    atraso = (data_referencia - vencimento).dt.days
+    faixas = pd.cut(atraso[aberto], FAIXAS_AGING, labels=ROTULOS_AGING)
+    tabela = valores[aberto].groupby(faixas, observed=False).agg(['count', 'sum'])
+    tabela.columns = ['titulos', 'valor']
+    tabela.index.name = 'faixa_atraso'
+    total_aberto = tabela['valor'].sum()
+    tabela['participacao_%'] = 100 * tabela['valor'] / total_aberto if total_aberto else 0.0
+
+    resumo = {
+        'total_titulos': int(len(df)),
+        'valor_total': float(valores.sum()),
+        'valor_em_aberto': float(total_aberto),
+        'valor_vencido': float(total_aberto - tabela.loc['a vencer', 'valor']),
+        'percentual_vencido_%': float(100 * (total_aberto - tabela.loc['a vencer', 'valor']) / total_aberto) if total_aberto else 0.0,
+    }
+    col_emissao = encontrar_coluna(df, COLUNAS_EMISSAO, ignorar=(col_venc,))
+    if col_emissao is not None:
+        prazo = (vencimento - _datas(df[col_emissao])).dt.days
+        validos = prazo.notna() & (valores > 0)
+        if validos.any():
+            resumo['prazo_medio_dias'] = float(np.average(prazo[validos], weights=valores[validos]))
+    return tabela, resumo
+
+
+def principais_naturezas_custo(df_pagar: pd.DataFrame, df_naturezas: pd.DataFrame | None) -> pd.DataFrame | None:
+    """
+    Maiores naturezas de custo em contas a pagar, com participação e variação entre os dois últimos meses.
+    """
+    col_natureza = encontrar_coluna(df_pagar, COLUNAS_ID_NATUREZA)
+    col_valor = encontrar_coluna(df_pagar, COLUNAS_VALOR)
+    if col_natureza is None or col_valor is None:
+        return None
+    natureza = df_pagar[col_natureza]
+    if df_naturezas is not None:
+        col_id = encontrar_coluna(df_naturezas, COLUNAS_ID + COLUNAS_ID_NATUREZA, aproximada=False)
+        col_nome = encontrar_coluna(df_naturezas, COLUNAS_NOME)
+        if col_id is not None and col_nome is not None:
+            posicoes = _posicoes(df_naturezas[col_id], natureza)
+            nomes = df_naturezas[col_nome].astype(str).to_numpy()[np.where(posicoes >= 0, posicoes, 0)]
+            natureza = pd.Series(np.where(posicoes >= 0, nomes, _chaves_texto(natureza)), index=df_pagar.index)
+    base = pd.DataFrame({'natureza': natureza.astype(str), 'valor': _numeros(df_pagar[col_valor]).abs()})
+    tabela = base.groupby('natureza', sort=False)['valor'].sum().to_frame()
+    tabela['participacao_%'] = 100 * tabela['valor'] / tabela['valor'].sum()
+
+    col_data = encontrar_coluna(df_pagar, COLUNAS_EMISSAO + COLUNAS_VENCIMENTO)
+    if col_data is not None:
+        base['mes'] = _datas(df_pagar[col_data]).dt.to_period('M')
+        por_mes = base.dropna(subset=['mes']).pivot_table(index='natureza', columns='mes', values='valor',
+                                                          aggfunc='sum', fill_value=0.0)
+        if por_mes.shape[1] >= 2:
+            ultimo, penultimo = por_mes.columns[-1], por_mes.columns[-2]
+            anterior = por_mes[penultimo].replace(0.0, np.nan)
+            tabela[f'var_%_{penultimo}_a_{ultimo}'] = 100 * (por_mes[ultimo] - por_mes[penultimo]) / anterior
+    return tabela.sort_values('valor', ascending=False).head(TOP_NATUREZAS)
+
+
+def calcular_indicadores(dados: dict, data_referencia: pd.Timestamp | None = None) -> tuple[dict, set]:
+    """
+    Calcula todos os indicadores disponíveis a partir de {nome_arquivo: DataFrame}.
+    Retorna (indicadores, nomes dos arquivos cujas linhas brutas foram substituídas pelos indicadores).
+    Só as tabelas de lançamentos entram nesse conjunto; os cadastros usados nos cruzamentos continuam no prompt.
+    """
+    data_referencia = data_referencia or pd.Timestamp.today().normalize()
+    indicadores = {}
+    usados = set()
+
+    nome_mov, df_mov = localizar_tabela(dados, 'movimento')
+    if df_mov is not None and (tabela := fluxo_caixa_mensal(df_mov)) is not None:
+        indicadores['Fluxo de caixa mensal (movimento financeiro)'] = tabela
+        usados.add(nome_mov)
+
+    nome_vendas, df_vendas = localizar_tabela(dados, 'vendas')
+    _, df_prod = localizar_tabela(dados, 'produtos')
+    _, df_cat = localizar_tabela(dados, 'categorias')
+    if df_vendas is not None and (tabela := vendas_por_categoria(df_vendas, df_prod, df_cat)) is not None:
+        indicadores['Vendas por categoria'] = tabela
+        receita = tabela['receita']
+        indicadores['Concentração de vendas'] = {
+            'participacao_top3_%': float(100 * receita.head(3).sum() / receita.sum()) if receita.sum() else 0.0,
+            'indice_hhi': float(((receita / receita.sum()) ** 2).sum() * 10_000) if receita.sum() else 0.0,
+        }
+        usados.add(nome_vendas)
+
+    prazos = {}
+    for trecho, rotulo, significado in (('receber', 'Contas a receber', 'inadimplência'),
+                                        ('pagar', 'Contas a pagar', 'atraso nos pagamentos')):
+        nome, df = localizar_tabela(dados, f'contas_a_{trecho}')
+        if df is not None and (resultado := aging_titulos(df, data_referencia)) is not None:
+            tabela, resumo = resultado
+            indicadores[f'{rotulo} – aging dos títulos em aberto (ref. {data_referencia:%Y-%m-%d})'] = tabela
+            indicadores[f'{rotulo} – resumo (percentual vencido = {significado})'] = resumo
+            prazos[trecho] = resumo.get('prazo_medio_dias')
+            usados.add(nome)
+    if prazos.get('receber') is not None and prazos.get('pagar') is not None:
+        indicadores['Ciclo financeiro (sem estoques)'] = {
+            'prazo_medio_recebimento_dias': prazos['receber'],
+            'prazo_medio_pagamento_dias': prazos['pagar'],
+            'ciclo_conversao_caixa_dias': prazos['receber'] - prazos['pagar'],
+        }
+
+    nome_pagar, df_pagar = localizar_tabela(dados, 'contas_a_pagar')
+    _, df_nat = localizar_tabela(dados, 'naturezas')
+    if df_pagar is not None and (tabela := principais_naturezas_custo(df_pagar, df_nat)) is not None:
+        indicadores[f'Top {TOP_NATUREZAS} naturezas de custo (contas a pagar)'] = tabela
+        usados.add(nome_pagar)
+
+    return indicadores, usados
+
+
+def formatar_indicadores(indicadores: dict) -> str:
+    """Converte os indicadores em um bloco de texto compacto para o prompt (valores com 2 casas decimais)."""
+    partes = [CABECALHO_INDICADORES]
+    for titulo, valor in indicadores.items():
+        partes.append(f"--- {titulo} ---\n")
+        if isinstance(valor, pd.DataFrame):
+            partes.append(valor.to_string(float_format=lambda x: f"{x:,.2f}"))
+        else:
+            partes.append("\n".join(
+                f"{chave}: {v:,.2f}" if isinstance(v, float) else f"{chave}: {v}" for chave, v in valor.items()
+            ))
+        partes.append("\n\n")
+    return "".join(partes)
+
+
+def montar_bloco_indicadores(arquivos: list[Path], cache_dados: CacheDadosZ, cache_secoes: CacheSecoes,
+                             data_referencia: pd.Timestamp | None = None) -> tuple[str, set]:
+    """
+    Calcula (ou reaproveita do cache, se nenhum arquivo mudou) o bloco de indicadores.
+    Retorna (texto, nomes dos arquivos cobertos pelos indicadores).
+    """
+    data_referencia = data_referencia or pd.Timestamp.today().normalize()
+    impressoes = {arquivo.name: cache_dados.impressao_digital(arquivo) for arquivo in arquivos}
+    chave = CacheSecoes.chave_de(
+        "indicadores", VERSAO_INDICADORES, f"{data_referencia:%Y-%m-%d}",
+        *(f"{nome}={impressao.hash}" for nome, impressao in sorted(impressoes.items())),
+    )
+    em_cache = cache_secoes.obter(chave)
+    if em_cache is not None:
+        registro = json.loads(em_cache)
+        print("  ♻️ Indicadores reaproveitados do cache (arquivos inalterados).")
+        return registro['texto'], set(registro['usados'])
+
+    dados = {}
+    for arquivo in arquivos:
+        try:
+            dados[arquivo.name] = cache_dados.carregar(arquivo, impressoes[arquivo.name])
+        except Exception as e:
+            print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
+    with etapa("reduzir", estrategia="indicadores") as detalhes:
+        indicadores, usados = calcular_indicadores(dados, data_referencia)
+        texto = formatar_indicadores(indicadores) if indicadores else ""
+        detalhes["arquivos"] = sorted(usados)
+    cache_secoes.guardar(chave, json.dumps({'texto': texto, 'usados': sorted(usados)}, ensure_ascii=False))
+    return texto, usados
+
+
+### Testes ###
+
+class TestIndicadores(unittest.TestCase):
+    def setUp(self):
+        self.df_mov = pd.DataFrame({
+            "data": ["2024-01-05", "2024-01-20", "2024-01-25", "05/02/2024", "2024-02-10", "2024-02-11"],
+            "valor": [100.0, 40.0, -50.0, 30.0, 20.0, 10.0],
+            "tipo": ["Entrada", "Saída", "Estorno", "crédito", "Débito", "Despesa"],
+        })
+
+    def test_sentido_pelas_palavras_do_tipo(self):
+        self.assertEqual(sentido_movimento(_normalizar("Entrada")), 1)
+        self.assertEqual(sentido_movimento(_normalizar("Saída")), -1)
+        self.assertEqual(sentido_movimento(_normalizar("C")), 1)
+        self.assertEqual(sentido_movimento(_normalizar("Estorno")), 0)  # começa com 'e', mas não é entrada
+        self.assertEqual(sentido_movimento(_normalizar("Pagamento fornecedor")), -1)
+
+    def test_fluxo_caixa_sinal_pelo_tipo(self):
+        tabela = fluxo_caixa_mensal(self.df_mov)
+        self.assertEqual([str(mes) for mes in tabela.index], ["2024-01", "2024-02"])
+        # Saída com valor positivo conta como saída; tipo desconhecido usa o sinal do próprio valor
+        self.assertEqual(tabela["entradas"].tolist(), [100.0, 30.0])
+        self.assertEqual(tabela["saidas"].tolist(), [90.0, 30.0])
+        self.assertEqual(tabela["saldo_acumulado"].tolist(), [10.0, 10.0])
+
+    def test_datas_iso_e_dia_primeiro(self):
+        datas = _datas(pd.Series(["2024-01-05", "05/02/2024", "2024-03-04 10:30:00", "12.11.2024", "invalida"]))
+        esperado = [pd.Timestamp("2024-01-05"), pd.Timestamp("2024-02-05"), pd.Timestamp("2024-03-04 10:30"),
+                    pd.Timestamp("2024-11-12")]
+        self.assertEqual(datas.iloc[:4].tolist(), esperado)
+        self.assertTrue(pd.isna(datas.iloc[4]))
+
+    def test_vendas_com_chaves_float_e_texto(self):
+        df_vendas = pd.DataFrame({"produto_id": [1.0, 2.0, 2.0, np.nan], "quantidade": [1, 2, 1, 1],
+                                  "preco_unitario": [10.0, 5.0, 5.0, 7.0]})
+        df_produtos = pd.DataFrame({"id": [1, 2], "categoria_id": ["10", 20.0]})
+        df_categorias = pd.DataFrame({"id": [10, 20], "nome": ["Bebidas", "Limpeza"]})
+        tabela = vendas_por_categoria(df_vendas, df_produtos, df_categorias)
+        self.assertEqual(tabela["receita"].to_dict(), {"Limpeza": 15.0, "Bebidas": 10.0, "sem categoria": 7.0})
+
+    def test_cadastros_continuam_no_prompt(self):
+        dados = {"movimento-financeiro.z": self.df_mov,
+                 "vendas.z": pd.DataFrame({"produto_id": [1], "quantidade": [2], "preco_unitario": [3.0]}),
+                 "produtos.z": pd.DataFrame({"id": [1], "categoria_id": [10]}),
+                 "categorias.z": pd.DataFrame({"id": [10], "nome": ["Bebidas"]})}
+        indicadores, usados = calcular_indicadores(dados, pd.Timestamp("2024-03-01"))
+        self.assertEqual(usados, {"movimento-financeiro.z", "vendas.z"})
+        self.assertEqual(indicadores["Vendas por categoria"]["receita"].to_dict(), {"Bebidas": 6.0})
+
+    def test_aging_so_conta_titulos_em_aberto(self):
+        df_receber = pd.DataFrame({
+            "data_emissao": ["2024-02-01", "2024-01-01", "2023-11-01", "2024-01-15", "2024-02-20"],
+            "data_vencimento": ["2024-03-10", "2024-02-15", "2023-12-15", "2024-02-01", "2024-03-20"],
+            "valor": [100.0, 200.0, 300.0, 50.0, 40.0],
+            "data_recebimento": [None, None, None, "2024-02-01", None],
+            "status": ["aberto", "aberto", "em aberto", "recebido", "Recebido"],
+        })
+        tabela, resumo = aging_titulos(df_receber, pd.Timestamp("2024-03-01"))
+        self.assertEqual(tabela["valor"].to_dict(), {"a vencer": 100.0, "1-30 dias": 200.0, "31-60 dias": 0.0,
+                                                     "61-90 dias": 300.0, "> 90 dias": 0.0})
+        self.assertEqual((resumo["valor_em_aberto"], resumo["valor_vencido"]), (600.0, 500.0))
+        self.assertAlmostEqual(resumo["percentual_vencido_%"], 500 / 6)
+        # Prazo médio ponderado pelo valor, sobre todos os títulos
+        prazos, pesos = [38, 45, 44, 17, 29], [100.0, 200.0, 300.0, 50.0, 40.0]
+        self.assertAlmostEqual(resumo["prazo_medio_dias"], np.average(prazos, weights=pesos))
+
+    def test_naturezas_de_custo_com_nome_e_variacao(self):
+        df_pagar = pd.DataFrame({"natureza_id": [1, 2, 1, 2, 3],
+                                 "data_emissao": ["2024-01-10", "2024-01-12", "2024-02-03", "2024-02-05", "2024-02-07"],
+                                 "valor": [-100.0, 50.0, 150.0, 25.0, 10.0]})
+        df_naturezas = pd.DataFrame({"id": [1, 2], "nome": ["Aluguel", "Energia"]})
+        tabela = principais_naturezas_custo(df_pagar, df_naturezas)
+        self.assertEqual(tabela["valor"].to_dict(), {"Aluguel": 250.0, "Energia": 75.0, "3": 10.0})
+        self.assertEqual(tabela["var_%_2024-01_a_2024-02"].round(1).tolist()[:2], [50.0, -50.0])
+        self.assertTrue(pd.isna(tabela.loc["3", "var_%_2024-01_a_2024-02"]))
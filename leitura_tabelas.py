@@ -0,0 +1,178 @@
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from telemetria import etapa
+
+# --- Leitura Rápida e Compacta de CSV/Excel ---
+# O read_csv padrão infere 'object' para todo texto e float64/int64 para todo número. Nos exports grandes isso
+# multiplica a memória residente: 'status', 'tipo' e as colunas de natureza/categoria repetem poucos valores
+# milhões de vezes. Aqui cada arquivo passa por um esquema: datas viram datetime64, colunas repetitivas viram
+# 'category' e números são reduzidos ao menor tipo que os representa sem perda (inteiros até int32, com sinal:
+# int8/uint8 transbordariam em contas como 'quantidade * preco' ou 'quantidade - 5'). O formato das datas é
+# detectado numa amostra da coluna (ISO ou dd/mm/aaaa dos exports brasileiros) e os valores que não seguem o
+# formato são avisados, não descartados em silêncio. A leitura usa o engine do pyarrow (multithread) quando ele
+# está instalado e os arquivos são lidos em paralelo.
+
+ENGINE_PYARROW_DISPONIVEL = importlib.util.find_spec("pyarrow") is not None
+MAX_WORKERS_LEITURA = int(os.getenv("LLM_LEITURA_WORKERS", "0")) or min(8, (os.cpu_count() or 1) + 2)
+PADROES_CATEGORICOS = ("natureza", "categoria", "status", "tipo")
+PREFIXO_DATA = "data"
+FRACAO_MAXIMA_CATEGORIAS = 0.5
+LINHAS_AMOSTRA_TIPOS = 1000
+MENOR_TIPO_INTEIRO = np.int32
+# Formatos de data tentados na amostra, em ordem de preferência: em empate (ex.: '05/01/2024', dia e mês ≤ 12)
+# vale o primeiro, por isso dd/mm vem antes de mm/dd.
+FORMATOS_DATA = ("ISO8601", "%d/%m/%Y", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%y", "%d-%m-%Y", "%d.%m.%Y",
+                 "%m/%d/%Y")
+EXEMPLOS_DATAS_INVALIDAS = 5
+
+
+@dataclass(frozen=True)
+class EsquemaTabela:
+    """
+    Tipos de um arquivo. Colunas ausentes no arquivo são ignoradas; colunas fora do esquema
+    passam pela inferência por nome (ver inferir_esquema).
+    """
+    datas: tuple[str, ...] = ()
+    categoricas: tuple[str, ...] = ()
+    texto: tuple[str, ...] = ()
+
+
+# Esquemas dos exports do WEBGEX usados por llm_openai.py
+ESQUEMAS_ARQUIVOS = {
+    "contas-a-pagar": EsquemaTabela(datas=("data_emissao", "data_vencimento", "data_pagamento"),
+                                    categoricas=("status", "natureza_id")),
+    "contas-a-receber": EsquemaTabela(datas=("data_emissao", "data_vencimento", "data_pagamento"),
+                                      categoricas=("status", "natureza_id")),
+    "movimento-financeiro": EsquemaTabela(datas=("data",), categoricas=("tipo", "natureza_id")),
+    "naturezas-financeiras": EsquemaTabela(categoricas=("tipo",), texto=("nome",)),
+    "categorias": EsquemaTabela(texto=("nome",)),
+    "produtos": EsquemaTabela(categoricas=("categoria_id",), texto=("nome",)),
+    "vendas": EsquemaTabela(datas=("data",)),
+}
+
+
+def inferir_esquema(colunas, esquema: EsquemaTabela | None = None) -> EsquemaTabela:
+    """
+    Completa o esquema pelo nome das colunas: 'data*' vira data e colunas que citam natureza, categoria,
+    status ou tipo viram candidatas a 'category' (só convertidas se tiverem poucos valores distintos).
+    """
+    esquema = esquema or EsquemaTabela()
+    conhecidas = set(esquema.datas) | set(esquema.categoricas) | set(esquema.texto)
+    livres = [str(coluna) for coluna in colunas if str(coluna) not in conhecidas]
+    datas = tuple(c for c in livres if c.lower().startswith(PREFIXO_DATA))
+    categoricas = tuple(c for c in livres if c not in datas and any(p in c.lower() for p in PADROES_CATEGORICOS))
+    return EsquemaTabela(esquema.datas + datas, esquema.categoricas + categoricas, esquema.texto)
+
+
+def esquema_do_arquivo(caminho) -> EsquemaTabela | None:
+    return ESQUEMAS_ARQUIVOS.get(Path(caminho).stem)
+
+
+def detectar_formato_data(serie: pd.Series, linhas_amostra: int = LINHAS_AMOSTRA_TIPOS) -> str:
+    """Formato de FORMATOS_DATA que reconhece mais valores da amostra (primeiros valores não nulos)."""
+    amostra = serie.dropna().astype(str).str.strip()
+    amostra = amostra[amostra != ""].head(linhas_amostra)
+    if amostra.empty:
+        return FORMATOS_DATA[0]
+    acertos = {formato: pd.to_datetime(amostra, errors="coerce", format=formato).notna().sum()
+               for formato in FORMATOS_DATA}
+    return max(FORMATOS_DATA, key=acertos.get)  # max devolve o primeiro em caso de empate
+
+
+def converter_datas(serie: pd.Series, formato: str | None = None, nome: str | None = None) -> pd.Series:
+    """
+    Converte a coluna em datetime64 com 'formato' (padrão: detectado na amostra). Valores preenchidos que não
+    seguem o formato viram NaT e são informados (quantidade, linhas e exemplos) em vez de sumirem em silêncio.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    formato = formato or detectar_formato_data(serie)
+    datas = pd.to_datetime(serie, errors="coerce", format=formato)
+    preenchidos = serie.notna() & (serie.astype(str).str.strip() != "")
+    invalidas = preenchidos & datas.isna()
+    if invalidas.any():
+        exemplos = ", ".join(f"linha {indice}: {valor!r}"
+                             for indice, valor in serie[invalidas].head(EXEMPLOS_DATAS_INVALIDAS).items())
+        print(f"  ⚠️ {int(invalidas.sum())} valor(es) de '{nome or serie.name}' fora do formato de data "
+              f"'{formato}' viraram NaT ({exemplos}).")
+    return datas
+
+
+def compactar_tipos(df: pd.DataFrame, esquema: EsquemaTabela | None = None) -> pd.DataFrame:
+    """
+    Aplica o esquema ao DataFrame (no lugar) e o retorna. Inteiros e floats só trocam para um tipo
+    menor quando todos os valores cabem nele sem perda; inteiros nunca ficam abaixo de MENOR_TIPO_INTEIRO.
+    """
+    esquema = inferir_esquema(df.columns, esquema)
+    for coluna in df.columns:
+        nome = str(coluna)
+        serie = df[coluna]
+        if nome in esquema.datas:
+            if not pd.api.types.is_datetime64_any_dtype(serie):
+                # Formato único (detectado na amostra): mais rápido que format="mixed" e sem misturar dd/mm e mm/dd
+                df[coluna] = converter_datas(serie, nome=nome)
+        elif nome in esquema.categoricas:
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                continue
+            if len(serie) and serie.nunique(dropna=True) <= FRACAO_MAXIMA_CATEGORIAS * len(serie):
+                df[coluna] = serie.astype("category")
+        elif pd.api.types.is_bool_dtype(serie):
+            continue
+        elif pd.api.types.is_integer_dtype(serie):
+            reduzida = pd.to_numeric(serie, downcast="integer")
+            if reduzida.dtype.itemsize < np.dtype(MENOR_TIPO_INTEIRO).itemsize:
+                reduzida = serie.astype(MENOR_TIPO_INTEIRO)
+            df[coluna] = reduzida
+        elif pd.api.types.is_float_dtype(serie) and serie.dtype != np.float32:
+            # float32 só quando nenhum valor muda (valores monetários com centavos costumam ficar em float64)
+            reduzida = serie.astype(np.float32)
+            if np.array_equal(reduzida.to_numpy(np.float64), serie.to_numpy(np.float64), equal_nan=True):
+                df[coluna] = reduzida
+    return df
+
+
+def ler_tabela(caminho, esquema: EsquemaTabela | None = None, usar_pyarrow: bool | None = None) -> pd.DataFrame:
+    """
+    Lê um CSV ou Excel e compacta os tipos. Levanta ValueError para extensões não suportadas;
+    erros de leitura (inclusive FileNotFoundError) são propagados.
+    """
+    caminho = str(caminho)
+    esquema = esquema or esquema_do_arquivo(caminho)
+    if usar_pyarrow is None:
+        usar_pyarrow = ENGINE_PYARROW_DISPONIVEL
+    if caminho.endswith('.csv'):
+        if usar_pyarrow:
+            df = pd.read_csv(caminho, engine="pyarrow")
+        else:
+            # Colunas categóricas de texto já saem do parser como 'category', sem materializar milhões de
+            # strings (com dtype='category' o parser trata tudo como texto, por isso só as de texto na amostra)
+            amostra = pd.read_csv(caminho, nrows=LINHAS_AMOSTRA_TIPOS)
+            categoricas = inferir_esquema(amostra.columns, esquema).categoricas
+            df = pd.read_csv(caminho, engine="c", dtype={
+                coluna: "category" for coluna in categoricas
+                if coluna in amostra.columns and pd.api.types.is_string_dtype(amostra[coluna])})
+    elif caminho.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(caminho)
+    else:
+        raise ValueError(f"Formato de arquivo não suportado: '{caminho}'")
+    return compactar_tipos(df, esquema)
+
+
+def ler_tabelas_em_paralelo(caminhos, ler=ler_tabela, max_workers: int | None = None) -> list:
+    """
+    Lê vários arquivos ao mesmo tempo (threads: o parser do pandas/pyarrow libera o GIL).
+    Retorna os resultados de 'ler' na ordem de 'caminhos'.
+    """
+    caminhos = list(caminhos)
+    if len(caminhos) <= 1:
+        return [ler(caminho) for caminho in caminhos]
+    with etapa("ler_tabelas_paralelo", arquivos=len(caminhos)):
+        with ThreadPoolExecutor(max_workers=min(max_workers or MAX_WORKERS_LEITURA, len(caminhos))) as executor:
+            return list(executor.map(ler, caminhos))
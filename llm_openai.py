@@ -1,9 +1,21 @@
 import pandas as pd
+import argparse
 import os
+import time
 import openai
 from unittest.mock import patch
 import unittest
 from dotenv import load_dotenv
+from pathlib import Path
+
+from agregacao_streaming import resumir_arquivo_em_blocos
+from leitura_tabelas import ler_tabela, ler_tabelas_em_paralelo
+from serializacao_tabelas import formatador_tabela
+from resiliencia import PoliticaRetentativa, RegistroDisjuntores, executar_com_retentativas
+from roteamento import RoteadorLLM, executar_com_failover, provedor_compativel, provedor_local_do_ambiente
+from streaming import MedidorStreaming, SaidaIncremental, imprimir_delta
+from telemetria import configurar_telemetria, etapa, telemetria
+from tokenizacao import obter_contador
 
 # Carrega as variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -11,14 +23,34 @@ load_dotenv()
 # Obtém a chave da API do OpenAI do arquivo .env
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def enviar_prompt_para_llm(prompt):
+# Erros transitórios (429, 5xx, conexão) são repetidos com backoff; o disjuntor evita insistir num endpoint fora do ar
+POLITICA_RETENTATIVA = PoliticaRetentativa(max_tentativas=int(os.getenv("LLM_MAX_TENTATIVAS", "5")))
+disjuntores = RegistroDisjuntores()
+
+# Com LLM_LOCAL_BASE_URL (Ollama, llama.cpp), os prompts pequenos (head() de cada tabela) vão primeiro ao modelo
+# local e o gpt-3.5-turbo fica como reserva, e vice-versa para prompts grandes (ver roteamento.py)
+provedor_local = provedor_local_do_ambiente()
+roteador = RoteadorLLM([provedor_local] if provedor_local is not None else [])
+provedor_nuvem = provedor_compativel("gpt-3.5-turbo", None, "gpt-3.5-turbo", 16_385, api_key=openai.api_key)
+
+# CSVs acima deste tamanho são lidos em blocos (memória limitada) e viram um ResumoStreaming com head/tail/describe
+LIMITE_MB_EM_MEMORIA = float(os.getenv("LLM_LIMITE_MB_EM_MEMORIA", "1024"))
+
+def enviar_prompt_para_llm(prompt, ao_receber=None):
     """
     Envia um prompt para um Modelo de Linguagem Grande (LLM) da OpenAI e retorna a resposta.
     Tenta enviar o prompt para a API da OpenAI (gpt-3.5-turbo) e retorna o texto da resposta.
+    Se 'ao_receber' for informado, a resposta é pedida em streaming e cada pedaço é repassado a essa
+    função assim que chega; o tempo até o primeiro token e os tokens/s são exibidos ao final.
 
     Note: 'gpt-3.5-turbo' é um modelo de chat e requer uma estrutura de mensagem diferente.
     """
-    try:
+    if roteador.locais:
+        return enviar_prompt_roteado(prompt, ao_receber)
+    inicio = time.perf_counter()
+    medidor = MedidorStreaming([ao_receber])
+
+    def chamar():
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
             messages=[
@@ -28,25 +60,100 @@ def enviar_prompt_para_llm(prompt):
             n=1,
             stop=None,
             temperature=0.7,
+            stream=ao_receber is not None,
         )
-        return response['choices'][0]['message']['content'].strip()
+        if ao_receber is None:
+            return response
+        for chunk in response:
+            medidor.registrar(chunk['choices'][0]['delta'].get('content'))
+        return None
+
+    try:
+        # Só repete o streaming se nada tiver sido entregue ainda (senão o texto sairia duplicado)
+        response, retentativas = executar_com_retentativas(chamar, POLITICA_RETENTATIVA,
+                                                           disjuntores.obter("gpt-3.5-turbo"),
+                                                           pode_repetir=lambda: medidor.num_deltas == 0)
+        if ao_receber is None:
+            uso = response.get('usage') or {}
+            telemetria.registrar_chamada_llm("gpt-3.5-turbo", time.perf_counter() - inicio,
+                                             tokens_prompt=uso.get('prompt_tokens'),
+                                             tokens_resposta=uso.get('completion_tokens'),
+                                             tokens_prompt_cache=(uso.get('prompt_tokens_details') or {}).get('cached_tokens'),
+                                             retentativas=retentativas)
+            return response['choices'][0]['message']['content'].strip()
+
+        metricas = medidor.finalizar()
+        print(f"\n⏱️ Streaming: {metricas.descricao()}")
+        telemetria.registrar_chamada_llm("gpt-3.5-turbo", time.perf_counter() - inicio, ttft_s=metricas.ttft_s,
+                                         retentativas=retentativas, streaming=True)
+        return medidor.texto().strip()
     except Exception as e:
+        telemetria.registrar_chamada_llm("gpt-3.5-turbo", time.perf_counter() - inicio, status="erro",
+                                         retentativas=getattr(e, 'retentativas', 0), erro=type(e).__name__)
         print(f"Erro ao chamar a API da OpenAI: {e}")
         return "Erro ao gerar resumo."
 
+def enviar_prompt_roteado(prompt, ao_receber=None):
+    """
+    Como enviar_prompt_para_llm, mas escolhendo entre o modelo local e o gpt-3.5-turbo pelo tamanho do prompt,
+    com failover entre eles. Usa o cliente atual da OpenAI, que também fala com Ollama e llama.cpp.
+    """
+    medidor = MedidorStreaming([ao_receber])
+    tokens_prompt = obter_contador("gpt-3.5-turbo")[1](prompt)
+
+    def chamar(provedor):
+        params = dict(model=provedor.modelo, messages=[{"role": "user", "content": prompt}], max_tokens=200,
+                      temperature=0.7)
+        if ao_receber is None:
+            return provedor.cliente().chat.completions.create(**params)
+        for chunk in provedor.cliente().chat.completions.create(**params, stream=True):
+            if chunk.choices:
+                medidor.registrar(chunk.choices[0].delta.content)
+        return None
+
+    def registrar_falha(provedor, erro, duracao_s):
+        telemetria.registrar_chamada_llm(provedor.modelo, duracao_s, status="erro",
+                                         retentativas=getattr(erro, 'retentativas', 0), erro=type(erro).__name__,
+                                         provedor=provedor.nome)
+        erro.entregou_parcial = medidor.num_deltas > 0
+
+    try:
+        response, provedor, retentativas, duracao_s = executar_com_failover(
+            roteador, [provedor_nuvem], chamar, tokens_prompt, 200, POLITICA_RETENTATIVA, disjuntores,
+            pode_repetir=lambda: medidor.num_deltas == 0,
+            tokens_resposta=lambda r: r.usage.completion_tokens if r is not None and r.usage else None,
+            ao_falhar=registrar_falha)
+    except Exception as e:
+        print(f"Erro ao chamar o LLM: {e}")
+        return "Erro ao gerar resumo."
+    print(f"🔀 Resposta gerada por '{provedor.nome}' ({tokens_prompt} tokens de prompt).")
+
+    if ao_receber is None:
+        uso = response.usage
+        telemetria.registrar_chamada_llm(provedor.modelo, duracao_s, tokens_prompt=getattr(uso, 'prompt_tokens', None),
+                                         tokens_resposta=getattr(uso, 'completion_tokens', None),
+                                         retentativas=retentativas, provedor=provedor.nome)
+        return (response.choices[0].message.content or "").strip()
+
+    metricas = medidor.finalizar()
+    print(f"\n⏱️ Streaming: {metricas.descricao()}")
+    telemetria.registrar_chamada_llm(provedor.modelo, duracao_s, ttft_s=metricas.ttft_s, retentativas=retentativas,
+                                     streaming=True, provedor=provedor.nome)
+    return medidor.texto().strip()
+
 def carregar_dataframe(caminho_arquivo):
     """
     Carrega um DataFrame do pandas a partir de um arquivo CSV ou Excel.
     Verifica a extensão do arquivo para usar a função de leitura correta do pandas.
+    Os tipos são compactados pelo esquema do arquivo (datas, 'category', números reduzidos; ver leitura_tabelas).
+    CSVs maiores que LIMITE_MB_EM_MEMORIA são lidos em blocos e retornados como ResumoStreaming.
     Em caso de arquivo não encontrado ou outro erro de leitura, retorna None.
     """
     try:
-        if caminho_arquivo.endswith('.csv'):
-            return pd.read_csv(caminho_arquivo)
-        elif caminho_arquivo.endswith(('.xlsx', '.xls')):
-            return pd.read_excel(caminho_arquivo)
-        else:
-            raise ValueError(f"Formato de arquivo não suportado: '{caminho_arquivo}'")
+        if caminho_arquivo.endswith('.csv') and os.path.getsize(caminho_arquivo) > LIMITE_MB_EM_MEMORIA * 1024 * 1024:
+            return resumir_arquivo_em_blocos(caminho_arquivo)
+        with etapa("carregar", arquivo=os.path.basename(caminho_arquivo)):
+            return ler_tabela(caminho_arquivo)
     except FileNotFoundError:
         print(f"Erro: Arquivo não encontrado: '{caminho_arquivo}'")
         return None
@@ -54,18 +161,20 @@ def carregar_dataframe(caminho_arquivo):
         print(f"Erro ao carregar arquivo: '{caminho_arquivo}'. Erro: {e}")
         return None
 
-def carregar_dataframes(arquivos_csv):
+def carregar_dataframes(arquivos_csv, pasta_arquivos=None):
     """
     Carrega múltiplos DataFrames a partir de um dicionário de nomes de arquivos.
-    Assume que os arquivos estão na pasta 'data' dentro de 'util', dois níveis acima
-    do diretório do script.
+    Por padrão, assume que os arquivos estão na pasta 'data' dentro de 'util', dois níveis acima
+    do diretório do script; 'pasta_arquivos' permite usar outra pasta.
+    Os arquivos são lidos em paralelo.
     """
     dataframes = {}
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    pasta_arquivos = os.path.join(script_dir, '..', '..', 'util', 'data')
-    for nome_arquivo, nome_df in arquivos_csv.items():
-        caminho_absoluto = os.path.join(pasta_arquivos, nome_arquivo)
-        df = carregar_dataframe(caminho_absoluto)
+    if pasta_arquivos is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        pasta_arquivos = os.path.join(script_dir, '..', '..', 'util', 'data')
+    caminhos = [os.path.join(pasta_arquivos, nome_arquivo) for nome_arquivo in arquivos_csv]
+    carregados = ler_tabelas_em_paralelo(caminhos, ler=lambda caminho: carregar_dataframe(caminho))
+    for (nome_arquivo, nome_df), caminho_absoluto, df in zip(arquivos_csv.items(), caminhos, carregados):
         if df is not None:
             dataframes[nome_df] = df
         else:
@@ -78,35 +187,45 @@ def converter_dfs_para_texto(dataframes):
     Cada DataFrame é limitado às primeiras linhas.
     DataFrames vazios são representados como tal.
     """
-    return "\n".join(
-        f"\n--- DataFrame: {nome} ---\n{df.head().to_string()}\n"
-        if not df.empty
-        else f"\n--- DataFrame: {nome} (vazio) ---\n"
-        for nome, df in dataframes.items()
-    )
+    with etapa("to_string", dataframes=len(dataframes)):
+        return "\n".join(
+            f"\n--- DataFrame: {nome} ---\n{formatador_tabela(df)(df.head())}\n"
+            if not df.empty
+            else f"\n--- DataFrame: {nome} (vazio) ---\n"
+            for nome, df in dataframes.items()
+        )
 
-def gerar_resumo_contabil(dataframes, prompt, usar_llm=True):
+def gerar_resumo_contabil(dataframes, prompt, usar_llm=True, ao_receber=None):
     """
     Gera um resumo contábil a partir de um conjunto de DataFrames, usando um LLM ou uma simulação.
     Prepara o prompt final incluindo os dados convertidos para texto.
     Se usar_llm for True, chama a API da OpenAI para gerar o resumo.
     Caso contrário, retorna um resumo simulado.
+    'ao_receber' ativa o streaming da resposta (ver enviar_prompt_para_llm).
     """
     dados_para_llm = converter_dfs_para_texto(dataframes)
     if not dados_para_llm.strip():
         return "Erro: Nenhum dado contábil fornecido."
 
-    prompt_final = f"{prompt}\n\nDados:\n{dados_para_llm}\nFormato de saída: Parágrafo único."
+    # Dados antes da instrução: trocar de prompt mantém o mesmo início da mensagem (cache de prefixo do provedor)
+    prompt_final = f"Dados:\n{dados_para_llm}\n{prompt}\n\nFormato de saída: Parágrafo único."
 
     print("\n--- Prompt Enviado para o LLM ---")
     print(prompt_final)
 
     if usar_llm:
-        resumo = enviar_prompt_para_llm(prompt_final)
+        resumo = enviar_prompt_para_llm(prompt_final, ao_receber=ao_receber)
     else:
         resumo = "[[RESUMO CONTÁBIL GERADO PELO LLM]]"
     return resumo
 
+PROMPTS_PREDEFINIDOS = {
+    '1': """Você é um especialista em contabilidade. Analise os dados financeiros e gere um resumo conciso do fluxo de caixa operacional.""",
+    '2': """Você é um especialista em análise de vendas. Analise os dados de vendas por categoria e destaque o desempenho.""",
+    '3': """Você é um especialista em análise financeira. Resuma a liquidez da empresa com base nos dados financeiros.""",
+    '4': """Você é um especialista em análise de custos. Resuma os principais tipos de gastos.""",
+}
+
 def escolher_prompt():
     """
     Apresenta ao usuário uma lista de opções de prompts predefinidos.
@@ -122,18 +241,11 @@ def escolher_prompt():
     print("5: Prompt Personalizado")
     print("0: Sair")
 
-    opcoes = {
-        '1': """Você é um especialista em contabilidade. Analise os dados financeiros e gere um resumo conciso do fluxo de caixa operacional.""",
-        '2': """Você é um especialista em análise de vendas. Analise os dados de vendas por categoria e destaque o desempenho.""",
-        '3': """Você é um especialista em análise financeira. Resuma a liquidez da empresa com base nos dados financeiros.""",
-        '4': """Você é um especialista em análise de custos. Resuma os principais tipos de gastos.""",
-    }
-
     while True:
         opcao = input("Digite o número da opção: ")
         print(f"Opção digitada: '{opcao}'")  # Adicionado para debug
-        if opcao in opcoes:
-            return opcoes[opcao]
+        if opcao in PROMPTS_PREDEFINIDOS:
+            return PROMPTS_PREDEFINIDOS[opcao]
         elif opcao == '5':
             return input("Digite seu prompt personalizado: ")
         elif opcao == '0':
@@ -142,11 +254,24 @@ def escolher_prompt():
         else:
             print("Opção inválida. Tente novamente.")
 
-def main():
+def main(argumentos=None):
+    """
+    Sem argumentos, pergunta o prompt no console. Para uso em scripts:
+        python llm_openai.py --data-dir dados --opcao 1 --out resumo.txt
+    """
+    parser = argparse.ArgumentParser(description="Gera um resumo contábil a partir dos CSVs.")
+    parser.add_argument("--data-dir", help="pasta dos arquivos CSV (padrão: ../../util/data)")
+    parser.add_argument("--opcao", choices=sorted(PROMPTS_PREDEFINIDOS), help="prompt predefinido, sem perguntar")
+    parser.add_argument("--prompt", help="prompt personalizado, sem perguntar")
+    parser.add_argument("--out", default="resumo_api.txt", help="arquivo do resumo (padrão: resumo_api.txt)")
+    args = parser.parse_args(argumentos)
+
     if not openai.api_key:
         print("Erro: A chave da API do OpenAI não foi configurada. Certifique-se de ter um arquivo .env com OPENAI_API_KEY.")
         return
 
+    configurar_telemetria(os.getenv("LLM_TELEMETRIA_JSONL"), int(os.getenv("LLM_PROMETHEUS_PORTA", "0")))
+
     arquivos_csv = {
         "contas-a-pagar.csv": "df_contas_a_pagar",
         "contas-a-receber.csv": "df_contas_a_receber",
@@ -156,29 +281,56 @@ def main():
         'produtos.csv': 'df_produtos',
         'vendas.csv': 'df_vendas',
     }
-    dataframes = carregar_dataframes(arquivos_csv)
+    dataframes = carregar_dataframes(arquivos_csv, args.data_dir)
 
     if dataframes:
-        num_testes = 1  # Vamos gerar apenas um resumo por execução para simplificar aqui
+        num_testes = 1  # Um resumo por execução; para K amostras por variante com métricas, use avaliacao.py
         acertos_api = 0
 
-        prompt = escolher_prompt()
+        prompt = args.prompt or PROMPTS_PREDEFINIDOS.get(args.opcao) or escolher_prompt()
         if prompt:
-            resumo = gerar_resumo_contabil(dataframes, prompt)
-            print("\n--- Resumo Gerado ---")
-            print(resumo)
+            nome_arquivo_resumo = args.out
+            salvo = True
+            if os.getenv("LLM_STREAMING", "").lower() in ("1", "true", "sim"):
+                # Streaming: a resposta aparece no console e no arquivo enquanto é gerada
+                saida = SaidaIncremental(Path(nome_arquivo_resumo))
+                print("\n--- Resumo Gerado ---")
+                try:
+                    resumo = gerar_resumo_contabil(dataframes, prompt,
+                                                   ao_receber=lambda delta: (imprimir_delta(delta), saida(delta)))
+                except BaseException:
+                    saida.concluir(False)  # descarta o parcial e preserva um resumo anterior
+                    raise
+                if resumo.startswith("Erro"):
+                    print(resumo)
+                    if saida.caracteres_recebidos:
+                        # Falhou no meio da transmissão: um resumo truncado não substitui o anterior
+                        salvo = False
+                    else:
+                        # Nada foi transmitido: grava a mensagem de erro, como no modo sem streaming
+                        saida(resumo)
+                saida.concluir(salvo)
+                if not salvo:
+                    print(f"\n⚠️ A resposta foi interrompida; '{nome_arquivo_resumo}' não foi alterado.")
+            else:
+                resumo = gerar_resumo_contabil(dataframes, prompt)
+                print("\n--- Resumo Gerado ---")
+                print(resumo)
 
-            # Salvar o resumo em um arquivo
-            nome_arquivo_resumo = "resumo_api.txt"
-            with open(nome_arquivo_resumo, "w") as arquivo:
-                arquivo.write(resumo)
-            print(f"\nO resumo da API foi salvo em '{nome_arquivo_resumo}'.")
+                # Salvar o resumo em um arquivo
+                with open(nome_arquivo_resumo, "w") as arquivo:
+                    arquivo.write(resumo)
+            if salvo:
+                print(f"\nO resumo da API foi salvo em '{nome_arquivo_resumo}'.")
 
             if resumo != "Erro ao gerar resumo.":
                 acertos_api += 1
 
             taxa_acerto_api = (acertos_api / num_testes) * 100
             print(f"\nTaxa de 'acerto' da API (ausência de erro na última chamada): {taxa_acerto_api:.2f}%")
+            resumo_telemetria = telemetria.resumo()
+            print(f"Tokens informados pela API: {resumo_telemetria['tokens'].get('prompt', 0)} de prompt, "
+                  f"{resumo_telemetria['tokens'].get('resposta', 0)} de resposta.")
         else:
             print("Encerrando o programa.")
     else:
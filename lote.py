@@ -0,0 +1,260 @@
+import contextvars
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from telemetria import Telemetria
+
+# --- Execução Concorrente de Prompts em Lote ---
+# Limites da conta (requisições e tokens por minuto) por modelo. Ajuste conforme o tier da sua conta OpenAI.
+# Os limites valem para o processo inteiro: todos os lotes (inclusive os aninhados, como map-reduce e seções
+# incrementais dentro de jobs concorrentes) usam o mesmo LimitadorTaxa do modelo (limitador_compartilhado).
+LIMITE_RPM_PADRAO = int(os.getenv("LLM_LIMITE_RPM", "500"))
+LIMITE_TPM_PADRAO = int(os.getenv("LLM_LIMITE_TPM", "200000"))
+MODELO_LIMITES_PADRAO = "gpt-4o-mini"  # o mesmo modelo padrão de prompts.MODELO_ID_FIXO
+MAX_WORKERS_PADRAO = 8
+
+
+@dataclass
+class TarefaPrompt:
+    """
+    Um job de prompt a ser executado pelo lote.
+    'tokens_estimados' é o custo reservado no balde de tokens (prompt + max_tokens da resposta).
+    """
+    prompt: str
+    tokens_estimados: int = 0
+    identificador: str = ""
+    kwargs: dict = field(default_factory=dict)
+
+
+@dataclass
+class ResultadoTarefa:
+    """
+    Resultado de uma tarefa do lote, devolvido na mesma posição da entrada.
+    'status' é 'ok' ou 'erro'.
+    """
+    indice: int
+    identificador: str
+    status: str
+    resposta: Any = None
+    erro: str | None = None
+    duracao_s: float = 0.0
+    espera_limite_s: float = 0.0
+
+
+class BaldeDeTokens:
+    """
+    Balde de tokens clássico: capacidade 'capacidade' e reposição contínua de 'capacidade' unidades por minuto.
+    """
+
+    def __init__(self, capacidade: float):
+        self.capacidade = float(capacidade)
+        self.disponivel = float(capacidade)
+        self.taxa_por_segundo = self.capacidade / 60.0
+        self.ultimo_reabastecimento = time.monotonic()
+
+    def _reabastecer(self, agora: float):
+        decorrido = agora - self.ultimo_reabastecimento
+        self.disponivel = min(self.capacidade, self.disponivel + decorrido * self.taxa_por_segundo)
+        self.ultimo_reabastecimento = agora
+
+    def tempo_ate_disponivel(self, quantidade: float, agora: float) -> float:
+        """Segundos até 'quantidade' unidades estarem disponíveis (0 se já estiverem)."""
+        self._reabastecer(agora)
+        falta = quantidade - self.disponivel
+        return 0.0 if falta <= 0 else falta / self.taxa_por_segundo
+
+    def consumir(self, quantidade: float):
+        self.disponivel -= quantidade
+
+
+class LimitadorTaxa:
+    """
+    Limita requisições por minuto (RPM) e tokens por minuto (TPM) com dois baldes de tokens.
+    É seguro para uso entre threads: cada chamada a 'adquirir' bloqueia até haver
+    capacidade nos dois baldes e então reserva 1 requisição e 'tokens' tokens.
+    """
+
+    def __init__(self, limite_rpm: int = LIMITE_RPM_PADRAO, limite_tpm: int = LIMITE_TPM_PADRAO):
+        self.balde_requisicoes = BaldeDeTokens(limite_rpm)
+        self.balde_tokens = BaldeDeTokens(limite_tpm)
+        self._lock = threading.Lock()
+
+    def adquirir(self, tokens: int) -> float:
+        """
+        Bloqueia até a requisição caber nos limites e retorna o tempo total de espera em segundos.
+        Pedidos maiores que o TPM inteiro são limitados à capacidade do balde para não travarem para sempre.
+        """
+        tokens = min(float(tokens), self.balde_tokens.capacidade)
+        espera_total = 0.0
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                espera = max(
+                    self.balde_requisicoes.tempo_ate_disponivel(1, agora),
+                    self.balde_tokens.tempo_ate_disponivel(tokens, agora),
+                )
+                if espera <= 0:
+                    self.balde_requisicoes.consumir(1)
+                    self.balde_tokens.consumir(tokens)
+                    return espera_total
+            time.sleep(espera)
+            espera_total += espera
+
+
+_limitadores: dict[str, LimitadorTaxa] = {}
+_lock_limitadores = threading.Lock()
+
+
+def limitador_compartilhado(modelo: str = MODELO_LIMITES_PADRAO) -> LimitadorTaxa:
+    """O LimitadorTaxa do processo para 'modelo' (LLM_LIMITE_RPM / LLM_LIMITE_TPM), criado no primeiro uso."""
+    with _lock_limitadores:
+        if modelo not in _limitadores:
+            _limitadores[modelo] = LimitadorTaxa(LIMITE_RPM_PADRAO, LIMITE_TPM_PADRAO)
+        return _limitadores[modelo]
+
+
+def executar_lote(
+    tarefas: list[TarefaPrompt],
+    funcao_envio: Callable[..., Any],
+    max_workers: int = MAX_WORKERS_PADRAO,
+    limitador: LimitadorTaxa | None = None,
+    eh_erro: Callable[[Any], bool] | None = None,
+) -> list[ResultadoTarefa]:
+    """
+    Executa várias tarefas de prompt em paralelo (pool de threads), respeitando os limites de RPM/TPM.
+    Sem 'limitador', usa o limitador do processo para o modelo padrão (limitador_compartilhado()).
+    'funcao_envio' recebe o prompt (e os kwargs da tarefa) e retorna a resposta do LLM.
+    'eh_erro' permite marcar como erro respostas que não levantam exceção
+    (ex.: a string "Erro ao gerar resumo." devolvida por enviar_prompt_para_llm).
+    Os resultados voltam na mesma ordem das tarefas de entrada. Cada tarefa roda numa cópia do contexto de quem
+    chamou (contextvars), então o acumulador de telemetria do job (telemetria.acumular_chamadas) vê as chamadas
+    feitas pelos workers, inclusive em lotes aninhados.
+    """
+    limitador = limitador or limitador_compartilhado()
+
+    def _executar(indice: int, tarefa: TarefaPrompt) -> ResultadoTarefa:
+        espera = limitador.adquirir(tarefa.tokens_estimados)
+        inicio = time.perf_counter()
+        try:
+            resposta = funcao_envio(tarefa.prompt, **tarefa.kwargs)
+        except Exception as e:
+            return ResultadoTarefa(indice, tarefa.identificador, "erro", erro=str(e),
+                                   duracao_s=time.perf_counter() - inicio, espera_limite_s=espera)
+        duracao = time.perf_counter() - inicio
+        if eh_erro is not None and eh_erro(resposta):
+            return ResultadoTarefa(indice, tarefa.identificador, "erro", resposta=resposta,
+                                   erro="Resposta de erro retornada pela função de envio.",
+                                   duracao_s=duracao, espera_limite_s=espera)
+        return ResultadoTarefa(indice, tarefa.identificador, "ok", resposta=resposta,
+                               duracao_s=duracao, espera_limite_s=espera)
+
+    if not tarefas:
+        return []
+
+    print(f"🚀 Executando {len(tarefas)} tarefa(s) em lote com até {max_workers} worker(s)...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = [executor.submit(contextvars.copy_context().run, _executar, i, tarefa)
+                   for i, tarefa in enumerate(tarefas)]
+        resultados = [futuro.result() for futuro in futuros]
+
+    ok = sum(1 for r in resultados if r.status == "ok")
+    print(f"✅ Lote concluído: {ok}/{len(resultados)} tarefa(s) com sucesso.")
+    return resultados
+
+
+### Testes ###
+
+class RelogioFalso:
+    """Substitui o módulo time nos testes: sleep avança o relógio em vez de esperar."""
+
+    def __init__(self):
+        self.agora = 1000.0
+
+    def monotonic(self) -> float:
+        return self.agora
+
+    perf_counter = monotonic
+
+    def sleep(self, segundos: float):
+        self.agora += segundos
+
+
+class TestLimitadorTaxa(unittest.TestCase):
+    def setUp(self):
+        from unittest import mock
+
+        self.relogio = RelogioFalso()
+        patcher = mock.patch(f"{__name__}.time", self.relogio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pedido_maior_que_o_tpm_limitado_a_capacidade(self):
+        limitador = LimitadorTaxa(limite_rpm=60, limite_tpm=1000)
+        self.assertEqual(limitador.adquirir(5000), 0.0)  # não trava: consome o balde inteiro
+        self.assertEqual(limitador.balde_tokens.disponivel, 0.0)
+        # 500 tokens a 1000/min: 30 s até o balde repor
+        self.assertAlmostEqual(limitador.adquirir(500), 30.0)
+
+    def test_rpm_espaca_as_requisicoes(self):
+        limitador = LimitadorTaxa(limite_rpm=2, limite_tpm=1_000_000)
+        self.assertEqual(limitador.adquirir(10), 0.0)
+        self.assertEqual(limitador.adquirir(10), 0.0)
+        self.assertAlmostEqual(limitador.adquirir(10), 30.0)
+
+    def test_balde_nao_passa_da_capacidade(self):
+        balde = BaldeDeTokens(120)
+        balde.consumir(100)
+        self.assertAlmostEqual(balde.tempo_ate_disponivel(120, self.relogio.agora), 50.0)
+        self.assertEqual(balde.tempo_ate_disponivel(120, self.relogio.agora + 3600), 0.0)
+        self.assertEqual(balde.disponivel, 120.0)
+
+
+class TestExecutarLote(unittest.TestCase):
+    def test_resultados_na_ordem_da_entrada(self):
+        def enviar(prompt: str) -> str:
+            if prompt == "falha":
+                raise RuntimeError("sem conexão")
+            time.sleep(0.01 * (5 - len(prompt)))  # os primeiros terminam por último
+            return "Erro ao gerar resumo." if prompt == "e" else prompt.upper()
+
+        tarefas = [TarefaPrompt(p, identificador=p) for p in ("a", "bb", "falha", "e", "cccc")]
+        resultados = executar_lote(tarefas, enviar, max_workers=5, limitador=LimitadorTaxa(1000, 1_000_000),
+                                   eh_erro=lambda resposta: resposta.startswith("Erro"))
+        self.assertEqual([r.identificador for r in resultados], ["a", "bb", "falha", "e", "cccc"])
+        self.assertEqual([r.status for r in resultados], ["ok", "ok", "erro", "erro", "ok"])
+        self.assertEqual(resultados[2].erro, "sem conexão")
+        self.assertEqual(resultados[4].resposta, "CCCC")
+
+    def test_limitador_unico_por_modelo(self):
+        self.assertIs(limitador_compartilhado("modelo-a"), limitador_compartilhado("modelo-a"))
+        self.assertIsNot(limitador_compartilhado("modelo-a"), limitador_compartilhado("modelo-b"))
+        limitador = limitador_compartilhado("modelo-a")
+        self.assertEqual(limitador.balde_requisicoes.capacidade, LIMITE_RPM_PADRAO)
+        self.assertEqual(limitador.balde_tokens.capacidade, LIMITE_TPM_PADRAO)
+
+    def test_chamadas_dos_workers_somam_no_job(self):
+        coletor = Telemetria()
+
+        def chamar_llm(prompt: str) -> str:
+            coletor.registrar_chamada_llm("modelo", 0.01, tokens_prompt=10, tokens_resposta=5)
+            return prompt
+
+        def job(prompt: str) -> tuple[list, dict]:
+            with coletor.acumular_chamadas() as uso:
+                # Lote aninhado (ex.: blocos do map-reduce) dentro do job, em outras threads
+                internos = executar_lote([TarefaPrompt(f"{prompt}.{i}") for i in range(3)], chamar_llm, max_workers=3)
+                chamar_llm(prompt)
+            return internos, uso
+
+        resultados = executar_lote([TarefaPrompt("a"), TarefaPrompt("b")], job, max_workers=2)
+        for resultado in resultados:
+            _, uso = resultado.resposta
+            self.assertEqual(uso["chamadas"], 4)
+            self.assertEqual(uso["tokens_prompt"], 40)
+            self.assertEqual(uso["tokens_resposta"], 20)
+        self.assertEqual(coletor.resumo()["chamadas_llm"], 8)
@@ -0,0 +1,194 @@
+import json
+import tempfile
+import time
+import unittest
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from resiliencia import PoliticaRetentativa, executar_com_retentativas
+
+# --- Execução de Prompts pela Batch API da OpenAI ---
+# Em vez de uma chamada síncrona por prompt, todos os jobs vão para um arquivo JSONL (uma requisição por linha,
+# identificada pelo 'custom_id'), que é enviado de uma vez. A OpenAI processa o lote em até 24h com preço
+# reduzido e limites de taxa próprios; o resultado é outro JSONL, juntado de volta aos jobs pelo 'custom_id'.
+# Ideal para execuções noturnas, em que a latência não importa.
+
+ENDPOINT_CHAT = "/v1/chat/completions"
+JANELA_CONCLUSAO_PADRAO = "24h"
+INTERVALO_CONSULTA_PADRAO_S = 30.0
+STATUS_FINAIS = ("completed", "failed", "expired", "cancelled")
+
+
+@dataclass
+class JobBatch:
+    """
+    Uma requisição do lote. 'parametros' são os mesmos de client.chat.completions.create;
+    'custom_id' precisa ser único no arquivo.
+    """
+    custom_id: str
+    parametros: dict
+    metadados: dict = field(default_factory=dict)
+
+
+@dataclass
+class ResultadoJobBatch:
+    """
+    Resultado de um job, juntado pelo 'custom_id'. 'status' é 'ok' ou 'erro'.
+    """
+    custom_id: str
+    status: str
+    resposta: str | None = None
+    modelo: str | None = None
+    uso: dict | None = None
+    erro: str | None = None
+
+
+def linha_batch(job: JobBatch, endpoint: str = ENDPOINT_CHAT) -> dict:
+    """Uma linha do arquivo de entrada no formato da Batch API."""
+    return {"custom_id": job.custom_id, "method": "POST", "url": endpoint, "body": job.parametros}
+
+
+def gravar_arquivo_batch(jobs: list[JobBatch], caminho: Path, endpoint: str = ENDPOINT_CHAT) -> Path:
+    """Grava os jobs em JSONL (um por linha). Levanta ValueError se houver 'custom_id' repetido."""
+    ids = [job.custom_id for job in jobs]
+    repetidos = sorted({custom_id for custom_id in ids if ids.count(custom_id) > 1})
+    if repetidos:
+        raise ValueError(f"custom_id repetido(s) no lote: {', '.join(repetidos)}")
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        for job in jobs:
+            arquivo.write(json.dumps(linha_batch(job, endpoint), ensure_ascii=False) + "\n")
+    return caminho
+
+
+def interpretar_linha_resultado(linha: dict) -> ResultadoJobBatch:
+    """Converte uma linha do arquivo de saída (ou de erros) da Batch API em ResultadoJobBatch."""
+    custom_id = linha.get("custom_id", "")
+    resposta = linha.get("response") or {}
+    erro = linha.get("error")
+    corpo = resposta.get("body") or {}
+    if erro or resposta.get("status_code") != 200:
+        detalhe = erro or corpo.get("error") or {}
+        mensagem = detalhe.get("message") if isinstance(detalhe, dict) else str(detalhe)
+        return ResultadoJobBatch(custom_id, "erro",
+                                 erro=f"HTTP {resposta.get('status_code', 'n/d')}: {mensagem or 'erro desconhecido'}")
+    conteudo = corpo["choices"][0]["message"]["content"] or ""
+    return ResultadoJobBatch(custom_id, "ok", resposta=conteudo.strip(), modelo=corpo.get("model"),
+                             uso=corpo.get("usage"))
+
+
+def _ler_arquivo_remoto(cliente, arquivo_id: str | None, politica: PoliticaRetentativa) -> list[dict]:
+    if not arquivo_id:
+        return []
+    conteudo, _ = executar_com_retentativas(lambda: cliente.files.content(arquivo_id).text, politica)
+    return [json.loads(linha) for linha in conteudo.splitlines() if linha.strip()]
+
+
+class ExecutorBatch:
+    """
+    Envia um arquivo de jobs à Batch API, acompanha o processamento e junta os resultados aos jobs.
+    As chamadas de controle (upload, consulta, download) usam a mesma política de retentativas das chamadas ao LLM.
+    """
+
+    def __init__(self, cliente, intervalo_consulta_s: float = INTERVALO_CONSULTA_PADRAO_S,
+                 janela_conclusao: str = JANELA_CONCLUSAO_PADRAO, politica: PoliticaRetentativa | None = None):
+        self.cliente = cliente
+        self.intervalo_consulta_s = intervalo_consulta_s
+        self.janela_conclusao = janela_conclusao
+        self.politica = politica or PoliticaRetentativa()
+
+    def submeter(self, caminho_jsonl: Path, metadados: dict | None = None) -> Any:
+        """Envia o arquivo (purpose='batch') e cria o lote. Retorna o objeto Batch."""
+        def enviar_arquivo():
+            with open(caminho_jsonl, "rb") as arquivo:
+                return self.cliente.files.create(file=arquivo, purpose="batch")
+
+        arquivo_remoto, _ = executar_com_retentativas(enviar_arquivo, self.politica)
+        lote, _ = executar_com_retentativas(lambda: self.cliente.batches.create(
+            input_file_id=arquivo_remoto.id, endpoint=ENDPOINT_CHAT, completion_window=self.janela_conclusao,
+            metadata=metadados or None), self.politica)
+        print(f"📦 Lote '{lote.id}' criado a partir de '{caminho_jsonl}' (arquivo {arquivo_remoto.id}).")
+        return lote
+
+    def aguardar(self, lote_id: str, tempo_maximo_s: float | None = None) -> Any:
+        """Consulta o lote a cada 'intervalo_consulta_s' até um status final. Retorna o objeto Batch."""
+        inicio = time.monotonic()
+        status_anterior = None
+        while True:
+            lote, _ = executar_com_retentativas(lambda: self.cliente.batches.retrieve(lote_id), self.politica)
+            contagem = getattr(lote, "request_counts", None)
+            if lote.status != status_anterior:
+                progresso = (f" ({contagem.completed + contagem.failed}/{contagem.total})"
+                             if contagem is not None and contagem.total else "")
+                print(f"  ⏳ Lote '{lote_id}': {lote.status}{progresso}")
+                status_anterior = lote.status
+            if lote.status in STATUS_FINAIS:
+                return lote
+            if tempo_maximo_s is not None and time.monotonic() - inicio > tempo_maximo_s:
+                raise TimeoutError(f"Lote '{lote_id}' não terminou em {tempo_maximo_s:.0f}s (status: {lote.status}).")
+            time.sleep(self.intervalo_consulta_s)
+
+    def baixar_resultados(self, lote) -> dict[str, ResultadoJobBatch]:
+        """Lê os arquivos de saída e de erros do lote, indexados pelo 'custom_id'."""
+        linhas = (_ler_arquivo_remoto(self.cliente, lote.output_file_id, self.politica)
+                  + _ler_arquivo_remoto(self.cliente, lote.error_file_id, self.politica))
+        resultados = {}
+        for linha in linhas:
+            resultado = interpretar_linha_resultado(linha)
+            resultados[resultado.custom_id] = resultado
+        return resultados
+
+    def executar(self, jobs: list[JobBatch], caminho_jsonl: Path, metadados: dict | None = None,
+                 tempo_maximo_s: float | None = None) -> list[ResultadoJobBatch]:
+        """
+        Grava, envia e aguarda o lote, devolvendo um resultado por job, na ordem de 'jobs'.
+        Jobs sem linha no resultado (lote expirado, cancelado ou com falha) voltam como erro.
+        """
+        if not jobs:
+            return []
+        gravar_arquivo_batch(jobs, caminho_jsonl)
+        lote = self.submeter(caminho_jsonl, metadados)
+        lote = self.aguardar(lote.id, tempo_maximo_s)
+        resultados = self.baixar_resultados(lote)
+        if lote.status != "completed":
+            print(f"  ⚠️ Lote '{lote.id}' terminou com status '{lote.status}'.")
+        return [resultados.get(job.custom_id) or
+                ResultadoJobBatch(job.custom_id, "erro", erro=f"Sem resultado no lote (status '{lote.status}').")
+                for job in jobs]
+
+
+### Testes ###
+
+class TestExecutorBatch(unittest.TestCase):
+    def _job(self, custom_id: str, modelo: str = "gpt-4o-mini") -> JobBatch:
+        return JobBatch(custom_id, {"model": modelo, "messages": [{"role": "user", "content": custom_id}],
+                                    "max_tokens": 20})
+
+    def test_custom_id_repetido(self):
+        with tempfile.TemporaryDirectory() as temporario:
+            with self.assertRaises(ValueError):
+                gravar_arquivo_batch([self._job("a"), self._job("b"), self._job("a")], Path(temporario) / "lote.jsonl")
+
+    def test_interpretar_linha_de_erro(self):
+        linha = {"custom_id": "x", "response": {"status_code": 400, "body": {"error": {"message": "inválido"}}}}
+        self.assertEqual(interpretar_linha_resultado(linha), ResultadoJobBatch("x", "erro", erro="HTTP 400: inválido"))
+        expirada = {"custom_id": "y", "response": None, "error": {"code": "batch_expired", "message": "expirou"}}
+        self.assertEqual(interpretar_linha_resultado(expirada).erro, "HTTP n/d: expirou")
+
+    def test_resultados_juntados_pelo_custom_id_na_ordem_dos_jobs(self):
+        from openai import OpenAI
+        from servidor_mock_openai import ConfiguracaoMock, ServidorMockOpenAI
+
+        config = ConfiguracaoMock(latencia_s=0.0, atraso_lote_s=0.05, modelos_indisponiveis=("fora-do-ar",))
+        jobs = [self._job("vendas"), self._job("categorias", "fora-do-ar"), self._job("produtos")]
+        with ServidorMockOpenAI(config) as servidor, tempfile.TemporaryDirectory() as temporario:
+            cliente = OpenAI(api_key="teste", base_url=servidor.url, max_retries=0)
+            executor = ExecutorBatch(cliente, intervalo_consulta_s=0.02)
+            resultados = executor.executar(jobs, Path(temporario) / "lote.jsonl", tempo_maximo_s=10)
+        self.assertEqual([r.custom_id for r in resultados], ["vendas", "categorias", "produtos"])
+        self.assertEqual([r.status for r in resultados], ["ok", "erro", "ok"])
+        self.assertIn("HTTP 503", resultados[1].erro)
+        self.assertEqual(resultados[0].modelo, "gpt-4o-mini")
+        self.assertTrue(resultados[2].resposta)
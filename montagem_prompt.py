@@ -0,0 +1,304 @@
+import hashlib
+import json
+import tempfile
+import threading
+import time
+import unittest
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+
+from cache_dados import CacheDadosZ, ImpressaoDigital, gravar_atomico
+from estatisticas_aproximadas import chave_estatisticas, descrever
+from serializacao_tabelas import chave_serializacao, formatador_tabela
+from telemetria import etapa
+
+# --- Montagem do Bloco de Dados do Prompt ---
+# Cada arquivo .z vira uma "seção" de texto. As seções são geradas uma a uma e unidas com "".join
+# (custo linear no tamanho total) e cada seção renderizada é guardada em cache, indexada pela impressão
+# digital do arquivo e pelas configurações de redução: só arquivos alterados são renderizados de novo.
+
+CABECALHO_DADOS = "### DADOS A SEREM ANALISADOS ###\n\n"
+# Limites padrão do cache de seções: 100 MB em disco e seções sem uso há mais de 30 dias são removidas.
+TAMANHO_MAXIMO_SECOES_BYTES = 100 * 1024 * 1024
+IDADE_MAXIMA_SECOES_S = 30 * 24 * 3600
+
+
+@dataclass(frozen=True)
+class ConfiguracaoReducao:
+    """
+    Limites de linhas da estratégia de redução agressiva.
+    DataFrames com até 'rows_small_df' linhas entram completos; os demais entram com head/tail e describe().
+    """
+    rows_small_df: int = 75
+    rows_medium_df_headtail: int = 15
+    rows_large_df_headtail: int = 10
+    rows_very_large_df_headtail: int = 5
+    limite_medium_df: int = 200
+    limite_very_large_df: int = 3000
+
+    def chave(self) -> str:
+        """Chave estável das configurações, incluindo as opções de exibição do pandas que afetam o texto."""
+        return json.dumps({'reducao': asdict(self), 'pandas': chave_opcoes_pandas(),
+                           'estatisticas': chave_estatisticas(), 'serializacao': chave_serializacao()},
+                          sort_keys=True, default=str)
+
+
+def chave_opcoes_pandas() -> str:
+    """Opções de exibição do pandas que alteram o texto de to_string(), serializadas de forma estável."""
+    opcoes = {
+        opcao: pd.get_option(opcao)
+        for opcao in ('display.max_rows', 'display.max_columns', 'display.width', 'display.max_colwidth')
+    }
+    return json.dumps(opcoes, sort_keys=True, default=str)
+
+
+def cabecalho_secao(nome: str, df_content) -> str:
+    df_shape = df_content.shape if hasattr(df_content, 'shape') else (0,0)
+    return f"### Arquivo: {nome} (Shape: {df_shape}) ###\n"
+
+
+def eh_dataframe(df_content) -> bool:
+    return hasattr(df_content, 'to_string') and hasattr(df_content, 'describe')
+
+
+def partes_head_tail(nome: str, df_content, head_n: int, tail_n: int) -> list[str]:
+    """Blocos com as primeiras 'head_n' e as últimas 'tail_n' linhas do DataFrame (ver serializacao_tabelas)."""
+    with etapa("to_string", arquivo=nome, linhas=head_n + tail_n):
+        formatar = formatador_tabela(df_content)
+        texto_head = formatar(df_content.head(head_n))
+        texto_tail = formatar(df_content.tail(tail_n))
+    return [
+        f"--- INÍCIO DAS PRIMEIRAS {head_n} LINHAS DE {nome} ---\n",
+        texto_head,
+        f"\n--- FIM DAS PRIMEIRAS {head_n} LINHAS DE {nome} ---\n\n",
+        f"--- INÍCIO DAS ÚLTIMAS {tail_n} LINHAS DE {nome} ---\n",
+        texto_tail,
+        f"\n--- FIM DAS ÚLTIMAS {tail_n} LINHAS DE {nome} ---\n\n",
+    ]
+
+
+def partes_describe(nome: str, df_content) -> list[str]:
+    """
+    Bloco com o describe(include='all') do DataFrame (ou o aviso de indisponível). Em tabelas enormes as
+    estatísticas são aproximadas (ver estatisticas_aproximadas) e o bloco informa o limite de erro.
+    """
+    try:
+        with etapa("describe", arquivo=nome):
+            estatisticas = descrever(nome, df_content)
+            describe = estatisticas.to_string()
+            if nota := estatisticas.attrs.get("nota_aproximacao"):
+                describe += f"\n({nota})"
+    except Exception as e:
+        print(f"    ⚠️ Não foi possível gerar describe() para {nome}: {e}")
+        return [
+            f"--- RESUMO ESTATÍSTICO (DESCRIBE) DE {nome} ---\n",
+            f"--- RESUMO ESTATÍSTICO (DESCRIBE) DE {nome} INDISPONÍVEL ---\n",
+        ]
+    return [
+        f"--- RESUMO ESTATÍSTICO (DESCRIBE) DE {nome} ---\n",
+        describe,
+        f"\n--- FIM DO RESUMO ESTATÍSTICO DE {nome} ---\n",
+    ]
+
+
+def renderizar_secao(nome: str, df_content, config: ConfiguracaoReducao) -> str:
+    """
+    Renderiza a seção de um arquivo (cabeçalho, linhas selecionadas e describe()) como texto.
+    """
+    with etapa("reduzir", arquivo=nome, estrategia="linhas_fixas"):
+        return _renderizar_secao(nome, df_content, config)
+
+
+def _renderizar_secao(nome: str, df_content, config: ConfiguracaoReducao) -> str:
+    partes = [cabecalho_secao(nome, df_content)]
+
+    if not eh_dataframe(df_content):
+        print(f"  📄 Conteúdo não é DataFrame ou não tem os métodos esperados (convertendo como string genérica): {nome}")
+        partes.append(str(df_content))
+        partes.append("\n\n")
+        return "".join(partes)
+
+    num_rows = df_content.shape[0]
+
+    if num_rows <= config.rows_small_df:
+        print(f"  📄 Incluindo DataFrame completo (<= {config.rows_small_df} linhas): {nome}")
+        with etapa("to_string", arquivo=nome, linhas=num_rows):
+            partes.append(formatador_tabela(df_content)(df_content))
+    else:
+        head_n, tail_n = config.rows_large_df_headtail, config.rows_large_df_headtail
+        if num_rows <= config.limite_medium_df:
+            head_n, tail_n = config.rows_medium_df_headtail, config.rows_medium_df_headtail
+        elif num_rows > config.limite_very_large_df:
+            head_n, tail_n = config.rows_very_large_df_headtail, config.rows_very_large_df_headtail
+
+        print(f"  📄 Incluindo head({head_n}), tail({tail_n}) e describe() para: {nome}")
+        partes += partes_head_tail(nome, df_content, head_n, tail_n)
+        partes += partes_describe(nome, df_content)
+
+    partes.append("\n\n")
+    return "".join(partes)
+
+
+class CacheSecoes:
+    """
+    Cache (memória + disco) das seções já renderizadas, indexado por hash do arquivo, nome e configurações.
+    A data de modificação de cada arquivo marca o último uso: seções sem uso há mais de 'idade_maxima_s' são
+    removidas e, se o total passar de 'tamanho_maximo_bytes', saem as menos usadas recentemente (LRU).
+    """
+
+    def __init__(self, diretorio_cache: Path, tamanho_maximo_bytes: int = TAMANHO_MAXIMO_SECOES_BYTES,
+                 idade_maxima_s: float = IDADE_MAXIMA_SECOES_S):
+        self.diretorio = Path(diretorio_cache)
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.tamanho_maximo_bytes = tamanho_maximo_bytes
+        self.idade_maxima_s = idade_maxima_s
+        self._memoria = {}
+        self._lock = threading.Lock()
+        self._locks_chave = {}  # chave -> Lock: gravações da mesma seção não se intercalam
+        with self._lock:
+            self._tamanho_total = self._remover_excedentes(time.time())
+
+    @staticmethod
+    def chave(impressao: ImpressaoDigital, nome: str, chave_config: str) -> str:
+        return CacheSecoes.chave_de(impressao.hash, nome, chave_config)
+
+    @staticmethod
+    def chave_de(*partes: str) -> str:
+        """Chave a partir de partes arbitrárias (ex.: conteúdo derivado de vários arquivos)."""
+        return hashlib.sha256("\0".join(partes).encode('utf-8')).hexdigest()
+
+    def obter(self, chave: str) -> str | None:
+        caminho = self.diretorio / f"{chave}.txt"
+        with self._lock:
+            texto = self._memoria.get(chave)
+        if texto is None:
+            try:
+                texto = caminho.read_text(encoding='utf-8')
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                self._memoria[chave] = texto
+        try:
+            caminho.touch()  # último uso, para a remoção LRU
+        except FileNotFoundError:
+            with self._lock:
+                self._memoria.pop(chave, None)
+            return None
+        return texto
+
+    def guardar(self, chave: str, texto: str):
+        caminho = self.diretorio / f"{chave}.txt"
+        with self._lock:
+            lock_chave = self._locks_chave.setdefault(chave, threading.Lock())
+        with lock_chave:
+            try:
+                tamanho_anterior = caminho.stat().st_size
+            except FileNotFoundError:
+                tamanho_anterior = 0
+            gravar_atomico(caminho, lambda temporario: temporario.write_text(texto, encoding='utf-8'))
+            with self._lock:
+                self._memoria[chave] = texto
+                self._tamanho_total += caminho.stat().st_size - tamanho_anterior
+                if self._tamanho_total > self.tamanho_maximo_bytes:
+                    self._tamanho_total = self._remover_excedentes(time.time())
+
+    def _remover_excedentes(self, agora: float) -> int:
+        """Remove as seções vencidas e, acima do limite de tamanho, as menos usadas. Retorna o total restante."""
+        arquivos = []
+        for caminho in self.diretorio.glob("*.txt"):
+            try:
+                info = caminho.stat()
+            except FileNotFoundError:
+                continue
+            if agora - info.st_mtime > self.idade_maxima_s:
+                self._remover(caminho)
+            else:
+                arquivos.append((info.st_mtime, info.st_size, caminho))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, caminho in sorted(arquivos, key=lambda arquivo: arquivo[0]):
+            if total <= self.tamanho_maximo_bytes:
+                break
+            self._remover(caminho)
+            total -= tamanho
+        return total
+
+    def _remover(self, caminho: Path):
+        caminho.unlink(missing_ok=True)
+        self._memoria.pop(caminho.stem, None)
+        self._locks_chave.pop(caminho.stem, None)
+
+
+def gerar_secoes(arquivos: list[Path], cache_dados: CacheDadosZ, cache_secoes: CacheSecoes,
+                 config: ConfiguracaoReducao) -> Iterator[str]:
+    """
+    Gera, em ordem, a seção de texto de cada arquivo .z. Se a seção do arquivo (mesma impressão digital
+    e mesmas configurações) já estiver em cache, o arquivo nem chega a ser carregado.
+    """
+    chave_config = config.chave()
+    for arquivo in arquivos:
+        try:
+            impressao = cache_dados.impressao_digital(arquivo)
+        except OSError as e:
+            print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
+            continue
+        chave = CacheSecoes.chave(impressao, arquivo.name, chave_config)
+        secao = cache_secoes.obter(chave)
+        if secao is not None:
+            print(f"  ♻️ Seção reaproveitada do cache (arquivo inalterado): {arquivo.name}")
+            yield secao
+            continue
+        try:
+            df_content = cache_dados.carregar(arquivo, impressao)
+        except Exception as e:
+            print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
+            continue
+        secao = renderizar_secao(arquivo.name, df_content, config)
+        cache_secoes.guardar(chave, secao)
+        yield secao
+
+
+def montar_conteudo_dados(arquivos: list[Path], cache_dados: CacheDadosZ, cache_secoes: CacheSecoes,
+                          config: ConfiguracaoReducao | None = None) -> str:
+    """
+    Monta o bloco '### DADOS A SEREM ANALISADOS ###' completo a partir das seções dos arquivos.
+    """
+    config = config or ConfiguracaoReducao()
+    partes = [CABECALHO_DADOS]
+    partes.extend(gerar_secoes(arquivos, cache_dados, cache_secoes, config))
+    return "".join(partes)
+
+
+### Testes ###
+
+class TestCacheSecoes(unittest.TestCase):
+    def setUp(self):
+        self._temporario = tempfile.TemporaryDirectory()
+        self.diretorio = Path(self._temporario.name)
+
+    def tearDown(self):
+        self._temporario.cleanup()
+
+    def test_gravacoes_concorrentes_da_mesma_chave(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        cache = CacheSecoes(self.diretorio)
+        chave = CacheSecoes.chave_de("tabela.z", "config")
+        textos = [f"seção {i}\n" * 200 for i in range(10)]
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            list(executor.map(lambda texto: cache.guardar(chave, texto), textos * 5))
+        self.assertIn((self.diretorio / f"{chave}.txt").read_text(encoding='utf-8'), textos)
+        self.assertEqual(list(self.diretorio.glob("*.tmp")), [])
+        # Regravar a mesma chave não conta o tamanho duas vezes
+        self.assertEqual(cache._tamanho_total, (self.diretorio / f"{chave}.txt").stat().st_size)
+
+    def test_limite_de_tamanho_remove_menos_usadas(self):
+        cache = CacheSecoes(self.diretorio, tamanho_maximo_bytes=250)
+        chaves = [CacheSecoes.chave_de(str(i)) for i in range(3)]
+        for chave in chaves:
+            cache.guardar(chave, "x" * 100)
+            time.sleep(0.01)  # mtimes distintos para a ordem LRU
+        self.assertIsNone(cache.obter(chaves[0]))
+        self.assertEqual(cache.obter(chaves[2]), "x" * 100)
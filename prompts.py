@@ -1,10 +1,34 @@
+import argparse
 import os
-import joblib
 import re
+import sys
+import threading
+from functools import partial
 import pandas as pd
 from openai import OpenAI
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Callable
+import time
+
+from agregacao_streaming import EXTENSOES_EM_BLOCOS
+from cache_dados import CacheDadosZ
+from cache_respostas import CacheRespostasLLM, chave_cache
+from estatisticas_aproximadas import configurar_estatisticas
+from montagem_prompt import CABECALHO_DADOS, CacheSecoes, ConfiguracaoReducao, montar_conteudo_dados
+from indicadores import montar_bloco_indicadores
+from reducao_orcamento import (JANELA_CONTEXTO_PADRAO, JANELAS_CONTEXTO, ajustar_blocos_pre_calculados,
+                                calcular_orcamento_dados, montar_conteudo_dados_com_orcamento)
+from resiliencia import PoliticaRetentativa, RegistroDisjuntores, eh_erro_contexto
+from roteamento import Provedor, RoteadorLLM, executar_com_failover, provedor_local_do_ambiente
+from serializacao_tabelas import FORMATOS_TABELA, configurar_serializacao
+from sumarizacao_map_reduce import montar_secoes_map_reduce
+from resumo_incremental import gerar_resumo_incremental
+from tokenizacao import obter_contador
+from streaming import MedidorStreaming, MetricasStreaming, ReceptorDeltas, SaidaIncremental, imprimir_delta
+from telemetria import acumular_chamadas, configurar_telemetria, etapa, telemetria
+from lote import TarefaPrompt, LimitadorTaxa, executar_lote, limitador_compartilhado, MAX_WORKERS_PADRAO
+from lote_batch import INTERVALO_CONSULTA_PADRAO_S, ExecutorBatch, JobBatch
 
 # --- Configurações Iniciais ---
 # Configurar Pandas para não truncar a saída de .to_string()
@@ -21,12 +45,58 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise ValueError("OPENAI_API_KEY não encontrada no arquivo .env ou nas variáveis de ambiente.")
 
-# Inicializar o cliente da OpenAI
-client = OpenAI(api_key=openai_api_key)
+# Cliente da OpenAI, criado no primeiro uso e reaproveitado (pool de conexões keep-alive) por todo o processo.
+# As retentativas ficam a cargo de resiliencia.py (backoff com jitter, Retry-After e disjuntor por modelo)
+_client = None
+_lock_client = threading.Lock()
+
+def obter_cliente() -> OpenAI:
+    global _client
+    with _lock_client:
+        if _client is None:
+            _client = OpenAI(api_key=openai_api_key, max_retries=0)
+        return _client
+
+_provedores_nuvem: dict[str, Provedor] = {}
+
+def provedor_nuvem(modelo: str) -> Provedor:
+    """Provedor do modelo 'modelo' na API da OpenAI, usando o cliente compartilhado do processo."""
+    with _lock_client:
+        if modelo not in _provedores_nuvem:
+            _provedores_nuvem[modelo] = Provedor(modelo, modelo, JANELAS_CONTEXTO.get(modelo, JANELA_CONTEXTO_PADRAO),
+                                                 obter_cliente)
+        return _provedores_nuvem[modelo]
 
 # Modelo OpenAI Fixo para os testes
 MODELO_ID_FIXO = "gpt-4o-mini"
 NOME_SUBPASTA_MODELO = "gpt4mini" # Nome da subpasta para os resultados
+MAX_TOKENS_RESPOSTA = 4096 # Um valor alto para garantir espaço para a resposta
+SYSTEM_MESSAGE = "Você é um especialista contábil e financeiro altamente qualificado, capaz de adaptar seu estilo de comunicação e análise conforme solicitado."
+# Orçamento de tokens do bloco de dados. 0 (padrão) = calcular pela janela de contexto do modelo.
+ORCAMENTO_TOKENS_DADOS = int(os.getenv("LLM_ORCAMENTO_TOKENS_DADOS", "0"))
+# Resumir por map-reduce (chamadas paralelas ao LLM) os DataFrames grandes em vez de enviar só head/tail.
+USAR_MAP_REDUCE = os.getenv("LLM_MAP_REDUCE", "").lower() in ("1", "true", "sim")
+# Exibir e gravar as respostas à medida que são geradas (stream=True), medindo TTFT e tokens/s.
+USAR_STREAMING = os.getenv("LLM_STREAMING", "").lower() in ("1", "true", "sim")
+# Gerar o resumo do prompt1 seção a seção, refazendo só as seções cujas tabelas mudaram desde a última execução.
+USAR_INCREMENTAL = os.getenv("LLM_INCREMENTAL", "").lower() in ("1", "true", "sim")
+# Incluir os exports CSV/Parquet do diretório (sem .z correspondente), lidos em blocos com memória limitada.
+USAR_LEITURA_EM_BLOCOS = os.getenv("LLM_DADOS_EM_BLOCOS", "").lower() in ("1", "true", "sim")
+# Resiliência: tentativas por modelo, modelos alternativos (em ordem) e fração mínima do orçamento de dados
+# ao refazer um prompt que excedeu o contexto.
+POLITICA_RETENTATIVA = PoliticaRetentativa(max_tentativas=int(os.getenv("LLM_MAX_TENTATIVAS", "5")))
+MODELOS_FALLBACK = [modelo.strip() for modelo in os.getenv("LLM_MODELOS_FALLBACK", "gpt-4.1-mini").split(",") if modelo.strip()]
+FRACAO_MINIMA_DADOS = 0.125
+disjuntores = RegistroDisjuntores()
+# Roteamento: com LLM_LOCAL_BASE_URL (Ollama, llama.cpp), prompts pequenos vão primeiro ao modelo local
+# e os grandes à nuvem, com failover entre eles (ver roteamento.py).
+roteador = RoteadorLLM([provedor for provedor in [provedor_local_do_ambiente()] if provedor is not None])
+# Telemetria: eventos JSONL de cada chamada/etapa e métricas Prometheus (endpoint /metrics e/ou arquivo).
+TELEMETRIA_JSONL = os.getenv("LLM_TELEMETRIA_JSONL")
+PROMETHEUS_PORTA = int(os.getenv("LLM_PROMETHEUS_PORTA", "0"))
+PROMETHEUS_ARQUIVO = os.getenv("LLM_PROMETHEUS_ARQUIVO")
+# Batch API: intervalo entre consultas ao status do lote.
+INTERVALO_CONSULTA_BATCH_S = float(os.getenv("LLM_BATCH_INTERVALO_S", str(INTERVALO_CONSULTA_PADRAO_S)))
 
 # Diretórios Base
 base_dir = Path(__file__).resolve().parent
@@ -36,6 +106,18 @@ base_dir = Path(__file__).resolve().parent
 # Para este código, estou focando na leitura de .z como a principal fonte de dados contábeis estruturados.
 data_dir_z = base_dir.parent.parent / 'util' / 'data'
 relatorio_dir_base = base_dir / 'task18_resultados' # Pasta principal de saída
+cache_dir = base_dir / '.cache_llm' # Caches locais (respostas do LLM, dados convertidos)
+
+# Cache persistente de respostas do LLM. Defina LLM_CACHE_DESATIVADO=1 para ignorá-lo em todas as chamadas.
+cache_respostas = CacheRespostasLLM(cache_dir / 'respostas.sqlite')
+CACHE_DESATIVADO = os.getenv("LLM_CACHE_DESATIVADO", "").lower() in ("1", "true", "sim")
+# Cópias colunares (mapeadas em memória) dos arquivos .z, reaproveitadas enquanto o arquivo não mudar.
+cache_dados = CacheDadosZ(cache_dir / 'dados_z')
+# Seções de texto já renderizadas por arquivo, indexadas pela impressão digital e pelas configurações de redução.
+cache_secoes = CacheSecoes(cache_dir / 'secoes')
+# Sketches (quantis, distintos, mais frequentes) das tabelas enormes, reaproveitados enquanto o conteúdo não muda
+# e estendidos quando o arquivo só ganha linhas.
+configurar_estatisticas(cache_dir / 'estatisticas')
 
 # --- Funções de Leitura de Dados ---
 
@@ -54,76 +136,109 @@ def ler_arquivo_csv(caminho_arquivo: Path) -> str | None:
         print(f"Erro ao ler arquivo CSV: '{caminho_arquivo}'. Erro: {e}")
         return None
 
-def carregar_e_processar_dados_para_llm(data_dir: Path) -> str:
+def listar_arquivos_dados(data_dir: Path, em_blocos: bool | None = None) -> list[Path]:
+    """
+    Arquivos .z do diretório e, com 'em_blocos' (padrão: USAR_LEITURA_EM_BLOCOS), os exports CSV/Parquet
+    que não têm um .z de mesmo nome. Os exports são resumidos em blocos (ver agregacao_streaming).
+    """
+    arquivos = sorted(data_dir.glob('*.z'))
+    if USAR_LEITURA_EM_BLOCOS if em_blocos is None else em_blocos:
+        nomes_z = {arquivo.stem for arquivo in arquivos}
+        arquivos += sorted(arquivo for arquivo in data_dir.iterdir()
+                           if arquivo.suffix in EXTENSOES_EM_BLOCOS and arquivo.stem not in nomes_z)
+    return arquivos
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Estimativa grosseira de tokens de um texto (aprox. 4 bytes UTF-8 por token).
+    """
+    return int(len(texto.encode('utf-8')) / 4)
+
+def incluir_blocos_pre_calculados(conteudo_dados: str, bloco_indicadores: str, secoes_map_reduce: str) -> str:
+    """Indicadores antes do bloco de dados; resumos map-reduce como as primeiras seções do bloco de dados."""
+    return bloco_indicadores + conteudo_dados.replace(CABECALHO_DADOS, CABECALHO_DADOS + secoes_map_reduce, 1)
+
+
+def carregar_e_processar_dados_para_llm(data_dir: Path, config_reducao: ConfiguracaoReducao | None = None,
+                                        orcamento_tokens: int | None = None, model_id: str = MODELO_ID_FIXO,
+                                        usar_indicadores: bool = False, usar_map_reduce: bool = False,
+                                        nomes_arquivos: set[str] | None = None) -> str:
     """
     Carrega arquivos .z (DataFrames) de um diretório, aplica uma estratégia de redução
     e retorna o conteúdo como uma string formatada para inclusão no prompt do LLM.
+    Com 'orcamento_tokens', a redução é guiada pelo orçamento (contado com o tokenizador local do modelo)
+    em vez dos limites fixos de linhas, e o resultado nunca passa desse número de tokens: indicadores e resumos
+    map-reduce que não caibam são truncados, e um orçamento menor que o cabeçalho do bloco levanta ValueError.
+    Com 'usar_indicadores', os indicadores pré-calculados sobre a base completa (fluxo de caixa, vendas por
+    categoria, aging, naturezas de custo) substituem as linhas brutas dos arquivos que eles cobrem.
+    Com 'usar_map_reduce', os demais DataFrames grandes são resumidos por completo em blocos paralelos
+    (map-reduce) pelo LLM, no lugar do head/tail.
+    As seções de arquivos inalterados são reaproveitadas do cache, sem recarregar o DataFrame.
+    'nomes_arquivos' restringe o bloco a alguns arquivos do diretório (ex.: as tabelas de uma seção do resumo).
     """
-    arquivos_z = list(data_dir.glob('*.z'))
-    dados = {}
+    with etapa("montar_prompt", diretorio=str(data_dir)) as detalhes:
+        conteudo_dados = _carregar_e_processar_dados_para_llm(data_dir, config_reducao, orcamento_tokens, model_id,
+                                                               usar_indicadores, usar_map_reduce, nomes_arquivos)
+        detalhes["caracteres"] = len(conteudo_dados)
+    return conteudo_dados
+
+def _carregar_e_processar_dados_para_llm(data_dir: Path, config_reducao: ConfiguracaoReducao | None,
+                                         orcamento_tokens: int | None, model_id: str,
+                                         usar_indicadores: bool, usar_map_reduce: bool,
+                                         nomes_arquivos: set[str] | None = None) -> str:
+    arquivos_z = listar_arquivos_dados(data_dir)
+    if nomes_arquivos is not None:
+        arquivos_z = [arquivo for arquivo in arquivos_z if arquivo.name in nomes_arquivos]
     if not arquivos_z:
         print(f"⚠️ Nenhum arquivo .z encontrado em {data_dir}. O conteúdo dos dados estará vazio.")
     else:
-        print(f"Arquivos .z encontrados em {data_dir}:")
+        print(f"Arquivos de dados encontrados em {data_dir}:")
         for arquivo in arquivos_z:
             print(f"  - {arquivo.name}")
-            try:
-                dados[arquivo.name] = joblib.load(arquivo)
-            except Exception as e:
-                print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
-
-    conteudo_dados = "### DADOS A SEREM ANALISADOS ###\n\n"
-    print("\n🔄 Processando DataFrames para inclusão no prompt (estratégia de redução agressiva)...")
-
-    ROWS_SMALL_DF = 75
-    ROWS_MEDIUM_DF_HEADTAIL = 15
-    ROWS_LARGE_DF_HEADTAIL = 10
-    ROWS_VERY_LARGE_DF_HEADTAIL = 5
-
-    for nome, df_content in dados.items():
-        df_shape = df_content.shape if hasattr(df_content, 'shape') else (0,0)
-        conteudo_dados += f"### Arquivo: {nome} (Shape: {df_shape}) ###\n"
-
-        if not hasattr(df_content, 'to_string') or not hasattr(df_content, 'describe'):
-            print(f"  📄 Conteúdo não é DataFrame ou não tem os métodos esperados (convertendo como string genérica): {nome}")
-            conteudo_dados += str(df_content)
-            conteudo_dados += "\n\n"
-            continue
-
-        num_rows = df_shape[0]
-
-        if num_rows <= ROWS_SMALL_DF:
-            print(f"  📄 Incluindo DataFrame completo (<= {ROWS_SMALL_DF} linhas): {nome}")
-            conteudo_dados += df_content.to_string()
-        else:
-            head_n, tail_n = ROWS_LARGE_DF_HEADTAIL, ROWS_LARGE_DF_HEADTAIL
-            if num_rows <= 200:
-                head_n, tail_n = ROWS_MEDIUM_DF_HEADTAIL, ROWS_MEDIUM_DF_HEADTAIL
-            elif num_rows > 3000:
-                head_n, tail_n = ROWS_VERY_LARGE_DF_HEADTAIL, ROWS_VERY_LARGE_DF_HEADTAIL
-
-            print(f"  📄 Incluindo head({head_n}), tail({tail_n}) e describe() para: {nome}")
-            conteudo_dados += f"--- INÍCIO DAS PRIMEIRAS {head_n} LINHAS DE {nome} ---\n"
-            conteudo_dados += df_content.head(head_n).to_string()
-            conteudo_dados += f"\n--- FIM DAS PRIMEIRAS {head_n} LINHAS DE {nome} ---\n\n"
 
-            conteudo_dados += f"--- INÍCIO DAS ÚLTIMAS {tail_n} LINHAS DE {nome} ---\n"
-            conteudo_dados += df_content.tail(tail_n).to_string()
-            conteudo_dados += f"\n--- FIM DAS ÚLTIMAS {tail_n} LINHAS DE {nome} ---\n\n"
+    bloco_indicadores, secoes_map_reduce = "", ""
+    if usar_indicadores and arquivos_z:
+        print("\n📊 Calculando indicadores sobre a base completa...")
+        bloco_indicadores, usados = montar_bloco_indicadores(arquivos_z, cache_dados, cache_secoes)
+        if usados:
+            print(f"  Linhas brutas substituídas pelos indicadores em: {', '.join(sorted(usados))}")
+        arquivos_z = [arquivo for arquivo in arquivos_z if arquivo.name not in usados]
+
+    if usar_map_reduce and arquivos_z:
+        _, contador = obter_contador(model_id)
+        secoes_map_reduce, resumidos = montar_secoes_map_reduce(
+            arquivos_z, cache_dados, cache_secoes, partial(enviar_prompt_para_llm, model_id=model_id), contador,
+            model_id, eh_erro=lambda resposta: "Erro ao gerar resumo." in resposta)
+        arquivos_z = [arquivo for arquivo in arquivos_z if arquivo.name not in resumidos]
+
+    if orcamento_tokens is not None:
+        _, contador = obter_contador(model_id)
+        # O cabeçalho do bloco de dados sempre entra; indicadores e resumos dividem o que sobra com as tabelas
+        bloco_indicadores, secoes_map_reduce = ajustar_blocos_pre_calculados(
+            bloco_indicadores, secoes_map_reduce, orcamento_tokens - contador(CABECALHO_DADOS), contador)
+        blocos_pre_calculados = bloco_indicadores + secoes_map_reduce
+        tokens_pre_calculados = contador(blocos_pre_calculados) if blocos_pre_calculados else 0
+        orcamento_restante = orcamento_tokens - tokens_pre_calculados
+        print(f"\n🔄 Processando DataFrames para inclusão no prompt (orçamento de {orcamento_restante} tokens)...")
+        conteudo_dados, _, nome_tokenizador = montar_conteudo_dados_com_orcamento(
+            arquivos_z, cache_dados, cache_secoes, orcamento_restante, model_id)
+        conteudo_dados = incluir_blocos_pre_calculados(conteudo_dados, bloco_indicadores, secoes_map_reduce)
+        tokens_dados = contador(conteudo_dados)
+        if tokens_dados > orcamento_tokens:
+            raise ValueError(f"O bloco de dados tem {tokens_dados} tokens e não cabe no orçamento de "
+                             f"{orcamento_tokens} tokens (tokenizador '{nome_tokenizador}').")
+        tamanho_kb = len(conteudo_dados.encode('utf-8')) / 1024
+        print(f"ℹ️ Tamanho do 'conteudo_dados': {tamanho_kb:.2f} KB")
+        print(f"ℹ️ Tokens do 'conteudo_dados' (tokenizador '{nome_tokenizador}'): {tokens_dados} de {orcamento_tokens} disponíveis")
+        return conteudo_dados
 
-            try:
-                conteudo_dados += f"--- RESUMO ESTATÍSTICO (DESCRIBE) DE {nome} ---\n"
-                conteudo_dados += df_content.describe(include='all').to_string()
-                conteudo_dados += f"\n--- FIM DO RESUMO ESTATÍSTICO DE {nome} ---\n"
-            except Exception as e:
-                print(f"    ⚠️ Não foi possível gerar describe() para {nome}: {e}")
-                conteudo_dados += f"--- RESUMO ESTATÍSTICO (DESCRIBE) DE {nome} INDISPONÍVEL ---\n"
-
-        conteudo_dados += "\n\n"
+    print("\n🔄 Processando DataFrames para inclusão no prompt (estratégia de redução agressiva)...")
+    conteudo_dados = incluir_blocos_pre_calculados(
+        montar_conteudo_dados(arquivos_z, cache_dados, cache_secoes, config_reducao), bloco_indicadores, secoes_map_reduce)
 
     tamanho_estimado_conteudo_dados_bytes = len(conteudo_dados.encode('utf-8'))
     tamanho_estimado_conteudo_dados_kb = tamanho_estimado_conteudo_dados_bytes / 1024
-    tokens_estimados_dados = tamanho_estimado_conteudo_dados_bytes / 4
+    tokens_estimados_dados = estimar_tokens(conteudo_dados)
 
     print(f"ℹ️ Tamanho estimado do 'conteudo_dados' (estratégia agressiva): {tamanho_estimado_conteudo_dados_kb:.2f} KB")
     print(f"ℹ️ Tokens estimados para 'conteudo_dados' (aprox.): {tokens_estimados_dados:.0f} tokens")
@@ -157,29 +272,92 @@ Use linguagem direta, sem jargões desnecessários, focada em decisões rápidas
 Utilize bullet points para clareza e uma linguagem direta e focada na tomada de decisão."""
 }
 
+# Variantes de resumo (nome usado no arquivo de resultado) e a opção correspondente no menu interativo
+VARIANTES_RESUMO = {'prompt1': "Prompt1_Conciso", 'prompt2': "Prompt2_Estrategico", 'hibrido': "Hibrido_P1_P2"}
+ESCOLHAS_MENU = {'1': 'prompt1', '2': 'prompt2', '3': 'hibrido'}
+
+# Layout estável para o cache de prefixo do provedor: todo prompt começa pelo mesmo bloco de dados, logo após o
+# SYSTEM_MESSAGE, e só depois vêm as instruções da variante (e, no refinador, o resumo base). Assim o system e os
+# dados formam um prefixo idêntico byte a byte entre prompt1, prompt2, as duas etapas do híbrido e execuções
+# repetidas, e a OpenAI cobra esses tokens com desconto e os processa mais rápido (cached_tokens no 'usage').
+SEPARADOR_INSTRUCOES = "\n\n---\n\n"
+
+def prefixo_dados(dados: str) -> str:
+    """Início comum a todos os prompts sobre o mesmo bloco de dados (não coloque nada variável aqui)."""
+    return f"Dados:\n{dados}{SEPARADOR_INSTRUCOES}"
+
+def montar_prompt_unico(prompt_tipo: str, dados: str) -> str:
+    """Prompt de uma etapa só: bloco de dados seguido da instrução."""
+    return f"{prefixo_dados(dados)}{prompts_comparativos[prompt_tipo]}"
+
+def instrucao_prompt_refinador(prompt_refinador_tipo: str) -> str:
+    """Instrução do prompt refinador do fluxo híbrido (vem depois dos dados); o resumo base vem logo em seguida."""
+    return (f"{prompts_comparativos[prompt_refinador_tipo]}\n\nAnalise o seguinte resumo inicial e os dados "
+            f"acima para enriquecer a resposta:\n\nResumo Inicial:\n")
+
+def montar_prompt_refinador(prompt_refinador_tipo: str, resumo_base: str, dados: str) -> str:
+    return f"{prefixo_dados(dados)}{instrucao_prompt_refinador(prompt_refinador_tipo)}{resumo_base}"
+
 # --- Funções de Geração de Resumo ---
 
-def enviar_prompt_para_llm(user_prompt_content: str, model_id: str = MODELO_ID_FIXO) -> str:
-    """
-    Envia um prompt para o Modelo de Linguagem Grande (LLM) da OpenAI e retorna a resposta.
-    """
-    system_message = "Você é um especialista contábil e financeiro altamente qualificado, capaz de adaptar seu estilo de comunicação e análise conforme solicitado."
+def montar_parametros_chat(user_prompt_content: str, model_id: str, max_tokens: int) -> dict:
     messages = [
-        {"role": "system", "content": system_message},
+        {"role": "system", "content": SYSTEM_MESSAGE},
         {"role": "user", "content": user_prompt_content}
     ]
 
-    params = {
+    return {
         "model": model_id,
         "messages": messages,
-        "max_tokens": 4096, # Um valor alto para garantir espaço para a resposta
+        "max_tokens": max_tokens,
         "temperature": 0.3,
         "top_p": 0.9
     }
 
+def enviar_prompt_para_llm(user_prompt_content: str, model_id: str = MODELO_ID_FIXO, usar_cache: bool = True,
+                           max_tokens: int = MAX_TOKENS_RESPOSTA, ao_receber: ReceptorDeltas | None = None,
+                           ao_concluir: Callable[[MetricasStreaming], None] | None = None,
+                           reduzir_prompt: Callable[[], str | None] | None = None) -> str:
+    """
+    Envia um prompt para o Modelo de Linguagem Grande (LLM) da OpenAI e retorna a resposta.
+    Respostas são reaproveitadas do cache em disco quando a mesma requisição já foi feita;
+    use usar_cache=False (ou LLM_CACHE_DESATIVADO=1) para forçar uma nova chamada.
+    Com 'ao_receber', a resposta é pedida em streaming e cada pedaço é repassado a essa função assim que chega;
+    o tempo até o primeiro token e os tokens/s são exibidos e entregues a 'ao_concluir'.
+    Toda chamada (inclusive acertos de cache e erros) é registrada na telemetria com os tokens reais do 'usage'.
+    Com LLM_LOCAL_BASE_URL, prompts pequenos são atendidos primeiro por um modelo local (ver roteamento.py).
+    Erros transitórios são repetidos com backoff (ver chamar_llm_com_fallback); se o provedor continuar falhando
+    ou o prompt exceder o contexto, os demais (nuvem, LLM_MODELOS_FALLBACK) são tentados e, por fim,
+    'reduzir_prompt' (se informado) é chamado para obter um prompt com menos dados.
+    No cache, cada resposta fica sob a chave do provedor que a gerou e só é reaproveitada quando esse provedor
+    seria o primeiro a ser chamado: a resposta de um modelo local ou alternativo nunca passa pela de 'model_id'.
+    A chave usa o prompt efetivamente enviado: a resposta a um prompt reduzido não vale pela do prompt completo.
+    """
+    inicio = time.perf_counter()
+    usar_cache = usar_cache and not CACHE_DESATIVADO
+    if usar_cache:
+        preferido = roteador.ordenar(provedores_nuvem(model_id), contar_tokens_prompt(user_prompt_content, model_id),
+                                     max_tokens)[0]
+        resposta_em_cache = cache_respostas.obter(chave_resposta(user_prompt_content, preferido, max_tokens))
+        if resposta_em_cache is not None:
+            print("  💾 Resposta obtida do cache local.")
+            telemetria.registrar_chamada_llm(preferido.modelo, time.perf_counter() - inicio, do_cache=True,
+                                             provedor=preferido.nome)
+            if ao_receber is not None:
+                medidor = MedidorStreaming([ao_receber])
+                medidor.registrar(resposta_em_cache)
+                metricas = medidor.finalizar(tokens_saida=estimar_tokens(resposta_em_cache), do_cache=True)
+                if ao_concluir is not None:
+                    ao_concluir(metricas)
+            return resposta_em_cache
+
     try:
-        chat_completion = client.chat.completions.create(**params)
-        return chat_completion.choices[0].message.content.strip()
+        resposta, provedor, prompt_enviado = chamar_llm_com_fallback(user_prompt_content, model_id, max_tokens,
+                                                                     ao_receber, ao_concluir, reduzir_prompt)
+        if usar_cache:
+            cache_respostas.guardar(chave_resposta(prompt_enviado, provedor, max_tokens), resposta,
+                                    modelo=provedor.modelo)
+        return resposta
     except Exception as e:
         error_details_str = str(e)
         if hasattr(e, 'response') and e.response is not None:
@@ -194,38 +372,507 @@ def enviar_prompt_para_llm(user_prompt_content: str, model_id: str = MODELO_ID_F
 
         print(f"  ❌ Erro ao chamar a API da OpenAI: {e}")
         print(f"    Detalhes do erro: {error_details_str}")
-        if "context_length_exceeded" in error_details_str.lower() or \
-           "prompt is too long" in error_details_str.lower() or \
-           "tokens" in error_details_str.lower():
+        if eh_erro_contexto(e):
             print("  ‼️ ERRO: O PROMPT PROVAVELMENTE EXCEDEU O TAMANHO MÁXIMO DE CONTEXTO/REQUISIÇÃO DO MODELO! ‼️")
             print("  Considere reduzir MAIS AINDA a quantidade de dados enviados ou usar uma estratégia de sumarização mais agressiva.")
         return "Erro ao gerar resumo."
 
-def gerar_resumo_contabil_hibrido(dados_processados: str, prompt_base_tipo: str, prompt_refinador_tipo: str) -> str:
+def tokens_em_cache(uso) -> int | None:
+    """Tokens do prompt servidos pelo cache de prefixo do provedor (usage.prompt_tokens_details.cached_tokens)."""
+    detalhes = uso.get('prompt_tokens_details') if isinstance(uso, dict) else getattr(uso, 'prompt_tokens_details', None)
+    if detalhes is None:
+        return None
+    return detalhes.get('cached_tokens') if isinstance(detalhes, dict) else getattr(detalhes, 'cached_tokens', None)
+
+def provedores_nuvem(model_id: str) -> list[Provedor]:
+    """'model_id' seguido dos modelos de MODELOS_FALLBACK, sem repetições."""
+    return [provedor_nuvem(modelo) for modelo in dict.fromkeys([model_id, *MODELOS_FALLBACK])]
+
+def contar_tokens_prompt(user_prompt_content: str, model_id: str) -> int:
+    """Tokens do prompt (com a mensagem de sistema) pelo tokenizador local do modelo, para o roteador."""
+    return obter_contador(model_id)[1](SYSTEM_MESSAGE + user_prompt_content)
+
+def chave_resposta(user_prompt_content: str, provedor: Provedor, max_tokens: int) -> str:
+    """Chave do cache de respostas para o prompt atendido por 'provedor' (modelos locais levam o nome do provedor)."""
+    params = montar_parametros_chat(user_prompt_content, provedor.modelo, max_tokens)
+    if provedor.local:
+        params["provedor"] = provedor.nome
+    return chave_cache(params)
+
+def chamar_llm(user_prompt_content: str, model_id: str, max_tokens: int, ao_receber: ReceptorDeltas | None = None,
+               ao_concluir: Callable[[MetricasStreaming], None] | None = None) -> tuple[str, Provedor]:
+    """
+    Uma rodada de chamadas ao LLM: os provedores (modelo local, 'model_id' e os de MODELOS_FALLBACK) são tentados
+    na ordem do roteador, cada um com retentativas (backoff com jitter, Retry-After) e o seu disjuntor.
+    Em streaming, só repete ou troca de provedor se nenhum pedaço da resposta tiver sido entregue ainda.
+    Retorna (resposta, provedor que respondeu).
+    """
+    nuvem = provedores_nuvem(model_id)
+    tokens_prompt = contar_tokens_prompt(user_prompt_content, model_id)
+    pedacos_entregues = [0]
+
+    def receber(delta: str):
+        pedacos_entregues[0] += 1
+        ao_receber(delta)
+
+    def tentar(provedor: Provedor):
+        params = montar_parametros_chat(user_prompt_content, provedor.modelo, max_tokens)
+        if ao_receber is not None:
+            resposta, uso, metricas = receber_em_streaming(params, receber, ao_concluir, provedor.cliente())
+            return resposta, uso, metricas.ttft_s
+        chat_completion = provedor.cliente().chat.completions.create(**params)
+        # Servidores locais podem devolver content=None (ex.: resposta vazia ou só tool calls)
+        return (chat_completion.choices[0].message.content or "").strip(), chat_completion.usage, None
+
+    def registrar_falha(provedor: Provedor, erro: Exception, duracao_s: float):
+        telemetria.registrar_chamada_llm(provedor.modelo, duracao_s, status="erro",
+                                         retentativas=getattr(erro, 'retentativas', 0), erro=type(erro).__name__,
+                                         streaming=ao_receber is not None, provedor=provedor.nome)
+        erro.entregou_parcial = pedacos_entregues[0] > 0
+
+    (resposta, uso, ttft_s), provedor, retentativas, duracao_s = executar_com_failover(
+        roteador, nuvem, tentar, tokens_prompt, max_tokens, POLITICA_RETENTATIVA, disjuntores,
+        pode_repetir=lambda: pedacos_entregues[0] == 0,
+        tokens_resposta=lambda resultado: getattr(resultado[1], 'completion_tokens', None), ao_falhar=registrar_falha)
+    if provedor.local:
+        print(f"  🏠 Respondido pelo modelo local '{provedor.modelo}' ({tokens_prompt} tokens de prompt).")
+    telemetria.registrar_chamada_llm(
+        provedor.modelo, duracao_s, tokens_prompt=getattr(uso, 'prompt_tokens', None),
+        tokens_resposta=getattr(uso, 'completion_tokens', None), retentativas=retentativas, ttft_s=ttft_s,
+        streaming=ao_receber is not None, tokens_prompt_cache=tokens_em_cache(uso), provedor=provedor.nome)
+    return resposta, provedor
+
+def chamar_llm_com_fallback(user_prompt_content: str, model_id: str, max_tokens: int,
+                            ao_receber: ReceptorDeltas | None = None,
+                            ao_concluir: Callable[[MetricasStreaming], None] | None = None,
+                            reduzir_prompt: Callable[[], str | None] | None = None) -> tuple[str, Provedor, str]:
+    """
+    Chama o LLM (ver chamar_llm): se o provedor escolhido falhar de vez (tentativas esgotadas, circuito aberto ou
+    contexto excedido), os demais são tentados; após um erro de contexto só os de janela maior.
+    Se todos excederem o contexto, refaz o prompt com 'reduzir_prompt' e recomeça.
+    Retorna (resposta, provedor que respondeu, prompt enviado), o último diferente do original se foi reduzido.
+    Levanta o último erro se nada funcionar.
+    """
+    prompt = user_prompt_content
+    while True:
+        try:
+            return (*chamar_llm(prompt, model_id, max_tokens, ao_receber, ao_concluir), prompt)
+        except Exception as e:
+            if not (getattr(e, 'contexto_excedido', False) and reduzir_prompt is not None):
+                raise
+            prompt = reduzir_prompt()
+            if prompt is None:
+                raise
+
+def receber_em_streaming(params: dict, ao_receber: ReceptorDeltas,
+                         ao_concluir: Callable[[MetricasStreaming], None] | None = None,
+                         cliente: OpenAI | None = None) -> tuple:
+    """
+    Faz a chamada com stream=True (em 'cliente', padrão: o da OpenAI), repassando cada pedaço a 'ao_receber'.
+    Retorna (resposta completa, usage, métricas do streaming).
+    A contagem de tokens da resposta vem do 'usage' do último pedaço (include_usage), quando disponível.
+    """
+    medidor = MedidorStreaming([ao_receber])
+    uso = None
+    cliente = cliente or obter_cliente()
+    stream = cliente.chat.completions.create(**params, stream=True, stream_options={"include_usage": True})
+    for chunk in stream:
+        if chunk.choices:
+            medidor.registrar(chunk.choices[0].delta.content)
+        if getattr(chunk, 'usage', None) is not None:
+            uso = chunk.usage
+    metricas = medidor.finalizar(tokens_saida=getattr(uso, 'completion_tokens', None))
+    print(f"\n  ⏱️ Streaming: {metricas.descricao()}")
+    if ao_concluir is not None:
+        ao_concluir(metricas)
+    return medidor.texto().strip(), uso, metricas
+
+def criar_redutor_prompt(montar_prompt: Callable[[str], str], reconstruir_dados: Callable[[float], str] | None,
+                         estado: dict | None = None) -> Callable[[], str | None] | None:
+    """
+    Função para 'reduzir_prompt' de enviar_prompt_para_llm: a cada chamada, refaz os dados com metade da fração
+    anterior do orçamento (via 'reconstruir_dados') e devolve o prompt montado com eles, ou None abaixo de
+    FRACAO_MINIMA_DADOS. 'estado' ({'fracao', 'dados'}) pode ser compartilhado por prompts que usam os mesmos dados.
+    """
+    if reconstruir_dados is None:
+        return None
+    estado = estado if estado is not None else {}
+
+    def reduzir() -> str | None:
+        fracao = estado.get('fracao', 1.0) / 2
+        if fracao < FRACAO_MINIMA_DADOS:
+            return None
+        print(f"  ✂️ Refazendo o prompt com {fracao:.1%} do orçamento de dados...")
+        estado['fracao'] = fracao
+        estado['dados'] = reconstruir_dados(fracao)
+        return montar_prompt(estado['dados'])
+
+    return reduzir
+
+def gerar_resumo_contabil_hibrido(dados_processados: str, prompt_base_tipo: str, prompt_refinador_tipo: str,
+                                  ao_receber: ReceptorDeltas | None = None,
+                                  reconstruir_dados: Callable[[float], str] | None = None,
+                                  resumo_base: str | None = None) -> str:
     """
     Gera um resumo contábil usando a abordagem híbrida:
     1. Aplica o prompt base para extração primária.
     2. Alimenta o resultado ao prompt refinador para detalhes estratégicos.
+    Com 'ao_receber' (streaming), o resumo base é exibido e escrito direto no buffer do prompt refinador
+    à medida que chega, e o resumo refinado é repassado a 'ao_receber'.
+    'reconstruir_dados(fracao)' permite refazer os dados com um orçamento menor se um prompt exceder o contexto;
+    nesse caso o refinador usa os mesmos dados reduzidos da etapa base.
+    Com 'resumo_base' já pronto (ex.: o resumo incremental do prompt1), a primeira etapa não chama o LLM.
     """
+    estado_dados = {'dados': dados_processados}
     # 1. Aplicação do Prompt Base (Prompt 1 para extração e padronização)
-    prompt_1_texto = prompts_comparativos[prompt_base_tipo]
-    prompt_1_final = f"{prompt_1_texto}\n\nDados:\n{dados_processados}"
+    montar_prompt_1 = partial(montar_prompt_unico, prompt_base_tipo)
+    prompt_1_final = montar_prompt_1(dados_processados)
+    reduzir_prompt_1 = criar_redutor_prompt(montar_prompt_1, reconstruir_dados, estado_dados)
+    buffer_prompt_2 = [instrucao_prompt_refinador(prompt_refinador_tipo)]
     print(f"\n--- Gerando Resumo Base com '{prompt_base_tipo}' ---")
-    resumo_base = enviar_prompt_para_llm(prompt_1_final)
-    print(f"\nResumo Base Gerado:\n{resumo_base[:500]}...") # Exibe uma parte do resumo base
+    if resumo_base is not None:
+        buffer_prompt_2.append(resumo_base)
+        print(f"\nResumo Base (incremental):\n{resumo_base[:500]}...")
+    elif ao_receber is not None:
+        def receber_base(delta: str):
+            buffer_prompt_2.append(delta)
+            imprimir_delta(delta)
+        resumo_base = enviar_prompt_para_llm(prompt_1_final, ao_receber=receber_base, reduzir_prompt=reduzir_prompt_1)
+        # O buffer recebeu a resposta bruta; o prompt refinador usa a versão sem espaços nas pontas,
+        # igual à do fluxo sem streaming (mesma chave no cache de respostas).
+        buffer_prompt_2[1:] = [resumo_base]
+    else:
+        resumo_base = enviar_prompt_para_llm(prompt_1_final, reduzir_prompt=reduzir_prompt_1)
+        buffer_prompt_2.append(resumo_base)
+        print(f"\nResumo Base Gerado:\n{resumo_base[:500]}...") # Exibe uma parte do resumo base
 
     if "Erro ao gerar resumo." in resumo_base:
         return "Erro na geração do resumo base. Abortando processo híbrido."
 
     # 2. Aplicação do Prompt Refinador (Prompt 2 para enriquecimento estratégico)
-    prompt_2_texto = prompts_comparativos[prompt_refinador_tipo]
-    prompt_2_final = f"{prompt_2_texto}\n\nAnalise o seguinte resumo inicial e os dados originais para enriquecer a resposta:\n\nResumo Inicial:\n{resumo_base}\n\nDados Originais:\n{dados_processados}"
+    # Mesmos dados da etapa base (inclusive se foram reduzidos): o prefixo system + dados já está no cache
+    montar_prompt_2 = lambda dados: prefixo_dados(dados) + "".join(buffer_prompt_2)
+    prompt_2_final = montar_prompt_2(estado_dados['dados'])
     print(f"\n--- Refinando Resumo com '{prompt_refinador_tipo}' ---")
-    resumo_final_hibrido = enviar_prompt_para_llm(prompt_2_final)
-    print(f"\nResumo Refinado Gerado:\n{resumo_final_hibrido[:500]}...") # Exibe uma parte do resumo refinado
+    resumo_final_hibrido = enviar_prompt_para_llm(
+        prompt_2_final, ao_receber=ao_receber,
+        reduzir_prompt=criar_redutor_prompt(montar_prompt_2, reconstruir_dados, estado_dados))
+    if ao_receber is None:
+        print(f"\nResumo Refinado Gerado:\n{resumo_final_hibrido[:500]}...") # Exibe uma parte do resumo refinado
 
     return resumo_final_hibrido
 
+def executar_prompts_em_lote(prompts_usuario: list[str], model_id: str = MODELO_ID_FIXO,
+                             max_workers: int = MAX_WORKERS_PADRAO, limitador: LimitadorTaxa | None = None) -> list:
+    """
+    Envia vários prompts ao LLM em paralelo, limitados por RPM/TPM da conta (por padrão, o limitador do
+    processo para 'model_id', compartilhado com os demais lotes).
+    Cada tarefa reserva no balde de tokens a estimativa do prompt (mesma de carregar_e_processar_dados_para_llm)
+    mais MAX_TOKENS_RESPOSTA, já que a OpenAI contabiliza o max_tokens no limite de TPM.
+    Retorna uma lista de ResultadoTarefa na mesma ordem de 'prompts_usuario'.
+    """
+    tarefas = [
+        TarefaPrompt(
+            prompt=prompt,
+            tokens_estimados=estimar_tokens(prompt) + MAX_TOKENS_RESPOSTA,
+            identificador=f"prompt_{i}",
+            kwargs={"model_id": model_id},
+        )
+        for i, prompt in enumerate(prompts_usuario)
+    ]
+    return executar_lote(
+        tarefas,
+        enviar_prompt_para_llm,
+        max_workers=max_workers,
+        limitador=limitador or limitador_compartilhado(model_id),
+        eh_erro=lambda resposta: "Erro ao gerar resumo." in resposta,
+    )
+
+def resolver_em_batch(pedidos: dict[str, str], rotulo: str, executor: ExecutorBatch,
+                      tempo_maximo_s: float | None = None, diretorio_saida: Path | None = None) -> dict[str, str]:
+    """
+    Obtém pela Batch API as respostas dos prompts em 'pedidos' ({custom_id: prompt}).
+    Prompts já respondidos saem do cache e nem entram no lote; as respostas do lote vão para o cache,
+    de modo que uma execução síncrona posterior com os mesmos dados as reaproveita.
+    Jobs que falharem no lote são refeitos de forma síncrona (com retentativas e modelos alternativos).
+    Retorna {custom_id: resposta}.
+    """
+    respostas = {}
+    jobs = []
+    for custom_id, prompt in pedidos.items():
+        params = montar_parametros_chat(prompt, MODELO_ID_FIXO, MAX_TOKENS_RESPOSTA)
+        resposta_em_cache = None if CACHE_DESATIVADO else cache_respostas.obter(chave_cache(params))
+        if resposta_em_cache is not None:
+            telemetria.registrar_chamada_llm(MODELO_ID_FIXO, 0.0, do_cache=True, modo="batch")
+            respostas[custom_id] = resposta_em_cache
+        else:
+            jobs.append(JobBatch(custom_id, params))
+    if not jobs:
+        print(f"  💾 Lote '{rotulo}': todas as {len(pedidos)} resposta(s) vieram do cache local.")
+        return respostas
+
+    caminho_jsonl = (diretorio_saida or relatorio_dir_base) / 'batch' / f"lote_{time.strftime('%Y%m%d_%H%M%S')}_{rotulo}.jsonl"
+    inicio = time.perf_counter()
+    resultados = executor.executar(jobs, caminho_jsonl, {"origem": "prompts.py", "etapa": rotulo}, tempo_maximo_s)
+    duracao = time.perf_counter() - inicio
+    for job, resultado in zip(jobs, resultados):
+        if resultado.status == "ok":
+            uso = resultado.uso or {}
+            telemetria.registrar_chamada_llm(resultado.modelo or MODELO_ID_FIXO, duracao,
+                                             tokens_prompt=uso.get('prompt_tokens'),
+                                             tokens_resposta=uso.get('completion_tokens'),
+                                             tokens_prompt_cache=tokens_em_cache(uso), modo="batch")
+            if not CACHE_DESATIVADO:
+                cache_respostas.guardar(chave_cache(job.parametros), resultado.resposta,
+                                        modelo=resultado.modelo or MODELO_ID_FIXO)
+            respostas[job.custom_id] = resultado.resposta
+        else:
+            telemetria.registrar_chamada_llm(MODELO_ID_FIXO, duracao, status="erro", modo="batch", erro=resultado.erro)
+            print(f"  ⚠️ Job '{job.custom_id}' falhou no lote ({resultado.erro}); refazendo de forma síncrona...")
+            respostas[job.custom_id] = enviar_prompt_para_llm(pedidos[job.custom_id])
+    return respostas
+
+def gerar_resumos_em_batch(diretorios_dados: list[Path], variantes: list[str],
+                           diretorio_saida: Path | None = None,
+                           intervalo_consulta_s: float = INTERVALO_CONSULTA_BATCH_S,
+                           tempo_maximo_s: float | None = None) -> dict[tuple[str, str], str]:
+    """
+    Gera as 'variantes' (chaves de VARIANTES_RESUMO) para cada diretório de dados usando a Batch API,
+    gravando cada resumo no mesmo layout de task18_resultados usado pelo main() (uma subpasta por
+    diretório quando há mais de um). O híbrido usa um segundo lote, com os resumos base do primeiro.
+    Retorna {(nome do diretório, variante): resumo}.
+    """
+    executor = ExecutorBatch(obter_cliente(), intervalo_consulta_s, politica=POLITICA_RETENTATIVA)
+    conteudos = {nome: dados for nome, (_, dados) in
+                 carregar_conjuntos_dados(diretorios_dados, calcular_orcamento_tokens_dados()).items()}
+
+    # Etapa 1: prompts de uma chamada só (o híbrido precisa do prompt1 como base)
+    tipos_base = [tipo for tipo in ('prompt1', 'prompt2') if tipo in variantes or (tipo == 'prompt1' and 'hibrido' in variantes)]
+    pedidos = {f"{nome}::{tipo}": montar_prompt_unico(tipo, dados)
+               for nome, dados in conteudos.items() for tipo in tipos_base}
+    respostas = resolver_em_batch(pedidos, "base", executor, tempo_maximo_s, diretorio_saida)
+
+    # Etapa 2: refinador do híbrido, alimentado pelos resumos base
+    if 'hibrido' in variantes:
+        pedidos_refinador = {
+            f"{nome}::hibrido": montar_prompt_refinador('prompt2', respostas[f"{nome}::prompt1"], dados)
+            for nome, dados in conteudos.items()
+            if "Erro ao gerar resumo." not in respostas.get(f"{nome}::prompt1", "Erro ao gerar resumo.")
+        }
+        respostas.update(resolver_em_batch(pedidos_refinador, "refinador", executor, tempo_maximo_s, diretorio_saida))
+
+    resumos = {}
+    for nome in conteudos:
+        for variante in variantes:
+            resumo = respostas.get(f"{nome}::{variante}")
+            if eh_resumo_com_erro(resumo):
+                print(f"❌ '{nome}' / {variante}: resumo não gerado.")
+                continue
+            caminho = gravar_resultado(diretorio_resultados(diretorio_saida, nome, len(conteudos) > 1), variante, resumo)
+            print(f"📄 '{nome}' / {variante}: salvo em '{caminho}'.")
+            resumos[(nome, variante)] = resumo
+    return resumos
+
+def carregar_conjuntos_dados(diretorios_dados: list[Path], orcamento_tokens: int) -> dict[str, tuple[Path, str]]:
+    """
+    Carrega e reduz cada diretório de dados uma única vez, para ser compartilhado por todas as variantes.
+    Retorna {nome: (diretório, bloco de dados)}; diretórios sem dados são ignorados e nomes repetidos ganham sufixo.
+    """
+    conjuntos = {}
+    for diretorio in diretorios_dados:
+        nome = diretorio.name if diretorio.name not in conjuntos else f"{diretorio.name}_{len(conjuntos)}"
+        dados = carregar_e_processar_dados_para_llm(diretorio, orcamento_tokens=orcamento_tokens,
+                                                    usar_indicadores=True, usar_map_reduce=USAR_MAP_REDUCE)
+        if not dados.strip():
+            print(f"⚠️ Nenhum dado carregado de '{diretorio}'; diretório ignorado.")
+            continue
+        conjuntos[nome] = (diretorio, dados)
+    return conjuntos
+
+def criar_reconstrutor_dados(diretorio: Path, orcamento_tokens: int) -> Callable[[float], str]:
+    """'reconstruir_dados(fracao)': refaz o bloco de dados com uma fração do orçamento (ver criar_redutor_prompt)."""
+    return lambda fracao: carregar_e_processar_dados_para_llm(
+        diretorio, orcamento_tokens=int(orcamento_tokens * fracao), usar_indicadores=True, usar_map_reduce=USAR_MAP_REDUCE)
+
+def diretorio_resultados(diretorio_saida: Path | None = None, nome_conjunto: str | None = None,
+                         subpasta_por_conjunto: bool = False) -> Path:
+    """Pasta dos arquivos de resultado: <saída>/<modelo>[/<conjunto de dados>]."""
+    diretorio = (diretorio_saida or relatorio_dir_base) / NOME_SUBPASTA_MODELO
+    if subpasta_por_conjunto and nome_conjunto:
+        diretorio = diretorio / nome_conjunto
+    diretorio.mkdir(parents=True, exist_ok=True)
+    return diretorio
+
+def gravar_resultado(diretorio: Path, variante: str, resumo: str) -> Path:
+    """Grava o resumo com o cabeçalho padrão em '<diretorio>/<Variante>_resultado.txt'."""
+    escolha = next(escolha for escolha, nome in ESCOLHAS_MENU.items() if nome == variante)
+    caminho = diretorio / f"{VARIANTES_RESUMO[variante]}_resultado.txt"
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        arquivo.write(montar_cabecalho_resultado(VARIANTES_RESUMO[variante], escolha))
+        arquivo.write(resumo)
+    return caminho
+
+def eh_resumo_com_erro(resumo: str | None) -> bool:
+    """Mensagens de erro devolvidas no lugar do resumo por enviar_prompt_para_llm e pelo fluxo híbrido."""
+    return not resumo or "Erro ao gerar resumo." in resumo or resumo.startswith("Erro na geração do resumo base")
+
+def gerar_variante(dados: str, variante: str, reconstruir_dados: Callable[[float], str] | None = None,
+                   ao_receber: ReceptorDeltas | None = None,
+                   gerar_resumo_base: Callable[[], str] | None = None) -> str:
+    """
+    Gera o resumo de uma variante ('prompt1', 'prompt2' ou 'hibrido') sobre um bloco de dados já montado.
+    'gerar_resumo_base' (ver criar_gerador_resumo_base) substitui a chamada única do prompt1, inclusive como
+    base do híbrido.
+    """
+    if variante == 'hibrido':
+        resumo_base = gerar_resumo_base() if gerar_resumo_base is not None else None
+        if resumo_base is not None and eh_resumo_com_erro(resumo_base):
+            return "Erro na geração do resumo base. Abortando processo híbrido."
+        return gerar_resumo_contabil_hibrido(dados, "prompt1", "prompt2", ao_receber=ao_receber,
+                                             reconstruir_dados=reconstruir_dados, resumo_base=resumo_base)
+    if variante == 'prompt1' and gerar_resumo_base is not None:
+        resumo = gerar_resumo_base()
+        if ao_receber is not None and not eh_resumo_com_erro(resumo):
+            ao_receber(resumo)
+        return resumo
+    montar_prompt = partial(montar_prompt_unico, variante)
+    return enviar_prompt_para_llm(montar_prompt(dados), ao_receber=ao_receber,
+                                  reduzir_prompt=criar_redutor_prompt(montar_prompt, reconstruir_dados))
+
+_locks_incrementais: dict[Path, threading.Lock] = {}
+_lock_incrementais = threading.Lock()
+
+def gerar_resumo_prompt1_incremental(diretorio: Path, orcamento_tokens: int) -> str:
+    """
+    Resumo do prompt1 montado seção a seção (resumo_incremental.py): só as seções cujas tabelas mudaram desde
+    a última execução vão ao LLM. Execuções simultâneas do mesmo diretório são serializadas.
+    """
+    diretorio = Path(diretorio).resolve()
+    with _lock_incrementais:
+        lock = _locks_incrementais.setdefault(diretorio, threading.Lock())
+    with lock:
+        print(f"\n--- Resumo incremental (prompt1) de '{diretorio}' ---")
+        _, contador = obter_contador(MODELO_ID_FIXO)
+        caminho_estado = cache_dir / 'resumo_incremental' / f"{CacheSecoes.chave_de(str(diretorio), MODELO_ID_FIXO)[:24]}.json"
+        montar_dados = lambda arquivos: carregar_e_processar_dados_para_llm(
+            diretorio, orcamento_tokens=orcamento_tokens, usar_indicadores=True, usar_map_reduce=USAR_MAP_REDUCE,
+            nomes_arquivos={arquivo.name for arquivo in arquivos})
+        resumo = gerar_resumo_incremental(
+            listar_arquivos_dados(diretorio), cache_dados, cache_secoes, caminho_estado, montar_dados,
+            enviar_prompt_para_llm, contador, MODELO_ID_FIXO, eh_erro=eh_resumo_com_erro)
+    return resumo if resumo is not None else "Erro ao gerar resumo."
+
+def criar_gerador_resumo_base(diretorio: Path, orcamento_tokens: int,
+                              incremental: bool = USAR_INCREMENTAL) -> Callable[[], str] | None:
+    """'gerar_resumo_base' para gerar_variante: o resumo incremental do diretório, se o modo estiver ativo."""
+    return partial(gerar_resumo_prompt1_incremental, diretorio, orcamento_tokens) if incremental else None
+
+def gerar_resumos_concorrentes(diretorios_dados: list[Path], variantes: list[str], diretorio_saida: Path | None = None,
+                               max_workers: int = MAX_WORKERS_PADRAO, incremental: bool = USAR_INCREMENTAL) -> list[dict]:
+    """
+    Executa todas as combinações (diretório de dados × variante) em paralelo, respeitando RPM/TPM.
+    Cada diretório é carregado e reduzido uma única vez; os resumos são gravados no layout de task18_resultados.
+    Retorna uma linha por job com status, latência, espera pelos limites, chamadas e tokens.
+    """
+    orcamento_tokens = calcular_orcamento_tokens_dados()
+    conjuntos = carregar_conjuntos_dados(diretorios_dados, orcamento_tokens)
+
+    def executar_job(dados: str, variante: str, diretorio: Path) -> tuple[str, dict]:
+        with acumular_chamadas() as uso:
+            return gerar_variante(dados, variante, criar_reconstrutor_dados(diretorio, orcamento_tokens),
+                                  gerar_resumo_base=criar_gerador_resumo_base(diretorio, orcamento_tokens, incremental)), uso
+
+    tarefas = [
+        TarefaPrompt(
+            prompt=dados,
+            # O híbrido faz duas chamadas, a segunda com os dados e o resumo base
+            tokens_estimados=(estimar_tokens(dados) + MAX_TOKENS_RESPOSTA) * (2 if variante == 'hibrido' else 1),
+            identificador=f"{nome}::{variante}",
+            kwargs={"variante": variante, "diretorio": diretorio},
+        )
+        for nome, (diretorio, dados) in conjuntos.items() for variante in variantes
+    ]
+    resultados = executar_lote(tarefas, executar_job, max_workers=max_workers,
+                               limitador=limitador_compartilhado(MODELO_ID_FIXO),
+                               eh_erro=lambda resposta: eh_resumo_com_erro(resposta[0]))
+
+    linhas = []
+    for tarefa, resultado in zip(tarefas, resultados):
+        nome, variante = tarefa.identificador.split("::")
+        resumo, uso = resultado.resposta if resultado.resposta is not None else (None, {})
+        linha = {"conjunto": nome, "variante": variante, "status": resultado.status,
+                 "latencia_s": round(resultado.duracao_s, 3), "espera_limite_s": round(resultado.espera_limite_s, 3),
+                 "chamadas": uso.get("chamadas", 0), "acertos_cache": uso.get("acertos_cache", 0),
+                 "tokens_prompt": uso.get("tokens_prompt", 0), "tokens_prompt_cache": uso.get("tokens_prompt_cache", 0),
+                 "tokens_resposta": uso.get("tokens_resposta", 0),
+                 "arquivo": None}
+        if resultado.status == "ok":
+            linha["arquivo"] = str(gravar_resultado(diretorio_resultados(diretorio_saida, nome, len(conjuntos) > 1),
+                                                    variante, resumo))
+        else:
+            print(f"❌ '{nome}' / {variante}: {resultado.erro}")
+        linhas.append(linha)
+    return linhas
+
+def imprimir_tabela_jobs(linhas: list[dict]):
+    """Tabela final do modo não interativo: latência e tokens por job, com o total."""
+    colunas = [("conjunto", "Conjunto"), ("variante", "Variante"), ("status", "Status"), ("latencia_s", "Latência (s)"),
+               ("espera_limite_s", "Espera RPM/TPM (s)"), ("chamadas", "Chamadas"), ("acertos_cache", "Cache"),
+               ("tokens_prompt", "Tokens prompt"), ("tokens_prompt_cache", "Prompt em cache"),
+               ("tokens_resposta", "Tokens resposta")]
+    total = {"conjunto": "TOTAL", "variante": "", "status": f"{sum(l['status'] == 'ok' for l in linhas)}/{len(linhas)} ok",
+             **{chave: round(sum(l[chave] for l in linhas), 3) for chave, _ in colunas[3:]}}
+    tabela = [[str(linha[chave]) for chave, _ in colunas] for linha in [*linhas, total]]
+    larguras = [max(len(titulo), *(len(celula[i]) for celula in tabela)) for i, (_, titulo) in enumerate(colunas)]
+    formatar = lambda celulas: " | ".join(celula.rjust(largura) if i >= 3 else celula.ljust(largura)
+                                          for i, (celula, largura) in enumerate(zip(celulas, larguras)))
+    print("\n--- Resumo da Execução ---")
+    print(formatar([titulo for _, titulo in colunas]))
+    print("-+-".join("-" * largura for largura in larguras))
+    for celulas in tabela[:-1]:
+        print(formatar(celulas))
+    print("-+-".join("-" * largura for largura in larguras))
+    print(formatar(tabela[-1]))
+
+def calcular_orcamento_tokens_dados(model_id: str = MODELO_ID_FIXO) -> int:
+    """
+    Orçamento de tokens do bloco de dados que garante que nenhum prompt do projeto exceda a janela do modelo:
+    considera o system, as instruções dos prompts e, no fluxo híbrido, o resumo base que volta no segundo prompt.
+    LLM_ORCAMENTO_TOKENS_DADOS, se definido, é usado como teto.
+    """
+    _, contador = obter_contador(model_id)
+    textos_fixos = [SYSTEM_MESSAGE, prompts_comparativos['prompt1'], prompts_comparativos['prompt2']]
+    orcamento = calcular_orcamento_dados(model_id, MAX_TOKENS_RESPOSTA, textos_fixos, contador)
+    return min(orcamento, ORCAMENTO_TOKENS_DADOS) if ORCAMENTO_TOKENS_DADOS > 0 else orcamento
+
+def montar_cabecalho_resultado(nome_tipo_resumo: str, escolha: str) -> str:
+    """Cabeçalho do arquivo de resultado: modelo, tipo do resumo e instruções dos prompts usados."""
+    partes = [f"Modelo Utilizado: {MODELO_ID_FIXO}\n\n", f"--- {nome_tipo_resumo.upper()} ---\n"]
+    if escolha == '1':
+        partes.append(f"Instrução do Prompt:\n{prompts_comparativos['prompt1']}\n\n")
+    elif escolha == '2':
+        partes.append(f"Instrução do Prompt:\n{prompts_comparativos['prompt2']}\n\n")
+    elif escolha == '3':
+        partes.append(f"Instrução do Prompt Base (P1):\n{prompts_comparativos['prompt1']}\n\n")
+        partes.append(f"Instrução do Prompt Refinador (P2):\n{prompts_comparativos['prompt2']}\n\n")
+    partes.append("--- RESPOSTA DO MODELO ---\n")
+    return "".join(partes)
+
+def imprimir_resumo_telemetria():
+    """Exibe onde foram o tempo e os tokens da sessão e grava as métricas Prometheus, se configurado."""
+    resumo = telemetria.resumo()
+    tokens = resumo['tokens']
+    print(f"📈 Telemetria: {resumo['chamadas_llm']} chamada(s) ao LLM ({resumo['acertos_cache']} do cache, "
+          f"{resumo['retentativas']} retentativa(s)), {tokens.get('prompt', 0)} tokens de prompt "
+          f"({tokens.get('prompt_cache', 0)} do cache de prefixo do provedor) e {tokens.get('resposta', 0)} de resposta.")
+    for nome_etapa, dados_etapa in list(resumo['etapas'].items())[:5]:
+        print(f"    {nome_etapa}: {dados_etapa['total_s']:.3f}s em {dados_etapa['vezes']} execução(ões)")
+    if PROMETHEUS_ARQUIVO:
+        telemetria.gravar_prometheus(Path(PROMETHEUS_ARQUIVO))
+        print(f"    Métricas Prometheus gravadas em '{PROMETHEUS_ARQUIVO}'.")
+    if telemetria.caminho_jsonl:
+        print(f"    Eventos detalhados em '{telemetria.caminho_jsonl}'.")
+
 # --- Função Principal ---
 
 def main():
@@ -233,8 +880,14 @@ def main():
         print("Erro: A chave da API do OpenAI não foi configurada. Certifique-se de ter um arquivo .env com OPENAI_API_KEY.")
         return
 
+    configurar_telemetria(TELEMETRIA_JSONL, PROMETHEUS_PORTA)
+
     # Carrega e processa os dados dos arquivos .z
-    conteudo_dados_llm = carregar_e_processar_dados_para_llm(data_dir_z)
+    orcamento_tokens = calcular_orcamento_tokens_dados()
+    conteudo_dados_llm = carregar_e_processar_dados_para_llm(data_dir_z, orcamento_tokens=orcamento_tokens,
+                                                             usar_indicadores=True, usar_map_reduce=USAR_MAP_REDUCE)
+    # Se um prompt exceder o contexto mesmo nos modelos alternativos, os dados são refeitos com menos orçamento
+    reconstruir_dados = criar_reconstrutor_dados(data_dir_z, orcamento_tokens)
 
     if not conteudo_dados_llm.strip():
         print("Nenhum conteúdo de dados foi carregado ou processado. Encerrando.")
@@ -249,45 +902,42 @@ def main():
     while True:
         escolha = input("Digite o número da sua escolha: ")
 
-        resumo_gerado = None
-        nome_tipo_resumo = ""
-
-        if escolha == '1':
-            nome_tipo_resumo = "Prompt1_Conciso"
-            resumo_gerado = enviar_prompt_para_llm(f"{prompts_comparativos['prompt1']}\n\nDados:\n{conteudo_dados_llm}")
-        elif escolha == '2':
-            nome_tipo_resumo = "Prompt2_Estrategico"
-            resumo_gerado = enviar_prompt_para_llm(f"{prompts_comparativos['prompt2']}\n\nDados:\n{conteudo_dados_llm}")
-        elif escolha == '3':
-            nome_tipo_resumo = "Hibrido_P1_P2"
-            resumo_gerado = gerar_resumo_contabil_hibrido(conteudo_dados_llm, "prompt1", "prompt2")
-        elif escolha == '0':
+        if escolha == '0':
             print("Saindo do programa.")
+            imprimir_resumo_telemetria()
             return
-        else:
+        if escolha not in ('1', '2', '3'):
             print("Opção inválida. Por favor, digite 1, 2, 3 ou 0.")
             continue
 
-        if resumo_gerado and "Erro ao gerar resumo." not in resumo_gerado:
-            print("\n--- Resumo Gerado ---")
-            print(resumo_gerado)
-
-            # Salvar o resumo
-            relatorio_dir_modelo_especifico = relatorio_dir_base / NOME_SUBPASTA_MODELO
-            relatorio_dir_modelo_especifico.mkdir(parents=True, exist_ok=True)
-            nome_arquivo_resumo = relatorio_dir_modelo_especifico / f"{nome_tipo_resumo}_resultado.txt"
-            with open(nome_arquivo_resumo, "w", encoding="utf-8") as arquivo:
-                arquivo.write(f"Modelo Utilizado: {MODELO_ID_FIXO}\n\n")
-                arquivo.write(f"--- {nome_tipo_resumo.upper()} ---\n")
-                if escolha == '1':
-                    arquivo.write(f"Instrução do Prompt:\n{prompts_comparativos['prompt1']}\n\n")
-                elif escolha == '2':
-                    arquivo.write(f"Instrução do Prompt:\n{prompts_comparativos['prompt2']}\n\n")
-                elif escolha == '3':
-                    arquivo.write(f"Instrução do Prompt Base (P1):\n{prompts_comparativos['prompt1']}\n\n")
-                    arquivo.write(f"Instrução do Prompt Refinador (P2):\n{prompts_comparativos['prompt2']}\n\n")
-                arquivo.write("--- RESPOSTA DO MODELO ---\n")
-                arquivo.write(resumo_gerado)
+        nome_tipo_resumo = VARIANTES_RESUMO[ESCOLHAS_MENU[escolha]]
+        nome_arquivo_resumo = diretorio_resultados() / f"{nome_tipo_resumo}_resultado.txt"
+        cabecalho_arquivo = montar_cabecalho_resultado(nome_tipo_resumo, escolha)
+
+        # Em streaming, a resposta vai para o console e para o arquivo enquanto é gerada.
+        saida = None
+        ao_receber = None
+        if USAR_STREAMING:
+            saida = SaidaIncremental(nome_arquivo_resumo, cabecalho_arquivo)
+            ao_receber = lambda delta: (imprimir_delta(delta), saida(delta))
+            print(f"\n--- Resumo Gerado (streaming, gravando em '{saida.caminho_parcial}') ---")
+
+        resumo_gerado = None
+        try:
+            resumo_gerado = gerar_variante(conteudo_dados_llm, ESCOLHAS_MENU[escolha], reconstruir_dados, ao_receber,
+                                           criar_gerador_resumo_base(data_dir_z, orcamento_tokens))
+        finally:
+            sucesso = not eh_resumo_com_erro(resumo_gerado)
+            if saida is not None:
+                saida.concluir(sucesso)
+
+        if sucesso:
+            if saida is None:
+                print("\n--- Resumo Gerado ---")
+                print(resumo_gerado)
+
+                # Salvar o resumo
+                gravar_resultado(nome_arquivo_resumo.parent, ESCOLHAS_MENU[escolha], resumo_gerado)
             print(f"\nO resumo foi salvo em '{nome_arquivo_resumo}'.")
         else:
             print(f"\nNão foi possível gerar o resumo para a opção {escolha}.")
@@ -295,8 +945,57 @@ def main():
         # Perguntar se o usuário quer gerar outro resumo
         continuar = input("\nGerar outro resumo? (s/n): ").lower()
         if continuar != 's':
+            estatisticas_cache = cache_respostas.estatisticas()
+            print(f"ℹ️ Cache de respostas: {estatisticas_cache['acertos']} acerto(s), {estatisticas_cache['falhas']} falha(s).")
+            imprimir_resumo_telemetria()
             print("Encerrando o programa.")
             break
 
+def main_cli(argumentos: list[str] | None = None):
+    """
+    Modo não interativo: todas as variantes pedidas para cada diretório de dados, em paralelo (ou pela Batch API
+    com --batch), terminando com uma tabela de latência e tokens por job.
+
+        python prompts.py --data-dir dados/jan --data-dir dados/fev --variants prompt1,hybrid --out saida --workers 4
+    """
+    aliases = {'hybrid': 'hibrido'}
+    parser = argparse.ArgumentParser(description="Gera os resumos contábeis sem interação.")
+    parser.add_argument("--data-dir", type=Path, action="append", dest="diretorios",
+                        help=f"diretório com os arquivos .z (pode repetir; padrão: {data_dir_z})")
+    parser.add_argument("--variants", "--variantes", dest="variantes", default=",".join(VARIANTES_RESUMO),
+                        help="variantes separadas por vírgula: prompt1, prompt2, hybrid (ou hibrido)")
+    parser.add_argument("--out", type=Path, default=relatorio_dir_base,
+                        help=f"pasta de saída (padrão: {relatorio_dir_base})")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS_PADRAO, help="jobs executados em paralelo")
+    parser.add_argument("--incremental", action="store_true", default=USAR_INCREMENTAL,
+                        help="prompt1 (e a base do híbrido) seção a seção, refazendo só as seções com tabelas alteradas")
+    parser.add_argument("--batch", action="store_true", help="usa a Batch API (mais barata, conclusão em até 24h)")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO_CONSULTA_BATCH_S,
+                        help="com --batch: segundos entre as consultas ao status do lote")
+    parser.add_argument("--tempo-maximo", type=float, default=None, help="com --batch: desiste de aguardar após N segundos")
+    parser.add_argument("--formato-tabelas", choices=("auto",) + FORMATOS_TABELA, default=None,
+                        help="serialização das linhas das tabelas no prompt (padrão: LLM_FORMATO_TABELAS ou texto)")
+    args = parser.parse_args(argumentos)
+
+    variantes = list(dict.fromkeys(aliases.get(variante.strip(), variante.strip())
+                                   for variante in args.variantes.split(",") if variante.strip()))
+    invalidas = [variante for variante in variantes if variante not in VARIANTES_RESUMO]
+    if invalidas:
+        parser.error(f"variante(s) desconhecida(s): {', '.join(invalidas)}")
+
+    configurar_serializacao(args.formato_tabelas)
+    configurar_telemetria(TELEMETRIA_JSONL, PROMETHEUS_PORTA)
+    diretorios = args.diretorios or [data_dir_z]
+    if args.batch:
+        gerar_resumos_em_batch(diretorios, variantes, args.out, args.intervalo, args.tempo_maximo)
+    else:
+        imprimir_tabela_jobs(gerar_resumos_concorrentes(diretorios, variantes, args.out, max(1, args.workers),
+                                                        args.incremental))
+    imprimir_resumo_telemetria()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Com argumentos de linha de comando, roda sem interação; sem eles, abre o menu
+    if sys.argv[1:]:
+        main_cli()
+    else:
+        main()
@@ -0,0 +1,301 @@
+import math
+import tempfile
+import unittest
+from pathlib import Path
+
+import joblib
+import pandas as pd
+
+from cache_dados import CacheDadosZ
+from montagem_prompt import (CABECALHO_DADOS, CacheSecoes, cabecalho_secao, chave_opcoes_pandas, eh_dataframe,
+                             partes_describe, partes_head_tail)
+from serializacao_tabelas import chave_serializacao, formatador_tabela
+from telemetria import etapa
+from tokenizacao import ContadorTokens, contar_tokens_aproximado, obter_contador
+
+# --- Redução dos Dados Guiada por Orçamento de Tokens ---
+# Em vez de limites fixos de linhas, o bloco de dados recebe um orçamento de tokens (contados com um
+# tokenizador local). O orçamento é dividido entre os arquivos conforme tamanho e importância e, em cada
+# arquivo, são escolhidas as linhas (head/tail) e estatísticas (describe) que cabem na sua fatia.
+# O texto final é sempre conferido com o contador: ele nunca passa do orçamento.
+
+# Janela de contexto (tokens) dos modelos usados no projeto.
+JANELAS_CONTEXTO = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-4.1-mini": 1_047_576,
+    "gpt-3.5-turbo": 16_385,
+}
+JANELA_CONTEXTO_PADRAO = 16_385
+# Folga para a estrutura das mensagens do chat e rótulos adicionados ao redor dos dados.
+MARGEM_SEGURANCA_TOKENS = 512
+
+# Peso relativo de cada tipo de arquivo na divisão do orçamento (casado por trecho do nome do arquivo).
+IMPORTANCIA_PADRAO = {
+    "movimento-financeiro": 3.0,
+    "vendas": 3.0,
+    "contas-a-receber": 2.0,
+    "contas-a-pagar": 2.0,
+    "produtos": 1.0,
+    "naturezas-financeiras": 1.0,
+    "categorias": 1.0,
+}
+# Fração máxima da fatia de um arquivo que o describe() pode ocupar.
+FRACAO_MAXIMA_DESCRIBE = 0.5
+LINHAS_AMOSTRA_DEMANDA = 50
+
+
+def calcular_orcamento_dados(model_id: str, max_tokens_resposta: int, textos_fixos: list[str],
+                             contador: ContadorTokens, respostas_no_prompt: int = 1) -> int:
+    """
+    Orçamento de tokens para o bloco de dados: janela de contexto do modelo menos a resposta,
+    as respostas anteriores que voltam no prompt (ex.: o resumo base do fluxo híbrido),
+    os textos fixos (system, instruções) e uma margem de segurança.
+    """
+    janela = JANELAS_CONTEXTO.get(model_id, JANELA_CONTEXTO_PADRAO)
+    reservado = max_tokens_resposta * (1 + respostas_no_prompt)
+    reservado += sum(contador(texto) for texto in textos_fixos) + MARGEM_SEGURANCA_TOKENS
+    return max(0, janela - reservado)
+
+
+def importancia_arquivo(nome: str, importancia: dict[str, float] | None = None) -> float:
+    importancia = IMPORTANCIA_PADRAO if importancia is None else importancia
+    for trecho, peso in importancia.items():
+        if trecho in nome:
+            return peso
+    return 1.0
+
+
+def estimar_demanda(nome: str, df_content, contador: ContadorTokens) -> int:
+    """
+    Estima quantos tokens a seção do arquivo ocuparia com todas as linhas.
+    Até LINHAS_AMOSTRA_DEMANDA linhas a contagem é exata; acima disso, é extrapolada das primeiras linhas.
+    """
+    if not eh_dataframe(df_content):
+        return contador(cabecalho_secao(nome, df_content) + str(df_content) + "\n\n")
+    num_rows = df_content.shape[0]
+    cabecalho = cabecalho_secao(nome, df_content)
+    amostra = df_content.head(LINHAS_AMOSTRA_DEMANDA)
+    formatar = formatador_tabela(df_content, contador=contador)
+    if num_rows <= len(amostra):
+        return contador(cabecalho + formatar(amostra) + "\n\n")
+    tokens_tabela = contador(formatar(amostra)) * num_rows / len(amostra)
+    return int(math.ceil(contador(cabecalho + "\n\n") + tokens_tabela))
+
+
+def distribuir_orcamento(demandas: dict[str, int], orcamento: int, pesos: dict[str, float]) -> dict[str, int]:
+    """
+    Divide o orçamento entre os arquivos ("enchimento de água"): cada arquivo recebe uma fatia proporcional a
+    importância × log da demanda (tabelas maiores pesam mais, sem sufocar as pequenas); quem precisa de menos
+    que a fatia recebe só o que precisa e a sobra é redistribuída entre os demais.
+    """
+    alocacoes = {}
+    pendentes = {nome: demanda for nome, demanda in demandas.items() if demanda > 0}
+    restante = orcamento
+    while pendentes and restante > 0:
+        fatores = {nome: pesos.get(nome, 1.0) * math.log2(2 + demanda) for nome, demanda in pendentes.items()}
+        soma = sum(fatores.values())
+        satisfeitos = {nome: demanda for nome, demanda in pendentes.items()
+                       if demanda <= restante * fatores[nome] / soma}
+        if not satisfeitos:
+            for nome in pendentes:
+                alocacoes[nome] = int(restante * fatores[nome] / soma)
+            return alocacoes
+        for nome, demanda in satisfeitos.items():
+            alocacoes[nome] = demanda
+            restante -= demanda
+            del pendentes[nome]
+    for nome in pendentes:
+        alocacoes[nome] = 0
+    return alocacoes
+
+
+def _truncar_para_orcamento(texto: str, orcamento: int, contador: ContadorTokens) -> str:
+    """Maior prefixo de 'texto' (com aviso de truncamento) que cabe no orçamento; '' se nada couber."""
+    aviso = "\n[... conteúdo truncado para caber no orçamento de tokens ...]\n\n"
+    if contador(texto) <= orcamento:
+        return texto
+    baixo, alto = 0, len(texto)
+    while baixo < alto:
+        meio = (baixo + alto + 1) // 2
+        if contador(texto[:meio] + aviso) <= orcamento:
+            baixo = meio
+        else:
+            alto = meio - 1
+    return texto[:baixo] + aviso if baixo > 0 else ""
+
+
+def ajustar_blocos_pre_calculados(bloco_indicadores: str, secoes_map_reduce: str, orcamento: int,
+                                  contador: ContadorTokens) -> tuple[str, str]:
+    """
+    Faz os blocos pré-calculados (indicadores e resumos map-reduce) caberem em 'orcamento' tokens.
+    Os resumos map-reduce são truncados primeiro; se os indicadores sozinhos já passam do orçamento,
+    eles também são truncados e os resumos ficam de fora.
+    """
+    orcamento = max(0, orcamento)
+    tokens_indicadores = contador(bloco_indicadores) if bloco_indicadores else 0
+    tokens_map_reduce = contador(secoes_map_reduce) if secoes_map_reduce else 0
+    if tokens_indicadores + tokens_map_reduce <= orcamento:
+        return bloco_indicadores, secoes_map_reduce
+    print(f"  ⚠️ Indicadores e resumos map-reduce ({tokens_indicadores + tokens_map_reduce} tokens) passam do "
+          f"orçamento de {orcamento} tokens; o excesso foi truncado.")
+    if tokens_indicadores > orcamento:
+        return _truncar_para_orcamento(bloco_indicadores, orcamento, contador), ""
+    return bloco_indicadores, _truncar_para_orcamento(secoes_map_reduce, orcamento - tokens_indicadores, contador)
+
+
+def renderizar_secao_com_orcamento(nome: str, df_content, orcamento: int, contador: ContadorTokens) -> str:
+    """
+    Renderiza a seção do arquivo usando no máximo 'orcamento' tokens. DataFrames que cabem inteiros entram
+    completos; os demais recebem o describe() (se couber em até metade da fatia) e o maior número de linhas
+    de head/tail que ainda cabe, encontrado por busca binária.
+    """
+    with etapa("reduzir", arquivo=nome, estrategia="orcamento", orcamento=orcamento):
+        return _renderizar_secao_com_orcamento(nome, df_content, orcamento, contador)
+
+
+def _renderizar_secao_com_orcamento(nome: str, df_content, orcamento: int, contador: ContadorTokens) -> str:
+    cabecalho = cabecalho_secao(nome, df_content)
+    if orcamento <= 0:
+        print(f"  ✂️ Sem orçamento de tokens para: {nome} (seção omitida)")
+        return ""
+    if not eh_dataframe(df_content):
+        return _truncar_para_orcamento(cabecalho + str(df_content) + "\n\n", orcamento, contador)
+
+    num_rows = df_content.shape[0]
+    if estimar_demanda(nome, df_content, contador) <= orcamento:
+        with etapa("to_string", arquivo=nome, linhas=num_rows):
+            completo = cabecalho + formatador_tabela(df_content, contador=contador)(df_content) + "\n\n"
+        if contador(completo) <= orcamento:
+            print(f"  📄 Incluindo DataFrame completo ({num_rows} linhas, orçamento {orcamento} tokens): {nome}")
+            return completo
+
+    describe = "".join(partes_describe(nome, df_content))
+    if contador(describe) > orcamento * FRACAO_MAXIMA_DESCRIBE:
+        describe = ""
+
+    def montar(k: int) -> str:
+        return "".join([cabecalho, *partes_head_tail(nome, df_content, k, k), describe, "\n\n"])
+
+    baixo, alto = 0, num_rows // 2
+    while baixo < alto:
+        meio = (baixo + alto + 1) // 2
+        if contador(montar(meio)) <= orcamento:
+            baixo = meio
+        else:
+            alto = meio - 1
+
+    secao = montar(baixo)
+    if contador(secao) > orcamento:
+        print(f"  ✂️ Orçamento insuficiente para linhas de {nome} ({orcamento} tokens); incluindo apenas o que couber.")
+        return _truncar_para_orcamento(cabecalho + describe + "\n\n", orcamento, contador)
+    detalhe_describe = "e describe() " if describe else ""
+    print(f"  📄 Incluindo head({baixo}), tail({baixo}) {detalhe_describe}para: {nome} (orçamento {orcamento} tokens)")
+    return secao
+
+
+def montar_conteudo_dados_com_orcamento(arquivos: list[Path], cache_dados: CacheDadosZ, cache_secoes: CacheSecoes,
+                                        orcamento_tokens: int, model_id: str,
+                                        importancia: dict[str, float] | None = None) -> tuple[str, int, str]:
+    """
+    Monta o bloco de dados respeitando 'orcamento_tokens'. Retorna (texto, tokens contados, nome do tokenizador).
+    Demandas e seções renderizadas ficam no cache de seções, então arquivos inalterados não são recarregados.
+    """
+    nome_contador, contador = obter_contador(model_id)
+    chave_pandas = f"{chave_opcoes_pandas()}|{chave_serializacao()}"
+
+    impressoes = {}
+    demandas = {}
+    for arquivo in arquivos:
+        try:
+            impressoes[arquivo.name] = impressao = cache_dados.impressao_digital(arquivo)
+            chave = CacheSecoes.chave(impressao, arquivo.name, f"demanda|{nome_contador}|{chave_pandas}")
+            demanda = cache_secoes.obter(chave)
+            if demanda is None:
+                demanda = str(estimar_demanda(arquivo.name, cache_dados.carregar(arquivo, impressao), contador))
+                cache_secoes.guardar(chave, demanda)
+            demandas[arquivo.name] = int(demanda)
+        except Exception as e:
+            print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
+            impressoes.pop(arquivo.name, None)
+
+    orcamento_secoes = orcamento_tokens - contador(CABECALHO_DADOS)
+    pesos = {nome: importancia_arquivo(nome, importancia) for nome in demandas}
+    alocacoes = distribuir_orcamento(demandas, orcamento_secoes, pesos)
+
+    def secao_do_arquivo(arquivo: Path) -> str:
+        alocacao = alocacoes.get(arquivo.name, 0)
+        chave = CacheSecoes.chave(impressoes[arquivo.name], arquivo.name,
+                                  f"orcamento|{alocacao}|{nome_contador}|{chave_pandas}")
+        secao = cache_secoes.obter(chave)
+        if secao is not None:
+            print(f"  ♻️ Seção reaproveitada do cache (arquivo inalterado): {arquivo.name}")
+            return secao
+        df_content = cache_dados.carregar(arquivo, impressoes[arquivo.name])
+        secao = renderizar_secao_com_orcamento(arquivo.name, df_content, alocacao, contador)
+        cache_secoes.guardar(chave, secao)
+        return secao
+
+    arquivos_validos = [arquivo for arquivo in arquivos if arquivo.name in impressoes]
+    secoes = {arquivo.name: secao_do_arquivo(arquivo) for arquivo in arquivos_validos}
+    texto = CABECALHO_DADOS + "".join(secoes.values())
+    tokens = contador(texto)
+
+    # A soma das seções pode diferir ligeiramente da contagem do texto unido (junções do BPE):
+    # nesse caso a maior fatia é reduzida pelo excesso até o total caber.
+    while tokens > orcamento_tokens and any(alocacoes.values()):
+        maior = max(alocacoes, key=alocacoes.get)
+        alocacoes[maior] = max(0, alocacoes[maior] - (tokens - orcamento_tokens) - 1)
+        secoes[maior] = secao_do_arquivo(next(a for a in arquivos_validos if a.name == maior))
+        texto = CABECALHO_DADOS + "".join(secoes.values())
+        tokens = contador(texto)
+
+    return texto, tokens, nome_contador
+
+
+### Testes ###
+
+class TestReducaoOrcamento(unittest.TestCase):
+    def setUp(self):
+        self.contador = contar_tokens_aproximado
+        self.df = pd.DataFrame({"data": pd.date_range("2024-01-01", periods=2000, freq="h").astype(str),
+                                "conta": [f"conta {i % 37}" for i in range(2000)],
+                                "valor": [round(i * 1.37, 2) for i in range(2000)]})
+
+    def test_distribuicao_atende_quem_pede_pouco_e_nao_passa_do_total(self):
+        demandas = {"categorias.z": 100, "vendas.z": 50_000, "produtos.z": 20_000}
+        pesos = {"vendas.z": 3.0}
+        alocacoes = distribuir_orcamento(demandas, 10_000, pesos)
+        self.assertEqual(alocacoes["categorias.z"], 100)
+        self.assertGreater(alocacoes["vendas.z"], alocacoes["produtos.z"])
+        self.assertLessEqual(sum(alocacoes.values()), 10_000)
+        self.assertEqual(distribuir_orcamento(demandas, 10**6, pesos), demandas)
+
+    def test_truncamento_cabe_no_orcamento(self):
+        texto = "linha de dados 123,45\n" * 500
+        truncado = _truncar_para_orcamento(texto, 200, self.contador)
+        self.assertLessEqual(self.contador(truncado), 200)
+        self.assertTrue(texto.startswith(truncado.split("\n[...")[0]))
+        self.assertEqual(_truncar_para_orcamento(texto, 3, self.contador), "")
+
+    def test_secao_nunca_passa_do_orcamento(self):
+        for orcamento in (0, 50, 400, 3000, 10**6):
+            secao = renderizar_secao_com_orcamento("vendas.z", self.df, orcamento, self.contador)
+            self.assertLessEqual(self.contador(secao), orcamento)
+        completa = renderizar_secao_com_orcamento("vendas.z", self.df.head(20), 10**6, self.contador)
+        self.assertIn("conta 19", completa)
+
+    def test_bloco_de_dados_respeita_o_orcamento(self):
+        with tempfile.TemporaryDirectory() as temporario:
+            diretorio = Path(temporario)
+            arquivos = []
+            for nome, df in (("vendas.z", self.df), ("categorias.z", self.df.head(10))):
+                joblib.dump(df, diretorio / nome)
+                arquivos.append(diretorio / nome)
+            cache_dados = CacheDadosZ(diretorio / "cache_dados")
+            cache_secoes = CacheSecoes(diretorio / "cache_secoes")
+            texto, tokens, _ = montar_conteudo_dados_com_orcamento(arquivos, cache_dados, cache_secoes, 1500,
+                                                                   "gpt-4o-mini")
+            self.assertLessEqual(tokens, 1500)
+            self.assertTrue(texto.startswith(CABECALHO_DADOS))
+            self.assertIn("categorias.z", texto)
@@ -0,0 +1,348 @@
+import random
+import threading
+import time
+import unittest
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable
+
+# --- Resiliência das Chamadas ao LLM ---
+# Erros transitórios (conexão, timeout, 408/409/429/5xx) são repetidos com backoff exponencial com jitter,
+# respeitando o Retry-After enviado pela API. Um disjuntor (circuit breaker) por modelo para de chamar um
+# endpoint que está falhando seguidamente e só volta a testá-lo depois de um tempo. Limite de taxa (429) não
+# conta como falha do disjuntor: o endpoint está respondendo, só pede para esperar, e abrir o circuito mandaria
+# as próximas chamadas para um modelo alternativo (mais caro) em vez de esperar o Retry-After.
+# Erros de contexto excedido não são repetidos: quem chama decide o fallback (outro modelo ou menos dados).
+
+STATUS_LIMITE_TAXA = 429
+STATUS_TRANSITORIOS = (408, 409, STATUS_LIMITE_TAXA)
+NOMES_ERROS_TRANSITORIOS = ("APIConnectionError", "APITimeoutError", "Timeout", "ServiceUnavailableError",
+                            "TryAgain", "RateLimitError")
+CODIGOS_NAO_TRANSITORIOS = ("insufficient_quota", "billing_hard_limit_reached")
+MARCADORES_CONTEXTO_EXCEDIDO = ("context_length_exceeded", "maximum context length", "prompt is too long",
+                                "string_above_max_length", "reduce the length of the messages")
+
+
+@dataclass(frozen=True)
+class PoliticaRetentativa:
+    """
+    Backoff exponencial com "full jitter": a espera da tentativa n é sorteada entre 0 e min(maximo_s, base_s * fator^n).
+    Um Retry-After informado pela API tem precedência (limitado a 'maximo_retry_after_s').
+    """
+    max_tentativas: int = 5
+    base_s: float = 1.0
+    fator: float = 2.0
+    maximo_s: float = 30.0
+    maximo_retry_after_s: float = 120.0
+
+
+class CircuitoAberto(Exception):
+    """O disjuntor do modelo está aberto: a chamada nem foi feita."""
+
+    def __init__(self, modelo: str, reabre_em_s: float):
+        super().__init__(f"Circuito aberto para '{modelo}' (nova tentativa em {reabre_em_s:.0f}s)")
+        self.modelo = modelo
+        self.reabre_em_s = reabre_em_s
+
+
+def status_http(erro: Exception) -> int | None:
+    """Status HTTP do erro, tanto no SDK atual (status_code) quanto no legado (http_status)."""
+    status = getattr(erro, 'status_code', None) or getattr(erro, 'http_status', None)
+    if status is None and getattr(erro, 'response', None) is not None:
+        status = getattr(erro.response, 'status_code', None)
+    return status
+
+
+def _texto_erro(erro: Exception) -> str:
+    partes = [str(erro), str(getattr(erro, 'code', '') or ''), str(getattr(erro, 'body', '') or '')]
+    return " ".join(partes).lower()
+
+
+def eh_erro_contexto(erro: Exception) -> bool:
+    """O prompt passou da janela de contexto do modelo (repetir a mesma requisição não adianta)."""
+    texto = _texto_erro(erro)
+    return any(marcador in texto for marcador in MARCADORES_CONTEXTO_EXCEDIDO)
+
+
+def eh_transitorio(erro: Exception) -> bool:
+    """Erros que costumam se resolver sozinhos: conexão, timeout, 408, 409, 429 (exceto falta de crédito) e 5xx."""
+    if eh_erro_contexto(erro):
+        return False
+    texto = _texto_erro(erro)
+    if any(codigo in texto for codigo in CODIGOS_NAO_TRANSITORIOS):
+        return False
+    status = status_http(erro)
+    if status is not None:
+        return status in STATUS_TRANSITORIOS or status >= 500
+    return type(erro).__name__ in NOMES_ERROS_TRANSITORIOS
+
+
+def eh_limite_taxa(erro: Exception) -> bool:
+    """429 / RateLimitError transitório: o endpoint está saudável, só pediu para esperar."""
+    if not eh_transitorio(erro):
+        return False
+    status = status_http(erro)
+    if status is not None:
+        return status == STATUS_LIMITE_TAXA
+    return type(erro).__name__ == "RateLimitError"
+
+
+def extrair_retry_after(erro: Exception) -> float | None:
+    """Segundos pedidos pela API no cabeçalho retry-after-ms / Retry-After (número ou data HTTP), se houver."""
+    resposta = getattr(erro, 'response', None)
+    cabecalhos = getattr(resposta, 'headers', None) or getattr(erro, 'headers', None) or {}
+    try:
+        valor_ms = cabecalhos.get('retry-after-ms')
+        if valor_ms is not None:
+            return max(0.0, float(valor_ms) / 1000)
+        valor = cabecalhos.get('retry-after')
+        if valor is None:
+            return None
+        try:
+            return max(0.0, float(valor))
+        except ValueError:
+            return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def calcular_espera(tentativa: int, politica: PoliticaRetentativa, retry_after: float | None = None,
+                    aleatorio: random.Random | None = None) -> float:
+    """Espera antes da retentativa número 'tentativa' (começando em 0)."""
+    if retry_after is not None:
+        return min(retry_after, politica.maximo_retry_after_s)
+    teto = min(politica.maximo_s, politica.base_s * politica.fator ** tentativa)
+    return (aleatorio or random).uniform(0, teto)
+
+
+class DisjuntorCircuito:
+    """
+    Disjuntor de um modelo. Fechado: chamadas passam. Após 'limite_falhas' falhas transitórias seguidas, abre
+    e recusa chamadas por 'tempo_aberto_s'; depois fica meio-aberto e deixa passar uma chamada de teste:
+    sucesso fecha o circuito, falha o reabre. Limite de taxa (429) e erros da própria requisição (ex.: contexto
+    excedido, 400) não mudam o estado nem a contagem: não dizem nada sobre a saúde do endpoint.
+    """
+
+    def __init__(self, modelo: str, limite_falhas: int = 5, tempo_aberto_s: float = 30.0):
+        self.modelo = modelo
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto_s = tempo_aberto_s
+        self.estado = "fechado"
+        self.falhas_seguidas = 0
+        self.aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def verificar(self):
+        """Levanta CircuitoAberto se a chamada não deve ser feita agora."""
+        with self._lock:
+            if self.estado == "fechado":
+                return
+            decorrido = time.monotonic() - self.aberto_em
+            if self.estado == "aberto" and decorrido >= self.tempo_aberto_s:
+                self.estado = "meio_aberto"
+            if self.estado == "meio_aberto" and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return
+            raise CircuitoAberto(self.modelo, max(0.0, self.tempo_aberto_s - decorrido))
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.estado = "fechado"
+            self.falhas_seguidas = 0
+            self._teste_em_andamento = False
+
+    def registrar_neutro(self):
+        """
+        429 ou erro da requisição: não conta como falha nem como sucesso; só libera a vaga da chamada de teste
+        do meio-aberto, para que outra chamada possa testar o endpoint.
+        """
+        with self._lock:
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self.estado == "meio_aberto" or self.falhas_seguidas >= self.limite_falhas:
+                if self.estado != "aberto":
+                    print(f"  🔌 Circuito aberto para '{self.modelo}' após {self.falhas_seguidas} falha(s) seguida(s).")
+                self.estado = "aberto"
+                self.aberto_em = time.monotonic()
+
+
+class RegistroDisjuntores:
+    """Um DisjuntorCircuito por modelo, criado sob demanda."""
+
+    def __init__(self, limite_falhas: int = 5, tempo_aberto_s: float = 30.0):
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto_s = tempo_aberto_s
+        self._disjuntores: dict[str, DisjuntorCircuito] = {}
+        self._lock = threading.Lock()
+
+    def obter(self, modelo: str) -> DisjuntorCircuito:
+        with self._lock:
+            if modelo not in self._disjuntores:
+                self._disjuntores[modelo] = DisjuntorCircuito(modelo, self.limite_falhas, self.tempo_aberto_s)
+            return self._disjuntores[modelo]
+
+
+def executar_com_retentativas(funcao: Callable[[], Any], politica: PoliticaRetentativa | None = None,
+                              disjuntor: DisjuntorCircuito | None = None,
+                              pode_repetir: Callable[[], bool] | None = None,
+                              espera: Callable[[float], None] = time.sleep) -> tuple[Any, int]:
+    """
+    Executa 'funcao', repetindo erros transitórios conforme a 'politica' e consultando o 'disjuntor'.
+    'pode_repetir' permite vetar a retentativa (ex.: um streaming que já entregou parte da resposta).
+    Retorna (resultado, número de retentativas). Erros não transitórios, tentativas esgotadas ou
+    circuito aberto são repassados como exceção (com o atributo 'retentativas').
+    """
+    politica = politica or PoliticaRetentativa()
+    tentativa = 0
+    while True:
+        if disjuntor is not None:
+            try:
+                disjuntor.verificar()
+            except CircuitoAberto as erro:
+                erro.retentativas = tentativa
+                raise
+        try:
+            resultado = funcao()
+        except Exception as erro:
+            transitorio = eh_transitorio(erro)
+            if disjuntor is not None:
+                if transitorio and not eh_limite_taxa(erro):
+                    disjuntor.registrar_falha()
+                else:
+                    # 429 ou erro da requisição (ex.: contexto excedido), não do endpoint
+                    disjuntor.registrar_neutro()
+            ultima = tentativa + 1 >= politica.max_tentativas
+            if not transitorio or ultima or (pode_repetir is not None and not pode_repetir()):
+                erro.retentativas = tentativa
+                raise
+            retry_after = extrair_retry_after(erro)
+            pausa = calcular_espera(tentativa, politica, retry_after)
+            origem = "Retry-After" if retry_after is not None else "backoff"
+            print(f"  🔁 Erro transitório ({status_http(erro) or type(erro).__name__}); nova tentativa "
+                  f"{tentativa + 2}/{politica.max_tentativas} em {pausa:.1f}s ({origem}).")
+            espera(pausa)
+            tentativa += 1
+            continue
+        if disjuntor is not None:
+            disjuntor.registrar_sucesso()
+        return resultado, tentativa
+
+
+### Testes ###
+
+class ErroHttp(Exception):
+    """Erro no formato do SDK da OpenAI (status_code, headers e code), para os testes."""
+
+    def __init__(self, status: int, mensagem: str = "", code: str = "", headers: dict | None = None):
+        super().__init__(mensagem or f"Erro {status}")
+        self.status_code = status
+        self.code = code
+        self.headers = headers or {}
+
+
+def sempre_falha(erro: Exception) -> Callable[[], Any]:
+    def chamar():
+        raise erro
+    return chamar
+
+
+class TestDisjuntorCircuito(unittest.TestCase):
+    def setUp(self):
+        from unittest import mock
+
+        self.agora = 100.0
+        patcher = mock.patch(f"{__name__}.time.monotonic", lambda: self.agora)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.disjuntor = DisjuntorCircuito("modelo", limite_falhas=2, tempo_aberto_s=30)
+
+    def _abrir(self):
+        for _ in range(2):
+            self.disjuntor.verificar()
+            self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, "aberto")
+
+    def test_meio_aberto_deixa_passar_uma_chamada_de_teste(self):
+        self._abrir()
+        self.assertRaises(CircuitoAberto, self.disjuntor.verificar)
+        self.agora += 30
+        self.disjuntor.verificar()  # a chamada de teste
+        self.assertEqual(self.disjuntor.estado, "meio_aberto")
+        self.assertRaises(CircuitoAberto, self.disjuntor.verificar)  # só uma de cada vez
+        self.disjuntor.registrar_sucesso()
+        self.assertEqual(self.disjuntor.estado, "fechado")
+        self.disjuntor.verificar()
+
+    def test_falha_no_meio_aberto_reabre(self):
+        self._abrir()
+        self.agora += 30
+        self.disjuntor.verificar()
+        self.disjuntor.registrar_falha()
+        self.assertEqual(self.disjuntor.estado, "aberto")
+        self.assertRaises(CircuitoAberto, self.disjuntor.verificar)
+
+    def test_erro_da_requisicao_nao_fecha_o_circuito(self):
+        self._abrir()
+        self.agora += 30
+        with self.assertRaises(ErroHttp):
+            executar_com_retentativas(sempre_falha(ErroHttp(400, code="context_length_exceeded")),
+                                      disjuntor=self.disjuntor, espera=lambda _: None)
+        self.assertEqual(self.disjuntor.estado, "meio_aberto")
+        self.assertEqual(self.disjuntor.falhas_seguidas, 2)
+        self.disjuntor.verificar()  # a vaga de teste foi liberada
+
+    def test_limite_de_taxa_nao_conta_como_falha(self):
+        self.disjuntor.verificar()
+        self.disjuntor.registrar_falha()
+        tentativas = iter([ErroHttp(429), ErroHttp(429), "ok"])
+
+        def chamar():
+            resultado = next(tentativas)
+            if isinstance(resultado, Exception):
+                raise resultado
+            return resultado
+
+        self.assertEqual(executar_com_retentativas(chamar, disjuntor=self.disjuntor, espera=lambda _: None),
+                         ("ok", 2))
+        self.assertEqual((self.disjuntor.estado, self.disjuntor.falhas_seguidas), ("fechado", 0))
+
+
+class TestRetentativas(unittest.TestCase):
+    def test_retry_after_em_segundos_milissegundos_e_data(self):
+        from email.utils import format_datetime
+
+        self.assertEqual(extrair_retry_after(ErroHttp(429, headers={"retry-after": "7"})), 7.0)
+        self.assertEqual(extrair_retry_after(ErroHttp(429, headers={"retry-after-ms": "1500", "retry-after": "7"})), 1.5)
+        data = format_datetime(datetime.now(timezone.utc).replace(microsecond=0) + timedelta(seconds=20), usegmt=True)
+        self.assertAlmostEqual(extrair_retry_after(ErroHttp(503, headers={"retry-after": data})), 20, delta=1.5)
+        self.assertIsNone(extrair_retry_after(ErroHttp(503)))
+        self.assertIsNone(extrair_retry_after(ErroHttp(503, headers={"retry-after": "amanhã"})))
+
+    def test_espera_respeita_retry_after_e_teto_do_backoff(self):
+        politica = PoliticaRetentativa(base_s=1, fator=2, maximo_s=5, maximo_retry_after_s=60)
+        self.assertEqual(calcular_espera(0, politica, retry_after=90), 60)
+        aleatorio = random.Random(0)
+        esperas = [calcular_espera(10, politica, aleatorio=aleatorio) for _ in range(200)]
+        self.assertTrue(all(0 <= espera <= 5 for espera in esperas))
+
+    def test_classificacao_dos_erros(self):
+        self.assertTrue(eh_transitorio(ErroHttp(503)))
+        self.assertTrue(eh_limite_taxa(ErroHttp(429)))
+        self.assertFalse(eh_transitorio(ErroHttp(429, code="insufficient_quota")))
+        self.assertFalse(eh_transitorio(ErroHttp(404)))
+        self.assertTrue(eh_erro_contexto(ErroHttp(400, "This model's maximum context length is 8192 tokens")))
+        self.assertFalse(eh_transitorio(ErroHttp(400, code="context_length_exceeded")))
+
+    def test_tentativas_esgotadas_levantam_com_retentativas(self):
+        esperas = []
+        with self.assertRaises(ErroHttp) as contexto:
+            executar_com_retentativas(sempre_falha(ErroHttp(500)), PoliticaRetentativa(max_tentativas=3),
+                                      espera=esperas.append)
+        self.assertEqual(contexto.exception.retentativas, 2)
+        self.assertEqual(len(esperas), 2)
@@ -0,0 +1,334 @@
+import json
+import tempfile
+import unittest
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import joblib
+import pandas as pd
+
+from cache_dados import CacheDadosZ
+from estatisticas_aproximadas import hash_linhas
+from indicadores import _normalizar, montar_bloco_indicadores
+from lote import LimitadorTaxa, TarefaPrompt, executar_lote, limitador_compartilhado, MAX_WORKERS_PADRAO
+from montagem_prompt import CacheSecoes, ConfiguracaoReducao, eh_dataframe, renderizar_secao
+from telemetria import etapa
+
+# --- Resumo Incremental por Seção ---
+# O resumo do prompt1 tem quatro seções, cada uma dependente de poucas tabelas. Guardamos, por diretório,
+# o texto de cada seção e a impressão digital das tabelas usadas, além do estado de cada arquivo (hash,
+# número de linhas e hash das linhas). Na próxima execução:
+#   - seções cujas tabelas não mudaram são reaproveitadas sem chamar o LLM;
+#   - se as tabelas só ganharam linhas no final (exportação diária), o LLM recebe a seção anterior, os
+#     indicadores recalculados e apenas as linhas novas, e atualiza a seção (resumo "delta");
+#   - qualquer outra alteração regenera a seção do zero, só com as tabelas dela.
+# As seções são então unidas, na ordem do prompt1, no resumo final.
+
+VERSAO_RESUMO_INCREMENTAL = "1"  # incremente ao mudar os prompts abaixo, para invalidar seções guardadas
+MAX_LINHAS_DELTA = 2000  # acima disso, regenerar a seção sai mais barato que descrever as linhas novas
+MAX_TOKENS_SECAO = 800
+
+# Os dados vêm primeiro (mesmo layout de prompts.prefixo_dados): seções com as mesmas tabelas (fluxo de caixa e
+# liquidez) começam pelo mesmo texto e aproveitam o cache de prefixo do provedor.
+PROMPT_SECAO = """Dados:
+{dados}
+
+---
+
+Com base nos dados acima, elabore APENAS a seção "{numero}. {titulo}" de um resumo contábil conciso ({descricao}).
+Comece pelo título "{numero}. {titulo}". Use linguagem direta, sem jargões desnecessários, focada em decisões rápidas."""
+
+PROMPT_DELTA = """Dados atualizados:
+{dados}
+
+---
+
+Os dados acima são os indicadores recalculados sobre a base completa e as linhas incluídas desde a última versão da seção "{numero}. {titulo}" de um resumo contábil ({descricao}), reproduzida abaixo.
+Atualize a seção para refletir os dados novos: ajuste números, tendências e alertas que mudaram e mantenha o restante.
+Comece pelo título "{numero}. {titulo}". Use linguagem direta, sem jargões desnecessários, focada em decisões rápidas.
+
+Seção anterior:
+{secao_anterior}"""
+
+
+@dataclass(frozen=True)
+class SecaoResumo:
+    """Uma seção do resumo e os trechos de nome (normalizados) das tabelas de que ela depende."""
+    numero: int
+    chave: str
+    titulo: str
+    descricao: str
+    fontes: tuple[str, ...]
+
+
+SECOES_PROMPT1 = (
+    SecaoResumo(1, "fluxo_caixa", "Fluxo de Caixa Operacional", "entradas, saídas e saldo do período",
+                ("movimento", "contas_a_receber", "contas_a_pagar")),
+    SecaoResumo(2, "vendas_categoria", "Desempenho de Vendas por Categoria", "receita, volume e concentração",
+                ("vendas", "produtos", "categorias")),
+    SecaoResumo(3, "liquidez", "Liquidez da Empresa", "capacidade de honrar as obrigações de curto prazo",
+                ("movimento", "contas_a_receber", "contas_a_pagar")),
+    SecaoResumo(4, "gastos", "Principais Gastos", "maiores centros de custo e variação relevante",
+                ("contas_a_pagar", "naturezas", "movimento")),
+)
+
+
+@dataclass
+class AlteracaoArquivo:
+    """
+    Mudança de um arquivo desde a execução anterior. 'tipo' é 'novo', 'inalterado', 'anexado' (só ganhou
+    linhas no final: as linhas [linhas_antes, linhas_depois) são as novas) ou 'alterado'.
+    """
+    nome: str
+    tipo: str
+    hash_anterior: str | None
+    hash_atual: str
+    linhas_antes: int | None = None
+    linhas_depois: int | None = None
+
+
+def fontes_da_secao(secao: SecaoResumo, arquivos: list[Path]) -> list[Path]:
+    """
+    Arquivos de que a seção depende. Arquivos que não pertencem a nenhuma seção entram em todas
+    (não dá para saber o que eles afetam); sem nenhuma tabela própria, a seção usa todos os arquivos.
+    """
+    def pertence(arquivo: Path, trechos) -> bool:
+        return any(trecho in _normalizar(arquivo.stem) for trecho in trechos)
+
+    todos_trechos = {trecho for s in SECOES_PROMPT1 for trecho in s.fontes}
+    proprios = [arquivo for arquivo in arquivos if pertence(arquivo, secao.fontes)]
+    if not proprios:
+        return list(arquivos)
+    return [arquivo for arquivo in arquivos if arquivo in proprios or not pertence(arquivo, todos_trechos)]
+
+
+class EstadoResumoIncremental:
+    """Estado persistido (JSON) de um diretório: arquivos vistos e seções geradas."""
+
+    def __init__(self, caminho: Path):
+        self.caminho = Path(caminho)
+        try:
+            dados = json.loads(self.caminho.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            dados = {}
+        self.arquivos: dict[str, dict] = dados.get("arquivos", {})
+        self.secoes: dict[str, dict] = dados.get("secoes", {})
+
+    def salvar(self):
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = self.caminho.with_suffix(".tmp")
+        temporario.write_text(json.dumps({"arquivos": self.arquivos, "secoes": self.secoes}, ensure_ascii=False),
+                              encoding="utf-8")
+        temporario.replace(self.caminho)
+
+
+def detectar_alteracoes(arquivos: list[Path], cache_dados: CacheDadosZ,
+                        estado: EstadoResumoIncremental) -> tuple[dict[str, AlteracaoArquivo], dict[str, Any]]:
+    """
+    Compara cada arquivo com o estado anterior e atualiza 'estado.arquivos'. Só carrega os arquivos cujo hash
+    mudou (para contar linhas e testar se a mudança foi só um acréscimo no final).
+    Retorna ({nome: alteração}, {nome: DataFrame carregado}).
+    """
+    alteracoes, carregados = {}, {}
+    for arquivo in arquivos:
+        impressao = cache_dados.impressao_digital(arquivo)
+        anterior = estado.arquivos.get(arquivo.name)
+        if anterior is not None and anterior["hash"] == impressao.hash:
+            alteracoes[arquivo.name] = AlteracaoArquivo(arquivo.name, "inalterado", anterior["hash"], impressao.hash,
+                                                        anterior.get("linhas"), anterior.get("linhas"))
+            continue
+        df = cache_dados.carregar(arquivo, impressao)
+        carregados[arquivo.name] = df
+        linhas = len(df) if eh_dataframe(df) else None
+        # Exports lidos em blocos (ResumoStreaming) não guardam todas as linhas: qualquer mudança refaz as seções
+        registro = {"hash": impressao.hash, "linhas": linhas,
+                    "hash_linhas": hash_linhas(df) if isinstance(df, pd.DataFrame) else None}
+        tipo = "novo" if anterior is None else "alterado"
+        if (anterior is not None and linhas is not None and anterior.get("hash_linhas") is not None
+                and anterior.get("linhas") is not None and linhas > anterior["linhas"]):
+            try:
+                if hash_linhas(df, anterior["linhas"]) == anterior["hash_linhas"]:
+                    tipo = "anexado"
+            except TypeError:
+                pass  # colunas não hasheáveis: trata como alteração completa
+        alteracoes[arquivo.name] = AlteracaoArquivo(arquivo.name, tipo, anterior and anterior["hash"], impressao.hash,
+                                                    anterior and anterior.get("linhas"), linhas)
+        estado.arquivos[arquivo.name] = registro
+    for nome in set(estado.arquivos) - {arquivo.name for arquivo in arquivos}:
+        del estado.arquivos[nome]
+    return alteracoes, carregados
+
+
+def planejar_secao(secao: SecaoResumo, fontes: list[Path], alteracoes: dict[str, AlteracaoArquivo],
+                   registro: dict | None, assinatura: str) -> tuple[str, list[AlteracaoArquivo]]:
+    """
+    Decide o que fazer com a seção: ('reaproveitar', []), ('delta', arquivos anexados) ou ('completa', []).
+    O delta só vale se a seção guardada foi gerada exatamente sobre a versão anterior de cada arquivo alterado.
+    """
+    if registro is None or registro.get("assinatura") != assinatura:
+        return "completa", []
+    hashes_usados = registro.get("fontes", {})
+    if set(hashes_usados) != {arquivo.name for arquivo in fontes}:
+        return "completa", []
+    mudancas = [alteracoes[arquivo.name] for arquivo in fontes if hashes_usados[arquivo.name] != alteracoes[arquivo.name].hash_atual]
+    if not mudancas:
+        return "reaproveitar", []
+    delta_valido = all(
+        mudanca.tipo == "anexado" and hashes_usados[mudanca.nome] == mudanca.hash_anterior for mudanca in mudancas)
+    if delta_valido and sum(m.linhas_depois - m.linhas_antes for m in mudancas) <= MAX_LINHAS_DELTA:
+        return "delta", mudancas
+    return "completa", []
+
+
+def gerar_resumo_incremental(arquivos: list[Path], cache_dados: CacheDadosZ, cache_secoes: CacheSecoes,
+                             caminho_estado: Path, montar_dados: Callable[[list[Path]], str],
+                             funcao_envio: Callable[..., Any], contador: Callable[[str], int], model_id: str,
+                             eh_erro: Callable[[Any], bool] | None = None, max_workers: int = MAX_WORKERS_PADRAO,
+                             limitador: LimitadorTaxa | None = None) -> str | None:
+    """
+    Gera o resumo do prompt1 seção a seção, regenerando só as seções cujas tabelas mudaram.
+    'montar_dados(arquivos)' devolve o bloco de dados (indicadores + seções reduzidas) de um subconjunto de arquivos.
+    Retorna o resumo completo, ou None se alguma seção sem versão anterior falhar.
+    """
+    estado = EstadoResumoIncremental(caminho_estado)
+    with etapa("detectar_alteracoes", arquivos=len(arquivos)) as detalhes:
+        alteracoes, carregados = detectar_alteracoes(arquivos, cache_dados, estado)
+        detalhes["alterados"] = sorted(nome for nome, a in alteracoes.items() if a.tipo != "inalterado")
+    for alteracao in alteracoes.values():
+        if alteracao.tipo == "anexado":
+            print(f"  ➕ {alteracao.nome}: {alteracao.linhas_depois - alteracao.linhas_antes} linha(s) nova(s) no final.")
+        elif alteracao.tipo in ("novo", "alterado"):
+            print(f"  ✏️ {alteracao.nome}: {alteracao.tipo}.")
+
+    tarefas, planos = [], {}
+    for secao in SECOES_PROMPT1:
+        fontes = fontes_da_secao(secao, arquivos)
+        assinatura = f"{VERSAO_RESUMO_INCREMENTAL}|{model_id}|{PROMPT_SECAO}|{PROMPT_DELTA}|{secao}"
+        registro = estado.secoes.get(secao.chave)
+        acao, anexados = planejar_secao(secao, fontes, alteracoes, registro, assinatura)
+        planos[secao.chave] = (fontes, assinatura)
+        if acao == "reaproveitar":
+            print(f"  ♻️ Seção {secao.numero} ({secao.titulo}) reaproveitada: tabelas inalteradas.")
+            continue
+        campos = {"numero": secao.numero, "titulo": secao.titulo, "descricao": secao.descricao}
+        if acao == "delta":
+            print(f"  🔺 Seção {secao.numero} ({secao.titulo}): atualização com as linhas novas.")
+            bloco_indicadores, _ = montar_bloco_indicadores(fontes, cache_dados, cache_secoes)
+            config = ConfiguracaoReducao()
+            partes = [bloco_indicadores]
+            for mudanca in anexados:
+                df = carregados[mudanca.nome]
+                nome_trecho = f"{mudanca.nome} – linhas novas {mudanca.linhas_antes + 1} a {mudanca.linhas_depois}"
+                partes.append(renderizar_secao(nome_trecho, df.iloc[mudanca.linhas_antes:mudanca.linhas_depois], config))
+            prompt = PROMPT_DELTA.format(**campos, secao_anterior=registro["texto"], dados="".join(partes))
+        else:
+            print(f"  🔄 Seção {secao.numero} ({secao.titulo}): geração completa.")
+            prompt = PROMPT_SECAO.format(**campos, dados=montar_dados(fontes))
+        tarefas.append(TarefaPrompt(prompt=prompt, tokens_estimados=contador(prompt) + MAX_TOKENS_SECAO,
+                                    identificador=secao.chave, kwargs={"max_tokens": MAX_TOKENS_SECAO}))
+
+    falhou = False
+    if tarefas:
+        with etapa("resumo_incremental", secoes=[tarefa.identificador for tarefa in tarefas]):
+            resultados = executar_lote(tarefas, funcao_envio, max_workers=max_workers,
+                                       limitador=limitador or limitador_compartilhado(model_id), eh_erro=eh_erro)
+        for resultado in resultados:
+            fontes, assinatura = planos[resultado.identificador]
+            if resultado.status == "ok":
+                estado.secoes[resultado.identificador] = {
+                    "texto": resultado.resposta.strip(), "assinatura": assinatura,
+                    "fontes": {arquivo.name: alteracoes[arquivo.name].hash_atual for arquivo in fontes}}
+            elif resultado.identificador in estado.secoes:
+                # Mantém o texto anterior; as impressões antigas fazem a seção ser refeita na próxima execução
+                print(f"  ⚠️ Seção '{resultado.identificador}' não foi atualizada ({resultado.erro}); usando a versão anterior.")
+            else:
+                print(f"  ❌ Seção '{resultado.identificador}' não pôde ser gerada: {resultado.erro}")
+                falhou = True
+    estado.salvar()
+    if falhou:
+        return None
+    return "\n\n".join(estado.secoes[secao.chave]["texto"] for secao in SECOES_PROMPT1)
+
+
+### Testes ###
+
+class TestDeteccaoAlteracoes(unittest.TestCase):
+    def setUp(self):
+        self._temporario = tempfile.TemporaryDirectory()
+        self.diretorio = Path(self._temporario.name)
+        self.arquivo = self.diretorio / "vendas.z"
+        self.df = pd.DataFrame({"produto_id": range(100), "valor": [float(i) * 1.5 for i in range(100)]})
+        self.cache_dados = CacheDadosZ(self.diretorio / "cache")
+        self.estado = EstadoResumoIncremental(self.diretorio / "estado.json")
+
+    def tearDown(self):
+        self._temporario.cleanup()
+
+    def _detectar(self, df: pd.DataFrame) -> AlteracaoArquivo:
+        joblib.dump(df, self.arquivo)
+        alteracoes, _ = detectar_alteracoes([self.arquivo], self.cache_dados, self.estado)
+        return alteracoes[self.arquivo.name]
+
+    def test_novo_e_inalterado(self):
+        self.assertEqual(self._detectar(self.df).tipo, "novo")
+        alteracoes, carregados = detectar_alteracoes([self.arquivo], self.cache_dados, self.estado)
+        self.assertEqual(alteracoes[self.arquivo.name].tipo, "inalterado")
+        self.assertEqual(carregados, {})
+
+    def test_linhas_acrescentadas_no_final(self):
+        self._detectar(self.df)
+        novas = pd.DataFrame({"produto_id": [100, 101], "valor": [1.0, 2.0]})
+        alteracao = self._detectar(pd.concat([self.df, novas], ignore_index=True))
+        self.assertEqual(alteracao.tipo, "anexado")
+        self.assertEqual((alteracao.linhas_antes, alteracao.linhas_depois), (100, 102))
+
+    def test_edicao_no_meio_nao_e_acrescimo(self):
+        self._detectar(self.df)
+        editado = pd.concat([self.df, self.df.tail(1)], ignore_index=True)
+        editado.loc[57, "valor"] = -1.0
+        self.assertEqual(self._detectar(editado).tipo, "alterado")
+        self.assertEqual(self._detectar(self.df.iloc[:80]).tipo, "alterado")  # linhas removidas
+
+    def test_export_csv_entra_na_deteccao(self):
+        arquivo = self.diretorio / "contas-a-pagar.csv"
+        self.df.to_csv(arquivo, index=False)
+        alteracoes, _ = detectar_alteracoes([arquivo], self.cache_dados, self.estado)
+        self.assertEqual(alteracoes[arquivo.name].tipo, "novo")
+        self.assertIn(arquivo, fontes_da_secao(SECOES_PROMPT1[3], [arquivo, self.arquivo]))
+
+
+class TestPlanejarSecao(unittest.TestCase):
+    def setUp(self):
+        self.secao = SECOES_PROMPT1[1]  # vendas, produtos e categorias
+        self.fontes = [Path("vendas.z"), Path("produtos.z")]
+        self.registro = {"assinatura": "v1", "texto": "seção anterior", "fontes": {"vendas.z": "h1", "produtos.z": "p1"}}
+
+    def _alteracoes(self, vendas: AlteracaoArquivo) -> dict[str, AlteracaoArquivo]:
+        return {"vendas.z": vendas, "produtos.z": AlteracaoArquivo("produtos.z", "inalterado", "p1", "p1", 5, 5)}
+
+    def test_fontes_da_secao(self):
+        arquivos = [Path(nome) for nome in ("vendas.z", "produtos.z", "movimento-financeiro.z", "extras.z")]
+        self.assertEqual(fontes_da_secao(self.secao, arquivos), [arquivos[0], arquivos[1], arquivos[3]])
+        self.assertEqual(fontes_da_secao(self.secao, [arquivos[2]]), [arquivos[2]])  # sem tabela própria: todas
+
+    def test_reaproveitar_delta_e_completa(self):
+        inalterado = AlteracaoArquivo("vendas.z", "inalterado", "h1", "h1", 100, 100)
+        anexado = AlteracaoArquivo("vendas.z", "anexado", "h1", "h2", 100, 120)
+        self.assertEqual(planejar_secao(self.secao, self.fontes, self._alteracoes(inalterado), self.registro, "v1"),
+                         ("reaproveitar", []))
+        self.assertEqual(planejar_secao(self.secao, self.fontes, self._alteracoes(anexado), self.registro, "v1"),
+                         ("delta", [anexado]))
+        # Outra assinatura (modelo, prompt) ou seção sem registro: geração completa
+        self.assertEqual(planejar_secao(self.secao, self.fontes, self._alteracoes(anexado), self.registro, "v2")[0],
+                         "completa")
+        self.assertEqual(planejar_secao(self.secao, self.fontes, self._alteracoes(anexado), None, "v1")[0], "completa")
+
+    def test_delta_exige_a_versao_anterior_usada_na_secao(self):
+        # O arquivo ganhou linhas duas vezes, mas a seção guardada é de antes da primeira: o delta pularia linhas
+        anexado = AlteracaoArquivo("vendas.z", "anexado", "h_intermediario", "h3", 120, 130)
+        self.assertEqual(planejar_secao(self.secao, self.fontes, self._alteracoes(anexado), self.registro, "v1")[0],
+                         "completa")
+        grande = AlteracaoArquivo("vendas.z", "anexado", "h1", "h2", 100, 100 + MAX_LINHAS_DELTA + 1)
+        self.assertEqual(planejar_secao(self.secao, self.fontes, self._alteracoes(grande), self.registro, "v1")[0],
+                         "completa")
@@ -0,0 +1,358 @@
+import argparse
+import math
+import os
+import threading
+import time
+import unittest
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from openai import OpenAI
+
+from resiliencia import (CircuitoAberto, PoliticaRetentativa, RegistroDisjuntores, eh_erro_contexto, eh_transitorio,
+                         executar_com_retentativas, status_http)
+
+# --- Roteamento entre Modelo Local e Modelo na Nuvem ---
+# Um Provedor é qualquer endpoint compatível com a API de chat da OpenAI: a própria OpenAI ou um modelo local
+# servido pelo Ollama (http://localhost:11434/v1) ou pelo servidor do llama.cpp (http://localhost:8080/v1).
+# O roteador ordena os provedores de cada chamada pela estimativa de tokens do prompt: prompts pequenos
+# (até LIMITE_TOKENS_LOCAL) vão primeiro ao modelo local, prompts grandes à nuvem. Um modelo local só é usado
+# se o prompt couber na sua janela (o Ollama corta o excesso em silêncio, sem erro de contexto) e é preterido
+# quando a latência observada para aquele tamanho passa de FATOR_LATENCIA_LOCAL vezes a da nuvem.
+# Se o provedor escolhido falhar de vez (tentativas esgotadas, circuito aberto, contexto excedido ou um erro
+# definitivo, como o 404 de um modelo que não existe no servidor local), o próximo da ordem é tentado. Sem LLM_LOCAL_BASE_URL não há provedor local e tudo vai à nuvem, como antes.
+#
+#   LLM_LOCAL_BASE_URL=http://localhost:11434/v1 LLM_LOCAL_MODELO=mistral LLM_LOCAL_JANELA=8192
+
+LOCAL_BASE_URL = os.getenv("LLM_LOCAL_BASE_URL")
+LOCAL_MODELO = os.getenv("LLM_LOCAL_MODELO", "mistral")
+LOCAL_JANELA_CONTEXTO = int(os.getenv("LLM_LOCAL_JANELA", "8192"))
+# Servidores locais fora do ar recusam a conexão na hora: poucas tentativas antes de passar à nuvem.
+LOCAL_MAX_TENTATIVAS = int(os.getenv("LLM_LOCAL_MAX_TENTATIVAS", "2"))
+LIMITE_TOKENS_LOCAL = int(os.getenv("LLM_LIMITE_TOKENS_LOCAL", "4000"))
+FATOR_LATENCIA_LOCAL = float(os.getenv("LLM_FATOR_LATENCIA_LOCAL", "3.0"))
+PESO_OBSERVACAO_LATENCIA = 0.3  # peso da chamada mais recente no ajuste da latência (ver LatenciaObservada)
+
+
+@dataclass
+class Provedor:
+    """
+    Endpoint de chat com o modelo que ele serve. 'criar_cliente' é chamado uma única vez, no primeiro uso, e o
+    cliente (pool de conexões keep-alive) é reaproveitado. 'politica' substitui a política de retentativas padrão.
+    """
+    nome: str
+    modelo: str
+    janela_contexto: int
+    criar_cliente: Callable[[], OpenAI]
+    local: bool = False
+    politica: PoliticaRetentativa | None = None
+    _cliente: OpenAI | None = field(default=None, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def cliente(self) -> OpenAI:
+        with self._lock:
+            if self._cliente is None:
+                self._cliente = self.criar_cliente()
+            return self._cliente
+
+
+def provedor_compativel(nome: str, base_url: str | None, modelo: str, janela_contexto: int, local: bool = False,
+                        api_key: str | None = None, politica: PoliticaRetentativa | None = None) -> Provedor:
+    """Provedor com cliente próprio para 'base_url' (None = API da OpenAI, ou OPENAI_BASE_URL)."""
+    # Ollama e llama.cpp ignoram a chave, mas o cliente da OpenAI exige uma
+    chave = api_key or (None if not local else os.getenv("LLM_LOCAL_API_KEY", "local"))
+    return Provedor(nome, modelo, janela_contexto, lambda: OpenAI(api_key=chave, base_url=base_url, max_retries=0),
+                    local=local, politica=politica)
+
+
+def provedor_local_do_ambiente() -> Provedor | None:
+    """Provedor local configurado por LLM_LOCAL_BASE_URL/LLM_LOCAL_MODELO/LLM_LOCAL_JANELA (None se não houver)."""
+    if not LOCAL_BASE_URL:
+        return None
+    return provedor_compativel(f"local:{LOCAL_MODELO}", LOCAL_BASE_URL, LOCAL_MODELO, LOCAL_JANELA_CONTEXTO,
+                               local=True, politica=PoliticaRetentativa(max_tentativas=LOCAL_MAX_TENTATIVAS))
+
+
+@dataclass
+class LatenciaObservada:
+    """
+    Ajuste linear duração ≈ fixo + custo × tokens (prompt + resposta), por mínimos quadrados com esquecimento
+    exponencial: cada observação nova pesa PESO_OBSERVACAO_LATENCIA e as antigas perdem peso na mesma proporção.
+    Separar o custo fixo (fila, tempo até o primeiro token) do custo por token evita que um provedor pareça lento
+    só porque atendeu prompts pequenos. Guarda também a média dos tokens de resposta, para as estimativas.
+    """
+    peso: float = 0.0
+    soma_x: float = 0.0
+    soma_y: float = 0.0
+    soma_xx: float = 0.0
+    soma_xy: float = 0.0
+    tokens_resposta: float = 0.0
+    chamadas: int = 0
+
+    def observar(self, tokens_prompt: int, tokens_resposta: int | None, duracao_s: float):
+        tokens_resposta = tokens_resposta if tokens_resposta is not None else self.tokens_resposta
+        x = tokens_prompt + tokens_resposta
+        esquecer = 1 - PESO_OBSERVACAO_LATENCIA if self.chamadas else 0.0
+        self.peso = esquecer * self.peso + PESO_OBSERVACAO_LATENCIA
+        self.soma_x = esquecer * self.soma_x + PESO_OBSERVACAO_LATENCIA * x
+        self.soma_y = esquecer * self.soma_y + PESO_OBSERVACAO_LATENCIA * duracao_s
+        self.soma_xx = esquecer * self.soma_xx + PESO_OBSERVACAO_LATENCIA * x * x
+        self.soma_xy = esquecer * self.soma_xy + PESO_OBSERVACAO_LATENCIA * x * duracao_s
+        self.tokens_resposta = esquecer * self.tokens_resposta + PESO_OBSERVACAO_LATENCIA * tokens_resposta
+        self.chamadas += 1
+
+    def coeficientes(self) -> tuple[float, float] | None:
+        """(segundos fixos, segundos por token); None antes da primeira observação."""
+        if not self.chamadas:
+            return None
+        media_x, media_y = self.soma_x / self.peso, self.soma_y / self.peso
+        variancia = self.soma_xx / self.peso - media_x ** 2
+        if variancia <= max(1.0, media_x) ** 2 * 1e-6:
+            return media_y, 0.0  # tamanhos parecidos: só dá para estimar a duração média
+        custo = max(0.0, (self.soma_xy / self.peso - media_x * media_y) / variancia)
+        return max(0.0, media_y - custo * media_x), custo
+
+    def estimar(self, tokens_prompt: int) -> float | None:
+        """Duração esperada (s) de uma chamada com 'tokens_prompt' tokens; None antes da primeira observação."""
+        coeficientes = self.coeficientes()
+        if coeficientes is None:
+            return None
+        fixo, custo = coeficientes
+        return fixo + custo * (tokens_prompt + self.tokens_resposta)
+
+
+class RoteadorLLM:
+    """
+    Decide a ordem em que os provedores são tentados em cada chamada (ver o cabeçalho do módulo).
+    Os provedores locais ficam no roteador; os da nuvem vêm de quem chama (o modelo pedido e os alternativos).
+    """
+
+    def __init__(self, locais: list[Provedor] | None = None, limite_tokens_local: int = LIMITE_TOKENS_LOCAL,
+                 fator_latencia_local: float = FATOR_LATENCIA_LOCAL):
+        self.locais = list(locais or [])
+        self.limite_tokens_local = limite_tokens_local
+        self.fator_latencia_local = fator_latencia_local
+        self._latencias: dict[str, LatenciaObservada] = {}
+        self._lock = threading.Lock()
+
+    def latencia(self, provedor: Provedor) -> LatenciaObservada:
+        with self._lock:
+            return self._latencias.setdefault(provedor.nome, LatenciaObservada())
+
+    def observar(self, provedor: Provedor, tokens_prompt: int, tokens_resposta: int | None, duracao_s: float):
+        latencia = self.latencia(provedor)
+        with self._lock:
+            latencia.observar(tokens_prompt, tokens_resposta, duracao_s)
+
+    def ordenar(self, nuvem: list[Provedor], tokens_prompt: int, max_tokens: int) -> list[Provedor]:
+        """
+        Ordem de tentativa para um prompt de 'tokens_prompt' tokens. Locais que não comportam prompt + resposta
+        ficam de fora; os demais vêm antes da nuvem se o prompt for pequeno e a latência deles não for muito pior,
+        e depois dela (como reserva) caso contrário. A ordem relativa da nuvem (modelo pedido, alternativos) é mantida.
+        """
+        locais = [p for p in self.locais if p.janela_contexto >= tokens_prompt + max_tokens]
+        if not locais:
+            return list(nuvem)
+        if tokens_prompt > self.limite_tokens_local:
+            return [*nuvem, *locais]
+        estimativas_nuvem = [e for e in (self.latencia(p).estimar(tokens_prompt) for p in nuvem) if e is not None]
+        melhor_nuvem = min(estimativas_nuvem, default=math.inf)
+        rapidos, lentos = [], []
+        for provedor in locais:
+            estimativa = self.latencia(provedor).estimar(tokens_prompt)
+            lento = estimativa is not None and estimativa > self.fator_latencia_local * melhor_nuvem
+            (lentos if lento else rapidos).append(provedor)
+        return [*rapidos, *nuvem, *lentos]
+
+    def resumo(self) -> list[dict]:
+        """Latência observada por provedor, para exibição."""
+        with self._lock:
+            linhas = [(nome, latencia.chamadas, latencia.coeficientes()) for nome, latencia in self._latencias.items()]
+        return [{"provedor": nome, "chamadas": chamadas, "fixo_s": coeficientes[0],
+                 "s_por_mil_tokens": coeficientes[1] * 1000}
+                for nome, chamadas, coeficientes in linhas if coeficientes is not None]
+
+
+def executar_com_failover(roteador: RoteadorLLM, nuvem: list[Provedor], chamada: Callable[[Provedor], Any],
+                          tokens_prompt: int, max_tokens: int, politica: PoliticaRetentativa | None = None,
+                          disjuntores: RegistroDisjuntores | None = None,
+                          pode_repetir: Callable[[], bool] | None = None,
+                          tokens_resposta: Callable[[Any], int | None] | None = None,
+                          ao_falhar: Callable[[Provedor, Exception, float], None] | None = None
+                          ) -> tuple[Any, Provedor, int, float]:
+    """
+    Executa 'chamada(provedor)' nos provedores na ordem do roteador, com retentativas e o disjuntor de cada um,
+    passando ao próximo quando um falha de vez (inclusive com erros não transitórios, se ainda houver a quem
+    passar); após um erro de contexto só são tentados provedores de janela maior.
+    A duração de cada sucesso alimenta a latência observada ('tokens_resposta' extrai os tokens do resultado);
+    'ao_falhar(provedor, erro, duração)' é avisado de cada provedor que falhou (ex.: para a telemetria).
+    Retorna (resultado, provedor, retentativas, duração em s). Se nenhum responder, levanta o último erro com o
+    atributo 'contexto_excedido' (verdadeiro só quando esse erro é de contexto, o único que reduzir o prompt
+    resolve); um erro com 'entregou_parcial' (streaming já exibido) é repassado na hora.
+    """
+    janela_minima = 0
+    ultimo_erro = None
+    ordem = roteador.ordenar(nuvem, tokens_prompt, max_tokens)
+    for posicao, provedor in enumerate(ordem):
+        if provedor.janela_contexto <= janela_minima:
+            continue
+        if posicao > 0:
+            print(f"  🔀 Tentando o provedor alternativo '{provedor.nome}'...")
+        disjuntor = disjuntores.obter(provedor.nome) if disjuntores is not None else None
+        provedor.cliente()  # a criação do cliente não entra na latência observada
+        inicio = time.perf_counter()
+        try:
+            resultado, retentativas = executar_com_retentativas(lambda: chamada(provedor),
+                                                                provedor.politica or politica, disjuntor, pode_repetir)
+        except Exception as e:
+            if ao_falhar is not None:
+                ao_falhar(provedor, e, time.perf_counter() - inicio)
+            ultimo_erro = e
+            if getattr(e, 'entregou_parcial', False):
+                raise  # parte da resposta já foi exibida/gravada: não mistura com a de outro provedor
+            if eh_erro_contexto(e):
+                janela_minima = max(janela_minima, provedor.janela_contexto)
+            elif not (eh_transitorio(e) or isinstance(e, CircuitoAberto)) and \
+                    not any(p.janela_contexto > janela_minima for p in ordem[posicao + 1:]):
+                raise  # erro definitivo e ninguém mais a tentar
+            print(f"  ⚠️ O provedor '{provedor.nome}' falhou: {type(e).__name__}.")
+            continue
+        duracao_s = time.perf_counter() - inicio
+        roteador.observar(provedor, tokens_prompt, tokens_resposta(resultado) if tokens_resposta else None, duracao_s)
+        return resultado, provedor, retentativas, duracao_s
+
+    if ultimo_erro is None:
+        raise RuntimeError("Nenhum provedor disponível para o prompt.")
+    ultimo_erro.contexto_excedido = eh_erro_contexto(ultimo_erro)
+    raise ultimo_erro
+
+
+def main():
+    """
+    Demonstração com dois servidores simulados (servidor_mock_openai): um "local" rápido e de janela pequena e
+    uma "nuvem" mais lenta. Envia prompts de vários tamanhos, derruba o local no meio e mostra quem respondeu.
+    """
+    from servidor_mock_openai import ConfiguracaoMock, ServidorMockOpenAI
+    from tokenizacao import obter_contador
+
+    parser = argparse.ArgumentParser(description="Roteamento local/nuvem contra servidores simulados.")
+    parser.add_argument("--janela-local", type=int, default=8192)
+    parser.add_argument("--limite-local", type=int, default=LIMITE_TOKENS_LOCAL)
+    parser.add_argument("--palavras", default="100,1000,3000,10000", help="tamanho de cada prompt, em palavras")
+    args = parser.parse_args()
+
+    contador = obter_contador("gpt-4o-mini")[1]
+    config_local = ConfiguracaoMock(latencia_s=0.02, tokens_por_segundo=2000, tokens_resposta=30,
+                                    janelas_contexto={"mistral": args.janela_local})
+    config_nuvem = ConfiguracaoMock(latencia_s=0.2, tokens_por_segundo=500, tokens_resposta=30)
+    with ServidorMockOpenAI(config_local) as local, ServidorMockOpenAI(config_nuvem) as nuvem:
+        provedor_local = provedor_compativel("local:mistral", local.url, "mistral", args.janela_local, local=True,
+                                             politica=PoliticaRetentativa(max_tentativas=1))
+        provedor_nuvem = provedor_compativel("gpt-4o-mini", nuvem.url, "gpt-4o-mini", 128_000, api_key="teste")
+        roteador = RoteadorLLM([provedor_local], limite_tokens_local=args.limite_local)
+        disjuntores = RegistroDisjuntores()
+
+        def chamada(provedor: Provedor):
+            return provedor.cliente().chat.completions.create(
+                model=provedor.modelo, messages=[{"role": "user", "content": prompt}], max_tokens=100)
+
+        for rodada in ("ambos no ar", "local fora do ar"):
+            if rodada == "local fora do ar":
+                config_local.modelos_indisponiveis = ("mistral",)
+            print(f"\n--- {rodada} ---")
+            for palavras in (int(p) for p in args.palavras.split(",") if p.strip()):
+                prompt = "dados " * palavras
+                tokens = contador(prompt)
+                try:
+                    _, provedor, _, duracao_s = executar_com_failover(
+                        roteador, [provedor_nuvem], chamada, tokens, 100, disjuntores=disjuntores,
+                        tokens_resposta=lambda r: r.usage.completion_tokens)
+                    print(f"  📦 {tokens:>6} tokens → {provedor.nome} ({duracao_s:.2f}s)")
+                except Exception as e:
+                    print(f"  ❌ {tokens:>6} tokens → erro: {type(e).__name__}")
+        print("\n📈 Latência observada:")
+        for linha in roteador.resumo():
+            print(f"  {linha['provedor']}: {linha['chamadas']} chamada(s), {linha['fixo_s']:.3f}s fixos + "
+                  f"{linha['s_por_mil_tokens']:.3f}s/mil tokens")
+
+
+if __name__ == "__main__":
+    main()
+
+
+### Testes ###
+
+class TestRoteadorLLM(unittest.TestCase):
+    def setUp(self):
+        def provedor(nome: str, janela: int, local: bool = False) -> Provedor:
+            return Provedor(nome, nome, janela, lambda: None, local=local)
+
+        self.local = provedor("local:mistral", 8192, local=True)
+        self.nuvem = [provedor("gpt-4o-mini", 128_000), provedor("gpt-4.1-mini", 1_000_000)]
+        self.roteador = RoteadorLLM([self.local], limite_tokens_local=4000, fator_latencia_local=3.0)
+
+    def test_prompt_pequeno_vai_primeiro_ao_local(self):
+        self.assertEqual(self.roteador.ordenar(self.nuvem, 1000, 500), [self.local, *self.nuvem])
+
+    def test_prompt_grande_vai_a_nuvem_com_local_de_reserva(self):
+        self.assertEqual(self.roteador.ordenar(self.nuvem, 5000, 500), [*self.nuvem, self.local])
+
+    def test_local_que_nao_comporta_prompt_e_resposta_fica_de_fora(self):
+        self.assertEqual(self.roteador.ordenar(self.nuvem, 3900, 4500), self.nuvem)
+
+    def test_local_lento_vai_para_o_fim(self):
+        for tokens in (500, 1000, 2000):
+            self.roteador.observar(self.nuvem[0], tokens, 100, 0.2 + tokens / 10_000)
+            self.roteador.observar(self.local, tokens, 100, 1.0 + tokens / 1000)
+        self.assertEqual(self.roteador.ordenar(self.nuvem, 1000, 500), [*self.nuvem, self.local])
+        self.roteador.fator_latencia_local = 100.0
+        self.assertEqual(self.roteador.ordenar(self.nuvem, 1000, 500), [self.local, *self.nuvem])
+
+    def test_latencia_separa_custo_fixo_do_custo_por_token(self):
+        latencia = LatenciaObservada()
+        self.assertIsNone(latencia.estimar(1000))
+        for tokens in (100, 1000, 3000, 500, 2000):
+            latencia.observar(tokens, 0, 0.5 + 0.002 * tokens)
+        fixo, custo = latencia.coeficientes()
+        self.assertAlmostEqual(fixo, 0.5, places=6)
+        self.assertAlmostEqual(custo, 0.002, places=9)
+        self.assertAlmostEqual(latencia.estimar(4000), 8.5, places=5)
+
+
+class TestExecutarComFailover(unittest.TestCase):
+    def setUp(self):
+        from servidor_mock_openai import ConfiguracaoMock, ServidorMockOpenAI
+
+        self.servidor = ServidorMockOpenAI(ConfiguracaoMock(latencia_s=0.0, tokens_resposta=5,
+                                                            janelas_contexto={"gpt-4o-mini": 50}))
+        self.servidor.__enter__()
+        self.addCleanup(self.servidor.__exit__, None, None, None)
+        self.nuvem = provedor_compativel("gpt-4o-mini", self.servidor.url, "gpt-4o-mini", 128_000, api_key="teste",
+                                         politica=PoliticaRetentativa(max_tentativas=1))
+
+    def _chamada(self, prompt: str):
+        return lambda provedor: provedor.cliente().chat.completions.create(
+            model=provedor.modelo, messages=[{"role": "user", "content": prompt}], max_tokens=10)
+
+    def test_local_com_404_passa_para_a_nuvem(self):
+        # Rota inexistente no servidor "local": o cliente recebe 404 (NotFoundError), um erro não transitório
+        local = provedor_compativel("local:mistral", f"{self.servidor.url}/inexistente", "mistral", 8192, local=True,
+                                    politica=PoliticaRetentativa(max_tentativas=1))
+        falhas = []
+        _, provedor, _, _ = executar_com_failover(RoteadorLLM([local]), [self.nuvem], self._chamada("oi"), 10, 10,
+                                                  ao_falhar=lambda p, erro, _: falhas.append((p.nome, erro)))
+        self.assertIs(provedor, self.nuvem)
+        self.assertEqual([(nome, status_http(erro)) for nome, erro in falhas], [("local:mistral", 404)])
+
+    def test_erro_definitivo_do_ultimo_provedor_e_repassado(self):
+        local = provedor_compativel("local:mistral", f"{self.servidor.url}/inexistente", "mistral", 8192, local=True,
+                                    politica=PoliticaRetentativa(max_tentativas=1))
+        with self.assertRaises(Exception) as contexto:
+            executar_com_failover(RoteadorLLM([local]), [], self._chamada("oi"), 10, 10)
+        self.assertEqual(status_http(contexto.exception), 404)
+        self.assertFalse(getattr(contexto.exception, "contexto_excedido", False))
+
+    def test_contexto_excedido_marcado_so_para_erro_de_contexto(self):
+        with self.assertRaises(Exception) as contexto:
+            executar_com_failover(RoteadorLLM(), [self.nuvem], self._chamada("dados " * 200), 200, 10)
+        self.assertTrue(contexto.exception.contexto_excedido)
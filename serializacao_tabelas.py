@@ -0,0 +1,174 @@
+import json
+import os
+from typing import Callable
+
+import pandas as pd
+
+from tokenizacao import ContadorTokens, obter_contador
+
+# --- Serialização Compacta de Tabelas para o Prompt ---
+# O to_string() alinha as colunas com espaços, repete o texto das categorias em toda linha e exibe floats com
+# todas as casas. Aqui as linhas podem ir como CSV, TSV, markdown ou TSV com as colunas de texto repetitivas
+# trocadas por códigos e uma legenda. Os números são arredondados (CASAS_DECIMAIS, sem zeros à direita) e as
+# datas sem hora perdem o '00:00:00'. No modo 'auto', cada tabela é serializada em todos os formatos sobre uma
+# amostra e vai no de menos tokens por linha, então cabem mais linhas reais no mesmo orçamento.
+#
+#   LLM_FORMATO_TABELAS=texto (padrão, to_string do pandas) | auto | csv | tsv | markdown | dicionario
+
+FORMATOS_TABELA = ("texto", "csv", "tsv", "markdown", "dicionario")
+FORMATO_TABELAS = os.getenv("LLM_FORMATO_TABELAS", "texto")
+CASAS_DECIMAIS = int(os.getenv("LLM_CASAS_DECIMAIS", "2"))
+LINHAS_AMOSTRA_FORMATO = 50
+MODELO_CONTAGEM_PADRAO = "gpt-4o-mini"
+
+
+def configurar_serializacao(formato: str | None = None, casas_decimais: int | None = None):
+    """Troca o formato padrão ('auto' ou um de FORMATOS_TABELA) e/ou as casas decimais."""
+    global FORMATO_TABELAS, CASAS_DECIMAIS
+    if formato is not None:
+        if formato != "auto" and formato not in FORMATOS_TABELA:
+            raise ValueError(f"Formato de tabela desconhecido: {formato}")
+        FORMATO_TABELAS = formato
+    if casas_decimais is not None:
+        CASAS_DECIMAIS = casas_decimais
+
+
+def chave_serializacao() -> str:
+    """Configuração que altera o texto das tabelas, para compor as chaves de cache das seções."""
+    return json.dumps({'formato': FORMATO_TABELAS, 'casas': CASAS_DECIMAIS})
+
+
+def _formatar_numero(valor, casas: int) -> str:
+    if pd.isna(valor):
+        return ""
+    texto = f"{valor:.{casas}f}".rstrip("0").rstrip(".") if casas > 0 else f"{valor:.0f}"
+    return "0" if texto == "-0" else texto
+
+
+def _formatar_texto(valor, largura_maxima: int | None) -> str:
+    if pd.api.types.is_scalar(valor) and pd.isna(valor):
+        return ""
+    texto = " ".join(str(valor).split())  # sem quebras de linha nem tabs, que quebrariam o CSV/TSV
+    if largura_maxima and len(texto) > largura_maxima:
+        texto = texto[:largura_maxima - 3] + "..."
+    return texto
+
+
+def normalizar_valores(df: pd.DataFrame, casas: int | None = None) -> pd.DataFrame:
+    """
+    Converte cada célula em texto enxuto: floats arredondados sem zeros à direita, datas sem hora quando
+    todas são meia-noite, nulos vazios e textos em uma linha, cortados em display.max_colwidth.
+    """
+    casas = CASAS_DECIMAIS if casas is None else casas
+    largura_maxima = pd.get_option('display.max_colwidth')
+    colunas = {}
+    for i in range(df.shape[1]):
+        serie = df.iloc[:, i]
+        if pd.api.types.is_bool_dtype(serie):
+            colunas[i] = serie.map(lambda v: "" if pd.isna(v) else str(bool(v)))
+        elif pd.api.types.is_float_dtype(serie):
+            colunas[i] = serie.map(lambda v: _formatar_numero(v, casas))
+        elif pd.api.types.is_integer_dtype(serie):
+            colunas[i] = serie.map(lambda v: "" if pd.isna(v) else str(int(v)))
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            validas = serie.dropna()
+            so_datas = validas.empty or bool((validas == validas.dt.normalize()).all())
+            colunas[i] = serie.dt.strftime('%Y-%m-%d' if so_datas else '%Y-%m-%d %H:%M:%S').fillna("")
+        else:
+            colunas[i] = serie.map(lambda v: _formatar_texto(v, largura_maxima)).astype(object)
+    normalizado = pd.DataFrame(colunas, index=df.index)
+    normalizado.columns = [str(coluna) for coluna in df.columns]
+    return normalizado
+
+
+def _linhas_separadas(normalizado: pd.DataFrame, separador: str) -> str:
+    linhas = [separador.join(normalizado.columns)]
+    linhas += [separador.join(valores) for valores in normalizado.itertuples(index=False, name=None)]
+    return "\n".join(linhas)
+
+
+def _markdown(normalizado: pd.DataFrame) -> str:
+    escapar = lambda texto: texto.replace("|", "\\|")
+    linhas = ["| " + " | ".join(escapar(c) for c in normalizado.columns) + " |",
+              "|" + "---|" * len(normalizado.columns)]
+    linhas += ["| " + " | ".join(escapar(v) for v in valores) + " |"
+               for valores in normalizado.itertuples(index=False, name=None)]
+    return "\n".join(linhas)
+
+
+def _dicionario(df: pd.DataFrame, normalizado: pd.DataFrame) -> str:
+    """TSV em que colunas de texto repetitivas viram códigos (0, 1, ...), com a legenda antes da tabela."""
+    legendas = []
+    codificado = normalizado.copy()
+    for i, coluna in enumerate(normalizado.columns):
+        original = df.iloc[:, i]
+        if pd.api.types.is_numeric_dtype(original) or pd.api.types.is_datetime64_any_dtype(original):
+            continue
+        frequencias = normalizado[coluna][normalizado[coluna] != ""].value_counts()
+        if frequencias.empty:
+            continue
+        codigos = {valor: str(codigo) for codigo, valor in enumerate(frequencias.index)}
+        custo_texto = sum(len(valor) * n for valor, n in frequencias.items())
+        custo_codigos = (sum(len(valor) + len(codigos[valor]) + 3 for valor in frequencias.index)
+                         + sum(len(codigos[valor]) * n for valor, n in frequencias.items()))
+        if custo_codigos >= custo_texto:
+            continue
+        codificado[coluna] = normalizado[coluna].map(lambda valor: codigos.get(valor, valor))
+        legendas.append(f"Legenda {coluna}: " + "; ".join(f"{codigo}={valor}" for valor, codigo in codigos.items()))
+    return "\n".join(legendas + [_linhas_separadas(codificado, "\t")])
+
+
+def serializar_tabela(df: pd.DataFrame, formato: str = "texto", casas: int | None = None) -> str:
+    """Serializa as linhas do DataFrame no formato pedido ('texto' = df.to_string(), como antes)."""
+    if formato == "texto":
+        return df.to_string()
+    normalizado = normalizar_valores(df, casas)
+    if formato == "csv":
+        return normalizado.to_csv(index=False, lineterminator="\n").rstrip("\n")
+    if formato == "tsv":
+        return _linhas_separadas(normalizado, "\t")
+    if formato == "markdown":
+        return _markdown(normalizado)
+    if formato == "dicionario":
+        return _dicionario(df, normalizado)
+    raise ValueError(f"Formato de tabela desconhecido: {formato}")
+
+
+def tokens_por_linha(df: pd.DataFrame, formato: str, contador: ContadorTokens) -> float:
+    """Tokens por linha do DataFrame no formato, com cabeçalho e legenda diluídos entre as linhas."""
+    return contador(serializar_tabela(df, formato)) / max(1, len(df))
+
+
+def escolher_formato(df: pd.DataFrame, contador: ContadorTokens | None = None,
+                     candidatos=FORMATOS_TABELA) -> str:
+    """Formato com menos tokens por linha nas primeiras LINHAS_AMOSTRA_FORMATO linhas (empate: ordem dos candidatos)."""
+    contador = contador or obter_contador(MODELO_CONTAGEM_PADRAO)[1]
+    amostra = df.head(LINHAS_AMOSTRA_FORMATO)
+    if amostra.empty:
+        return candidatos[0]
+    custos = {formato: tokens_por_linha(amostra, formato, contador) for formato in candidatos}
+    return min(candidatos, key=custos.get)
+
+
+def formatador_tabela(df_content, formato: str | None = None,
+                      contador: ContadorTokens | None = None) -> Callable[[pd.DataFrame], str]:
+    """
+    Função que serializa trechos (head, tail, blocos) de 'df_content' sempre no mesmo formato. Com 'auto',
+    o formato é escolhido uma vez, pelas primeiras linhas da tabela.
+    """
+    formato = formato or FORMATO_TABELAS
+    if formato == "auto":
+        formato = escolher_formato(df_content.head(LINHAS_AMOSTRA_FORMATO), contador)
+
+    def formatar(trecho) -> str:
+        if isinstance(trecho, pd.DataFrame):
+            return serializar_tabela(trecho, formato)
+        # Tabela lida em blocos (ResumoStreaming): só há as linhas dos buffers de início e fim
+        if formato == "texto":
+            return trecho.to_string()
+        texto = serializar_tabela(trecho.head(len(trecho)), formato)
+        if not trecho.completo:
+            texto += "\n...\n" + serializar_tabela(trecho.tail(len(trecho)), formato)
+        return texto
+
+    return formatar
@@ -0,0 +1,277 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# --- Serviço Residente de Resumos ---
+# Cada execução de prompts.py paga a importação do pandas/openai, a leitura do .env, a criação do cliente
+# e a montagem do bloco de dados antes da primeira chamada. Este serviço faz tudo isso uma vez: mantém em
+# memória o bloco de dados de cada diretório (recarregando só os diretórios cujos arquivos .z mudaram) e
+# reaproveita o cliente da OpenAI com suas conexões keep-alive. Cada pedido custa só a ida e volta ao LLM.
+#
+#   python servico_resumos.py servir --data-dir dados/jan --porta 8765          (ou --socket /tmp/resumos.sock)
+#   python servico_resumos.py pedir --data-dir dados/jan --variante hibrido --porta 8765
+
+PORTA_PADRAO = 8765
+
+
+@dataclass
+class ConjuntoAquecido:
+    """Bloco de dados de um diretório já montado, com a impressão digital dos arquivos de dados usados."""
+    diretorio: Path
+    impressao: tuple
+    dados: str
+    carregado_em: float
+    duracao_carga_s: float
+
+
+class ServicoResumos:
+    """
+    Mantém os conjuntos de dados aquecidos e atende pedidos de resumo. Seguro entre threads:
+    cada diretório tem seu lock, então pedidos para diretórios diferentes não esperam uns pelos outros.
+    """
+
+    def __init__(self, diretorio_saida: Path | None = None):
+        import prompts  # importado uma única vez, na subida do serviço
+        self.prompts = prompts
+        self.diretorio_saida = diretorio_saida
+        self.orcamento_tokens = prompts.calcular_orcamento_tokens_dados()
+        self.conjuntos: dict[Path, ConjuntoAquecido] = {}
+        self.pedidos_atendidos = 0
+        self.iniciado_em = time.time()
+        self._locks: dict[Path, threading.Lock] = {}
+        self._lock = threading.Lock()
+        prompts.obter_cliente()
+
+    def _impressao(self, diretorio: Path) -> tuple:
+        # O hash de cada arquivo só é recalculado quando tamanho ou mtime mudam (ver CacheDadosZ)
+        return tuple((arquivo.name, self.prompts.cache_dados.impressao_digital(arquivo).hash)
+                     for arquivo in self.prompts.listar_arquivos_dados(diretorio))
+
+    def obter_conjunto(self, diretorio: Path, forcar: bool = False) -> tuple[ConjuntoAquecido, bool]:
+        """Retorna (conjunto, recarregado). Só remonta o bloco de dados se algum arquivo .z mudou."""
+        diretorio = Path(diretorio).resolve()
+        if not diretorio.is_dir():
+            raise FileNotFoundError(f"Diretório de dados não encontrado: {diretorio}")
+        with self._lock:
+            lock = self._locks.setdefault(diretorio, threading.Lock())
+        with lock:
+            impressao = self._impressao(diretorio)
+            atual = self.conjuntos.get(diretorio)
+            if atual is not None and atual.impressao == impressao and not forcar:
+                return atual, False
+            if atual is not None:
+                print(f"♻️ Arquivos alterados em '{diretorio}'; recarregando o conjunto...")
+            inicio = time.perf_counter()
+            dados = self.prompts.carregar_e_processar_dados_para_llm(
+                diretorio, orcamento_tokens=self.orcamento_tokens, usar_indicadores=True,
+                usar_map_reduce=self.prompts.USAR_MAP_REDUCE)
+            conjunto = ConjuntoAquecido(diretorio, impressao, dados, time.time(), time.perf_counter() - inicio)
+            self.conjuntos[diretorio] = conjunto
+            return conjunto, True
+
+    def resumir(self, diretorio: Path, variante: str, gravar: bool = True) -> dict:
+        """Gera uma variante sobre o conjunto aquecido. Retorna o resumo com latência e tokens do pedido."""
+        variante = {'hybrid': 'hibrido'}.get(variante, variante)
+        if variante not in self.prompts.VARIANTES_RESUMO:
+            raise ValueError(f"Variante desconhecida: {variante}")
+        inicio = time.perf_counter()
+        conjunto, recarregado = self.obter_conjunto(diretorio)
+        if not conjunto.dados.strip():
+            raise ValueError(f"Nenhum dado carregado de '{conjunto.diretorio}'.")
+        espera_dados_s = time.perf_counter() - inicio
+        reconstruir_dados = self.prompts.criar_reconstrutor_dados(conjunto.diretorio, self.orcamento_tokens)
+        with self.prompts.acumular_chamadas() as uso:
+            gerar_resumo_base = self.prompts.criar_gerador_resumo_base(conjunto.diretorio, self.orcamento_tokens)
+            resumo = self.prompts.gerar_variante(conjunto.dados, variante, reconstruir_dados,
+                                                 gerar_resumo_base=gerar_resumo_base)
+        erro = self.prompts.eh_resumo_com_erro(resumo)
+        arquivo = None
+        if gravar and not erro:
+            diretorio_resultados = self.prompts.diretorio_resultados(self.diretorio_saida, conjunto.diretorio.name, True)
+            arquivo = str(self.prompts.gravar_resultado(diretorio_resultados, variante, resumo))
+        with self._lock:
+            self.pedidos_atendidos += 1
+        return {"status": "erro" if erro else "ok", "variante": variante, "diretorio": str(conjunto.diretorio),
+                "resumo": resumo, "arquivo": arquivo, "recarregado": recarregado,
+                "espera_dados_s": round(espera_dados_s, 4), "latencia_s": round(time.perf_counter() - inicio, 4),
+                **uso}
+
+    def estado(self) -> dict:
+        return {"pedidos_atendidos": self.pedidos_atendidos, "ativo_ha_s": round(time.time() - self.iniciado_em, 1),
+                "conjuntos": [{"diretorio": str(c.diretorio), "arquivos": len(c.impressao), "caracteres": len(c.dados),
+                               "carregado_em": c.carregado_em, "duracao_carga_s": round(c.duracao_carga_s, 4)}
+                              for c in self.conjuntos.values()]}
+
+
+class _ManipuladorServico(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # conexões keep-alive
+
+    def log_message(self, formato, *args):
+        pass
+
+    def address_string(self):
+        return str(self.client_address or "unix")
+
+    def _responder(self, status: int, corpo: dict | str, tipo: str = "application/json"):
+        dados = (corpo if isinstance(corpo, str) else json.dumps(corpo, ensure_ascii=False)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_GET(self):
+        servico: ServicoResumos = self.server.servico
+        rota = self.path.split("?")[0].rstrip("/")
+        if rota == "/saude":
+            self._responder(200, {"status": "ok", **servico.estado()})
+        elif rota == "/metrics":
+            self._responder(200, servico.prompts.telemetria.exportar_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._responder(404, {"erro": f"Rota inexistente: {self.path}"})
+
+    def do_POST(self):
+        servico: ServicoResumos = self.server.servico
+        rota = self.path.split("?")[0].rstrip("/")
+        try:
+            corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if rota == "/resumo":
+                resultado = servico.resumir(Path(corpo["data_dir"]), corpo.get("variante", "prompt1"),
+                                            corpo.get("gravar", True))
+                self._responder(200 if resultado["status"] == "ok" else 502, resultado)
+            elif rota == "/recarregar":
+                conjunto, _ = servico.obter_conjunto(Path(corpo["data_dir"]), forcar=True)
+                self._responder(200, {"status": "ok", "diretorio": str(conjunto.diretorio),
+                                      "duracao_carga_s": round(conjunto.duracao_carga_s, 4)})
+            else:
+                self._responder(404, {"erro": f"Rota inexistente: {self.path}"})
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            self._responder(400, {"status": "erro", "erro": str(e)})
+        except Exception as e:
+            self._responder(500, {"status": "erro", "erro": f"{type(e).__name__}: {e}"})
+
+
+class _ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def criar_servidor(servico: ServicoResumos, porta: int | None = PORTA_PADRAO, host: str = "127.0.0.1",
+                   caminho_socket: str | None = None):
+    """Servidor HTTP do serviço em TCP (host:porta) ou, com 'caminho_socket', em um socket Unix."""
+    if caminho_socket:
+        if os.path.exists(caminho_socket):
+            os.unlink(caminho_socket)
+        servidor = _ServidorUnix(caminho_socket, _ManipuladorServico)
+    else:
+        servidor = ThreadingHTTPServer((host, porta), _ManipuladorServico)
+        servidor.daemon_threads = True
+    servidor.servico = servico
+    return servidor
+
+
+class _ConexaoUnix(http.client.HTTPConnection):
+    def __init__(self, caminho_socket: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.caminho_socket = caminho_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.caminho_socket)
+
+
+class ClienteServico:
+    """
+    Cliente do serviço que mantém uma única conexão keep-alive aberta entre pedidos
+    (reconectando uma vez se o servidor a tiver fechado).
+    """
+
+    def __init__(self, porta: int = PORTA_PADRAO, host: str = "127.0.0.1", caminho_socket: str | None = None,
+                 timeout: float | None = 600.0):
+        self._criar_conexao = ((lambda: _ConexaoUnix(caminho_socket, timeout)) if caminho_socket
+                               else (lambda: http.client.HTTPConnection(host, porta, timeout=timeout)))
+        self._conexao = None
+
+    def _requisitar(self, metodo: str, rota: str, corpo: dict | None = None) -> dict:
+        dados = json.dumps(corpo).encode("utf-8") if corpo is not None else None
+        cabecalhos = {"Content-Type": "application/json"} if dados is not None else {}
+        for tentativa in range(2):
+            if self._conexao is None:
+                self._conexao = self._criar_conexao()
+            try:
+                self._conexao.request(metodo, rota, body=dados, headers=cabecalhos)
+                resposta = self._conexao.getresponse()
+                return json.loads(resposta.read() or b"{}")
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.fechar()
+                if tentativa:
+                    raise
+
+    def resumir(self, data_dir: Path, variante: str = "prompt1", gravar: bool = True) -> dict:
+        return self._requisitar("POST", "/resumo", {"data_dir": str(data_dir), "variante": variante, "gravar": gravar})
+
+    def recarregar(self, data_dir: Path) -> dict:
+        return self._requisitar("POST", "/recarregar", {"data_dir": str(data_dir)})
+
+    def saude(self) -> dict:
+        return self._requisitar("GET", "/saude")
+
+    def fechar(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serviço residente de resumos contábeis.")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    servir = subcomandos.add_parser("servir", help="sobe o serviço e aquece os conjuntos de dados")
+    pedir = subcomandos.add_parser("pedir", help="pede um resumo a um serviço em execução")
+    for sub in (servir, pedir):
+        sub.add_argument("--porta", type=int, default=PORTA_PADRAO)
+        sub.add_argument("--socket", help="caminho de um socket Unix (em vez de TCP)")
+    servir.add_argument("--data-dir", type=Path, action="append", dest="diretorios", default=[],
+                        help="diretório a carregar na subida (pode repetir; outros são carregados no primeiro pedido)")
+    servir.add_argument("--out", type=Path, default=None, help="pasta de saída dos resultados")
+    pedir.add_argument("--data-dir", type=Path, required=True)
+    pedir.add_argument("--variante", default="prompt1", help="prompt1, prompt2 ou hibrido (hybrid)")
+    pedir.add_argument("--nao-gravar", action="store_true", help="não grava o arquivo de resultado")
+    args = parser.parse_args()
+
+    if args.comando == "pedir":
+        cliente = ClienteServico(args.porta, caminho_socket=args.socket)
+        resultado = cliente.resumir(args.data_dir, args.variante, not args.nao_gravar)
+        cliente.fechar()
+        print(resultado.get("resumo") or resultado.get("erro"))
+        if resultado.get("status") == "ok":
+            print(f"\n⏱️ {resultado['latencia_s']:.2f}s | {resultado['tokens_prompt']} tokens de prompt, "
+                  f"{resultado['tokens_resposta']} de resposta | dados {'recarregados' if resultado['recarregado'] else 'em memória'}")
+        return
+
+    servico = ServicoResumos(args.out)
+    servico.prompts.configurar_telemetria(servico.prompts.TELEMETRIA_JSONL, servico.prompts.PROMETHEUS_PORTA)
+    for diretorio in args.diretorios:
+        servico.obter_conjunto(diretorio)
+    servidor = criar_servidor(servico, args.porta, caminho_socket=args.socket)
+    print(f"🟢 Serviço de resumos em {args.socket or f'http://127.0.0.1:{args.porta}'} "
+          f"({len(servico.conjuntos)} conjunto(s) aquecido(s)). Ctrl+C para encerrar.")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tokenizacao import contar_tokens_aproximado
+
+# --- Servidor Local Compatível com a API da OpenAI (para testes e benchmarks) ---
+# Atende POST /v1/chat/completions (com e sem stream) imitando a API real: latência até o primeiro token,
+# geração a uma taxa fixa de tokens/s e injeção de erros (429 com Retry-After ou 500). Basta apontar o
+# cliente para ele: OPENAI_BASE_URL=http://127.0.0.1:<porta>/v1 (o SDK lê essa variável automaticamente).
+# Também simula a Batch API (/v1/files e /v1/batches): o lote fica "in_progress" por 'atraso_lote_s'
+# e então cada linha é respondida como uma chamada de chat sem stream.
+
+CARACTERES_POR_BLOCO_CACHE = 512  # ~128 tokens, a granularidade do cache de prefixo da OpenAI
+MINIMO_TOKENS_CACHE = 1024  # prompts menores não entram no cache de prefixo
+PALAVRAS_RESPOSTA = ("Resumo", "contábil", "sintético:", "receitas", "estáveis,", "despesas", "operacionais",
+                     "em", "alta,", "fluxo", "de", "caixa", "positivo", "no", "período.")
+
+
+@dataclass
+class ConfiguracaoMock:
+    """
+    Comportamento do servidor simulado.
+    'taxa_erro' é a fração de requisições que falham com 'status_erro' (429 inclui o cabeçalho Retry-After).
+    'janelas_contexto' ({modelo: tokens}) faz prompts maiores que a janela falharem com context_length_exceeded;
+    modelos em 'modelos_indisponiveis' sempre respondem 503. Com 'cache_prefixo', o início do prompt já visto
+    em requisições anteriores (do mesmo modelo) volta em usage.prompt_tokens_details.cached_tokens.
+    """
+    latencia_s: float = 0.05
+    tokens_por_segundo: float = 200.0
+    tokens_resposta: int = 60
+    taxa_erro: float = 0.0
+    status_erro: int = 500
+    retry_after_s: float = 1.0
+    semente: int | None = None
+    janelas_contexto: dict[str, int] = field(default_factory=dict)
+    modelos_indisponiveis: tuple[str, ...] = ()
+    atraso_lote_s: float = 0.5
+    cache_prefixo: bool = True
+
+
+def texto_resposta(num_tokens: int) -> list[str]:
+    """Pedaços ("tokens") determinísticos da resposta simulada."""
+    return [("" if i == 0 else " ") + PALAVRAS_RESPOSTA[i % len(PALAVRAS_RESPOSTA)] for i in range(num_tokens)]
+
+
+class _ManipuladorOpenAI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _enviar_json(self, status: int, corpo: dict, cabecalhos: dict | None = None):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _enviar_evento(self, corpo: dict | str):
+        dados = f"data: {corpo if isinstance(corpo, str) else json.dumps(corpo)}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(dados):X}\r\n".encode('ascii') + dados + b"\r\n")
+        self.wfile.flush()
+
+    def _enviar_bytes(self, status: int, dados: bytes, tipo: str = "application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _rota_inexistente(self):
+        self._enviar_json(404, {"error": {"message": f"Rota não simulada: {self.command} {self.path}",
+                                          "type": "invalid_request_error"}})
+
+    def do_GET(self):
+        servidor: ServidorMockOpenAI = self.server.mock
+        partes = self.path.split("?")[0].strip("/").split("/")
+        if partes[:2] == ["v1", "batches"] and len(partes) == 3:
+            lote = servidor.consultar_lote(partes[2])
+            self._enviar_json(200, lote) if lote else self._rota_inexistente()
+        elif partes[:2] == ["v1", "files"] and len(partes) == 4 and partes[3] == "content":
+            arquivo = servidor.arquivos.get(partes[2])
+            self._enviar_bytes(200, arquivo["conteudo"]) if arquivo else self._rota_inexistente()
+        else:
+            self._rota_inexistente()
+
+    def do_POST(self):
+        servidor: ServidorMockOpenAI = self.server.mock
+        dados = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        rota = self.path.split("?")[0].rstrip('/')
+        if rota == "/v1/files":
+            self._enviar_json(200, servidor.guardar_arquivo(self.headers.get("Content-Type", ""), dados))
+            return
+        if rota == "/v1/batches":
+            lote = servidor.criar_lote(json.loads(dados or b"{}"))
+            self._enviar_json(200, lote) if lote else self._enviar_json(
+                400, {"error": {"message": "input_file_id inexistente", "type": "invalid_request_error"}})
+            return
+        if rota not in ("/v1/chat/completions", "/chat/completions"):
+            self._rota_inexistente()
+            return
+
+        corpo = json.loads(dados or b"{}")
+        resposta = servidor.preparar_resposta_chat(corpo)
+        if resposta["status"] != 200:
+            self._enviar_json(resposta["status"], resposta["corpo"], resposta["cabecalhos"])
+            return
+        pedacos, uso, base = resposta["pedacos"], resposta["uso"], resposta["base"]
+        config = servidor.config
+        intervalo = 1.0 / config.tokens_por_segundo if config.tokens_por_segundo > 0 else 0.0
+
+        time.sleep(config.latencia_s)
+        if not corpo.get("stream"):
+            time.sleep(intervalo * len(pedacos))
+            self._enviar_json(200, resposta["corpo"])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, pedaco in enumerate(pedacos):
+            if i:
+                time.sleep(intervalo)
+            delta = {"role": "assistant", "content": pedaco} if i == 0 else {"content": pedaco}
+            self._enviar_evento({**base, "object": "chat.completion.chunk",
+                                 "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._enviar_evento({**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (corpo.get("stream_options") or {}).get("include_usage"):
+            self._enviar_evento({**base, "object": "chat.completion.chunk", "choices": [], "usage": uso})
+        self._enviar_evento("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class ServidorMockOpenAI:
+    """
+    Servidor simulado em uma thread de fundo. Use como gerenciador de contexto:
+
+        with ServidorMockOpenAI(ConfiguracaoMock(latencia_s=0.2)) as servidor:
+            cliente = OpenAI(api_key="teste", base_url=servidor.url)
+    """
+
+    def __init__(self, config: ConfiguracaoMock | None = None, host: str = "127.0.0.1", porta: int = 0):
+        self.config = config or ConfiguracaoMock()
+        self._aleatorio = random.Random(self.config.semente)
+        self._lock = threading.Lock()
+        self.requisicoes = 0
+        self.erros_injetados = 0
+        self.arquivos: dict[str, dict] = {}
+        self.lotes: dict[str, dict] = {}
+        self._prefixos: set[str] = set()
+        self._http = ThreadingHTTPServer((host, porta), _ManipuladorOpenAI)
+        self._http.daemon_threads = True
+        self._http.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, porta = self._http.server_address[:2]
+        return f"http://{host}:{porta}/v1"
+
+    def sortear_erro(self) -> bool:
+        with self._lock:
+            self.requisicoes += 1
+            erro = self.config.taxa_erro > 0 and self._aleatorio.random() < self.config.taxa_erro
+            self.erros_injetados += erro
+            return erro
+
+    def tokens_em_cache(self, modelo: str, prompt: str) -> int:
+        """
+        Simula o cache de prefixo: os blocos iniciais de CARACTERES_POR_BLOCO_CACHE caracteres que já abriram um
+        prompt anterior do mesmo modelo contam como cached_tokens (0 abaixo de MINIMO_TOKENS_CACHE tokens).
+        """
+        if not self.config.cache_prefixo:
+            return 0
+        hash_prefixo = hashlib.sha256(modelo.encode("utf-8"))
+        blocos = []
+        for inicio in range(0, len(prompt) - CARACTERES_POR_BLOCO_CACHE + 1, CARACTERES_POR_BLOCO_CACHE):
+            hash_prefixo.update(prompt[inicio:inicio + CARACTERES_POR_BLOCO_CACHE].encode("utf-8"))
+            blocos.append(hash_prefixo.hexdigest())
+        with self._lock:
+            comuns = next((i for i, bloco in enumerate(blocos) if bloco not in self._prefixos), len(blocos))
+            self._prefixos.update(blocos)
+        tokens = contar_tokens_aproximado(prompt[:comuns * CARACTERES_POR_BLOCO_CACHE])
+        return tokens if tokens >= MINIMO_TOKENS_CACHE else 0
+
+    def preparar_resposta_chat(self, corpo: dict) -> dict:
+        """
+        Decide a resposta de uma requisição de chat: {'status', 'corpo', 'cabecalhos'} e, se status 200,
+        os 'pedacos' da resposta, o 'uso' e os campos 'base' (id, modelo) para montar os eventos do stream.
+        """
+        config = self.config
+        modelo = corpo.get("model", "mock")
+        if modelo in config.modelos_indisponiveis:
+            self.sortear_erro()
+            return {"status": 503, "cabecalhos": {}, "corpo": {"error": {
+                "message": f"Modelo '{modelo}' indisponível (simulado)", "type": "server_error", "code": "server_error"}}}
+        if self.sortear_erro():
+            cabecalhos = {"Retry-After": f"{config.retry_after_s:g}"} if config.status_erro == 429 else {}
+            tipo = "rate_limit_exceeded" if config.status_erro == 429 else "server_error"
+            return {"status": config.status_erro, "cabecalhos": cabecalhos,
+                    "corpo": {"error": {"message": "Erro simulado", "type": tipo, "code": tipo}}}
+
+        prompt = "".join(str(mensagem.get("content", "")) for mensagem in corpo.get("messages", []))
+        tokens_prompt = contar_tokens_aproximado(prompt)
+        janela = config.janelas_contexto.get(modelo)
+        if janela is not None and tokens_prompt > janela:
+            return {"status": 400, "cabecalhos": {}, "corpo": {"error": {
+                "message": f"This model's maximum context length is {janela} tokens. However, your messages "
+                           f"resulted in {tokens_prompt} tokens. Please reduce the length of the messages.",
+                "type": "invalid_request_error", "param": "messages", "code": "context_length_exceeded"}}}
+        limite = corpo.get("max_completion_tokens") or corpo.get("max_tokens") or config.tokens_resposta
+        pedacos = texto_resposta(min(config.tokens_resposta, int(limite)))
+        n = max(1, int(corpo.get("n") or 1))  # 'n' respostas iguais; só a primeira vai no stream
+        uso = {"prompt_tokens": tokens_prompt, "completion_tokens": len(pedacos) * n,
+               "total_tokens": tokens_prompt + len(pedacos) * n,
+               "prompt_tokens_details": {"cached_tokens": self.tokens_em_cache(modelo, prompt)}}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()), "model": modelo}
+        return {"status": 200, "cabecalhos": {}, "pedacos": pedacos, "uso": uso, "base": base, "corpo": {
+            **base, "object": "chat.completion",
+            "choices": [{"index": i, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "".join(pedacos)}} for i in range(n)],
+            "usage": uso,
+        }}
+
+    # --- Batch API simulada ---
+
+    def guardar_arquivo(self, tipo_conteudo: str, dados: bytes, nome: str = "arquivo.jsonl",
+                        finalidade: str = "batch") -> dict:
+        """Recebe o upload multipart de /v1/files (ou o conteúdo já pronto, com tipo_conteudo vazio)."""
+        conteudo = dados
+        if tipo_conteudo.startswith("multipart/"):
+            mensagem = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {tipo_conteudo}\r\n\r\n".encode("latin-1") + dados)
+            for parte in mensagem.iter_parts():
+                campo = parte.get_param("name", header="content-disposition")
+                if campo == "purpose":
+                    finalidade = parte.get_content().strip()
+                elif campo == "file":
+                    nome = parte.get_filename() or nome
+                    conteudo = parte.get_payload(decode=True)
+        arquivo_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            self.arquivos[arquivo_id] = {"nome": nome, "finalidade": finalidade, "conteudo": conteudo}
+        return {"id": arquivo_id, "object": "file", "bytes": len(conteudo), "created_at": int(time.time()),
+                "filename": nome, "purpose": finalidade, "status": "processed"}
+
+    def criar_lote(self, corpo: dict) -> dict | None:
+        arquivo = self.arquivos.get(corpo.get("input_file_id", ""))
+        if arquivo is None:
+            return None
+        total = sum(1 for linha in arquivo["conteudo"].splitlines() if linha.strip())
+        lote = {"id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch", "endpoint": corpo.get("endpoint"),
+                "errors": None, "input_file_id": corpo["input_file_id"],
+                "completion_window": corpo.get("completion_window", "24h"), "status": "in_progress",
+                "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+                "in_progress_at": int(time.time()), "completed_at": None, "metadata": corpo.get("metadata"),
+                "request_counts": {"total": total, "completed": 0, "failed": 0}}
+        with self._lock:
+            self.lotes[lote["id"]] = {"lote": lote, "inicio": time.monotonic()}
+        return lote
+
+    def consultar_lote(self, lote_id: str) -> dict | None:
+        """Devolve o lote; passado 'atraso_lote_s', processa as linhas e grava os arquivos de saída e de erros."""
+        registro = self.lotes.get(lote_id)
+        if registro is None:
+            return None
+        lote = registro["lote"]
+        if lote["status"] == "in_progress" and time.monotonic() - registro["inicio"] >= self.config.atraso_lote_s:
+            saidas, erros = [], []
+            for linha in self.arquivos[lote["input_file_id"]]["conteudo"].decode("utf-8").splitlines():
+                if not linha.strip():
+                    continue
+                requisicao = json.loads(linha)
+                resposta = self.preparar_resposta_chat(requisicao.get("body", {}))
+                resultado = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": requisicao.get("custom_id"),
+                             "response": {"status_code": resposta["status"], "request_id": uuid.uuid4().hex,
+                                          "body": resposta["corpo"]}, "error": None}
+                (saidas if resposta["status"] == 200 else erros).append(json.dumps(resultado, ensure_ascii=False))
+            for chave, linhas in (("output_file_id", saidas), ("error_file_id", erros)):
+                if linhas:
+                    lote[chave] = self.guardar_arquivo("", ("\n".join(linhas) + "\n").encode("utf-8"),
+                                                       f"{lote_id}_{chave}.jsonl", "batch_output")["id"]
+            lote["request_counts"] = {"total": len(saidas) + len(erros), "completed": len(saidas), "failed": len(erros)}
+            lote["status"] = "completed"
+            lote["completed_at"] = int(time.time())
+        return lote
+
+    def iniciar(self) -> "ServidorMockOpenAI":
+        self._thread = threading.Thread(target=self._http.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+    def __enter__(self) -> "ServidorMockOpenAI":
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local compatível com a API de chat da OpenAI.")
+    parser.add_argument("--porta", type=int, default=8000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="segundos até o primeiro token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=200.0)
+    parser.add_argument("--tokens-resposta", type=int, default=60)
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de requisições com erro (0 a 1)")
+    parser.add_argument("--status-erro", type=int, default=500, choices=[429, 500, 503])
+    parser.add_argument("--atraso-lote", type=float, default=0.5, help="segundos até um lote da Batch API concluir")
+    args = parser.parse_args()
+
+    config = ConfiguracaoMock(latencia_s=args.latencia, tokens_por_segundo=args.tokens_por_segundo,
+                              tokens_resposta=args.tokens_resposta, taxa_erro=args.taxa_erro,
+                              status_erro=args.status_erro, atraso_lote_s=args.atraso_lote)
+    servidor = ServidorMockOpenAI(config, porta=args.porta).iniciar()
+    print(f"🧪 Servidor simulado em {servidor.url} (Ctrl+C para encerrar)")
+    print(f"   Use: OPENAI_BASE_URL={servidor.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.parar()
+
+
+if __name__ == "__main__":
+    main()
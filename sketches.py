@@ -0,0 +1,296 @@
+import copy
+import math
+import os
+import unittest
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# --- Sketches de Estatísticas Aproximadas ---
+# Estruturas de tamanho fixo que resumem uma coluna inteira e podem ser combinadas (mescladas) entre blocos,
+# partições ou versões de um arquivo com linhas acrescentadas:
+#   - KLL: quantis com erro de posto limitado (Karnin, Lang e Liberty);
+#   - HyperLogLog: número de valores distintos com erro padrão de 1.04/sqrt(2^p);
+#   - Misra-Gries: valores mais frequentes, com frequência subestimada em no máximo n/(capacidade+1).
+# Os tamanhos saem de um único erro máximo configurado (ParametrosErro.para_erro).
+
+ERRO_PADRAO_ESTATISTICAS = float(os.getenv("LLM_ERRO_ESTATISTICAS", "0.01"))
+CAPACIDADE_MINIMA_FREQUENTES = 1000
+MASCARA_32_BITS = np.uint64(0xFFFFFFFF)
+
+
+def erro_posto_kll(k: int) -> float:
+    """Erro de posto normalizado do KLL com parâmetro k (ajuste empírico do Apache DataSketches, 99% de confiança)."""
+    return 2.296 / k ** 0.9723
+
+
+def erro_padrao_hll(precisao: int) -> float:
+    return 1.04 / math.sqrt(2 ** precisao)
+
+
+@dataclass(frozen=True)
+class ParametrosErro:
+    """
+    Tamanhos dos sketches para um erro máximo 'erro' (fração: 0.01 = 1%).
+    """
+    erro: float
+    k_quantis: int
+    precisao_hll: int
+    capacidade_frequentes: int
+
+    @classmethod
+    def para_erro(cls, erro: float = ERRO_PADRAO_ESTATISTICAS) -> "ParametrosErro":
+        if not 0 < erro < 1:
+            raise ValueError(f"Erro máximo deve estar entre 0 e 1 (recebido {erro}).")
+        k = 8
+        while erro_posto_kll(k) > erro:
+            k += 1
+        precisao = 4
+        while precisao < 18 and erro_padrao_hll(precisao) > erro:
+            precisao += 1
+        return cls(erro, k, precisao, max(math.ceil(1 / erro), CAPACIDADE_MINIMA_FREQUENTES))
+
+    def descricao(self) -> str:
+        return (f"quantis com erro de posto de até {erro_posto_kll(self.k_quantis):.2%} (99% de confiança); "
+                f"'unique' com erro padrão de {erro_padrao_hll(self.precisao_hll):.2%} quando há mais de "
+                f"{self.capacidade_frequentes} valores distintos; 'freq' subestimada em no máximo "
+                f"{1 / (self.capacidade_frequentes + 1):.2%} das linhas")
+
+
+class SketchQuantisKLL:
+    """
+    Sketch KLL: níveis de compactação em que cada item do nível h representa 2^h valores. Quando um nível passa
+    da capacidade, ele é ordenado e metade dos itens (posições pares ou ímpares, ao acaso) sobe de nível.
+    Enquanto nada foi compactado, os quantis são exatos (mesma interpolação do numpy/pandas).
+    """
+
+    def __init__(self, k: int = 200, semente: int | None = None):
+        self.k = k
+        self.n = 0
+        self.niveis = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(semente)
+
+    def _capacidade(self, nivel: int) -> int:
+        return max(2, math.ceil(self.k * (2 / 3) ** (len(self.niveis) - 1 - nivel)))
+
+    def _compactar(self):
+        while True:
+            cheio = next((h for h, itens in enumerate(self.niveis) if len(itens) > self._capacidade(h)), None)
+            if cheio is None:
+                return
+            if cheio + 1 == len(self.niveis):
+                self.niveis.append(np.empty(0, dtype=np.float64))
+            itens = np.sort(self.niveis[cheio])
+            resto, itens = (itens[:1], itens[1:]) if len(itens) % 2 else (itens[:0], itens)
+            promovidos = itens[self._rng.integers(2)::2]
+            self.niveis[cheio] = resto
+            self.niveis[cheio + 1] = np.concatenate([self.niveis[cheio + 1], promovidos])
+
+    def atualizar(self, valores: np.ndarray):
+        if not len(valores):
+            return
+        self.n += len(valores)
+        self.niveis[0] = np.concatenate([self.niveis[0], np.asarray(valores, dtype=np.float64)])
+        self._compactar()
+
+    def mesclar(self, outro: "SketchQuantisKLL"):
+        self.k = min(self.k, outro.k)
+        self.n += outro.n
+        while len(self.niveis) < len(outro.niveis):
+            self.niveis.append(np.empty(0, dtype=np.float64))
+        for h, itens in enumerate(outro.niveis):
+            self.niveis[h] = np.concatenate([self.niveis[h], itens])
+        self._compactar()
+
+    @property
+    def exato(self) -> bool:
+        return all(len(itens) == 0 for itens in self.niveis[1:])
+
+    def quantis(self, qs) -> list[float]:
+        if self.n == 0:
+            return [np.nan] * len(qs)
+        if self.exato:
+            return [float(v) for v in np.quantile(self.niveis[0], qs)]
+        valores = np.concatenate(self.niveis)
+        pesos = np.concatenate([np.full(len(itens), 2.0 ** h) for h, itens in enumerate(self.niveis)])
+        ordem = np.argsort(valores, kind="stable")
+        valores, acumulado = valores[ordem], np.cumsum(pesos[ordem])
+        posicoes = np.searchsorted(acumulado, np.asarray(qs) * acumulado[-1], side="left")
+        return [float(valores[min(p, len(valores) - 1)]) for p in posicoes]
+
+
+def _comprimento_bits_32(x: np.ndarray) -> np.ndarray:
+    # Valores de até 32 bits são exatos em float64, então floor(log2) não sofre arredondamento
+    comprimento = np.zeros(len(x), dtype=np.int64)
+    positivos = x > 0
+    comprimento[positivos] = np.floor(np.log2(x[positivos].astype(np.float64))).astype(np.int64) + 1
+    return comprimento
+
+
+class HyperLogLog:
+    """
+    Contagem aproximada de distintos em 2^precisao registradores de 1 byte. Repetições não alteram o sketch,
+    então basta passar os valores distintos de cada bloco. Mesclar é o máximo registrador a registrador.
+    """
+
+    def __init__(self, precisao: int = 14):
+        self.precisao = precisao
+        self.registradores = np.zeros(2 ** precisao, dtype=np.uint8)
+
+    def atualizar_hashes(self, hashes: np.ndarray):
+        if not len(hashes):
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        indices = (hashes >> np.uint64(64 - self.precisao)).astype(np.int64)
+        resto = hashes << np.uint64(self.precisao)
+        alto, baixo = resto >> np.uint64(32), resto & MASCARA_32_BITS
+        comprimento = np.where(alto > 0, 32 + _comprimento_bits_32(alto), _comprimento_bits_32(baixo))
+        posicao = np.minimum(64 - comprimento + 1, 64 - self.precisao + 1).astype(np.uint8)
+        np.maximum.at(self.registradores, indices, posicao)
+
+    def atualizar(self, valores):
+        """Acrescenta valores (Series/Index/array); nulos são ignorados."""
+        valores = pd.Series(valores).dropna()
+        self.atualizar_hashes(pd.util.hash_pandas_object(valores, index=False).to_numpy())
+
+    def mesclar(self, outro: "HyperLogLog"):
+        if outro.precisao != self.precisao:
+            raise ValueError("HyperLogLog com precisões diferentes não podem ser mesclados.")
+        np.maximum(self.registradores, outro.registradores, out=self.registradores)
+
+    def estimativa(self) -> int:
+        m = len(self.registradores)
+        alfa = 0.7213 / (1 + 1.079 / m)
+        estimativa = alfa * m * m / np.sum(2.0 ** -self.registradores.astype(np.float64))
+        vazios = int(np.count_nonzero(self.registradores == 0))
+        if estimativa <= 2.5 * m and vazios:
+            estimativa = m * math.log(m / vazios)  # correção para poucos distintos (linear counting)
+        return int(round(estimativa))
+
+
+class FrequentesMisraGries:
+    """
+    Valores mais frequentes com no máximo 'capacidade' contadores. Ao passar da capacidade, todas as contagens
+    perdem o valor da (capacidade+1)-ésima maior e as que zeram saem. 'decremento' acumula o quanto cada
+    contagem pode estar abaixo da real (no máximo n/(capacidade+1)), inclusive após mesclas.
+    """
+
+    def __init__(self, capacidade: int = CAPACIDADE_MINIMA_FREQUENTES):
+        self.capacidade = capacidade
+        self.n = 0
+        self.contagens: dict = {}
+        self.decremento = 0
+
+    @property
+    def exato(self) -> bool:
+        return self.decremento == 0
+
+    def _podar(self):
+        if len(self.contagens) <= self.capacidade:
+            return
+        corte = sorted(self.contagens.values(), reverse=True)[self.capacidade]
+        self.contagens = {valor: c - corte for valor, c in self.contagens.items() if c > corte}
+        self.decremento += corte
+
+    def _somar(self, contagens: dict):
+        for valor, c in contagens.items():
+            self.contagens[valor] = self.contagens.get(valor, 0) + c
+        self._podar()
+
+    def atualizar_contagens(self, contagens: dict):
+        self.n += sum(contagens.values())
+        self._somar(contagens)
+
+    def mesclar(self, outro: "FrequentesMisraGries"):
+        self.n += outro.n
+        self.decremento += outro.decremento
+        self._somar(outro.contagens)
+
+    def mais_frequentes(self, k: int = 10) -> list[tuple]:
+        """Os k valores de maior contagem, como (valor, contagem mínima garantida)."""
+        return sorted(self.contagens.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+### Testes ###
+
+class TestSketches(unittest.TestCase):
+    def setUp(self):
+        self.parametros = ParametrosErro.para_erro(0.01)
+        self.rng = np.random.default_rng(42)
+
+    def _kll(self, valores: np.ndarray, semente: int = 0) -> SketchQuantisKLL:
+        sketch = SketchQuantisKLL(self.parametros.k_quantis, semente=semente)
+        for bloco in np.array_split(valores, 20):
+            sketch.atualizar(bloco)
+        return sketch
+
+    def assertErroPostoDentroDoLimite(self, sketch: SketchQuantisKLL, valores: np.ndarray):
+        ordenados = np.sort(valores)
+        qs = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+        for q, estimado in zip(qs, sketch.quantis(qs)):
+            posto = np.searchsorted(ordenados, estimado, side="right") / len(ordenados)
+            self.assertLessEqual(abs(posto - q), erro_posto_kll(sketch.k), f"quantil {q}")
+
+    def test_quantis_exatos_sem_compactacao(self):
+        valores = self.rng.normal(size=self.parametros.k_quantis)
+        sketch = self._kll(valores)
+        self.assertTrue(sketch.exato)
+        np.testing.assert_allclose(sketch.quantis([0.25, 0.5, 0.75]), np.quantile(valores, [0.25, 0.5, 0.75]))
+
+    def test_quantis_kll_dentro_do_erro(self):
+        valores = self.rng.lognormal(size=200_000)
+        sketch = self._kll(valores)
+        self.assertFalse(sketch.exato)
+        self.assertEqual(sketch.n, len(valores))
+        self.assertErroPostoDentroDoLimite(sketch, valores)
+
+    def test_distintos_hll_dentro_do_erro(self):
+        distintos = 100_000
+        hll = HyperLogLog(self.parametros.precisao_hll)
+        hll.atualizar(np.arange(distintos))
+        hll.atualizar(np.arange(distintos // 2))  # repetições não alteram a estimativa
+        erro = abs(hll.estimativa() - distintos) / distintos
+        self.assertLessEqual(erro, 3 * erro_padrao_hll(self.parametros.precisao_hll))
+
+    def test_frequentes_subestimam_no_maximo_o_limite(self):
+        valores = self.rng.zipf(1.5, size=50_000)
+        frequentes = FrequentesMisraGries(capacidade=50)
+        for bloco in np.array_split(valores, 10):
+            frequentes.atualizar_contagens(pd.Series(bloco).value_counts().to_dict())
+        reais = pd.Series(valores).value_counts()
+        self.assertLessEqual(frequentes.decremento, len(valores) / (frequentes.capacidade + 1))
+        for valor, contagem in frequentes.mais_frequentes(10):
+            self.assertLessEqual(contagem, reais[valor])
+            self.assertGreaterEqual(contagem, reais[valor] - frequentes.decremento)
+
+    def test_mesclar_associativo(self):
+        partes = [self.rng.normal(loc=i, size=60_000) for i in range(3)]
+        todos = np.concatenate(partes)
+
+        kll = [self._kll(parte, semente=i) for i, parte in enumerate(partes)]
+        esquerda, direita = copy.deepcopy(kll[0]), copy.deepcopy(kll[1])
+        esquerda.mesclar(kll[1])
+        esquerda.mesclar(kll[2])
+        direita.mesclar(kll[2])
+        primeiro = copy.deepcopy(kll[0])
+        primeiro.mesclar(direita)
+        for mesclado in (esquerda, primeiro):
+            self.assertEqual(mesclado.n, len(todos))
+            self.assertErroPostoDentroDoLimite(mesclado, todos)
+
+        hll = []
+        for parte in partes:
+            sketch = HyperLogLog(self.parametros.precisao_hll)
+            sketch.atualizar(np.round(parte, 3))
+            hll.append(sketch)
+        esquerda, direita = copy.deepcopy(hll[0]), copy.deepcopy(hll[1])
+        esquerda.mesclar(hll[1])
+        esquerda.mesclar(hll[2])
+        direita.mesclar(hll[2])
+        primeiro = copy.deepcopy(hll[0])
+        primeiro.mesclar(direita)
+        np.testing.assert_array_equal(esquerda.registradores, primeiro.registradores)
+        unico = HyperLogLog(self.parametros.precisao_hll)
+        unico.atualizar(np.round(todos, 3))
+        np.testing.assert_array_equal(esquerda.registradores, unico.registradores)
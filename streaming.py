@@ -0,0 +1,165 @@
+import sys
+import tempfile
+import time
+import unittest
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+# --- Respostas em Streaming ---
+# Com stream=True a API devolve a resposta em pedaços ("deltas") à medida que é gerada. O MedidorStreaming
+# repassa cada delta aos destinos (console, arquivo, buffer do próximo prompt) e mede o tempo até o primeiro
+# token (TTFT) e a vazão em tokens/s; a SaidaIncremental grava o arquivo de resultado enquanto ele é gerado.
+
+ReceptorDeltas = Callable[[str], None]
+
+
+@dataclass
+class MetricasStreaming:
+    """
+    Métricas de uma resposta em streaming.
+    'ttft_s' é o tempo até o primeiro token; 'tokens_por_segundo' é medido do primeiro ao último token.
+    """
+    ttft_s: float | None
+    duracao_s: float
+    tokens_saida: int
+    tokens_por_segundo: float
+    do_cache: bool = False
+
+    def descricao(self) -> str:
+        if self.do_cache:
+            return f"{self.tokens_saida} token(s) reproduzido(s) do cache"
+        ttft = f"{self.ttft_s:.2f}s" if self.ttft_s is not None else "n/d"
+        return (f"primeiro token em {ttft} | {self.tokens_saida} token(s) em {self.duracao_s:.2f}s "
+                f"({self.tokens_por_segundo:.1f} tokens/s)")
+
+
+class MedidorStreaming:
+    """
+    Acumula os deltas de uma resposta, repassando-os aos 'destinos' e medindo TTFT e tokens/s.
+    Sem a contagem de tokens informada pela API (usage), cada delta com texto conta como um token.
+    """
+
+    def __init__(self, destinos: list[ReceptorDeltas] | None = None):
+        self.destinos = [destino for destino in (destinos or []) if destino is not None]
+        self.partes = []
+        self.inicio = time.perf_counter()
+        self.primeiro_token = None
+        self.ultimo_token = None
+        self.num_deltas = 0
+
+    def registrar(self, delta: str | None):
+        if not delta:
+            return
+        agora = time.perf_counter()
+        if self.primeiro_token is None:
+            self.primeiro_token = agora
+        self.ultimo_token = agora
+        self.num_deltas += 1
+        self.partes.append(delta)
+        for destino in self.destinos:
+            destino(delta)
+
+    def texto(self) -> str:
+        return "".join(self.partes)
+
+    def finalizar(self, tokens_saida: int | None = None, do_cache: bool = False) -> MetricasStreaming:
+        fim = time.perf_counter()
+        tokens = tokens_saida if tokens_saida is not None else self.num_deltas
+        ttft = self.primeiro_token - self.inicio if self.primeiro_token is not None else None
+        geracao = (self.ultimo_token - self.primeiro_token) if self.primeiro_token is not None else 0.0
+        # Com um único delta (ou resposta do cache) não há intervalo de geração: usa a duração total.
+        geracao = geracao if geracao > 0 else fim - self.inicio
+        return MetricasStreaming(
+            ttft_s=ttft,
+            duracao_s=fim - self.inicio,
+            tokens_saida=tokens,
+            tokens_por_segundo=tokens / geracao if geracao > 0 else 0.0,
+            do_cache=do_cache,
+        )
+
+
+def imprimir_delta(delta: str):
+    """Destino que escreve o delta no console imediatamente."""
+    sys.stdout.write(delta)
+    sys.stdout.flush()
+
+
+class SaidaIncremental:
+    """
+    Arquivo de resultado escrito à medida que a resposta chega. O conteúdo vai para '<arquivo>.parcial'
+    (que pode ser acompanhado durante a geração) e só substitui o arquivo final em concluir(True);
+    em caso de falha o parcial é descartado e um resultado anterior, se houver, é preservado.
+    'caracteres_recebidos' conta o que já chegou da resposta (sem o cabeçalho).
+    """
+
+    def __init__(self, caminho: Path, cabecalho: str = ""):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self.caminho_parcial = self.caminho.with_name(self.caminho.name + ".parcial")
+        self._arquivo = open(self.caminho_parcial, "w", encoding="utf-8")
+        self.caracteres_recebidos = 0
+        if cabecalho:
+            self._arquivo.write(cabecalho)
+            self._arquivo.flush()
+
+    def __call__(self, delta: str):
+        self.caracteres_recebidos += len(delta)
+        self._arquivo.write(delta)
+        self._arquivo.flush()
+
+    def concluir(self, sucesso: bool):
+        self._arquivo.close()
+        if sucesso:
+            self.caminho_parcial.replace(self.caminho)
+        else:
+            self.caminho_parcial.unlink(missing_ok=True)
+
+
+### Testes ###
+
+class TestSaidaIncremental(unittest.TestCase):
+    def setUp(self):
+        self._temporario = tempfile.TemporaryDirectory()
+        self.addCleanup(self._temporario.cleanup)
+        self.caminho = Path(self._temporario.name) / "resumo.txt"
+        self.caminho.write_text("resumo anterior", encoding="utf-8")
+
+    def test_parcial_visivel_durante_a_geracao_e_promovido_no_sucesso(self):
+        saida = SaidaIncremental(self.caminho, cabecalho="# Resumo\n")
+        saida("Receita ")
+        saida("cresceu.")
+        self.assertEqual(saida.caminho_parcial.read_text(encoding="utf-8"), "# Resumo\nReceita cresceu.")
+        self.assertEqual(self.caminho.read_text(encoding="utf-8"), "resumo anterior")
+        self.assertEqual(saida.caracteres_recebidos, len("Receita cresceu."))
+        saida.concluir(True)
+        self.assertEqual(self.caminho.read_text(encoding="utf-8"), "# Resumo\nReceita cresceu.")
+        self.assertFalse(saida.caminho_parcial.exists())
+
+    def test_falha_descarta_o_parcial_e_preserva_o_anterior(self):
+        saida = SaidaIncremental(self.caminho)
+        saida("Receita ")
+        saida.concluir(False)
+        self.assertEqual(self.caminho.read_text(encoding="utf-8"), "resumo anterior")
+        self.assertFalse(saida.caminho_parcial.exists())
+
+
+class TestMedidorStreaming(unittest.TestCase):
+    def test_repassa_deltas_e_mede_tokens(self):
+        recebidos = []
+        medidor = MedidorStreaming([recebidos.append, None])
+        for delta in ("Olá", None, "", ", ", "mundo"):
+            medidor.registrar(delta)
+        self.assertEqual(recebidos, ["Olá", ", ", "mundo"])
+        self.assertEqual(medidor.texto(), "Olá, mundo")
+        metricas = medidor.finalizar()
+        self.assertEqual(metricas.tokens_saida, 3)  # sem usage, um token por delta
+        self.assertIsNotNone(metricas.ttft_s)
+        self.assertLessEqual(metricas.ttft_s, metricas.duracao_s)
+        self.assertEqual(medidor.finalizar(tokens_saida=7).tokens_saida, 7)
+
+    def test_sem_deltas_nao_ha_ttft(self):
+        metricas = MedidorStreaming().finalizar()
+        self.assertIsNone(metricas.ttft_s)
+        self.assertEqual(metricas.tokens_saida, 0)
+        self.assertIn("n/d", metricas.descricao())
@@ -0,0 +1,252 @@
+import unittest
+from pathlib import Path
+from typing import Any, Callable
+
+import pandas as pd
+
+from cache_dados import CacheDadosZ
+from lote import LimitadorTaxa, TarefaPrompt, executar_lote, limitador_compartilhado, MAX_WORKERS_PADRAO
+from montagem_prompt import CacheSecoes, cabecalho_secao, chave_opcoes_pandas
+from serializacao_tabelas import chave_serializacao, formatador_tabela
+from telemetria import etapa
+from tokenizacao import ContadorTokens
+
+# --- Sumarização Map-Reduce de DataFrames Grandes ---
+# DataFrames acima de LIMITE_LINHAS_MAP_REDUCE linhas são divididos em blocos limitados por tokens;
+# cada bloco é resumido pelo LLM em paralelo (map) e os resumos parciais são combinados em níveis,
+# também em paralelo (reduce), até restar um resumo por arquivo. O resumo final substitui o head/tail
+# do arquivo no prompt, de modo que o modelo "vê" todas as linhas sem estourar o contexto.
+# Resumos de blocos que falharam ficam fora dos níveis seguintes e a seção é marcada como parcial; se nenhum
+# bloco do arquivo foi resumido, o arquivo fica fora das seções map-reduce e volta à renderização normal.
+
+LIMITE_LINHAS_MAP_REDUCE = 3000
+MAX_TOKENS_BLOCO = 12_000
+MAX_TOKENS_RESUMO_PARCIAL = 400
+LINHAS_AMOSTRA_BLOCO = 200
+VERSAO_MAP_REDUCE = "1"  # incremente ao mudar os prompts abaixo, para invalidar resumos em cache
+
+PROMPT_MAP = """Você receberá um trecho (linhas {inicio} a {fim} de {total}) da tabela contábil '{nome}'.
+Resuma em até 10 tópicos os fatos relevantes DESTE trecho: período coberto, totais e médias das colunas numéricas,
+valores extremos, categorias/naturezas predominantes e anomalias. Cite números exatos e não invente dados.
+
+Trecho:
+{tabela}"""
+
+PROMPT_REDUCE = """Os textos abaixo são resumos parciais de trechos consecutivos da tabela contábil '{nome}'.
+Combine-os em um único resumo de até 15 tópicos: some totais quando fizer sentido, preserve números exatos,
+tendências ao longo do tempo e anomalias. Não invente dados.
+
+{resumos}"""
+
+MENSAGEM_FALHA_BLOCO = "[falha ao resumir este trecho]"
+
+
+def dividir_em_blocos(df: pd.DataFrame, max_tokens_bloco: int, contador: ContadorTokens) -> list[tuple[int, int, str]]:
+    """
+    Divide o DataFrame em blocos consecutivos de linhas cujo texto (ver serializacao_tabelas) cabe em
+    'max_tokens_bloco'. Retorna [(linha_inicial, linha_final_exclusiva, texto)].
+    """
+    num_rows = len(df)
+    formatar = formatador_tabela(df, contador=contador)
+    amostra = df.head(LINHAS_AMOSTRA_BLOCO)
+    tokens_por_linha = max(1.0, contador(formatar(amostra)) / max(1, len(amostra)))
+    linhas_por_bloco = max(1, int(max_tokens_bloco / tokens_por_linha * 0.9))
+
+    blocos = []
+    inicio = 0
+    while inicio < num_rows:
+        fim = min(num_rows, inicio + linhas_por_bloco)
+        texto = formatar(df.iloc[inicio:fim])
+        while contador(texto) > max_tokens_bloco and fim - inicio > 1:
+            fim = inicio + (fim - inicio) // 2
+            texto = formatar(df.iloc[inicio:fim])
+        blocos.append((inicio, fim, texto))
+        inicio = fim
+    return blocos
+
+
+def _agrupar_resumos(resumos: list[str], max_tokens_bloco: int, contador: ContadorTokens) -> list[list[str]]:
+    """Agrupa resumos consecutivos até 'max_tokens_bloco' tokens por grupo (no mínimo 2 por grupo)."""
+    grupos, atual, tokens_atual = [], [], 0
+    for resumo in resumos:
+        tokens = contador(resumo)
+        if len(atual) >= 2 and tokens_atual + tokens > max_tokens_bloco:
+            grupos.append(atual)
+            atual, tokens_atual = [], 0
+        atual.append(resumo)
+        tokens_atual += tokens
+    if len(atual) == 1 and grupos:
+        grupos[-1].append(atual[0])
+    elif atual:
+        grupos.append(atual)
+    return grupos
+
+
+def resumir_map_reduce(tabelas: dict[str, pd.DataFrame], funcao_envio: Callable[..., Any], contador: ContadorTokens,
+                       eh_erro: Callable[[Any], bool] | None = None, max_workers: int = MAX_WORKERS_PADRAO,
+                       limitador: LimitadorTaxa | None = None,
+                       max_tokens_bloco: int = MAX_TOKENS_BLOCO) -> dict[str, tuple[str, int, bool]]:
+    """
+    Resume cada DataFrame de 'tabelas' com map-reduce. Os blocos de TODAS as tabelas vão para o mesmo lote
+    concorrente, assim o tempo total depende do número de níveis, não do número de linhas.
+    Retorna {nome: (resumo final, número de blocos, houve_falha)}. Resumos que falharam não entram na combinação;
+    se todos falharam, o resumo final é MENSAGEM_FALHA_BLOCO.
+    """
+    def executar(tarefas: list[TarefaPrompt]) -> list[str]:
+        resultados = executar_lote(tarefas, funcao_envio, max_workers=max_workers, limitador=limitador, eh_erro=eh_erro)
+        return [r.resposta if r.status == "ok" else MENSAGEM_FALHA_BLOCO for r in resultados]
+
+    def tarefa(prompt: str, identificador: str) -> TarefaPrompt:
+        return TarefaPrompt(prompt=prompt, tokens_estimados=contador(prompt) + MAX_TOKENS_RESUMO_PARCIAL,
+                            identificador=identificador, kwargs={"max_tokens": MAX_TOKENS_RESUMO_PARCIAL})
+
+    # Map: um resumo por bloco
+    tarefas, destinos, num_blocos = [], [], {}
+    for nome, df in tabelas.items():
+        with etapa("to_string", arquivo=nome, linhas=len(df)):
+            blocos = dividir_em_blocos(df, max_tokens_bloco, contador)
+        num_blocos[nome] = len(blocos)
+        print(f"  🧩 {nome}: {len(df)} linhas divididas em {len(blocos)} bloco(s) para sumarização.")
+        for inicio, fim, texto in blocos:
+            prompt = PROMPT_MAP.format(inicio=inicio + 1, fim=fim, total=len(df), nome=nome, tabela=texto)
+            tarefas.append(tarefa(prompt, f"{nome}#map{inicio}"))
+            destinos.append(nome)
+    parciais = {nome: [] for nome in tabelas}
+    falhas = set()
+    for nome, resumo in zip(destinos, executar(tarefas)):
+        if resumo == MENSAGEM_FALHA_BLOCO:
+            falhas.add(nome)
+        else:
+            parciais[nome].append(resumo)
+
+    # Reduce hierárquico: cada nível combina grupos de resumos consecutivos, em paralelo
+    nivel = 1
+    while any(len(resumos) > 1 for resumos in parciais.values()):
+        tarefas, destinos = [], []
+        for nome, resumos in parciais.items():
+            if len(resumos) <= 1:
+                continue
+            for i, grupo in enumerate(_agrupar_resumos(resumos, max_tokens_bloco, contador)):
+                texto_resumos = "\n\n".join(f"Resumo parcial {j + 1}:\n{r}" for j, r in enumerate(grupo))
+                prompt = PROMPT_REDUCE.format(nome=nome, resumos=texto_resumos)
+                tarefas.append(tarefa(prompt, f"{nome}#reduce{nivel}.{i}"))
+                destinos.append(nome)
+        print(f"  🔗 Nível {nivel} de combinação: {len(tarefas)} chamada(s).")
+        novos = {nome: [] for nome in set(destinos)}
+        for nome, resumo in zip(destinos, executar(tarefas)):
+            if resumo == MENSAGEM_FALHA_BLOCO:
+                falhas.add(nome)
+            else:
+                novos[nome].append(resumo)
+        parciais.update(novos)
+        nivel += 1
+
+    return {
+        nome: (resumos[0] if resumos else MENSAGEM_FALHA_BLOCO, num_blocos[nome], nome in falhas or not resumos)
+        for nome, resumos in parciais.items()
+    }
+
+
+def formatar_secao_map_reduce(nome: str, df: pd.DataFrame, resumo: str, num_blocos: int,
+                              parcial: bool = False) -> str:
+    if parcial:
+        titulo = (f"--- RESUMO PARCIAL DAS {len(df)} LINHAS DE {nome} (map-reduce em {num_blocos} blocos; "
+                  f"alguns trechos não puderam ser resumidos e faltam neste resumo) ---\n")
+    else:
+        titulo = f"--- RESUMO DE TODAS AS {len(df)} LINHAS DE {nome} (map-reduce em {num_blocos} blocos) ---\n"
+    return "".join([
+        cabecalho_secao(nome, df),
+        titulo,
+        resumo,
+        f"\n--- FIM DO RESUMO DE {nome} ---\n\n",
+    ])
+
+
+def montar_secoes_map_reduce(arquivos: list[Path], cache_dados: CacheDadosZ, cache_secoes: CacheSecoes,
+                             funcao_envio: Callable[..., Any], contador: ContadorTokens, model_id: str,
+                             eh_erro: Callable[[Any], bool] | None = None,
+                             limite_linhas: int = LIMITE_LINHAS_MAP_REDUCE,
+                             max_workers: int = MAX_WORKERS_PADRAO,
+                             limitador: LimitadorTaxa | None = None) -> tuple[str, set]:
+    """
+    Gera as seções map-reduce dos arquivos com mais de 'limite_linhas' linhas.
+    Seções de arquivos inalterados vêm do cache; seções com falha em algum bloco são marcadas como parciais e não
+    são guardadas. Arquivos sem nenhum bloco resumido ficam de fora, para o chamador renderizá-los normalmente.
+    Retorna (texto das seções, nomes dos arquivos resumidos).
+    """
+    chave_pandas = chave_opcoes_pandas()
+    secoes, pendentes, chaves = {}, {}, {}
+    for arquivo in arquivos:
+        try:
+            impressao = cache_dados.impressao_digital(arquivo)
+            chave = CacheSecoes.chave_de("map_reduce", VERSAO_MAP_REDUCE, model_id, str(MAX_TOKENS_BLOCO),
+                                         impressao.hash, arquivo.name, chave_pandas, chave_serializacao())
+            secao = cache_secoes.obter(chave)
+            if secao is not None:
+                print(f"  ♻️ Resumo map-reduce reaproveitado do cache (arquivo inalterado): {arquivo.name}")
+                secoes[arquivo.name] = secao
+                continue
+            df = cache_dados.carregar(arquivo, impressao)
+        except Exception as e:
+            print(f"  ❌ Erro ao carregar {arquivo.name}: {e}")
+            continue
+        # Exports lidos em blocos (ResumoStreaming) não têm as linhas em memória para dividir
+        if isinstance(df, pd.DataFrame) and len(df) > limite_linhas:
+            pendentes[arquivo.name] = df
+            chaves[arquivo.name] = chave
+
+    if pendentes:
+        print(f"\n🗺️ Sumarização map-reduce de {len(pendentes)} arquivo(s) com mais de {limite_linhas} linhas...")
+        with etapa("reduzir", estrategia="map_reduce", arquivos=sorted(pendentes)):
+            resultados = resumir_map_reduce(pendentes, funcao_envio, contador, eh_erro=eh_erro,
+                                            max_workers=max_workers,
+                                            limitador=limitador or limitador_compartilhado(model_id))
+        for nome, (resumo, num_blocos, houve_falha) in resultados.items():
+            if houve_falha and resumo == MENSAGEM_FALHA_BLOCO:
+                print(f"  ⚠️ Nenhum bloco de {nome} foi resumido; o arquivo entra com a redução normal.")
+                continue
+            secoes[nome] = formatar_secao_map_reduce(nome, pendentes[nome], resumo, num_blocos, parcial=houve_falha)
+            if houve_falha:
+                print(f"  ⚠️ Algum bloco de {nome} falhou; o resumo parcial não será guardado em cache.")
+            else:
+                cache_secoes.guardar(chaves[nome], secoes[nome])
+
+    ordem = [arquivo.name for arquivo in arquivos if arquivo.name in secoes]
+    return "".join(secoes[nome] for nome in ordem), set(ordem)
+
+
+### Testes ###
+
+class TestResumirMapReduce(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({"id": range(40), "valor": [float(i) for i in range(40)]})
+        self.contador = lambda texto: len(texto) // 4 + 1
+        self.prompts_reduce = []
+
+    def _resumir(self, falhar: Callable[[str], bool]) -> tuple[str, int, bool]:
+        def enviar(prompt: str, **kwargs) -> str:
+            if "resumos parciais" in prompt:
+                self.prompts_reduce.append(prompt)
+            if falhar(prompt):
+                raise RuntimeError("falha simulada")
+            return "resumo ok"
+
+        resultado = resumir_map_reduce({"vendas.z": self.df}, enviar, self.contador, max_workers=2,
+                                       max_tokens_bloco=60)
+        return resultado["vendas.z"]
+
+    def test_blocos_com_falha_ficam_fora_da_combinacao(self):
+        resumo, num_blocos, houve_falha = self._resumir(lambda prompt: "linhas 1 a" in prompt)
+        self.assertGreater(num_blocos, 2)
+        self.assertTrue(houve_falha)
+        self.assertEqual(resumo, "resumo ok")
+        self.assertTrue(self.prompts_reduce)
+        self.assertFalse(any(MENSAGEM_FALHA_BLOCO in prompt for prompt in self.prompts_reduce))
+        secao = formatar_secao_map_reduce("vendas.z", self.df, resumo, num_blocos, parcial=houve_falha)
+        self.assertIn("RESUMO PARCIAL", secao)
+
+    def test_todos_os_blocos_com_falha(self):
+        resumo, _, houve_falha = self._resumir(lambda prompt: True)
+        self.assertTrue(houve_falha)
+        self.assertEqual(resumo, MENSAGEM_FALHA_BLOCO)
+        self.assertEqual(self.prompts_reduce, [])
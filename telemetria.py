@@ -0,0 +1,339 @@
+import contextvars
+import json
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+
+# --- Telemetria de Chamadas ao LLM e Etapas de Preparação dos Dados ---
+# Cada chamada ao LLM (tempo, tokens reais do 'usage', retentativas, acerto de cache) e cada etapa de
+# preparação (carregar, reduzir, to_string, describe, montar_prompt) vira um evento. Os eventos são
+# agregados em memória (contadores e histogramas no formato de texto do Prometheus, servidos em /metrics
+# ou gravados em arquivo) e, se configurado, gravados um por linha em JSONL.
+
+BUCKETS_DURACAO_S = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+DESCRICOES_METRICAS = {
+    "llm_chamadas_total": ("counter", "Chamadas ao LLM por modelo, origem (api/cache) e status."),
+    "llm_tokens_total": ("counter", "Tokens informados pela API (usage), por modelo e tipo (prompt/resposta/prompt_cache)."),
+    "llm_retentativas_total": ("counter", "Retentativas feitas pelo cliente antes da resposta."),
+    "llm_duracao_segundos": ("histogram", "Tempo de parede de cada chamada ao LLM."),
+    "llm_ttft_segundos": ("histogram", "Tempo até o primeiro token (respostas em streaming)."),
+    "etapa_duracao_segundos": ("histogram", "Duração das etapas de preparação dos dados e do prompt."),
+    "etapa_erros_total": ("counter", "Etapas interrompidas por exceção."),
+}
+
+
+def _rotulos(rotulos: dict) -> tuple:
+    return tuple(sorted((chave, str(valor)) for chave, valor in rotulos.items() if valor is not None))
+
+
+def _formatar_rotulos(rotulos: tuple, extra: tuple = ()) -> str:
+    pares = rotulos + extra
+    if not pares:
+        return ""
+    texto = ",".join(f'{chave}="{valor.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for chave, valor in pares)
+    return "{" + texto + "}"
+
+
+class Telemetria:
+    """
+    Coletor de eventos thread-safe. 'caminho_jsonl' (opcional) recebe um evento JSON por linha.
+    """
+
+    def __init__(self, caminho_jsonl: Path | None = None):
+        self._lock = threading.Lock()
+        self._contadores: dict[tuple[str, tuple], float] = {}
+        self._histogramas: dict[tuple[str, tuple], list] = {}
+        self._arquivo = None
+        self.caminho_jsonl = None
+        self._servidor = None
+        # Contexto (não thread): executar_lote copia o contexto para os workers, que somam no job que os criou
+        self._acumulador = contextvars.ContextVar(f"acumulador_chamadas_{id(self)}", default=None)
+        if caminho_jsonl is not None:
+            self.definir_arquivo_jsonl(caminho_jsonl)
+
+    def definir_arquivo_jsonl(self, caminho_jsonl: Path | None):
+        with self._lock:
+            if self._arquivo is not None:
+                self._arquivo.close()
+                self._arquivo = None
+            self.caminho_jsonl = Path(caminho_jsonl) if caminho_jsonl else None
+            if self.caminho_jsonl is not None:
+                self.caminho_jsonl.parent.mkdir(parents=True, exist_ok=True)
+                self._arquivo = open(self.caminho_jsonl, "a", encoding="utf-8", buffering=1)
+
+    # --- Agregação ---
+
+    def _somar(self, nome: str, rotulos: dict, valor: float = 1.0):
+        chave = (nome, _rotulos(rotulos))
+        self._contadores[chave] = self._contadores.get(chave, 0.0) + valor
+
+    def _observar(self, nome: str, rotulos: dict, valor: float):
+        chave = (nome, _rotulos(rotulos))
+        histograma = self._histogramas.get(chave)
+        if histograma is None:
+            histograma = self._histogramas[chave] = [[0] * len(BUCKETS_DURACAO_S), 0.0, 0]
+        for i, limite in enumerate(BUCKETS_DURACAO_S):
+            if valor <= limite:
+                histograma[0][i] += 1
+        histograma[1] += valor
+        histograma[2] += 1
+
+    def _gravar_evento(self, evento: dict):
+        if self._arquivo is not None:
+            evento = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), **evento}
+            self._arquivo.write(json.dumps(evento, ensure_ascii=False, default=str) + "\n")
+
+    # --- Registro ---
+
+    def registrar_chamada_llm(self, modelo: str, duracao_s: float, tokens_prompt: int | None = None,
+                              tokens_resposta: int | None = None, retentativas: int = 0, do_cache: bool = False,
+                              status: str = "ok", ttft_s: float | None = None,
+                              tokens_prompt_cache: int | None = None, **extras):
+        """
+        Registra uma chamada ao LLM. Tokens devem ser os do 'usage' da resposta (None se indisponíveis);
+        'tokens_prompt_cache' é a parte do prompt servida pelo cache de prefixo do provedor (cached_tokens).
+        """
+        origem = "cache" if do_cache else "api"
+        acumulador = self._acumulador.get()
+        with self._lock:
+            if acumulador is not None:
+                acumulador["chamadas"] += 1
+                acumulador["acertos_cache"] += do_cache
+                acumulador["erros"] += status != "ok"
+                acumulador["tokens_prompt"] += tokens_prompt or 0
+                acumulador["tokens_resposta"] += tokens_resposta or 0
+                acumulador["tokens_prompt_cache"] += tokens_prompt_cache or 0
+            self._somar("llm_chamadas_total", {"modelo": modelo, "origem": origem, "status": status})
+            if tokens_prompt is not None:
+                self._somar("llm_tokens_total", {"modelo": modelo, "tipo": "prompt"}, tokens_prompt)
+            if tokens_resposta is not None:
+                self._somar("llm_tokens_total", {"modelo": modelo, "tipo": "resposta"}, tokens_resposta)
+            if tokens_prompt_cache is not None:
+                self._somar("llm_tokens_total", {"modelo": modelo, "tipo": "prompt_cache"}, tokens_prompt_cache)
+            if retentativas:
+                self._somar("llm_retentativas_total", {"modelo": modelo}, retentativas)
+            self._observar("llm_duracao_segundos", {"modelo": modelo, "origem": origem}, duracao_s)
+            if ttft_s is not None:
+                self._observar("llm_ttft_segundos", {"modelo": modelo}, ttft_s)
+            self._gravar_evento({
+                "tipo": "llm", "modelo": modelo, "origem": origem, "status": status, "duracao_s": round(duracao_s, 6),
+                "tokens_prompt": tokens_prompt, "tokens_resposta": tokens_resposta, "tokens_prompt_cache": tokens_prompt_cache,
+                "retentativas": retentativas, "ttft_s": ttft_s, **extras,
+            })
+
+    def registrar_etapa(self, etapa: str, duracao_s: float, status: str = "ok", **detalhes):
+        """
+        Registra a duração de uma etapa. Só 'etapa' vira rótulo no Prometheus; os 'detalhes'
+        (arquivo, linhas, caracteres...) vão apenas para o JSONL, evitando séries demais.
+        """
+        with self._lock:
+            self._observar("etapa_duracao_segundos", {"etapa": etapa}, duracao_s)
+            if status != "ok":
+                self._somar("etapa_erros_total", {"etapa": etapa})
+            self._gravar_evento({"tipo": "etapa", "etapa": etapa, "status": status,
+                                 "duracao_s": round(duracao_s, 6), **detalhes})
+
+    @contextmanager
+    def etapa(self, nome: str, **detalhes) -> Iterator[dict]:
+        """
+        Cronometra o bloco como a etapa 'nome'. O dicionário devolvido pode receber detalhes
+        descobertos durante a etapa (ex.: origem do carregamento, número de caracteres).
+        """
+        inicio = time.perf_counter()
+        status = "ok"
+        try:
+            yield detalhes
+        except BaseException:
+            status = "erro"
+            raise
+        finally:
+            self.registrar_etapa(nome, time.perf_counter() - inicio, status, **detalhes)
+
+    @contextmanager
+    def acumular_chamadas(self) -> Iterator[dict]:
+        """
+        Soma as chamadas ao LLM feitas dentro do bloco (chamadas, acertos de cache, erros e tokens), para atribuir
+        custo a um job entre vários executados em paralelo. O acumulador vale para o contexto atual (contextvars),
+        então também recebe as chamadas das threads que herdam esse contexto (ver lote.executar_lote).
+        """
+        anterior = self._acumulador.get()
+        acumulador = {"chamadas": 0, "acertos_cache": 0, "erros": 0, "tokens_prompt": 0, "tokens_resposta": 0,
+                      "tokens_prompt_cache": 0}
+        token = self._acumulador.set(acumulador)
+        try:
+            yield acumulador
+        finally:
+            self._acumulador.reset(token)
+            if anterior is not None:
+                with self._lock:
+                    for chave, valor in acumulador.items():
+                        anterior[chave] += valor
+
+    # --- Consulta e exportação ---
+
+    def resumo(self) -> dict:
+        """Totais para exibição: chamadas, tokens, retentativas e tempo total por etapa."""
+        with self._lock:
+            chamadas = sum(v for (nome, _), v in self._contadores.items() if nome == "llm_chamadas_total")
+            acertos = sum(v for (nome, r), v in self._contadores.items()
+                          if nome == "llm_chamadas_total" and ("origem", "cache") in r)
+            tokens = {}
+            for (nome, rotulos), valor in self._contadores.items():
+                if nome == "llm_tokens_total":
+                    tipo = dict(rotulos)["tipo"]
+                    tokens[tipo] = tokens.get(tipo, 0) + int(valor)
+            retentativas = sum(v for (nome, _), v in self._contadores.items() if nome == "llm_retentativas_total")
+            etapas = {}
+            for (nome, rotulos), (_, soma, contagem) in self._histogramas.items():
+                if nome == "etapa_duracao_segundos":
+                    etapa = dict(rotulos)["etapa"]
+                    total, vezes = etapas.get(etapa, (0.0, 0))
+                    etapas[etapa] = (total + soma, vezes + contagem)
+        return {"chamadas_llm": int(chamadas), "acertos_cache": int(acertos), "tokens": tokens,
+                "retentativas": int(retentativas),
+                "etapas": {etapa: {"total_s": round(total, 4), "vezes": vezes}
+                           for etapa, (total, vezes) in sorted(etapas.items(), key=lambda item: -item[1][0])}}
+
+    def exportar_prometheus(self) -> str:
+        """Métricas agregadas no formato de texto do Prometheus (exposition format 0.0.4)."""
+        linhas = []
+        with self._lock:
+            for nome, (tipo, descricao) in DESCRICOES_METRICAS.items():
+                if tipo == "counter":
+                    series = sorted((r, v) for (n, r), v in self._contadores.items() if n == nome)
+                else:
+                    series = sorted((r, h) for (n, r), h in self._histogramas.items() if n == nome)
+                if not series:
+                    continue
+                linhas.append(f"# HELP {nome} {descricao}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                for rotulos, valor in series:
+                    if tipo == "counter":
+                        linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {valor:g}")
+                        continue
+                    buckets, soma, contagem = valor
+                    for limite, quantidade in zip(BUCKETS_DURACAO_S, buckets):
+                        linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, (('le', f'{limite:g}'),))} {quantidade}")
+                    linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos, (('le', '+Inf'),))} {contagem}")
+                    linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {soma:.6f}")
+                    linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {contagem}")
+        return "\n".join(linhas) + "\n" if linhas else ""
+
+    def gravar_prometheus(self, caminho: Path):
+        """Grava as métricas em arquivo (para o textfile collector do node_exporter), de forma atômica."""
+        caminho = Path(caminho)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = caminho.with_name(caminho.name + ".tmp")
+        temporario.write_text(self.exportar_prometheus(), encoding="utf-8")
+        temporario.replace(caminho)
+
+    def servir_prometheus(self, porta: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Expõe GET /metrics em uma thread de fundo. Retorna o servidor (use .shutdown() para parar)."""
+        telemetria = self
+
+        class _ManipuladorMetricas(BaseHTTPRequestHandler):
+            def log_message(self, formato, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                corpo = telemetria.exportar_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+        servidor = ThreadingHTTPServer((host, porta), _ManipuladorMetricas)
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        self._servidor = servidor
+        return servidor
+
+
+# Coletor global do processo: os módulos registram nele via etapa() e registrar_chamada_llm().
+telemetria = Telemetria()
+
+
+def etapa(nome: str, **detalhes):
+    """Atalho para telemetria.etapa(...) no coletor global."""
+    return telemetria.etapa(nome, **detalhes)
+
+
+def acumular_chamadas():
+    """Atalho para telemetria.acumular_chamadas() no coletor global."""
+    return telemetria.acumular_chamadas()
+
+
+def configurar_telemetria(caminho_jsonl: Path | None = None, porta_prometheus: int | None = None) -> Telemetria:
+    """
+    Ativa as saídas do coletor global: eventos em JSONL e/ou o endpoint /metrics na porta informada.
+    """
+    if caminho_jsonl is not None:
+        telemetria.definir_arquivo_jsonl(caminho_jsonl)
+    if porta_prometheus:
+        servidor = telemetria.servir_prometheus(porta_prometheus)
+        print(f"📈 Métricas Prometheus em http://{servidor.server_address[0]}:{servidor.server_address[1]}/metrics")
+    return telemetria
+
+
+### Testes ###
+
+class TestTelemetria(unittest.TestCase):
+    def test_histograma_cumulativo_no_formato_prometheus(self):
+        coletor = Telemetria()
+        for duracao in (0.003, 0.2, 0.2, 500.0):
+            coletor.registrar_chamada_llm("gpt-4o-mini", duracao, tokens_prompt=100, tokens_resposta=10)
+        texto = coletor.exportar_prometheus()
+        rotulos = 'modelo="gpt-4o-mini",origem="api"'
+        self.assertIn(f'llm_duracao_segundos_bucket{{{rotulos},le="0.001"}} 0', texto)
+        self.assertIn(f'llm_duracao_segundos_bucket{{{rotulos},le="0.005"}} 1', texto)
+        self.assertIn(f'llm_duracao_segundos_bucket{{{rotulos},le="0.25"}} 3', texto)
+        self.assertIn(f'llm_duracao_segundos_bucket{{{rotulos},le="120"}} 3', texto)
+        self.assertIn(f'llm_duracao_segundos_bucket{{{rotulos},le="+Inf"}} 4', texto)
+        self.assertIn(f'llm_duracao_segundos_count{{{rotulos}}} 4', texto)
+        self.assertIn('llm_tokens_total{modelo="gpt-4o-mini",tipo="prompt"} 400', texto)
+
+    def test_rotulos_escapados(self):
+        coletor = Telemetria()
+        coletor.registrar_chamada_llm('modelo "local"\\x', 0.1)
+        self.assertIn('modelo="modelo \\"local\\"\\\\x"', coletor.exportar_prometheus())
+
+    def test_etapa_com_erro_e_resumo(self):
+        coletor = Telemetria()
+        with coletor.etapa("carregar", arquivo="vendas.z") as detalhes:
+            detalhes["origem"] = "original"
+        with self.assertRaises(ValueError):
+            with coletor.etapa("carregar"):
+                raise ValueError("arquivo corrompido")
+        coletor.registrar_chamada_llm("gpt-4o-mini", 0.1, do_cache=True)
+        resumo = coletor.resumo()
+        self.assertEqual(resumo["etapas"]["carregar"]["vezes"], 2)
+        self.assertEqual((resumo["chamadas_llm"], resumo["acertos_cache"]), (1, 1))
+        self.assertIn('etapa_erros_total{etapa="carregar"} 1', coletor.exportar_prometheus())
+
+    def test_eventos_jsonl_e_acumuladores_aninhados(self):
+        with tempfile.TemporaryDirectory() as temporario:
+            caminho = Path(temporario) / "eventos.jsonl"
+            coletor = Telemetria(caminho)
+            with coletor.acumular_chamadas() as externo:
+                coletor.registrar_chamada_llm("gpt-4o-mini", 0.1, tokens_prompt=10)
+                with coletor.acumular_chamadas() as interno:
+                    coletor.registrar_chamada_llm("gpt-4o-mini", 0.1, tokens_prompt=5, status="erro")
+            coletor.registrar_chamada_llm("gpt-4o-mini", 0.1, tokens_prompt=1)  # fora de qualquer job
+            coletor.definir_arquivo_jsonl(None)
+            eventos = [json.loads(linha) for linha in caminho.read_text(encoding="utf-8").splitlines()]
+        self.assertEqual((interno["chamadas"], interno["erros"], interno["tokens_prompt"]), (1, 1, 5))
+        self.assertEqual((externo["chamadas"], externo["erros"], externo["tokens_prompt"]), (2, 1, 15))
+        self.assertEqual([evento["status"] for evento in eventos], ["ok", "erro", "ok"])
+        self.assertTrue(all(evento["tipo"] == "llm" and "ts" in evento for evento in eventos))
@@ -0,0 +1,87 @@
+import math
+import os
+import re
+from typing import Callable
+
+# --- Contagem de Tokens Local (offline) ---
+# O contador é "plugável": por padrão usa o tiktoken (codificação do modelo) quando ele está instalado e
+# os arquivos BPE estão disponíveis localmente (TIKTOKEN_CACHE_DIR); caso contrário, usa uma aproximação
+# conservadora baseada na pré-tokenização do BPE da OpenAI, que tende a superestimar, nunca a subestimar muito.
+# Outros contadores podem ser registrados com registrar_contador() e escolhidos via LLM_TOKENIZADOR.
+
+ContadorTokens = Callable[[str], int]
+
+# Pré-tokenização no estilo do BPE da OpenAI: palavras, números em grupos de até 3 dígitos,
+# espaços e pontuação. Cada pedaço é então convertido em tokens de forma pessimista.
+_PADRAO_PEDACOS = re.compile(r"[^\W\d_]+|\d{1,3}| +|[^\S ]+|[^\w\s]+|_+")
+
+
+def contar_tokens_aproximado(texto: str) -> int:
+    """
+    Contagem aproximada e conservadora de tokens, sem dependências externas.
+    Palavras contam 1 token a cada 4 caracteres (no mínimo 1); números, 1 token por grupo de até 3 dígitos;
+    sequências de espaços, 1 token a cada 4 espaços; quebras de linha e tabs, 1 token cada; pontuação, 1 token por caractere.
+    """
+    total = 0
+    for pedaco in _PADRAO_PEDACOS.findall(texto):
+        primeiro = pedaco[0]
+        if primeiro.isdigit():
+            total += 1
+        elif primeiro == ' ':
+            total += math.ceil(len(pedaco) / 4)
+        elif primeiro.isspace():
+            total += len(pedaco)
+        elif primeiro.isalpha():
+            total += math.ceil(len(pedaco) / 4)
+        else:
+            total += len(pedaco)
+    return total
+
+
+def _criar_contador_tiktoken(model_id: str) -> ContadorTokens:
+    import tiktoken
+    try:
+        codificacao = tiktoken.encoding_for_model(model_id)
+    except KeyError:
+        codificacao = tiktoken.get_encoding("o200k_base")
+    return lambda texto: len(codificacao.encode(texto, disallowed_special=()))
+
+
+_FABRICAS_CONTADORES: dict[str, Callable[[str], ContadorTokens]] = {
+    "tiktoken": _criar_contador_tiktoken,
+    "aproximado": lambda model_id: contar_tokens_aproximado,
+}
+_contadores_criados: dict[tuple[str, str], tuple[str, ContadorTokens]] = {}
+
+
+def registrar_contador(nome: str, fabrica: Callable[[str], ContadorTokens]):
+    """
+    Registra um novo contador de tokens. 'fabrica' recebe o id do modelo e retorna uma função texto -> nº de tokens.
+    """
+    _FABRICAS_CONTADORES[nome] = fabrica
+
+
+def obter_contador(model_id: str, preferencia: str | None = None) -> tuple[str, ContadorTokens]:
+    """
+    Retorna (nome, contador) para o modelo. Tenta, em ordem, a preferência informada (ou LLM_TOKENIZADOR),
+    o tiktoken e, por fim, o contador aproximado, que está sempre disponível.
+    """
+    preferencia = preferencia or os.getenv("LLM_TOKENIZADOR") or "tiktoken"
+    chave = (preferencia, model_id)
+    if chave in _contadores_criados:
+        return _contadores_criados[chave]
+
+    for nome in dict.fromkeys([preferencia, "tiktoken", "aproximado"]):
+        fabrica = _FABRICAS_CONTADORES.get(nome)
+        if fabrica is None:
+            continue
+        try:
+            contador = fabrica(model_id)
+            contador("teste")
+        except Exception as e:
+            if nome != "aproximado":
+                print(f"  ⚠️ Tokenizador '{nome}' indisponível offline ({type(e).__name__}); tentando o próximo.")
+            continue
+        _contadores_criados[chave] = (nome, contador)
+        return nome, contador
+    raise RuntimeError("Nenhum contador de tokens disponível.")